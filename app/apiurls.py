@@ -0,0 +1,21 @@
+"""This module builds the urls of MailChimp API endpoints."""
+import os
+
+# The base url of MailChimp's API, formatted with an api key's data center
+DEFAULT_API_BASE = 'https://{}.api.mailchimp.com/3.0'
+
+def mailchimp_url(data_center, path=''):
+    """Returns the url of a MailChimp API endpoint.
+
+    The base url can be set with the MAILCHIMP_API_BASE environment
+    variable, e.g. to point the app at a local stand-in for MailChimp. Any
+    {} in it is replaced with the data center.
+
+    Args:
+        data_center: the data center of the api key, e.g. 'us1'.
+        path: the path of the endpoint relative to the base url, e.g.
+            'lists'.
+    """
+    base = (os.environ.get('MAILCHIMP_API_BASE') or
+            DEFAULT_API_BASE).format(data_center).rstrip('/')
+    return '{}/{}'.format(base, path)
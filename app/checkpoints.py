@@ -0,0 +1,173 @@
+"""This module records the progress of list imports so they can be resumed."""
+import os
+import json
+import gzip
+import time
+import shutil
+from datetime import timedelta
+from app.localstate import local_state_path
+
+# Checkpoints older than this are discarded rather than resumed
+CHECKPOINT_MAX_AGE = timedelta(days=1)
+
+def checkpoint_dir(list_id=None):
+    """Returns the directory holding a list's checkpoint, or all checkpoints.
+
+    The directory is created if it doesn't exist yet.
+    """
+    directory = local_state_path(
+        'checkpoints', *([str(list_id)] if list_id else []))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def prune_checkpoints(now=None):
+    """Deletes checkpoints of imports which were never resumed.
+
+    Args:
+        now: the current unix time. Defaults to time.time().
+    """
+    now = now or time.time()
+    directory = checkpoint_dir()
+    for list_id in os.listdir(directory):
+        path = os.path.join(directory, list_id)
+        if (os.path.isdir(path) and now - os.path.getmtime(path) >
+                CHECKPOINT_MAX_AGE.total_seconds()):
+            shutil.rmtree(path, ignore_errors=True)
+
+class ImportCheckpoint():
+    """Stores completed member chunks and activity responses for a list.
+
+    Each member chunk and each subscriber's activity response is written
+    to local storage as soon as it arrives, as are the opens of each
+    campaign whose open-details report has been paged through. If the import fails part way,
+    the next attempt for the same list only requests what's missing. The
+    checkpoint is cleared once the import completes.
+    """
+
+    # The name of the file holding activity responses, one per line
+    ACTIVITY_FILENAME = 'activity.jsonl'
+
+    def __init__(self, list_id):
+        """Opens the checkpoint for a list, discarding it if it's stale.
+
+        Args:
+            list_id: the list's unique MailChimp id.
+        """
+        self.list_id = list_id
+        if (time.time() - os.path.getmtime(self.directory) >
+                CHECKPOINT_MAX_AGE.total_seconds()):
+            self.clear()
+
+    @property
+    def directory(self):
+        """The directory holding the checkpoint, created if it's missing."""
+        return checkpoint_dir(self.list_id)
+
+    def _touch(self):
+        """Marks the checkpoint as recently updated."""
+        os.utime(self.directory)
+
+    @staticmethod
+    def _member_chunk_filename(offset, count):
+        """Returns the filename of a member chunk."""
+        return 'members-{}-{}.json.gz'.format(offset, count)
+
+    def member_chunks(self):
+        """Returns the (offset, count) of each saved member chunk, in order."""
+        chunks = []
+        for filename in os.listdir(self.directory):
+            if (filename.startswith('members-') and
+                    filename.endswith('.json.gz')):
+                offset, count = filename[len('members-'):-len('.json.gz')
+                                        ].split('-')
+                chunks.append((int(offset), int(count)))
+        return sorted(chunks)
+
+    def _save_json(self, filename, data):
+        """Saves json-serializable data to a gzipped file."""
+        path = os.path.join(self.directory, filename)
+
+        # Write to a temporary file first so a crash can't leave half a file
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as json_file:
+            json.dump(data, json_file)
+        os.replace(path + '.tmp', path)
+        self._touch()
+
+    def _load_json(self, filename):
+        """Loads data saved by _save_json()."""
+        path = os.path.join(self.directory, filename)
+        with gzip.open(path, 'rt', encoding='utf-8') as json_file:
+            return json.load(json_file)
+
+    def save_member_chunk(self, offset, count, members):
+        """Saves a chunk of members.
+
+        Args:
+            offset: the offset the chunk was requested from.
+            count: the number of members the chunk was requested with.
+            members: the list of member dictionaries in the chunk.
+        """
+        self._save_json(self._member_chunk_filename(offset, count), members)
+
+    def load_member_chunk(self, offset, count):
+        """Loads a saved chunk of members. See save_member_chunk()."""
+        return self._load_json(self._member_chunk_filename(offset, count))
+
+    @staticmethod
+    def _campaign_filename(campaign_id):
+        """Returns the filename of a campaign's opens."""
+        return 'campaign-{}.json.gz'.format(campaign_id)
+
+    def campaigns(self):
+        """Returns the ids of the campaigns whose opens were saved."""
+        return sorted(
+            filename[len('campaign-'):-len('.json.gz')]
+            for filename in os.listdir(self.directory)
+            if filename.startswith('campaign-') and
+            filename.endswith('.json.gz'))
+
+    def save_campaign_opens(self, campaign_id, opens):
+        """Saves the opens of a campaign once all of them were imported.
+
+        Args:
+            campaign_id: the campaign's id.
+            opens: a dictionary mapping the id of each member who opened
+                the campaign to their latest open of it.
+        """
+        self._save_json(self._campaign_filename(campaign_id), opens)
+
+    def load_campaign_opens(self, campaign_id):
+        """Loads a campaign's saved opens. See save_campaign_opens()."""
+        return self._load_json(self._campaign_filename(campaign_id))
+
+    def save_activity(self, response):
+        """Appends a subscriber's decoded activity response."""
+        path = os.path.join(self.directory, self.ACTIVITY_FILENAME)
+        with open(path, 'a') as activity_file:
+            activity_file.write(json.dumps(response) + '\n')
+        self._touch()
+
+    def has_activity(self):
+        """Returns True if any activity responses were saved."""
+        return os.path.exists(
+            os.path.join(self.directory, self.ACTIVITY_FILENAME))
+
+    def load_activity(self):
+        """Yields every saved activity response.
+
+        A line cut short by a crash is skipped, that subscriber's activity
+        is simply requested again.
+        """
+        path = os.path.join(self.directory, self.ACTIVITY_FILENAME)
+        if not os.path.exists(path):
+            return
+        with open(path) as activity_file:
+            for line in activity_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def clear(self):
+        """Deletes the checkpoint."""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,7 +1,8 @@
 """This module contains database operations, e.g. insert, update, etc."""
+from datetime import datetime
 from sqlalchemy.exc import IntegrityError
 from app import db
-from app.models import AppUser, Organization
+from app.models import AppUser, Organization, ImportLock
 
 def update_user(user_info, org):
     """Updates a user in the database.
@@ -83,3 +84,48 @@ def associate_user_with_list(user_id, list_object):
     except:
         db.session.rollback()
         raise
+
+def acquire_import_lock(list_id, owner, timeout):
+    """Takes a list's import lock, unless another import holds it.
+
+    The lock is a row in the import_lock table, so whichever worker
+    inserts it first wins. Locks held longer than the timeout are assumed
+    to belong to a worker which died mid-import, and are broken.
+
+    Args:
+        list_id: the list's unique MailChimp id.
+        owner: a unique token identifying the caller.
+        timeout: a timedelta after which a held lock is broken.
+
+    Returns:
+        True if the caller now holds the lock.
+    """
+    ImportLock.query.filter(
+        ImportLock.list_id == list_id,
+        ImportLock.acquired_at < datetime.utcnow() - timeout).delete(
+            synchronize_session=False)
+    db.session.add(ImportLock(list_id=list_id, owner=owner))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    except:
+        db.session.rollback()
+        raise
+    return True
+
+def release_import_lock(list_id, owner):
+    """Releases a list's import lock, if the caller still holds it.
+
+    Args:
+        list_id: see acquire_import_lock().
+        owner: see acquire_import_lock().
+    """
+    ImportLock.query.filter_by(list_id=list_id, owner=owner).delete(
+        synchronize_session=False)
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
@@ -9,6 +9,7 @@ from flask_wtf import FlaskForm
 from wtforms import (StringField, SubmitField,
                      BooleanField, RadioField, SelectField)
 from wtforms.validators import DataRequired, Email
+from app.apiurls import mailchimp_url
 
 class UserForm(FlaskForm):
     """A form allowing the user to submit their basic information.
@@ -108,13 +109,12 @@ class ApiKeyForm(FlaskForm):
 
         # Get total number of lists
         # If connection refused by server or request fails, bad API key
-        request_uri = 'https://{}.api.mailchimp.com/3.0/'.format(data_center)
+        request_uri = mailchimp_url(data_center, 'lists')
         params = (
             ('fields', 'total_items'),
         )
         try:
-            response = (requests.get(request_uri +
-                                     'lists', params=params,
+            response = (requests.get(request_uri, params=params,
                                      auth=('shorenstein', key)))
         except requests.exceptions.ConnectionError:
             self.key.errors.append('Connection to MailChimp servers '
@@ -0,0 +1,372 @@
+"""This module caches MailChimp API responses between analyses.
+
+Responses to GET requests are stored zlib-compressed in a sqlite database
+in the local import state directory, keyed by the url, the request
+parameters and a hash of the api key. Each endpoint has its own time to
+live, after which a response is revalidated with its ETag, if MailChimp
+sent one. Responses are never kept longer than a day, and the least
+recently used ones are evicted to keep the cache under its size cap.
+
+A large import makes hundreds of thousands of cached requests from the
+event loop, so the cache keeps its own running total of the bytes
+stored rather than summing the table on every insert. It also queues
+the responses it's given, and when responses were last used, in memory,
+and writes them out in batches, so the event loop isn't held up by a
+compression and a sqlite commit per request.
+"""
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+from collections import namedtuple
+from datetime import timedelta
+from urllib.parse import urlparse
+from app.localstate import local_state_path
+
+# Responses are deleted this long after they were fetched, fresh or not
+MAX_RESPONSE_AGE = timedelta(days=1)
+
+# A cached response, and whether it's still within its time to live
+CachedResponse = namedtuple('CachedResponse', ['key', 'body', 'etag', 'fresh'])
+
+class ResponseCache():
+    """A disk-backed cache of MailChimp GET responses."""
+
+    # The time to live of responses from each endpoint, by url path
+    # Responses from any other endpoint, e.g. batch statuses, aren't cached
+    TTLS = (
+        (re.compile(r'/lists/[^/]+/members/[^/]+/activity$'),
+         timedelta(hours=6)),
+        (re.compile(r'/lists/[^/]+/members$'), timedelta(hours=6)),
+        (re.compile(r'/reports/[^/]+/open-details$'), timedelta(hours=6)),
+        (re.compile(r'/campaigns$'), timedelta(hours=1)),
+    )
+
+    # The zlib compression level. Favors speed, as json compresses well
+    COMPRESSION_LEVEL = 1
+
+    # The number of cache hits whose last use is recorded at once
+    LAST_USED_BATCH_SIZE = 1000
+
+    # The number of responses, or uncompressed bytes, stored at once
+    # Batches are looked up in one query, so stay under sqlite's 999
+    # Parameters
+    PUT_BATCH_SIZE = 100
+    PUT_BATCH_BYTES = 16 * 1024 * 1024
+
+    # The running total is recounted from the database after this many
+    # Inserts, since other worker processes write to the same cache
+    RECOUNT_INTERVAL = 10000
+
+    def __init__(self, path, max_bytes):
+        """Initializes a cache.
+
+        Args:
+            path: the path to the sqlite database.
+            max_bytes: the most compressed bytes to keep.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = None
+        self.pid = None
+        self.total_bytes = 0
+        self.inserts_since_recount = 0
+        self.last_used = {}
+        self.pending = {}
+        self.pending_bytes = 0
+
+    def connect(self):
+        """Returns a connection to the database, creating it if necessary.
+
+        Connections can't be shared with forked processes, so each process
+        opens its own, and counts the bytes stored for itself.
+
+        Other class variables:
+            total_bytes: the compressed bytes stored, as last counted plus
+                those this process has inserted since.
+            inserts_since_recount: the number of responses this process
+                has inserted since total_bytes was last counted.
+            last_used: a dictionary mapping the keys of responses served
+                since the last batch was written to when they were used.
+            pending: a dictionary mapping the keys of responses put since
+                the last batch was written to their rows, with the body
+                not yet compressed.
+            pending_bytes: the uncompressed bytes of the pending responses.
+        """
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=30)
+            self.pid = os.getpid()
+            self.last_used = {}
+            self.pending = {}
+            self.pending_bytes = 0
+            with self.connection:
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS responses ('
+                    'key TEXT PRIMARY KEY, url TEXT, api_key_hash TEXT, '
+                    'params TEXT, body BLOB, etag TEXT, stored_at REAL, '
+                    'expires_at REAL, last_used REAL, size INTEGER)')
+                self.connection.execute(
+                    'CREATE INDEX IF NOT EXISTS responses_url '
+                    'ON responses (url, api_key_hash)')
+                self.connection.execute(
+                    'CREATE INDEX IF NOT EXISTS responses_last_used '
+                    'ON responses (last_used)')
+            self.recount()
+        return self.connection
+
+    def recount(self):
+        """Counts the compressed bytes stored in the database."""
+        self.total_bytes, = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        self.inserts_since_recount = 0
+
+    @classmethod
+    def get_ttl(cls, url):
+        """Returns the time to live of an endpoint's responses, or None."""
+        path = urlparse(url).path
+        for pattern, ttl in cls.TTLS:
+            if pattern.search(path):
+                return ttl
+        return None
+
+    @staticmethod
+    def hash_api_key(api_key):
+        """Returns a hash of an api key, so the key itself isn't stored."""
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def serialize_params(params):
+        """Returns the request parameters as a json string."""
+        return json.dumps([list(param) for param in params or ()])
+
+    @classmethod
+    def make_key(cls, url, params, api_key):
+        """Returns the cache key of a request."""
+        return hashlib.sha256('\n'.join([
+            cls.hash_api_key(api_key), url,
+            cls.serialize_params(params)]).encode('utf-8')).hexdigest()
+
+    def get(self, url, params, api_key, now=None):
+        """Looks up a cached response.
+
+        Args:
+            url: the request url.
+            params: the HTTP GET parameters.
+            api_key: the api key the request is made with.
+            now: the current unix time. Defaults to time.time().
+
+        Returns:
+            A CachedResponse, or None if the request isn't cached.
+        """
+        if self.get_ttl(url) is None:
+            return None
+        now = now or time.time()
+        key = self.make_key(url, params, api_key)
+        connection = self.connect()
+
+        # Responses waiting to be written are served from memory
+        if key in self.pending:
+            (_, _, _, _, body, etag, stored_at, expires_at,
+             _, _) = self.pending[key]
+            if stored_at <= now - MAX_RESPONSE_AGE.total_seconds():
+                return None
+            self.pending[key][8] = now
+            return CachedResponse(key, body, etag, now < expires_at)
+
+        row = connection.execute(
+            'SELECT body, etag, expires_at FROM responses '
+            'WHERE key = ? AND stored_at > ?',
+            (key, now - MAX_RESPONSE_AGE.total_seconds())).fetchone()
+        if row is None:
+            return None
+        body, etag, expires_at = row
+        self.last_used[key] = now
+        if len(self.last_used) >= self.LAST_USED_BATCH_SIZE:
+            self.write_last_used()
+        return CachedResponse(key, zlib.decompress(body), etag,
+                              now < expires_at)
+
+    def put(self, url, params, api_key, body, etag=None, now=None): # pylint: disable=too-many-arguments
+        """Queues a response to be cached.
+
+        The queue is written out by write_pending() once it holds
+        PUT_BATCH_SIZE responses or PUT_BATCH_BYTES bytes.
+
+        Args:
+            url: see get().
+            params: see get().
+            api_key: see get().
+            body: the response body as bytes.
+            etag: the response's ETag header, if any.
+            now: see get().
+        """
+        ttl = self.get_ttl(url)
+        if ttl is None:
+            return
+        now = now or time.time()
+        key = self.make_key(url, params, api_key)
+        self.connect()
+        replaced = self.pending.pop(key, None)
+        if replaced is not None:
+            self.pending_bytes -= len(replaced[4])
+        self.pending[key] = [
+            key, url, self.hash_api_key(api_key),
+            self.serialize_params(params), body, etag, now,
+            now + ttl.total_seconds(), now, None]
+        self.pending_bytes += len(body)
+        self.last_used.pop(key, None)
+        if (len(self.pending) >= self.PUT_BATCH_SIZE or
+                self.pending_bytes >= self.PUT_BATCH_BYTES):
+            self.write_pending()
+
+    def write_pending(self):
+        """Compresses and stores the responses put since the last batch,
+        then evicts responses over the size cap."""
+        if not self.pending:
+            return
+        connection = self.connect()
+        rows = list(self.pending.values())
+        self.pending = {}
+        self.pending_bytes = 0
+        for row in rows:
+            row[4] = zlib.compress(row[4], self.COMPRESSION_LEVEL)
+            row[9] = len(row[4])
+        replaced, = connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses '
+            'WHERE key IN ({})'.format(', '.join('?' * len(rows))),
+            [row[0] for row in rows]).fetchone()
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO responses VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.total_bytes += sum(row[9] for row in rows) - replaced
+        self.inserts_since_recount += len(rows)
+        if self.inserts_since_recount >= self.RECOUNT_INTERVAL:
+            self.recount()
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def refresh(self, url, key, now=None):
+        """Restarts the time to live of a response MailChimp revalidated.
+
+        Args:
+            url: the request url.
+            key: the response's cache key.
+            now: see get().
+        """
+        now = now or time.time()
+        connection = self.connect()
+        self.last_used.pop(key, None)
+        if key in self.pending:
+            self.pending[key][7] = now + self.get_ttl(url).total_seconds()
+            self.pending[key][8] = now
+            return
+        with connection:
+            connection.execute(
+                'UPDATE responses SET expires_at = ?, last_used = ? '
+                'WHERE key = ?',
+                (now + self.get_ttl(url).total_seconds(), now, key))
+
+    def fresh_params(self, url, api_key, now=None):
+        """Returns the parameters of every fresh cached request to a url.
+
+        Args:
+            url: the request url.
+            api_key: see get().
+            now: see get().
+
+        Returns:
+            A list of parameter tuples, as passed to get().
+        """
+        now = now or time.time()
+        self.write_pending()
+        rows = self.connect().execute(
+            'SELECT params FROM responses WHERE url = ? AND '
+            'api_key_hash = ? AND expires_at > ?',
+            (url, self.hash_api_key(api_key), now)).fetchall()
+        return [tuple(tuple(param) for param in json.loads(params))
+                for params, in rows]
+
+    def write_last_used(self):
+        """Writes when the responses served since the last batch were
+        used."""
+        if not self.last_used:
+            return
+        with self.connect():
+            self.connection.executemany(
+                'UPDATE responses SET last_used = ? WHERE key = ?',
+                [(last_used, key) for key, last_used in self.last_used.items()])
+        self.last_used = {}
+
+    def flush(self):
+        """Writes out the queued responses and last uses."""
+        self.write_pending()
+        self.write_last_used()
+
+    def evict(self):
+        """Deletes the least recently used responses over the size cap.
+
+        Only called once the running total crosses the cap, so the table
+        is only summed then, in case other processes evicted meanwhile.
+        """
+        connection = self.connect()
+        self.write_last_used()
+        self.recount()
+        if self.total_bytes <= self.max_bytes:
+            return
+        excess = self.total_bytes - self.max_bytes
+        keys = []
+        for key, size in connection.execute(
+                'SELECT key, size FROM responses ORDER BY last_used'):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        with connection:
+            connection.executemany(
+                'DELETE FROM responses WHERE key = ?', keys)
+        self.recount()
+
+    def prune(self, now=None):
+        """Deletes responses older than MAX_RESPONSE_AGE."""
+        now = now or time.time()
+        connection = self.connect()
+        self.flush()
+        with connection:
+            connection.execute(
+                'DELETE FROM responses WHERE stored_at <= ?',
+                (now - MAX_RESPONSE_AGE.total_seconds(),))
+        self.recount()
+
+# The response cache of this worker process. See get_response_cache()
+_RESPONSE_CACHE = None
+
+def get_response_cache():
+    """Returns the response cache, or None if caching is disabled.
+
+    The cache is enabled by setting the RESPONSE_CACHE_MB environment
+    variable to its size cap in megabytes.
+    """
+    global _RESPONSE_CACHE # pylint: disable=global-statement
+    max_megabytes = os.environ.get('RESPONSE_CACHE_MB')
+    if not max_megabytes:
+        return None
+    if _RESPONSE_CACHE is None:
+        _RESPONSE_CACHE = ResponseCache(
+            local_state_path('responses.sqlite3'),
+            int(float(max_megabytes) * 1024 * 1024))
+    return _RESPONSE_CACHE
+
+def prune_response_cache(now=None):
+    """Deletes cached responses older than MAX_RESPONSE_AGE, if caching is
+    enabled.
+
+    Args:
+        now: the current unix time. Defaults to time.time().
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        cache.prune(now)
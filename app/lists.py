@@ -1,23 +1,115 @@
 """This module handles the data science operations on email lists."""
 import io
 import os
+import sys
 import json
+import time
 import asyncio
+import tarfile
+import tempfile
+import zlib
+from array import array
+from asyncio import TimeoutError as AsyncTimeoutError
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime, timedelta, timezone
-from billiard import current_process # pylint: disable=no-name-in-module
-import requests
-from requests.exceptions import ConnectionError as ConnError
 import pandas as pd
 from pandas.io.json import json_normalize
 import numpy as np
-from aiohttp import ClientSession, BasicAuth
+from aiohttp import BasicAuth
 import iso8601
 from celery.utils.log import get_task_logger
+from app.throttle import AIMDController, TokenBucketLimiter, RetryPolicy
+from app.snapshots import load_latest_snapshot
+from app.checkpoints import ImportCheckpoint
+from app.sessions import SESSION_MANAGER
+from app.proxies import get_proxy_pool
+from app.httpcache import get_response_cache
+from app.apiurls import mailchimp_url
+from app.metrics import MemberMetrics, open_rate_deciles
+
+# Use a faster json decoder if one is installed
+try:
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:
+        fast_json = json
+
+# Use a faster event loop if one is installed. See install_uvloop()
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# The threads large response bodies are decoded in
+# This keeps the event loop free to service the other connections
+DECODE_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+def decode_json(body):
+    """Decodes a json response body (bytes or str) with the fastest
+    available decoder."""
+    return fast_json.loads(body)
+
+async def decode_json_in_executor(body):
+    """Decodes a json response body in DECODE_EXECUTOR.
+
+    Args:
+        body: the response body, as bytes or str.
+
+    Returns:
+        The decoded response.
+    """
+    return await asyncio.get_event_loop().run_in_executor(
+        DECODE_EXECUTOR, decode_json, body)
+
+def estimate_stratified_proportion(strata, outcomes, stratum_sizes, z=1.96):
+    """Estimates a population proportion from a stratified random sample.
+
+    Each stratum's sample proportion is weighted by the stratum's share of
+    the population. The variance includes the finite population
+    correction, so fully sampled strata add no uncertainty.
+
+    Args:
+        strata: an int array holding the stratum of each sampled unit.
+        outcomes: a boolean array, True for each sampled unit which has the
+            property whose proportion is estimated.
+        stratum_sizes: an array holding the population size of each
+            stratum.
+        z: the z-score of the confidence level. 1.96 for 95%.
+
+    Returns:
+        A tuple containing the estimate and the lower and upper bounds of
+        its confidence interval.
+    """
+    stratum_sizes = np.asarray(stratum_sizes, dtype=float)
+    sample_sizes = np.bincount(strata, minlength=len(stratum_sizes))
+    positives = np.bincount(strata, weights=outcomes,
+                            minlength=len(stratum_sizes))
+    sampled = sample_sizes > 0
+    weights = stratum_sizes[sampled] / stratum_sizes.sum()
+    proportions = positives[sampled] / sample_sizes[sampled]
+    estimate = float(np.sum(weights * proportions))
+    variance = np.sum(
+        weights ** 2 * proportions * (1 - proportions) /
+        np.maximum(sample_sizes[sampled] - 1, 1) *
+        (1 - sample_sizes[sampled] / stratum_sizes[sampled]))
+    margin = z * float(np.sqrt(variance))
+    return estimate, max(estimate - margin, 0.), min(estimate + margin, 1.)
+
+def install_uvloop():
+    """Makes asyncio create uvloop's faster event loops, if installed."""
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 def do_async_import(coroutine):
     """Generic wrapper function to run async imports.
 
+    Runs on the worker process's event loop, which is reused by every
+    import the process runs.
+
     Args:
         coroutine: the coroutine to be run asynchronously
     """
@@ -31,13 +123,118 @@ class MailChimpImportError(ConnectionError):
         super().__init__(message)
         self.error_details = error_details
 
+class MemberColumns():
+    """Typed column buffers holding imported list members.
+
+    Member chunks are appended as soon as they are decoded, so the import
+    only keeps the columns we analyze in memory rather than every raw
+    response and the dictionaries built from it. Each column is stored in
+    the compact type given by the member schema: statuses as a
+    categorical, timestamps as datetime64 and rates as float32. Ids are
+    kept as strings, since activity requests, snapshot merges and the
+    activity sample are all keyed by them.
+    """
+
+    # Top-level member fields, as returned by the MailChimp API
+    STRING_FIELDS = ('status', 'timestamp_opt', 'timestamp_signup', 'id')
+
+    # Top-level member fields parsed into timestamps
+    TIMESTAMP_FIELDS = ('timestamp_opt', 'timestamp_signup')
+
+    # Member stats stored as rates
+    STATS_FIELDS = ('avg_open_rate', 'avg_click_rate')
+
+    # The type rates are stored as
+    # MailChimp reports rates to two decimal places, which float32 holds
+    # Exactly enough for every comparison we make
+    RATE_DTYPE = np.float32
+
+    def __init__(self):
+        self.columns = OrderedDict(
+            [(field, array('q') if field in self.TIMESTAMP_FIELDS else [])
+             for field in self.STRING_FIELDS] +
+            [(field, array('f')) for field in self.STATS_FIELDS])
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def append_members(self, members):
+        """Appends a chunk of members to the column buffers.
+
+        Args:
+            members: a list of member dictionaries as returned by the
+                MailChimp API, including the nested stats object.
+        """
+        for member in members:
+
+            # Statuses repeat across the whole list, so share one copy
+            status = member.get('status')
+            self.columns['status'].append(
+                sys.intern(status) if status else status)
+            self.columns['id'].append(member.get('id'))
+
+            stats = member.get('stats') or {}
+            for field in self.STATS_FIELDS:
+                value = stats.get(field)
+                self.columns[field].append(
+                    float('nan') if value is None else value)
+
+        # Parse each chunk's timestamps at once, so their strings are
+        # Never buffered. Missing or blank timestamps become NaT
+        for field in self.TIMESTAMP_FIELDS:
+            self.columns[field].frombytes(pd.to_datetime(
+                [member.get(field) for member in members], utc=True,
+                errors='coerce').asi8.tobytes())
+
+    def to_frame(self):
+        """Returns the buffered columns as a pandas dataframe."""
+        columns = OrderedDict()
+        for field, column in self.columns.items():
+            if field in self.TIMESTAMP_FIELDS:
+                column = np.asarray(column, dtype=np.int64).view(
+                    'datetime64[ns]')
+            elif isinstance(column, array):
+                column = np.asarray(column)
+            columns[field] = column
+        return self.apply_schema(pd.DataFrame(columns))
+
+    @classmethod
+    def apply_schema(cls, df): # pylint: disable=invalid-name
+        """Converts a members dataframe's columns to the member schema.
+
+        Columns which already have their compact type are left as is, so
+        this also tidies up frames read from older snapshots or joined
+        from several sources.
+
+        Args:
+            df: a pandas dataframe with some or all of the member columns.
+
+        Returns:
+            The dataframe, converted in place.
+        """
+        if 'status' in df:
+            df['status'] = df['status'].astype('category')
+        for field in cls.TIMESTAMP_FIELDS:
+            if field in df:
+                df[field] = pd.to_datetime(
+                    df[field], utc=True, errors='coerce')
+        for field in cls.STATS_FIELDS:
+            if field in df:
+                df[field] = df[field].astype(cls.RATE_DTYPE)
+        return df
+
 class MailChimpList(): # pylint: disable=too-many-instance-attributes
     """A class representing a MailChimp list."""
 
     # The max size of a request to the MailChimp API
     # This is for direct requests to the members endpoint
+    # This is only the starting point, the page size is tuned at runtime
     CHUNK_SIZE = 5000
 
+    # The bounds within which the member page size is tuned
+    MIN_CHUNK_SIZE = 1000
+    MAX_CHUNK_SIZE = 10000
+
     # The number of simultaneous connections we'll make to the API
     # The API limit is 10
     # But we want to make sure we don't interrupt other tasks
@@ -49,6 +246,30 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
     # (Each request takes very little time to complete)
     MAX_ACTIVITY_CONNECTIONS = 2
 
+    # The most connections the tuned concurrency may grow to
+    # Kept below the API limit of 10 for the same reason as above
+    MAX_TUNED_CONNECTIONS = 8
+
+    # The number of seconds we'd like a single request to take
+    # Slower member pages shrink the page size
+    TARGET_MEMBER_LATENCY = 15
+    TARGET_ACTIVITY_LATENCY = 2
+
+    # The number of requests per second each api key may make to MailChimp
+    # This is shared by every import using the key on a node
+    API_KEY_RATE_LIMIT = 10
+
+    # The largest burst of requests each api key may make at once
+    API_KEY_BURST = 10
+
+    # The most requests each api key may have in flight at once
+    # MailChimp allows each api key ten simultaneous connections
+    API_KEY_MAX_CONNECTIONS = 10
+
+    # The number of tokens an import takes from its api key's bucket at once
+    # So the bucket file is locked at most once per this many requests
+    API_KEY_TOKEN_BATCH = 5
+
     # The http status codes we'd like to retry in case of a connection issue
     HTTP_STATUS_CODES_TO_RETRY = [429, 504]
 
@@ -58,10 +279,102 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
     # The base backoff time in seconds
     BACKOFF_INTERVAL = 5
 
-    # The approximate amount of seconds it takes to cold boot a proxy
-    PROXY_BOOT_TIME = 30
-
-    def __init__(self, id, count, api_key, data_center): # pylint: disable=redefined-builtin
+    # The longest backoff time in seconds
+    MAX_BACKOFF_INTERVAL = 125
+
+    # The longest Retry-After we'll honor, in seconds
+    MAX_RETRY_AFTER = 300
+
+    # The number of seconds allowed to connect to MailChimp
+    # And to wait between reads once connected
+    CONNECT_TIMEOUT = 15
+    READ_TIMEOUT = 120
+
+    # How long a whole import may take before outstanding requests are
+    # Cancelled and the import fails
+    IMPORT_DEADLINE = timedelta(hours=12)
+
+    # The value recorded for subscribers who haven't opened an email
+    # Numpy reads this as NaT (not a time)
+    NO_OPEN = np.iinfo(np.int64).min
+
+    # The fields we request from the member activity endpoint
+    ACTIVITY_FIELDS = (
+        ('fields', 'activity.action,activity.timestamp,email_id'),
+        ('exclude_fields', 'total_items,_links')
+    )
+
+    # Lists with at least this many subscribers import their activity
+    # Via the Batch Operations API rather than one request per subscriber
+    BATCH_ACTIVITY_THRESHOLD = 10000
+
+    # The number of operations submitted in each batch
+    BATCH_SIZE = 50000
+
+    # How often to check whether a batch has finished, in seconds
+    BATCH_POLL_INTERVAL = 15
+
+    # How long to wait for a batch to finish before giving up, in seconds
+    BATCH_TIMEOUT = 6 * 60 * 60
+
+    # The size of the chunks batch results archives are downloaded in
+    DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+    # Lists with at least this many subscribers per campaign sent in the
+    # Past year may import opens campaign by campaign instead of per
+    # Subscriber, if that's estimated to take fewer requests
+    CAMPAIGN_ACTIVITY_RATIO = 100
+
+    # The number of members in each page of a campaign's opens
+    # This is the most MailChimp allows
+    CAMPAIGN_OPENS_PAGE_SIZE = 1000
+
+    # The member fields requested from the members endpoint
+    MEMBER_FIELDS = ('members.status,members.timestamp_opt,'
+                     'members.timestamp_signup,members.stats,members.id,'
+                     'total_items')
+
+    # The number of subscribers' activity lookups submitted in each batch
+    # While list members are still being imported
+    PIPELINE_BATCH_SIZE = 10000
+
+    # Lists with at least this many subscribers only import the activity of
+    # A stratified random sample of them
+    # Can be set with the ACTIVITY_SAMPLING_THRESHOLD environment variable
+    ACTIVITY_SAMPLING_THRESHOLD = int(
+        os.environ.get('ACTIVITY_SAMPLING_THRESHOLD') or 250000)
+
+    # The number of subscribers in the sample
+    # The 95% confidence interval of cur_yr_inactive_pct is then at most
+    # About +/- 1.6 percentage points wide, less for skewed lists
+    ACTIVITY_SAMPLE_SIZE = 4000
+
+    # The fewest subscribers sampled from each open rate decile
+    MIN_STRATUM_SAMPLE_SIZE = 30
+
+    # Lists with at least this many members are analyzed while they're
+    # Imported, without holding them in a dataframe. See MemberMetrics
+    # Can be set with the STREAMING_ANALYSIS_THRESHOLD environment variable
+    # Disabled unless it's set
+    STREAMING_ANALYSIS_THRESHOLD = int(
+        os.environ.get('STREAMING_ANALYSIS_THRESHOLD') or 0)
+
+    # The z-score of the confidence level reported for sampled metrics
+    CONFIDENCE_Z = 1.96
+
+    # Snapshots whose members were last all imported longer ago than this
+    # Are replaced by a full import, however often they were updated since
+    # This bounds the drift from members who were deleted in the meantime
+    # And from members' stats, as changing them doesn't change last_changed
+    SNAPSHOT_MAX_AGE = timedelta(days=7)
+
+    # The largest relative difference between an incrementally updated
+    # Snapshot and the list size before we fall back to a full import
+    SNAPSHOT_DRIFT_TOLERANCE = 0.02
+
+    def __init__(self, id, count, api_key, data_center, # pylint: disable=redefined-builtin,too-many-arguments
+                 keep_snapshot=False, retry_policy=None,
+                 session_manager=None, proxy_pool=None, memory_profiler=None):
         """Initializes a MailCimp list.
 
         Args:
@@ -71,8 +384,53 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
             api_key: a MailChimp api key associated with the list.
             data_center: the data center where the list is stored,
                 e.g. 'us2'. Used in MailChimp api calls.
+            keep_snapshot: whether local snapshots of the list are kept,
+                so the next import only requests members who have changed.
+                Only set if the user allowed us to store the list.
+            retry_policy: the RetryPolicy which decides whether failed
+                requests are retried. Defaults to one built from the
+                retry class variables, whose deadline starts now.
+            session_manager: the SessionManager lending out the aiohttp
+                session requests are made with. Defaults to the one shared
+                by the worker process.
+            proxy_pool: the ProxyPool which leases proxies. Defaults to the
+                worker process's.
+            memory_profiler: the MemoryProfiler recording the memory used
+                by each stage of the import, if any.
 
         Other class variables:
+            fetch_metadata: a dictionary describing how the members and
+                their activity were fetched. Stored alongside snapshots.
+            streaming: whether the list is analyzed in streaming mode, i.e.
+                from member_metrics rather than df.
+            member_metrics: the MemberMetrics accumulated from the members
+                in streaming mode, or tallied from df by tally_members().
+            tallied_df: the dataframe member_metrics was tallied from.
+            rate_limiter: the TokenBucketLimiter shared by every request
+                made with this list's api key.
+            checkpoint: the ImportCheckpoint recording the progress of the
+                import, so a failed import can be resumed.
+            subscriber_positions: a dictionary mapping each member's id to
+                their row in the dataframe. Only set while activity is
+                imported.
+            recent_opens: an int64 array holding each member's most recent
+                open, in nanoseconds since the epoch, by row. Only set
+                while activity is imported.
+            activity_sample: a pandas series holding the open rate decile
+                of each sampled subscriber, indexed by id. None unless the
+                list was large enough to sample.
+            stratum_sizes: an array holding the number of subscribers in
+                each open rate decile. None unless the list was sampled.
+            subscriber_queue: an asyncio queue which import_list_members()
+                feeds each chunk's subscriber ids into. Only set while
+                import_list() prefetches activity.
+            prefetched_opens: a dictionary mapping the id of each
+                subscriber whose activity was prefetched to their most
+                recent open. Only set while import_list() runs.
+            recent_campaign_ids: the ids of the campaigns sent in the past
+                year, if they were requested while prefetching.
+            response_cache: the ResponseCache GET requests are served
+                from, or None if caching is disabled.
             proxy: the proxy to use for making MailChimp API requests.
             df: the pandas dataframe to perform calculations on.
             frequency: how often a campaign is sent on average.
@@ -90,12 +448,46 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
                 than 80% of emails.
             cur_yr_active_pct: the percentage of list members who registered
                 an 'open' event in the past 365 days.
+            cur_yr_inactive_pct_lower: the lower bound of the confidence
+                interval of cur_yr_inactive_pct, if it was estimated from a
+                sample.
+            cur_yr_inactive_pct_upper: the upper bound of the same.
         """
         self.id = id # pylint: disable=invalid-name
         self.count = int(count)
         self.api_key = api_key
         self.data_center = data_center
+        self.keep_snapshot = keep_snapshot
+        self.fetch_metadata = {}
+        self.streaming = bool(self.STREAMING_ANALYSIS_THRESHOLD and
+                              self.count >= self.STREAMING_ANALYSIS_THRESHOLD)
+        self.member_metrics = None
+        self.tallied_df = None
         self.logger = get_task_logger(__name__)
+        self.rate_limiter = TokenBucketLimiter(
+            api_key, data_center, self.API_KEY_RATE_LIMIT, self.API_KEY_BURST,
+            max_connections=self.API_KEY_MAX_CONNECTIONS,
+            batch_size=self.API_KEY_TOKEN_BATCH)
+        self.checkpoint = ImportCheckpoint(id)
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_retries=self.MAX_RETRIES, base_delay=self.BACKOFF_INTERVAL,
+            max_delay=self.MAX_BACKOFF_INTERVAL,
+            max_retry_after=self.MAX_RETRY_AFTER,
+            connect_timeout=self.CONNECT_TIMEOUT,
+            read_timeout=self.READ_TIMEOUT,
+            deadline=self.IMPORT_DEADLINE.total_seconds())
+        self.session_manager = session_manager or SESSION_MANAGER
+        self.proxy_pool = proxy_pool
+        self.memory_profiler = memory_profiler
+        self.response_cache = get_response_cache()
+
+        self.subscriber_positions = None
+        self.recent_opens = None
+        self.activity_sample = None
+        self.stratum_sizes = None
+        self.subscriber_queue = None
+        self.prefetched_opens = None
+        self.recent_campaign_ids = None
 
         self.proxy = None
         self.df = None # pylint: disable=invalid-name
@@ -109,13 +501,16 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
         self.pending_pct = None
         self.high_open_rt_pct = None
         self.cur_yr_inactive_pct = None
+        self.cur_yr_inactive_pct_lower = None
+        self.cur_yr_inactive_pct_upper = None
 
     async def enable_proxy(self):
         """Enables a proxy server.
 
         Requests are proxied through US Proxies to prevent MailChimp
         blocks. This is an accepted technique among integrators and
-        does not violate MailChimp's Terms of Service.
+        does not violate MailChimp's Terms of Service. The proxy is leased
+        from the worker's ProxyPool, which keeps it warm between imports.
         """
 
         # Don't use a proxy if environment variable is set, e.g. in development
@@ -124,70 +519,51 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
                 'NO_PROXY environment variable set. Not using a proxy.')
             return
 
-        # Get the worker number for this Celery worker
-        # We want each worker to control its corresponding proxy process
-        # Note that workers are zero-indexed, proxy procceses are not
-        process = current_process()
-
-        # Fall back to proxy #1 if we can't ascertain the worker index
-        # e.g. anyone hacking with this app on windows
-        try:
-            proxy_process_number = str(process.index + 1)
-        except AttributeError:
-            proxy_process_number = '1'
-
-        # Use the US Proxies API to get the proxy info
-        proxy_request_uri = 'http://us-proxies.com/api.php'
-        proxy_params = (
-            ('api', ''),
-            ('uid', '9557'),
-            ('pwd', os.environ.get('PROXY_AUTH_PWD')),
-            ('cmd', 'rotate'),
-            ('process', proxy_process_number),
-        )
+        # Lease a warm proxy from this worker's pool
+        if self.proxy_pool is None:
+            self.proxy_pool = get_proxy_pool()
+        self.proxy = await self.proxy_pool.lease()
 
-        try:
-            proxy_response = requests.get(proxy_request_uri,
-                                          params=proxy_params)
-            proxy_response_vars = proxy_response.text.split(':')
-
-            # Set the proxy for requests from this worker
-            # Keep as None (i.e, use the server's IP)
-            # Only if we have an issue with the proxy provider
-            if proxy_response_vars[0] != 'ERROR':
-                self.proxy = ('http://{}:{}'.format(
-                    proxy_response_vars[1], proxy_response_vars[2]))
-
-        # If proxy provider is unreachable, don't use a proxy
-        except ConnError:
-            proxy_response_vars = None
-
-        # Allow some time for the proxy server to boot up
-        # We don't need to wait if we're not using a proxy
+        # Keep as None (i.e, use the server's IP)
+        # Only if we have an issue with the proxy provider
         if self.proxy:
             self.logger.info('Using proxy: %s', self.proxy)
-            await asyncio.sleep(self.PROXY_BOOT_TIME)
         else:
             self.logger.warning('Not using a proxy. Reason: %s.',
-                                proxy_response_vars[2] if
-                                proxy_response_vars else
-                                'ConnectionError: proxy provider down.')
+                                self.proxy_pool.last_error)
 
-    async def make_async_request(self, url, params, session, retry=0):
+    async def make_async_request(self, url, params, session, # pylint: disable=too-many-arguments,too-many-branches
+                                 controller=None, json_payload=None,
+                                 as_bytes=False, use_cache=True,
+                                 download_to=None):
         """Makes an async request using aiohttp.
 
-        Makes a get request.
+        Makes a get request (or a post request, if there's a json payload)
+        once the api key's rate limiter allows it. If response caching is
+        enabled, fresh cached responses to get requests are returned
+        without making a request, and stale ones are revalidated with their
+        ETag, unless the request asks for the current state of the list.
         If successful, returns the response text future.
         If the request times out, or returns a status code
-        that we want to retry, recursively retry the request
-        up to MAX_RETRIES times using exponential backoff.
+        that we want to retry, retry the request as long as the
+        retry policy allows, waiting at least as long as any
+        Retry-After header asks.
 
         Args:
             url: The url to make the request to.
             params: The HTTP GET parameters.
             session: The aiohttp ClientSession to make requests with.
-            retry: The number of previous attempts at this individual
-                request.
+            controller: An AIMDController to report each attempt's
+                latency and status code to. Optional.
+            json_payload: A json-serializable body to post. Optional.
+            as_bytes: Whether to return the raw response body rather than
+                decoding it to text.
+            use_cache: Whether the response cache may be used. If not, the
+                response is neither served from nor stored in it.
+            download_to: A file to stream the response body into, which is
+                returned instead. Optional. Used for pre-signed urls, so the
+                request is made without MailChimp credentials, and isn't
+                cached.
 
         Returns:
             An asyncio future, which, when awaited,
@@ -195,116 +571,249 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
 
         Throws:
             MailChimpImportError: The request keeps returning a bad HTTP status
-                code and/or timing out with no response.
+                code and/or timing out with no response, or the import's
+                deadline has passed.
         """
-        try:
+        retry = 0
+        delay = None
+
+        # Serve get requests from the response cache while they're fresh
+        cache = (self.response_cache
+                 if json_payload is None and use_cache and download_to is None
+                 else None)
+        cached = cache.get(url, params, self.api_key) if cache else None
+        if cached is not None and cached.fresh:
+            return cached.body if as_bytes else cached.body.decode('utf-8')
+
+        # Otherwise ask MailChimp whether a stale response is still current
+        revalidation = ({'headers': {'If-None-Match': cached.etag}}
+                        if cached is not None and cached.etag else {})
+
+        while True:
+
+            # Don't start requests the import no longer has time for
+            if self.retry_policy.expired():
+                self.raise_deadline_exceeded(url)
+
+            # Wait our turn among every import using this api key
+            # The connection slot it takes is freed before any backoff
+            await self.rate_limiter.acquire()
+
+            start_time = time.monotonic()
+
+            try:
+
+                # Make the async request with aiohttp
+                auth = (BasicAuth('shorenstein', self.api_key)
+                        if download_to is None else None)
+                timeout = self.retry_policy.get_timeout()
+                request = (session.get(url, params=params, auth=auth,
+                                       proxy=self.proxy, timeout=timeout,
+                                       **revalidation)
+                           if json_payload is None
+                           else session.post(url, json=json_payload,
+                                             auth=auth, proxy=self.proxy,
+                                             timeout=timeout))
+                async with request as response:
+
+                    # If we got a 200 OK, return the request response
+                    # Caching it first, if it's cacheable
+                    # A download restarts from scratch on each attempt
+                    if response.status == 200:
+                        if download_to is not None:
+                            download_to.seek(0)
+                            download_to.truncate()
+                            async for data in response.content.iter_chunked(
+                                    self.DOWNLOAD_CHUNK_SIZE):
+                                download_to.write(data)
+                            response_text = download_to
+                        elif cache is not None:
+                            response_text = await response.read()
+                            cache.put(url, params, self.api_key, response_text,
+                                      response.headers.get('ETag'))
+                            if not as_bytes:
+                                response_text = response_text.decode('utf-8')
+                        else:
+                            response_text = await (
+                                response.read() if as_bytes
+                                else response.text())
+                        if controller:
+                            controller.record(time.monotonic() - start_time,
+                                              response.status)
+                        return response_text
+
+                    # If the cached response is still current, return it
+                    if response.status == 304 and cached is not None:
+                        cache.refresh(url, cached.key)
+                        if controller:
+                            controller.record(time.monotonic() - start_time,
+                                              response.status)
+                        return (cached.body if as_bytes
+                                else cached.body.decode('utf-8'))
+
+                    # Let the controller back off if MailChimp is overloaded
+                    if controller:
+                        controller.record(time.monotonic() - start_time,
+                                          response.status)
+
+                    # Always log the bad response
+                    self.logger.warning('Received invalid response code: '
+                                        '%s. URL: %s. API key: %s. '
+                                        'Response: %s.', response.status,
+                                        url, self.api_key,
+                                        response.reason)
+
+                    # Retry if we got an error
+                    # And the retry policy allows it
+                    delay = self.retry_policy.get_delay(
+                        delay, response.headers.get('Retry-After'))
+                    if not (response.status in self.HTTP_STATUS_CODES_TO_RETRY
+                            and self.retry_policy.should_retry(retry, delay)):
+
+                        # Prepare some details for the user
+                        error_details = OrderedDict([
+                            ('err_desc', 'An error occurred when '
+                                         'trying to import your data '
+                                         'from MailChimp.'),
+                            ('mailchimp_err_code', response.status),
+                            ('mailchimp_url', url),
+                            ('api_key', self.api_key),
+                            ('mailchimp_err_reason', response.reason)])
+
+                        # Log the error and raise an exception
+                        self.logger.exception(
+                            'Invalid response code from MailChimp')
+                        raise MailChimpImportError(
+                            'Invalid response code from MailChimp',
+                            error_details)
+
+            # Catch proxy problems as well as potential asyncio timeouts/disconnects
+            except Exception as e: # pylint: disable=invalid-name
+
+                exception_type = type(e).__name__
+
+                # If we're just catching the exception raised above
+                # don't need to do anything else
+                if exception_type == 'MailChimpImportError':
+                    raise
+
+                # We didn't get a response, which the controller treats as
+                # congestion
+                if controller:
+                    controller.record(time.monotonic() - start_time)
+
+                # Otherwise, log what happened as appropriate
+                # A proxy which fails is replaced before the retry
+                if exception_type == 'ClientHttpProxyError':
+                    self.logger.warning('Failed to connect to proxy! '
+                                        'Proxy: %s', self.proxy)
+                    if self.proxy_pool is not None:
+                        self.proxy_pool.flag(self.proxy)
+
+                elif exception_type == 'ServerDisconnectedError':
+                    self.logger.warning('Server disconnected! URL: %s. API '
+                                        'key: %s.', url, self.api_key)
+
+                elif exception_type == 'TimeoutError':
+                    self.logger.warning('Asyncio request timed out! URL: %s. '
+                                        'API key: %s.', url, self.api_key)
+
+                else:
+                    self.logger.warning('An unforseen error type occurred. '
+                                        'Error type: %s. URL: %s. API Key: '
+                                        '%s.', exception_type, url,
+                                        self.api_key)
+
+                # Retry if the retry policy allows it
+                delay = self.retry_policy.get_delay(delay)
+                if not self.retry_policy.should_retry(retry, delay):
+
+                    # Prepare some details for the user
+                    error_details = OrderedDict([
+                        ('err_desc', 'An error occurred when '
+                                     'trying to import your data from '
+                                     'MailChimp.'),
+                        ('application_exception', exception_type),
+                        ('mailchimp_url', url),
+                        ('api_key', self.api_key)])
+
+                    # Log the error and raise an exception
+                    self.logger.exception(
+                        'Error in async request to MailChimp (%s)',
+                        exception_type)
+
+                    raise MailChimpImportError(
+                        'Error in async request to MailChimp ({})'.format(
+                            exception_type),
+                        error_details)
+
+            finally:
+                await self.rate_limiter.release()
+
+            # Increment retry count, log, and sleep before retrying
+            retry += 1
+            self.logger.info('Retrying (%s) in %.1f seconds.', retry, delay)
+            await asyncio.sleep(delay)
+
+            # Swap a flagged proxy for a working one
+            if (self.proxy is not None and
+                    self.proxy_pool.is_flagged(self.proxy)):
+                self.proxy = await self.proxy_pool.lease()
+
+    def raise_deadline_exceeded(self, url):
+        """Raises an exception for an import which ran out of time.
 
-            # Make the async request with aiohttp
-            async with session.get(url, params=params,
-                                   auth=BasicAuth('shorenstein',
-                                                  self.api_key),
-                                   proxy=self.proxy) as response:
-
-                # If we got a 200 OK, return the request response
-                if response.status == 200:
-                    return await response.text()
-
-                # Always log the bad response
-                self.logger.warning('Received invalid response code: '
-                                    '%s. URL: %s. API key: %s. '
-                                    'Response: %s.', response.status,
-                                    url, self.api_key,
-                                    response.reason)
-
-                # Retry if we got an error
-                # And we haven't already retried a few times
-                if (response.status in self.HTTP_STATUS_CODES_TO_RETRY
-                        and retry < self.MAX_RETRIES):
-
-                    # Increment retry count, log, sleep and then retry
-                    retry += 1
-                    self.logger.info('Retrying (%s)', retry)
-                    await asyncio.sleep(self.BACKOFF_INTERVAL ** retry)
-                    return await self.make_async_request(
-                        url, params, session, retry)
-
-                # Prepare some details for the user
-                error_details = OrderedDict([
-                    ('err_desc', 'An error occurred when '
-                                 'trying to import your data '
-                                 'from MailChimp.'),
-                    ('mailchimp_err_code', response.status),
-                    ('mailchimp_url', url),
-                    ('api_key', self.api_key),
-                    ('mailchimp_err_reason', response.reason)])
-
-                # Log the error and raise an exception
-                self.logger.exception('Invalid response code from MailChimp')
-                raise MailChimpImportError(
-                    'Invalid response code from MailChimp',
-                    error_details)
-
-        # Catch proxy problems as well as potential asyncio timeouts/disconnects
-        except Exception as e: # pylint: disable=invalid-name
-
-            exception_type = type(e).__name__
-
-            # If we're just catching the exception raised above
-            # don't need to do anything else
-            if exception_type == 'MailChimpImportError':
-                raise
-
-            # Otherwise, log what happened as appropriate
-            if exception_type == 'ClientHttpProxyError':
-                self.logger.warning('Failed to connect to proxy! Proxy: %s',
-                                    self.proxy)
-
-            elif exception_type == 'ServerDisconnectedError':
-                self.logger.warning('Server disconnected! URL: %s. API key: '
-                                    '%s.', url, self.api_key)
-
-            elif exception_type == 'TimeoutError':
-                self.logger.warning('Asyncio request timed out! URL: %s. '
-                                    'API key: %s.', url, self.api_key)
-
-            else:
-                self.logger.warning('An unforseen error type occurred. '
-                                    'Error type: %s. URL: %s. API Key: %s.',
-                                    exception_type, url, self.api_key)
-
-            # Retry if we haven't already retried a few times
-            if retry < self.MAX_RETRIES:
-
-                # Increment retry count, log, sleep, and then retry
-                retry += 1
-                self.logger.info('Retrying (%s)', retry)
-                await asyncio.sleep(self.BACKOFF_INTERVAL ** retry)
-                return await self.make_async_request(
-                    url, params, session, retry)
-
-            # Prepare some details for the user
-            error_details = OrderedDict([
-                ('err_desc', 'An error occurred when '
-                             'trying to import your data from MailChimp.'),
-                ('application_exception', exception_type),
-                ('mailchimp_url', url),
-                ('api_key', self.api_key)])
-
-            # Log the error and raise an exception
-            self.logger.exception('Error in async request to MailChimp (%s)',
-                                  exception_type)
-
-            raise MailChimpImportError(
-                'Error in async request to MailChimp ({})'.format(
-                    exception_type),
-                error_details)
+        Args:
+            url: the url of the request which couldn't be made in time.
+
+        Throws:
+            MailChimpImportError: always.
+        """
+        error_details = OrderedDict([
+            ('err_desc', 'An error occurred when '
+                         'trying to import your data from MailChimp.'),
+            ('application_exception', 'ImportDeadlineExceeded'),
+            ('mailchimp_url', url),
+            ('api_key', self.api_key)])
+        self.logger.error('Import of list %s did not finish in time.',
+                          self.id)
+        raise MailChimpImportError('Import did not finish in time',
+                                   error_details)
+
+    async def gather_requests(self, tasks, url):
+        """Awaits a number of request tasks within the import's deadline.
+
+        If any task fails, or the deadline passes, the outstanding tasks
+        are cancelled so the import fails fast rather than waiting on them.
+
+        Args:
+            tasks: a list of asyncio tasks.
+            url: the endpoint the tasks make requests to. Used for error
+                details.
+
+        Returns:
+            A list of the tasks' results.
+
+        Throws:
+            MailChimpImportError: the deadline passed before all tasks
+                completed, or a task raised one.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.gather(*tasks),
+                                          self.retry_policy.remaining())
+        except AsyncTimeoutError:
+            self.raise_deadline_exceeded(url)
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def make_async_requests(self, sem, url, params, session):
         """Makes a number of async requests using a semaphore.
 
         Args:
             sem: A semaphore to limit the number of concurrent async
-                requests.
+                requests. If this is an AIMDController, each request's
+                outcome is reported back to it as well.
             url: See make_async_request().
             params: See make_async_request().
             session: See make_async_request().
@@ -313,108 +822,770 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
             An asyncio future resolved into a dictionary containing
                 request results.
         """
+        controller = sem if isinstance(sem, AIMDController) else None
         async with sem:
-            res = await self.make_async_request(url, params, session)
-            return json.loads(res)
+            res = await self.make_async_request(
+                url, params, session, controller=controller)
+
+        # Free the slot for the next request before decoding
+        # Then decode off the event loop, as open-details pages are large
+        return await decode_json_in_executor(res)
+
+    async def request_checkpointed_activity(self, controller, url, session):
+        """Requests a subscriber's activity, then checkpoints and records
+        the response.
+
+        Args:
+            controller: See make_async_requests().
+            url: See make_async_request().
+            session: See make_async_request().
+        """
+        response = await self.make_async_requests(
+            controller, url, self.ACTIVITY_FIELDS, session)
+        self.checkpoint.save_activity(response)
+        self.record_sub_activity(response)
+
+    def plan_member_chunks(self, controller, completed=(), cached=()):
+        """Plans the member requests one chunk at a time.
+
+        Each chunk is only sized when it's requested, so it uses the page
+        size the controller has tuned so far and the list size most
+        recently reported by MailChimp. If a cached page starts where a
+        chunk does, the chunk takes the page's size instead, so it's
+        served from the cache.
+
+        Args:
+            controller: the AIMDController governing the member import.
+            completed: a sorted list of (offset, count) tuples of chunks
+                which have already been imported. These are skipped.
+            cached: a list of (offset, count) tuples of member pages in the
+                response cache.
+
+        Yields:
+            The HTTP GET parameters for each request.
+        """
+        completed = list(completed)
+        cached = dict(cached)
+        offset = 0
+        while offset < self.count:
+
+            # Skip past any chunks imported by a previous attempt
+            if completed and completed[0][0] <= offset:
+                completed_offset, completed_count = completed.pop(0)
+                offset = max(offset, completed_offset + completed_count)
+                continue
+
+            # Calculate the number of members in this request
+            # Without overlapping the next chunk already imported
+            chunk = min(cached.get(offset) or controller.chunk_size,
+                        self.count - offset,
+                        *([completed[0][0] - offset] if completed else []))
+
+            yield (
+                ('fields', self.MEMBER_FIELDS),
+                ('count', str(chunk)),
+                ('offset', str(offset)),
+            )
+
+            offset += chunk
+
+    async def import_members_worker(self, controller, url, chunks, session, # pylint: disable=too-many-arguments
+                                    columns, use_cache=True):
+        """Imports chunks of list members until none are left.
+
+        A chunk is only taken once the controller grants a request slot,
+        which is freed as soon as the raw body has been downloaded.
+        Each chunk is then decoded in DECODE_EXECUTOR, so other chunks keep
+        downloading meanwhile, and its members are appended to the column
+        buffers straight away, so the raw response can be released before
+        the remaining chunks land. Its subscribers' ids are handed to the
+        activity prefetcher, if import_list() started one. The chunk is
+        also checkpointed so a retried import doesn't request it again.
+        MailChimp's total_items replaces the list size, so the remaining
+        chunks are planned from an up-to-date count.
+
+        Args:
+            controller: the AIMDController governing the member import.
+            url: See make_async_request().
+            chunks: a generator of request parameters, shared between
+                workers. See plan_member_chunks().
+            session: See make_async_request().
+            columns: the MemberColumns instance to append members to.
+            use_cache: see make_async_request().
+        """
+        while True:
+            async with controller:
+                params = next(chunks, None)
+                if params is None:
+                    return
+                response = await self.make_async_request(
+                    url, params, session, controller=controller,
+                    as_bytes=True, use_cache=use_cache)
+            response = await decode_json_in_executor(response)
+            members = response.get('members', [])
+            columns.append_members(members)
+
+            # Hand the chunk's subscribers to the activity prefetcher
+            if self.subscriber_queue is not None:
+                self.subscriber_queue.put_nowait(
+                    [member['id'] for member in members
+                     if member['status'] == 'subscribed'])
+            if 'total_items' in response:
+                self.count = response['total_items']
+            params = dict(params)
+            self.checkpoint.save_member_chunk(
+                int(params['offset']), int(params['count']), members)
 
     async def import_list_members(self):
         """Requests basic information about MailChimp list members in chunks.
 
         This includes the member status, member stats, etc.
-        Requests are made asynchronously (up to CHUNK_SIZE members
-        per requests) using aiohttp. This speeds up the process
-        significantly and prevents timeouts.
-        After the requests have completed, parses the results and turns
-        them into a pandas dataframe.
+        Requests are made asynchronously using aiohttp. This speeds up the
+        process significantly and prevents timeouts. The number of
+        requests in flight and the size of each chunk are tuned while the
+        import runs, starting from the values which worked last time for
+        this data center.
+        Each chunk is streamed into typed column buffers as it arrives,
+        so peak memory grows with the column data rather than with the
+        raw responses. After the requests have completed, the buffers are
+        turned into a pandas dataframe with the member stats already
+        flattened.
+        If a previous attempt to import the list failed part way, the
+        chunks it checkpointed are loaded instead of requested again.
+        The list size we were given may be stale, so the first chunk is
+        requested on its own and the rest are planned from the size
+        MailChimp reports. Once every chunk has arrived, the size is
+        checked again and any members added in the meantime are imported.
         """
 
         # Enable a proxy
         await self.enable_proxy()
 
         # MailChimp API endpoint for requests
-        request_uri = ('https://{}.api.mailchimp.com/3.0/lists/{}/'
-                       'members'.format(self.data_center, self.id))
+        request_uri = mailchimp_url(
+            self.data_center, 'lists/{}/members'.format(self.id))
+
+        # Column buffers which each chunk is appended to as it arrives
+        # In streaming mode, metrics which each chunk is added to instead
+        columns = (MemberMetrics(self.id, self.ACTIVITY_SAMPLE_SIZE)
+                   if self.streaming else MemberColumns())
+
+        # Resume from the chunks a previous attempt already imported
+        completed = self.checkpoint.member_chunks()
+        for offset, count in completed:
+            columns.append_members(
+                self.checkpoint.load_member_chunk(offset, count))
+        if completed:
+            self.logger.info('Resuming import of list %s from %s '
+                             'checkpointed members.', self.id, len(columns))
+
+        # Pages a recent import left in the response cache
+        cached = self.cached_member_chunks(request_uri)
+
+        # Controller to limit and tune simultaneous connections to MailChimp
+        controller = AIMDController.load(
+            self.data_center, 'members', self.MAX_CONNECTIONS,
+            self.CHUNK_SIZE, min_chunk_size=self.MIN_CHUNK_SIZE,
+            max_chunk_size=self.MAX_CHUNK_SIZE,
+            max_concurrency=self.MAX_TUNED_CONNECTIONS,
+            target_latency=self.TARGET_MEMBER_LATENCY)
+
+        # Make requests with the worker's long-lived session
+        async with self.session_manager as session:
+            while True:
+
+                # The chunks to request, planned lazily as workers pick
+                # them up. Every imported chunk is checkpointed
+                chunks = self.plan_member_chunks(
+                    controller, self.checkpoint.member_chunks(), cached)
+
+                # Request the first chunk on its own
+                # So the rest are planned from MailChimp's count
+                # Which mustn't be a cached one
+                await self.import_members_worker(
+                    controller, request_uri, islice(chunks, 1), session,
+                    columns, use_cache=False)
+
+                # Start enough workers to use the highest concurrency we
+                # may reach
+                tasks = [asyncio.ensure_future(
+                    self.import_members_worker(
+                        controller, request_uri, chunks, session, columns))
+                         for _ in range(controller.max_concurrency)]
+
+                # Await completion of all requests
+                await self.gather_requests(tasks, request_uri)
+
+                # Re-check the count and import any tail we missed
+                self.count = await self.count_list_members(
+                    request_uri, session)
+                if next(self.plan_member_chunks(
+                        controller, self.checkpoint.member_chunks()),
+                        None) is None:
+                    break
+                self.logger.info('List %s grew to %s members during the '
+                                 'import. Importing the rest.', self.id,
+                                 self.count)
+
+        # Remember what worked for the next import from this data center
+        controller.save()
+
+        # Create a pandas dataframe from the column buffers
+        if self.streaming:
+            self.member_metrics = columns
+        else:
+            self.df = columns.to_frame() # pylint: disable=invalid-name
 
-        # List of async tasks to do
-        tasks = []
+    def cached_member_chunks(self, url):
+        """Returns the (offset, count) of each fresh member page in the
+        response cache.
 
-        # Placeholder for async responses
-        responses = None
+        Args:
+            url: the list's members endpoint.
+        """
+        if self.response_cache is None:
+            return []
+        chunks = []
+        for params in self.response_cache.fresh_params(url, self.api_key):
+            params = dict(params)
+            if (set(params) == {'fields', 'count', 'offset'} and
+                    params['fields'] == self.MEMBER_FIELDS):
+                chunks.append((int(params['offset']), int(params['count'])))
+        return sorted(chunks)
+
+    async def count_list_members(self, url, session):
+        """Requests the current number of members in the list.
 
-        # Semaphore to limit max simultaneous connections to MailChimp API
-        sem = asyncio.Semaphore(self.MAX_CONNECTIONS)
+        Args:
+            url: the list's members endpoint.
+            session: See make_async_request().
 
-        # The total number of chunks, i.e. requests to make to MailChimp
-        # If list is smaller than CHUNK_SIZE, this is 1 request
-        number_of_chunks = (1 if self.count < self.CHUNK_SIZE
-                            else self.count // self.CHUNK_SIZE + 1)
+        Returns:
+            The number of members, including subscribed, unsubscribed,
+            pending, and cleaned. Never a cached count, so members who
+            joined during the import are noticed.
+        """
+        response = json.loads(await self.make_async_request(
+            url, (('fields', 'total_items'), ('count', '1')), session,
+            use_cache=False))
+        return response['total_items']
 
-        # Make requests with a single session
-        async with ClientSession() as session:
-            for chunk_num in range(number_of_chunks):
+    async def import_changed_members(self, since):
+        """Requests the list members who have changed since a given time.
 
-                # Calculate the number of members in this request
-                chunk = (str(self.count % self.CHUNK_SIZE
-                             if chunk_num == number_of_chunks - 1
-                             else self.CHUNK_SIZE))
+        Pages through the members endpoint using MailChimp's
+        since_last_changed filter until every changed member has been
+        requested.
 
-                # Calculate where to begin request from
-                offset = str(chunk_num * self.CHUNK_SIZE)
+        Args:
+            since: a timezone-aware datetime. Only members changed after
+                this are requested.
 
+        Returns:
+            A pandas dataframe of the changed members, with the same columns
+            as the one created by import_list_members().
+        """
+        request_uri = mailchimp_url(
+            self.data_center, 'lists/{}/members'.format(self.id))
+        columns = MemberColumns()
+        offset = 0
+        total_items = None
+
+        async with self.session_manager as session:
+            while total_items is None or offset < total_items:
                 params = (
-                    ('fields', 'members.status,'
-                               'members.timestamp_opt,'
-                               'members.timestamp_signup,'
-                               'members.stats,members.id'),
-                    ('count', chunk),
-                    ('offset', offset),
+                    ('fields', self.MEMBER_FIELDS),
+                    ('since_last_changed', since.isoformat()),
+                    ('count', str(self.CHUNK_SIZE)),
+                    ('offset', str(offset)),
                 )
+                response = json.loads(await self.make_async_request(
+                    request_uri, params, session))
+                members = response.get('members', [])
+                columns.append_members(members)
+                total_items = response.get('total_items', 0)
+                offset += self.CHUNK_SIZE
+                if not members:
+                    break
+
+        return columns.to_frame()
+
+    async def import_list_members_incremental(self):
+        """Imports list members, reusing the last snapshot if there is one.
+
+        If a recent snapshot of the list exists, only members who have
+        changed since it was fetched are requested and merged into it.
+        Otherwise, or if the merged result has drifted too far from the list
+        size, falls back to import_list_members().
+        MailChimp doesn't count a change to a member's stats as a change,
+        so the stats of other members are only as recent as the last full
+        import. Snapshots are therefore only updated until SNAPSHOT_MAX_AGE
+        after it.
+        """
+
+        # Note when we started, so members changing mid-import aren't missed
+        fetched_at = datetime.now(timezone.utc)
+
+        snapshot = (load_latest_snapshot(
+            self.id, columns=list(MemberColumns.STRING_FIELDS +
+                                  MemberColumns.STATS_FIELDS))
+                    if self.keep_snapshot else None)
+        snapshot_fetched_at = (
+            datetime.fromtimestamp(
+                snapshot[1]['members_fetched_at'], timezone.utc)
+            if snapshot and 'members_fetched_at' in snapshot[1] else None)
+
+        # When every member of the snapshot was last imported
+        # Older snapshots didn't record it, so are replaced
+        full_fetched_at = (
+            datetime.fromtimestamp(
+                snapshot[1]['members_full_fetched_at'], timezone.utc)
+            if snapshot and 'members_full_fetched_at' in snapshot[1]
+            else None)
+
+        if (snapshot_fetched_at and full_fetched_at and
+                fetched_at - full_fetched_at < self.SNAPSHOT_MAX_AGE):
+            self.logger.info('Updating members of list %s changed since %s.',
+                             self.id, snapshot_fetched_at.isoformat())
+
+            await self.enable_proxy()
+            snapshot_df = snapshot[0]
+            changed_members = await self.import_changed_members(
+                snapshot_fetched_at)
+
+            # Replace the stale rows of any changed members
+            # Snapshots may predate the member schema, and categoricals
+            # With different categories are joined as strings
+            members = pd.concat(
+                [snapshot_df[~snapshot_df['id'].isin(changed_members['id'])],
+                 changed_members], ignore_index=True)
+            self.df = MemberColumns.apply_schema(members) # pylint: disable=invalid-name
+            self.fetch_metadata.update({
+                'members_mode': 'incremental',
+                'members_changed': len(changed_members)})
+
+            drift = abs(len(self.df) - self.count) / max(self.count, 1)
+            if drift > self.SNAPSHOT_DRIFT_TOLERANCE:
+                self.logger.warning('Snapshot of list %s has drifted from '
+                                    'the list size (%s vs. %s). Importing '
+                                    'every member.', self.id, len(self.df),
+                                    self.count)
+                await self.import_list_members()
+                self.fetch_metadata['members_mode'] = 'full'
+        else:
+            await self.import_list_members()
+            self.fetch_metadata['members_mode'] = 'full'
+
+        if self.fetch_metadata['members_mode'] == 'full':
+            full_fetched_at = fetched_at
+        self.fetch_metadata.update({
+            'members_fetched_at': fetched_at.timestamp(),
+            'members_full_fetched_at': full_fetched_at.timestamp(),
+            'members': len(self.df)})
+
+    async def request_sub_activity(self, subscriber_ids):
+        """Requests subscribers' activity one-by-one.
+
+        Makes the requests using aiohttp (MailChimp's API is very
+        inefficient and you cannot request multiple subscribers' activity
+        at the same time). Each response is checkpointed and recorded
+        as it arrives.
+
+        Args:
+            subscriber_ids: a list of md5-hashed email ids.
+        """
+        request_uri = mailchimp_url(
+            self.data_center,
+            'lists/{}/members/{}/activity'.format(self.id, '{}'))
+
+        # List of async tasks to do
+        tasks = []
+
+        # Controller to limit and tune simultaneous connections to MailChimp
+        controller = AIMDController.load(
+            self.data_center, 'activity', self.MAX_ACTIVITY_CONNECTIONS,
+            max_concurrency=self.MAX_TUNED_CONNECTIONS,
+            target_latency=self.TARGET_ACTIVITY_LATENCY)
+
+        # Make requests with the worker's long-lived session
+        async with self.session_manager as session:
+            for subscriber_id in subscriber_ids:
 
-                # Add a new import task to the queue for each chunk
+                # Format the request string
+                request_string = request_uri.format(subscriber_id)
+
+                # Add a new import task to the queue for each list subscriber
                 task = asyncio.ensure_future(
-                    self.make_async_requests(
-                        sem, request_uri, params, session))
+                    self.request_checkpointed_activity(
+                        controller, request_string, session))
                 tasks.append(task)
 
-            # Await completion of all requests and gather results
-            responses = await asyncio.gather(*tasks)
+            # Await completion of all requests
+            await self.gather_requests(tasks, request_uri)
 
-        # Flatten the responses into a single list of dicts
-        list_data = [response
-                     for response_dict in responses
-                     for v in response_dict.values()
-                     for response in v]
+        # Remember what worked for the next import from this data center
+        controller.save()
 
-        # Create a pandas dataframe to store the results
-        self.df = pd.DataFrame(list_data) # pylint: disable=invalid-name
+    @classmethod
+    def reduce_sub_activity(cls, response):
+        """Reduces an activity response to the subscriber's most recent open.
 
-    async def import_sub_activity(self): # pylint: disable=too-many-locals
-        """Requests each subscriber's recent activity.
+        Only the latest open timestamp is parsed. MailChimp formats every
+        timestamp the same way, in UTC, so the latest also sorts last.
 
-        First, gets a list of subscribers.
-        Then makes the requests one-by-one using aiohttp (MailChimp's API is
-        very inefficient and you cannot request multiple subscribers' activity
-        at the same time).
-        After the requests have completed, parses the results, turns them into
-        a pandas dataframe, and merges this dataframe with the members
-        dataframe created by import_list_members().
+        Args:
+            response: a decoded response from the member activity endpoint.
+
+        Returns:
+            The time of the subscriber's most recent open, in nanoseconds
+            since the epoch, or NO_OPEN if they haven't opened an email.
         """
-        params = (
-            ('fields', 'activity.action,activity.timestamp,email_id'),
-            ('exclude_fields', 'total_items,_links')
-        )
+        return cls.latest_open([activity['timestamp']
+                                for activity in response['activity']
+                                if activity['action'] == 'open'])
 
-        request_uri = ('https://{}.api.mailchimp.com/3.0/lists/{}/members/'
-                       '{}/activity'.format(self.data_center, self.id, '{}'))
+    @classmethod
+    def latest_open(cls, timestamps):
+        """Returns the latest of a number of open timestamps.
 
-        # List of async tasks to do
-        tasks = []
+        Args:
+            timestamps: a list of MailChimp timestamp strings.
+
+        Returns:
+            The latest open, in nanoseconds since the epoch, or NO_OPEN if
+            there are no timestamps.
+        """
+        if not timestamps:
+            return cls.NO_OPEN
+        return pd.Timestamp(iso8601.parse_date(max(timestamps))).value
+
+    def record_sub_activity(self, response):
+        """Records a subscriber's most recent open in their row of
+        recent_opens.
+
+        Args:
+            response: a decoded response from the member activity endpoint.
+        """
+        self.record_open(response['email_id'],
+                         self.reduce_sub_activity(response))
+
+    def record_open(self, subscriber_id, recent_open):
+        """Records an open in a subscriber's row of recent_opens, unless
+        a later one was recorded already. Ids of members who aren't
+        subscribed are ignored. While activity is being prefetched, before
+        the rows are known, the open is recorded in prefetched_opens.
+
+        Args:
+            subscriber_id: the md5-hashed email id.
+            recent_open: the time of the open in nanoseconds since the
+                epoch, or NO_OPEN.
+        """
+        if self.subscriber_positions is None:
+            self.prefetched_opens[subscriber_id] = max(
+                recent_open,
+                self.prefetched_opens.get(subscriber_id, self.NO_OPEN))
+            return
+        position = self.subscriber_positions.get(subscriber_id)
+        if position is not None and recent_open > self.recent_opens[position]:
+            self.recent_opens[position] = recent_open
+
+    @staticmethod
+    def since_param(since):
+        """Returns the start of a time's day as a request parameter.
+
+        Imports ask for the last year's campaigns and opens, so their
+        parameters would otherwise change by the microsecond, and never
+        match a cached response.
+
+        Args:
+            since: a timezone-aware datetime.
+
+        Returns:
+            An ISO 8601 timestamp.
+        """
+        return since.replace(
+            hour=0, minute=0, second=0, microsecond=0).isoformat()
+
+    async def request_recent_campaign_ids(self, since):
+        """Requests the ids of the campaigns sent to the list recently.
+
+        Args:
+            since: a timezone-aware datetime. Only campaigns sent since
+                the start of its day are requested.
+
+        Returns:
+            A list of campaign ids.
+        """
+        request_uri = mailchimp_url(self.data_center, 'campaigns')
+        campaign_ids = []
+        total_items = None
+        async with self.session_manager as session:
+            while total_items is None or len(campaign_ids) < total_items:
+                params = (
+                    ('fields', 'campaigns.id,total_items'),
+                    ('list_id', self.id),
+                    ('status', 'sent'),
+                    ('since_send_time', self.since_param(since)),
+                    ('count', str(self.CAMPAIGN_OPENS_PAGE_SIZE)),
+                    ('offset', str(len(campaign_ids))),
+                )
+                response = json.loads(await self.make_async_request(
+                    request_uri, params, session))
+                campaigns = response.get('campaigns', [])
+                campaign_ids.extend(
+                    campaign['id'] for campaign in campaigns)
+                total_items = response.get('total_items', 0)
+                if not campaigns:
+                    break
+        return campaign_ids
+
+    async def import_campaign_opens(self, controller, url, since, session):
+        """Pages through a campaign's opens, recording each member's latest.
+
+        Args:
+            controller: the AIMDController governing the campaign imports.
+            url: the campaign's open-details report endpoint.
+            since: a timezone-aware datetime. Only opens since the start
+                of its day are requested.
+            session: See make_async_request().
+
+        Returns:
+            A dictionary mapping the id of each member who opened the
+            campaign to their latest open of it.
+        """
+        opens = {}
+        offset = 0
+        total_items = None
+        while total_items is None or offset < total_items:
+            params = (
+                ('fields', 'members.email_id,members.opens,total_items'),
+                ('since', self.since_param(since)),
+                ('count', str(self.CAMPAIGN_OPENS_PAGE_SIZE)),
+                ('offset', str(offset)),
+            )
+            response = await self.make_async_requests(
+                controller, url, params, session)
+            members = response.get('members', [])
+            for member in members:
+                recent_open = self.latest_open(
+                    [member_open['timestamp']
+                     for member_open in member.get('opens', [])])
+                self.record_open(member['email_id'], recent_open)
+                if recent_open != self.NO_OPEN:
+                    opens[member['email_id']] = recent_open
+            total_items = response.get('total_items', 0)
+            offset += self.CAMPAIGN_OPENS_PAGE_SIZE
+            if not members:
+                break
+        return opens
+
+    async def import_checkpointed_campaign_opens(
+            self, controller, url, campaign_id, since, session):
+        """Imports a campaign's opens, then checkpoints them.
+
+        Args:
+            controller: See import_campaign_opens().
+            url: See import_campaign_opens().
+            campaign_id: the campaign's id.
+            since: See import_campaign_opens().
+            session: See import_campaign_opens().
+        """
+        opens = await self.import_campaign_opens(
+            controller, url, since, session)
+        self.checkpoint.save_campaign_opens(campaign_id, opens)
+
+    async def import_sub_activity_by_campaign(self, campaign_ids, since):
+        """Requests subscribers' recent opens campaign by campaign.
+
+        Each campaign's opens are paged through in bulk from its
+        open-details report, which takes far fewer requests than asking
+        for each subscriber's activity when subscribers greatly outnumber
+        campaigns. Only opens of the given campaigns are seen, so opens of
+        automation emails, or of campaigns sent before the cutoff, aren't
+        recorded.
+        Each campaign's opens are checkpointed once they have all been
+        paged through, so a resumed import only requests the others.
+
+        Args:
+            campaign_ids: a list of campaign ids.
+            since: see import_campaign_opens().
+        """
+        request_uri = mailchimp_url(self.data_center,
+                                    'reports/{}/open-details')
+
+        # Controller to limit and tune simultaneous connections to MailChimp
+        controller = AIMDController.load(
+            self.data_center, 'campaign_opens', self.MAX_CONNECTIONS,
+            max_concurrency=self.MAX_TUNED_CONNECTIONS,
+            target_latency=self.TARGET_MEMBER_LATENCY)
+
+        # Resume from the campaigns a previous attempt finished
+        finished = set(self.checkpoint.campaigns())
+        for campaign_id in finished:
+            for subscriber_id, recent_open in (
+                    self.checkpoint.load_campaign_opens(campaign_id).items()):
+                self.record_open(subscriber_id, recent_open)
+        if finished:
+            self.logger.info('Resuming campaign opens import of list %s from '
+                             '%s checkpointed campaigns.', self.id,
+                             len(finished))
+
+        async with self.session_manager as session:
+            tasks = [asyncio.ensure_future(
+                self.import_checkpointed_campaign_opens(
+                    controller, request_uri.format(campaign_id), campaign_id,
+                    since, session))
+                     for campaign_id in campaign_ids
+                     if campaign_id not in finished]
+            await self.gather_requests(tasks, request_uri)
+
+        # Remember what worked for the next import from this data center
+        controller.save()
+
+    async def import_sub_activity_batch(self, subscriber_ids):
+        """Requests subscribers' activity via the Batch Operations API.
+
+        Submits the activity lookups to MailChimp's /batches endpoint
+        BATCH_SIZE operations at a time, waits for MailChimp to process
+        them, and then streams through the result archives. Any lookups
+        which failed within a batch are retried one-by-one.
+
+        Args:
+            subscriber_ids: a list of md5-hashed email ids.
+        """
+        request_uri = mailchimp_url(self.data_center, 'batches')
+
+        failed_ids = []
+
+        async with self.session_manager as session:
+
+            # Submit every batch up front so MailChimp can process them
+            # While we wait on the first
+            batch_ids = []
+            for start in range(0, len(subscriber_ids), self.BATCH_SIZE):
+                operations = [
+                    {'method': 'GET',
+                     'path': '/lists/{}/members/{}/activity'.format(
+                         self.id, subscriber_id),
+                     'params': dict(self.ACTIVITY_FIELDS),
+                     'operation_id': subscriber_id}
+                    for subscriber_id in
+                    subscriber_ids[start:start + self.BATCH_SIZE]]
+                response = await self.make_async_request(
+                    request_uri, None, session,
+                    json_payload={'operations': operations})
+                batch_ids.append(json.loads(response)['id'])
+
+            for batch_id in batch_ids:
+                results_url = await self.wait_for_batch(
+                    request_uri, batch_id, session)
+                await self.read_batch_results(
+                    results_url, session, failed_ids)
+
+        # Retry any failed lookups the usual way
+        if failed_ids:
+            self.logger.warning('%s batch activity lookups failed for list '
+                                '%s. Retrying them individually.',
+                                len(failed_ids), self.id)
+            await self.request_sub_activity(failed_ids)
+
+    async def wait_for_batch(self, request_uri, batch_id, session):
+        """Polls a batch operation until MailChimp has finished it.
+
+        Args:
+            request_uri: the MailChimp batches endpoint.
+            batch_id: the id of the batch operation.
+            session: See make_async_request().
+
+        Returns:
+            The url of the archive containing the batch results.
+
+        Throws:
+            MailChimpImportError: the batch didn't finish within
+                BATCH_TIMEOUT seconds.
+        """
+        batch_uri = '{}/{}'.format(request_uri, batch_id)
+        params = (('fields', 'status,response_body_url'),)
+        waited = 0
+        while True:
+            batch = json.loads(await self.make_async_request(
+                batch_uri, params, session))
+            if batch['status'] == 'finished':
+                return batch['response_body_url']
+            if waited >= self.BATCH_TIMEOUT:
+                error_details = OrderedDict([
+                    ('err_desc', 'An error occurred when '
+                                 'trying to import your data from MailChimp.'),
+                    ('application_exception', 'BatchTimeout'),
+                    ('mailchimp_url', batch_uri),
+                    ('api_key', self.api_key)])
+                self.logger.error('Batch operation %s did not finish in time.',
+                                  batch_id)
+                raise MailChimpImportError(
+                    'Batch operation did not finish in time', error_details)
+            await asyncio.sleep(self.BATCH_POLL_INTERVAL)
+            waited += self.BATCH_POLL_INTERVAL
 
-        # Placeholder for async responses
-        responses = None
+    async def read_batch_results(self, results_url, session, failed_ids):
+        """Streams through a batch results archive.
 
-        # Semaphore to limit max simultaneous connections to MailChimp API
-        sem = asyncio.Semaphore(self.MAX_ACTIVITY_CONNECTIONS)
+        The archive is a gzipped tarball of json files, each containing a
+        list of operation results. It is downloaded to a temporary file and
+        each result is checkpointed and recorded as soon as it has been
+        parsed.
+
+        Args:
+            results_url: the url of the results archive.
+            session: See make_async_request().
+            failed_ids: a list to append the ids of failed lookups to.
+
+        Throws:
+            MailChimpImportError: the archive couldn't be downloaded. See
+                make_async_request().
+        """
+        with tempfile.TemporaryFile() as archive:
+
+            # The url is pre-signed, so no MailChimp credentials are needed
+            # The download is retried like any other request
+            await self.make_async_request(
+                results_url, None, session, download_to=archive)
+            archive.seek(0)
+
+            with tarfile.open(fileobj=archive, mode='r|gz') as results:
+                for member in results:
+                    if not member.isfile():
+                        continue
+                    result_file = results.extractfile(member)
+                    for result in json.loads(
+                            result_file.read().decode('utf-8')):
+                        if result['status_code'] == 200:
+                            response = json.loads(result['response'])
+                            self.checkpoint.save_activity(response)
+                            self.record_sub_activity(response)
+                        else:
+                            failed_ids.append(result['operation_id'])
+
+    async def import_sub_activity(self):
+        """Requests each subscriber's recent activity.
+
+        First, gets a list of subscribers.
+        Then requests the activity of any subscribers not checkpointed by a
+        previous attempt, nor prefetched by import_list(). On lists with at
+        least ACTIVITY_SAMPLING_THRESHOLD subscribers, only a stratified
+        random sample of subscribers is requested. If they outnumber the
+        campaigns sent in the past year CAMPAIGN_ACTIVITY_RATIO to one, and
+        paging through every campaign's opens is estimated to take fewer
+        requests than there are subscribers to request, opens are requested
+        campaign by campaign instead. Otherwise activity is requested
+        one-by-one or, if at least BATCH_ACTIVITY_THRESHOLD subscribers are
+        left, via MailChimp's Batch Operations API.
+        Each response is reduced as it arrives to the subscriber's most
+        recent open, which is stored in the subscriber's row of an int64
+        array. After the requests have completed, opens older than a year
+        are dropped in one vectorized comparison and the array becomes the
+        recent_open column of the dataframe created by import_list_members().
+        The import is then complete, so its checkpoint is cleared.
+        """
 
         # Get a list of unique subscriber ids
         subscriber_list = self.get_list_ids()
@@ -422,55 +1593,378 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
         # Store the number of subscribers for later
         self.subscribers = len(subscriber_list)
 
-        # Create a session with which to make requests
-        async with ClientSession() as session:
-            for subscriber_id in subscriber_list:
-
-                # Format the request string
-                request_string = request_uri.format(subscriber_id)
-
-                # Add a new import task to the queue for each list subscriber
-                task = asyncio.ensure_future(
-                    self.make_async_requests(
-                        sem, request_string, params, session))
-                tasks.append(task)
+        # Calculate timestamp for one year ago
+        now = datetime.now(timezone.utc)
+        one_year_ago = now - timedelta(days=365)
 
-            # Await completion of all requests and gather results
-            responses = await asyncio.gather(*tasks)
+        # Only consider importing campaign by campaign if there are enough
+        # Subscribers to outnumber even a single campaign
+        # The prefetcher may have requested the campaigns already
+        if self.subscribers < self.CAMPAIGN_ACTIVITY_RATIO:
+            campaign_ids = None
+        elif self.recent_campaign_ids is not None:
+            campaign_ids = self.recent_campaign_ids
+        else:
+            campaign_ids = await self.request_recent_campaign_ids(
+                one_year_ago)
+
+        # On very large lists, only a sample's activity would be requested
+        sampled = self.subscribers >= self.ACTIVITY_SAMPLING_THRESHOLD
+        requested_list = (self.sample_subscribers() if sampled
+                          else subscriber_list)
+
+        # Import opens campaign by campaign if that takes fewer requests
+        # Without any recent campaigns there are no opens to request that way
+        # Nor is there once activity was prefetched subscriber by subscriber
+        by_campaign = (
+            bool(campaign_ids) and not self.prefetched_opens and
+            self.subscribers >= (
+                self.CAMPAIGN_ACTIVITY_RATIO * len(campaign_ids)) and
+            self.estimate_campaign_requests(campaign_ids) <
+            len(requested_list))
+
+        # Every subscriber's opens are recorded campaign by campaign
+        # So there's no sample to estimate from
+        if by_campaign:
+            self.activity_sample = None
+            self.stratum_sizes = None
+        elif sampled:
+            subscriber_list = requested_list
+            self.fetch_metadata['activity_sample'] = len(subscriber_list)
+            self.logger.info('Sampling the activity of %s of the %s '
+                             'subscribers of list %s.', len(subscriber_list),
+                             self.subscribers, self.id)
+
+        # Preallocate a slot for each member's most recent open
+        # Only the opens of the subscribers we request are recorded
+        subscriber_ids = set(subscriber_list)
+        self.subscriber_positions = {
+            member_id: position
+            for position, member_id in enumerate(self.df['id'].values)
+            if member_id in subscriber_ids}
+        self.recent_opens = np.full(len(self.df), self.NO_OPEN,
+                                    dtype=np.int64)
+
+        # Resume from the responses a previous attempt already received
+        resumed = set()
+        for response in self.checkpoint.load_activity():
+            self.record_sub_activity(response)
+            resumed.add(response['email_id'])
+
+        # And from the activity prefetched while members were imported
+        for subscriber_id, recent_open in (
+                self.prefetched_opens or {}).items():
+            self.record_open(subscriber_id, recent_open)
+            resumed.add(subscriber_id)
+        remaining_list = [subscriber_id for subscriber_id in subscriber_list
+                          if subscriber_id not in resumed]
+        if resumed:
+            self.logger.info('Resuming activity import of list %s from %s '
+                             'checkpointed subscribers.', self.id,
+                             len(subscriber_list) - len(remaining_list))
+        subscriber_list = remaining_list
+
+        # Request the remaining subscribers' activity
+        if by_campaign:
+            await self.import_sub_activity_by_campaign(
+                campaign_ids, one_year_ago)
+            self.fetch_metadata['activity_mode'] = 'campaign'
+        elif len(subscriber_list) >= self.BATCH_ACTIVITY_THRESHOLD:
+            await self.import_sub_activity_batch(subscriber_list)
+            self.fetch_metadata['activity_mode'] = 'batch'
+        else:
+            await self.request_sub_activity(subscriber_list)
+            self.fetch_metadata['activity_mode'] = 'direct'
+        self.fetch_metadata['activity_fetched_at'] = now.timestamp()
+
+        # Filter out opens older than one year
+        # NO_OPEN is below any cutoff, so it's left as is
+        recent_opens = self.recent_opens
+        recent_opens[recent_opens <= pd.Timestamp(one_year_ago).value] = (
+            self.NO_OPEN)
+
+        # Join the opens back into the dataframe by position
+        # Subscribers without a recent open are left as NaT
+        self.df['recent_open'] = pd.Series(
+            recent_opens.view('datetime64[ns]'),
+            index=self.df.index).dt.tz_localize('UTC')
+        self.subscriber_positions = None
+        self.recent_opens = None
+
+        # The import is complete, so there's nothing left to resume
+        self.checkpoint.clear()
+
+    async def import_sampled_activity(self):
+        """Imports the activity of a sample of subscribers, in streaming
+        mode.
+
+        The sample is drawn from member_metrics, allocated across open
+        rate deciles like sample_subscribers(). Lists with at most
+        ACTIVITY_SAMPLE_SIZE subscribers are sampled in full. Activity is
+        requested, checkpointed and resumed as import_sub_activity() does,
+        but only which sampled subscribers opened an email in the past year
+        is kept, in member_metrics.
+        """
+        metrics = self.member_metrics
+        self.subscribers = metrics.subscribers
+        subscriber_list = metrics.sample_subscribers(
+            self.ACTIVITY_SAMPLE_SIZE, self.MIN_STRATUM_SAMPLE_SIZE)
+        self.fetch_metadata['activity_sample'] = len(subscriber_list)
+        self.logger.info('Sampling the activity of %s of the %s '
+                         'subscribers of list %s.', len(subscriber_list),
+                         self.subscribers, self.id)
 
         # Calculate timestamp for one year ago
         now = datetime.now(timezone.utc)
         one_year_ago = now - timedelta(days=365)
 
-        # Flatten responses
-        # Filter out activity older than one year
-        activities = [{**{'id': response['email_id']},
-                       **{'recent_open': d['timestamp']
-                          for d in response['activity']
-                          if d['action'] == 'open' and
-                          iso8601.parse_date(d['timestamp']) > one_year_ago}}
-                      for response in responses]
-
-        # Convert results to a dataframe
-        subscriber_activities = pd.DataFrame(activities)
-
-        # Merge dataframes if any subscribers have recently opened
-        # Else add an empty recent_open column to dataframe
-        # This allows us to assume that a 'recent open' column exists
-        if 'recent_open' in subscriber_activities:
-            self.df = pd.merge(self.df,
-                               subscriber_activities,
-                               on='id',
-                               how='left')
+        # Preallocate a slot for each sampled subscriber's most recent open
+        self.subscriber_positions = {
+            subscriber_id: position
+            for position, subscriber_id in enumerate(subscriber_list)}
+        self.recent_opens = np.full(len(subscriber_list), self.NO_OPEN,
+                                    dtype=np.int64)
+
+        # Resume from the responses a previous attempt already received
+        resumed = set()
+        for response in self.checkpoint.load_activity():
+            self.record_sub_activity(response)
+            resumed.add(response['email_id'])
+        remaining_list = [subscriber_id for subscriber_id in subscriber_list
+                          if subscriber_id not in resumed]
+
+        # Request the remaining subscribers' activity
+        if len(remaining_list) >= self.BATCH_ACTIVITY_THRESHOLD:
+            await self.import_sub_activity_batch(remaining_list)
+            self.fetch_metadata['activity_mode'] = 'batch'
         else:
-            self.df['recent_open'] = np.NaN
+            await self.request_sub_activity(remaining_list)
+            self.fetch_metadata['activity_mode'] = 'direct'
+        self.fetch_metadata['activity_fetched_at'] = now.timestamp()
+
+        # Keep whether each sampled subscriber opened within the last year
+        metrics.record_recent_opens(
+            self.recent_opens > pd.Timestamp(one_year_ago).value)
+        self.subscriber_positions = None
+        self.recent_opens = None
+
+        # The import is complete, so there's nothing left to resume
+        self.checkpoint.clear()
+
+    async def prefetch_sub_activity(self, queue):
+        """Requests subscribers' activity while members are imported.
+
+        Consumes the subscriber ids import_list_members() puts on the queue
+        until it receives None. If the list is small enough that every
+        subscriber's activity will be requested one way or another, each
+        id is requested one-by-one or, from BATCH_ACTIVITY_THRESHOLD
+        members on, submitted in batches of PIPELINE_BATCH_SIZE. Lists
+        which could be imported campaign by campaign, or sampled, need
+        every member first, so nothing is prefetched for them.
+        Responses are recorded in prefetched_opens.
+
+        Args:
+            queue: the asyncio queue of subscriber id lists.
+        """
+        subscriber_ids = await queue.get()
+        if subscriber_ids is None:
+            return
+
+        # The list size is an upper bound on the number of subscribers
+        # So if it's too small to import by campaign, subscribers are too
+        campaign_ids = (
+            await self.request_recent_campaign_ids(
+                datetime.now(timezone.utc) - timedelta(days=365))
+            if self.count >= self.CAMPAIGN_ACTIVITY_RATIO else None)
+        self.recent_campaign_ids = campaign_ids
+        if (self.count >= self.ACTIVITY_SAMPLING_THRESHOLD or
+                campaign_ids and self.count >= (
+                    self.CAMPAIGN_ACTIVITY_RATIO * len(campaign_ids))):
+            self.subscriber_queue = None
+            return
+        by_batch = self.count >= self.BATCH_ACTIVITY_THRESHOLD
+
+        request_uri = mailchimp_url(
+            self.data_center,
+            'lists/{}/members/{}/activity'.format(self.id, '{}'))
+        controller = AIMDController.load(
+            self.data_center, 'activity', self.MAX_ACTIVITY_CONNECTIONS,
+            max_concurrency=self.MAX_TUNED_CONNECTIONS,
+            target_latency=self.TARGET_ACTIVITY_LATENCY)
+        tasks = []
+        pending_ids = []
+        requested = set()
+
+        async with self.session_manager as session:
+            while subscriber_ids is not None:
+
+                # A member can appear in two chunks if the list changes
+                subscriber_ids = [subscriber_id
+                                  for subscriber_id in subscriber_ids
+                                  if subscriber_id not in requested]
+                requested.update(subscriber_ids)
+
+                if by_batch:
+                    pending_ids.extend(subscriber_ids)
+                    while len(pending_ids) >= self.PIPELINE_BATCH_SIZE:
+                        tasks.append(asyncio.ensure_future(
+                            self.import_sub_activity_batch(
+                                pending_ids[:self.PIPELINE_BATCH_SIZE])))
+                        pending_ids = pending_ids[self.PIPELINE_BATCH_SIZE:]
+                else:
+                    tasks.extend(asyncio.ensure_future(
+                        self.request_checkpointed_activity(
+                            controller, request_uri.format(subscriber_id),
+                            session))
+                                 for subscriber_id in subscriber_ids)
+
+                subscriber_ids = await queue.get()
+
+            # Submit the last, partial batch once every member has arrived
+            if pending_ids:
+                tasks.append(asyncio.ensure_future(
+                    self.import_sub_activity_batch(pending_ids)))
+
+            await self.gather_requests(tasks, request_uri)
+
+        # Remember what worked for the next import from this data center
+        controller.save()
+        self.fetch_metadata['activity_prefetched'] = len(
+            self.prefetched_opens)
+
+    async def import_list(self):
+        """Imports list members and their activity in one pipeline.
+
+        While import_list_members_incremental() runs, the subscribers of
+        each member chunk are passed to prefetch_sub_activity() as soon as
+        the chunk is parsed, so activity requests overlap with member
+        requests rather than waiting for all of them. Both phases are
+        throttled by the same per-key rate limiter and share the worker's
+        connection pool. Once every member has arrived,
+        import_sub_activity() requests whatever activity wasn't prefetched
+        and merges it in.
+        A previous attempt's checkpointed activity is resumed by
+        import_sub_activity() instead, so nothing is prefetched then.
+        In streaming mode, members are added to member_metrics as they
+        arrive, and then import_sampled_activity() imports the activity
+        of a sample of subscribers. Snapshots need every member, so none
+        is used.
+        """
+        self.prefetched_opens = {}
+        if self.streaming:
+            await self.import_list_members()
+            self.fetch_metadata.update({
+                'members_mode': 'streaming',
+                'members': len(self.member_metrics)})
+        elif self.checkpoint.has_activity():
+            await self.import_list_members_incremental()
+        else:
+            queue = asyncio.Queue()
+            self.subscriber_queue = queue
+
+            async def import_members():
+                """Imports members, then tells the prefetcher it's done."""
+                try:
+                    await self.import_list_members_incremental()
+                finally:
+                    self.subscriber_queue = None
+                    queue.put_nowait(None)
+
+            await self.gather_requests(
+                [asyncio.ensure_future(import_members()),
+                 asyncio.ensure_future(self.prefetch_sub_activity(queue))],
+                mailchimp_url(self.data_center, 'lists/{}'.format(self.id)))
+        if self.memory_profiler:
+            self.memory_profiler.record('import_members')
+
+        if self.streaming:
+            await self.import_sampled_activity()
+        else:
+            await self.import_sub_activity()
+        if self.memory_profiler:
+            self.memory_profiler.record('import_activity')
+        self.prefetched_opens = None
+        self.recent_campaign_ids = None
+
+    @staticmethod
+    def open_rate_deciles(open_rates):
+        """Returns the decile (0-9) of each open rate.
+
+        Uses the same bins as calc_histogram(). See
+        app.metrics.open_rate_deciles().
+
+        Args:
+            open_rates: an array of open rates between 0 and 1.
+        """
+        return open_rate_deciles(open_rates)
+
+    def sample_subscribers(self):
+        """Draws a stratified random sample of subscribers.
+
+        Subscribers are stratified by avg_open_rate decile, which tracks
+        how likely they are to have opened recently. Each decile is
+        sampled in proportion to its size, but at least
+        MIN_STRATUM_SAMPLE_SIZE subscribers are drawn from each. The random
+        draw is seeded with the list id, so a resumed import samples the
+        same subscribers.
+
+        Returns:
+            A list of the sampled subscribers' ids.
+        """
+        subscribers = self.df[self.df['status'] == 'subscribed']
+        strata = self.open_rate_deciles(subscribers['avg_open_rate'].values)
+        self.stratum_sizes = np.bincount(strata, minlength=10)
+        random_state = np.random.RandomState(
+            zlib.crc32(str(self.id).encode('utf-8')))
+        sample_rows = []
+        for stratum, stratum_size in enumerate(self.stratum_sizes):
+            if not stratum_size:
+                continue
+            sample_size = min(stratum_size, max(
+                self.MIN_STRATUM_SAMPLE_SIZE,
+                int(round(self.ACTIVITY_SAMPLE_SIZE * stratum_size /
+                          len(subscribers)))))
+            sample_rows.append(random_state.choice(
+                np.flatnonzero(strata == stratum), sample_size,
+                replace=False))
+        sample_rows = np.sort(np.concatenate(sample_rows))
+        self.activity_sample = pd.Series(
+            strata[sample_rows], index=subscribers['id'].values[sample_rows])
+        return self.activity_sample.index.tolist()
+
+    def estimate_campaign_requests(self, campaign_ids):
+        """Estimates how many requests importing opens campaign by campaign
+        takes.
+
+        Each campaign's open-details report lists the members who opened
+        it, CAMPAIGN_OPENS_PAGE_SIZE per page. Subscribers' average open
+        rates add up to the number expected to open a typical campaign.
+
+        Args:
+            campaign_ids: a list of campaign ids.
+
+        Returns:
+            The estimated number of open-details pages.
+        """
+        open_rates = self.df.loc[
+            self.df['status'] == 'subscribed', 'avg_open_rate']
+        pages_per_campaign = max(1, int(np.ceil(
+            float(open_rates.sum()) / self.CAMPAIGN_OPENS_PAGE_SIZE)))
+        return len(campaign_ids) * pages_per_campaign
 
     def get_list_ids(self):
         """Returns a list of md5-hashed email ids for subscribers only."""
         return self.df[self.df['status'] == 'subscribed']['id'].tolist()
 
     def flatten(self):
-        """Removes nested jsons from the dataframe."""
+        """Removes nested jsons from the dataframe.
+
+        Frames built by import_list_members() already hold the member stats
+        as flat columns, in which case there is nothing to normalize.
+        Neither is there in streaming mode, which builds no dataframe.
+        """
+        if self.streaming or 'stats' not in self.df:
+            return
 
         # Extract member stats from nested json
         # Then store them in a flattened dataframe
@@ -480,25 +1974,26 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
         self.df = (self.df[['status', 'timestamp_opt', 'timestamp_signup',
                             'id', 'recent_open']].join(stats))
 
+    def tally_members(self):
+        """Returns the MemberMetrics the calc_* methods read from.
+
+        In streaming mode these were accumulated during the import.
+        Otherwise the members dataframe is tallied in a single pass by
+        MemberMetrics.from_frame(), which is repeated only if df has been
+        replaced since.
+        """
+        if not self.streaming and self.tallied_df is not self.df:
+            self.member_metrics = MemberMetrics.from_frame(self.df)
+            self.tallied_df = self.df
+        return self.member_metrics
+
     def calc_list_breakdown(self):
         """Calculates the list breakdown."""
-        statuses = self.df.status.unique()
-        self.subscribed_pct = (
-            0 if 'subscribed' not in statuses
-            else self.df.status.value_counts()['subscribed'] /
-            self.count)
-        self.unsubscribed_pct = (
-            0 if 'unsubscribed' not in statuses
-            else self.df.status.value_counts()['unsubscribed'] /
-            self.count)
-        self.cleaned_pct = (
-            0 if 'cleaned' not in statuses
-            else self.df.status.value_counts()['cleaned'] /
-            self.count)
-        self.pending_pct = (
-            0 if 'pending' not in statuses
-            else self.df.status.value_counts()['pending'] /
-            self.count)
+        status_counts = self.tally_members().status_counts
+        self.subscribed_pct = status_counts['subscribed'] / self.count
+        self.unsubscribed_pct = status_counts['unsubscribed'] / self.count
+        self.cleaned_pct = status_counts['cleaned'] / self.count
+        self.pending_pct = status_counts['pending'] / self.count
 
     def calc_open_rate(self, open_rate):
         """Calculates the open rate as a decimal."""
@@ -520,29 +2015,41 @@ class MailChimpList(): # pylint: disable=too-many-instance-attributes
 
     def calc_histogram(self):
         """Calculates the distribution for subscriber open rate."""
-        bin_boundaries = np.linspace(0, 1, num=11)
-        bins = (pd.cut(
-            self.df.loc[self.df['status'] == 'subscribed', 'avg_open_rate'],
-            bin_boundaries, include_lowest=True))
-        self.hist_bin_counts = (pd.value_counts(bins, sort=False).tolist())
+        self.hist_bin_counts = self.tally_members().hist_bin_counts.tolist()
 
     def calc_high_open_rate_pct(self):
         """Calcuates the percentage of subscribers who open >80% of emails."""
-
-        # Sum the number of rows where average open rate exceeds 0.8
-        # And the member is a subscriber
-        # Then divide by the total number of rows
         self.high_open_rt_pct = (
-            sum(x > 0.8 for x in self.df[self.df['status'] == 'subscribed']
-                ['avg_open_rate']) / self.subscribers)
+            self.tally_members().high_open_count / self.subscribers)
 
     def calc_cur_yr_stats(self):
         """Calculates metrics related to activity
         that occured in the previous year."""
 
+        # In streaming mode, estimate the percent of subscribers without
+        # An open from the sample, unless every subscriber was sampled
+        metrics = self.tally_members()
+        if self.streaming and not metrics.fully_sampled:
+            (self.cur_yr_inactive_pct,
+             self.cur_yr_inactive_pct_lower,
+             self.cur_yr_inactive_pct_upper) = estimate_stratified_proportion(
+                 metrics.sample_strata, ~metrics.sample_opened,
+                 metrics.stratum_sizes, self.CONFIDENCE_Z)
+            return
+
+        # Likewise if only a sample's activity was imported
+        if self.activity_sample is not None:
+            opened = (self.df.set_index('id')['recent_open']
+                      .reindex(self.activity_sample.index).notnull().values)
+            (self.cur_yr_inactive_pct,
+             self.cur_yr_inactive_pct_lower,
+             self.cur_yr_inactive_pct_upper) = estimate_stratified_proportion(
+                 self.activity_sample.values, ~opened, self.stratum_sizes,
+                 self.CONFIDENCE_Z)
+            return
+
         # Total number of subsribers without an open within the last year
-        cur_yr_inactive_subs = (self.subscribers -
-                                int(self.df['recent_open'].count()))
+        cur_yr_inactive_subs = self.subscribers - metrics.recent_open_count
 
         # Percent of such subscribers
         self.cur_yr_inactive_pct = cur_yr_inactive_subs / self.subscribers
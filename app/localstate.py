@@ -0,0 +1,56 @@
+"""This module manages local files used to persist import state across tasks."""
+import os
+import json
+import tempfile
+
+# Default location for local import state, next to the default sqlite db
+DEFAULT_STATE_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(os.path.dirname(__file__))),
+    'import_state')
+
+def local_state_path(*parts):
+    """Returns a path inside the local import state directory.
+
+    The directory can be set with the IMPORT_STATE_DIR environment variable.
+    Any missing parent directories of the returned path are created.
+
+    Args:
+        parts: path components relative to the state directory.
+    """
+    path = os.path.join(
+        os.environ.get('IMPORT_STATE_DIR') or DEFAULT_STATE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def load_json_state(path, default=None):
+    """Loads a json state file, returning default if it's missing or corrupt.
+
+    Args:
+        path: the path to the state file.
+        default: the value to return if the file can't be read.
+    """
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return default
+
+def save_json_state(path, state):
+    """Atomically writes a json state file.
+
+    The state is written to a temporary file in the same directory and then
+    moved into place, so concurrent readers never see a partial file.
+
+    Args:
+        path: the path to the state file.
+        state: a json-serializable object.
+    """
+    descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w') as temp_file:
+            json.dump(state, temp_file)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,272 @@
+"""This module profiles the memory used by each stage of a list analysis.
+
+Profiling is opt-in, since tracing allocations slows the analysis down.
+When the MEMORY_PROFILING environment variable is set, the peak resident
+set size of each stage of import_analyze_store_list() and the source lines
+holding the most traced memory at its end are logged along with the list
+id and member count. Each stage is also appended to a profile file in the
+import state directory as soon as it ends, so the stages leading up to a
+worker being killed for running out of memory are kept, and profiles of
+the same list can be compared across runs.
+"""
+import os
+import json
+import time
+import threading
+import tracemalloc
+from datetime import datetime, timezone
+from collections import OrderedDict
+import psutil
+from celery.utils.log import get_task_logger
+from app.localstate import local_state_path
+
+# The number of source lines reported at each stage boundary
+TOP_ALLOCATION_COUNT = 10
+
+# The number of profiles to keep per list
+PROFILE_RETENTION_COUNT = 10
+
+# The format of the start time in profile filenames
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S%fZ'
+
+# Stages are only reported as using more memory if their peak RSS also
+# Grew by this many megabytes, so noise in small lists is ignored
+MIN_REGRESSION_MB = 10
+
+def memory_profiling_enabled():
+    """Returns whether the MEMORY_PROFILING environment variable is set."""
+    return bool(os.environ.get('MEMORY_PROFILING'))
+
+def profile_dir(list_id):
+    """Returns the directory holding a list's memory profiles.
+
+    The directory is created if it doesn't exist yet.
+    """
+    directory = local_state_path('memory_profiles', str(list_id))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def load_memory_profiles(list_id):
+    """Loads a list's memory profiles, oldest first.
+
+    Args:
+        list_id: the list's unique MailChimp id.
+
+    Returns:
+        A list of dictionaries, each holding the start time of a profiled
+        analysis and the stages it recorded, in order.
+    """
+    directory = profile_dir(list_id)
+    profiles = []
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension != '.jsonl':
+            continue
+        stages = []
+        with open(os.path.join(directory, filename)) as profile_file:
+            for line in profile_file:
+                try:
+                    stages.append(json.loads(line))
+                except ValueError:
+                    break
+        profiles.append({'started_at': name, 'stages': stages})
+    return profiles
+
+def compare_memory_profiles(baseline, profile, tolerance=0.2):
+    """Compares the peak RSS of each stage of two profiles of a list.
+
+    Args:
+        baseline: a profile returned by load_memory_profiles().
+        profile: a later profile of the same list.
+        tolerance: how much more memory, as a fraction of the baseline, a
+            stage may use before it's reported.
+
+    Returns:
+        A list of descriptions of the stages which used more memory.
+    """
+    baseline_stages = {stage['stage']: stage for stage in baseline['stages']}
+    regressions = []
+    for stage in profile['stages']:
+        baseline_stage = baseline_stages.get(stage['stage'])
+        if baseline_stage is None:
+            continue
+        peak_rss_mb = stage['peak_rss_mb']
+        baseline_peak_rss_mb = baseline_stage['peak_rss_mb']
+        if (peak_rss_mb > baseline_peak_rss_mb * (1 + tolerance) and
+                peak_rss_mb - baseline_peak_rss_mb > MIN_REGRESSION_MB):
+            regressions.append(
+                '{} ({} members): {:.1f} MB peak RSS, was {:.1f} MB '
+                '({} members)'.format(
+                    stage['stage'], stage['member_count'], peak_rss_mb,
+                    baseline_peak_rss_mb, baseline_stage['member_count']))
+    return regressions
+
+class PeakRssSampler(threading.Thread):
+    """Samples the process's resident set size in the background, keeping
+    the peak since it was last reset."""
+
+    # The number of seconds between samples
+    SAMPLE_INTERVAL = 0.05
+
+    def __init__(self, process):
+        """Initializes a sampler.
+
+        Args:
+            process: the psutil Process to sample.
+        """
+        super().__init__(daemon=True)
+        self.process = process
+        self.peak_rss = process.memory_info().rss
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def reset(self):
+        """Returns the current and peak RSS in bytes, then starts a new
+        peak."""
+        rss = self.process.memory_info().rss
+        peak_rss = max(self.peak_rss, rss)
+        self.peak_rss = rss
+        return rss, peak_rss
+
+    def stop(self):
+        """Stops sampling."""
+        self.stopped.set()
+        self.join()
+
+class MemoryProfiler():
+    """Records the memory used by each stage of a list's analysis.
+
+    A profiler which isn't enabled records nothing, so stage boundaries
+    can be marked unconditionally.
+    """
+
+    def __init__(self, list_id, member_count, enabled=None):
+        """Initializes a profiler and starts tracing allocations.
+
+        Args:
+            list_id: the list's unique MailChimp id.
+            member_count: the total size of the list.
+            enabled: whether to profile. Defaults to whether the
+                MEMORY_PROFILING environment variable is set.
+
+        Other class variables:
+            path: the file the profile's stages are appended to.
+            stages: a list of dictionaries describing each recorded stage.
+            started_tracing: whether the profiler started tracemalloc, and
+                so should stop it.
+            sampler: the PeakRssSampler measuring each stage's peak RSS.
+            previous_sizes: a dictionary mapping each source line to the
+                traced memory it held at the end of the previous stage.
+        """
+        self.list_id = list_id
+        self.member_count = member_count
+        self.enabled = (memory_profiling_enabled() if enabled is None
+                        else enabled)
+        self.logger = get_task_logger(__name__)
+        self.path = None
+        self.stages = []
+        self.started_tracing = False
+        self.sampler = None
+        self.previous_sizes = {}
+        self.stage_started_at = None
+        if not self.enabled:
+            return
+        self.prune()
+        self.path = os.path.join(profile_dir(list_id), '{}.jsonl'.format(
+            datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)))
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.sampler = PeakRssSampler(psutil.Process())
+        self.sampler.start()
+        self.stage_started_at = time.perf_counter()
+
+    def prune(self):
+        """Deletes the list's oldest profiles, leaving room for a new one
+        within PROFILE_RETENTION_COUNT."""
+        directory = profile_dir(self.list_id)
+        filenames = sorted(filename for filename in os.listdir(directory)
+                           if filename.endswith('.jsonl'))
+        for filename in filenames[:max(
+                0, len(filenames) - PROFILE_RETENTION_COUNT + 1)]:
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def record(self, stage):
+        """Records the memory used by a stage which just ended.
+
+        Logs and stores the stage's peak RSS, the RSS and traced memory at
+        its end, and the source lines holding the most traced memory along
+        with how much each grew during the stage.
+
+        Args:
+            stage: the name of the stage.
+
+        Returns:
+            A dictionary describing the stage, or None if the profiler
+            isn't enabled.
+        """
+        if not self.enabled:
+            return None
+        rss, peak_rss = self.sampler.reset()
+        traced, _ = tracemalloc.get_traced_memory()
+
+        # Only keep per-line totals between stages, since a snapshot of
+        # Every traced allocation can be as large as the list itself
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        sizes = {}
+        for statistic in statistics:
+            frame = statistic.traceback[0]
+            sizes['{}:{}'.format(frame.filename, frame.lineno)] = (
+                statistic.size)
+        top_allocations = [
+            OrderedDict([
+                ('location', location),
+                ('size_mb', size / (1024 * 1024)),
+                ('growth_mb',
+                 (size - self.previous_sizes.get(location, 0)) /
+                 (1024 * 1024))])
+            for location, size in sorted(
+                sizes.items(), key=lambda item: item[1],
+                reverse=True)[:TOP_ALLOCATION_COUNT]]
+        self.previous_sizes = sizes
+
+        now = time.perf_counter()
+        stage_record = OrderedDict([
+            ('stage', stage),
+            ('list_id', self.list_id),
+            ('member_count', self.member_count),
+            ('duration', now - self.stage_started_at),
+            ('rss_mb', rss / (1024 * 1024)),
+            ('peak_rss_mb', peak_rss / (1024 * 1024)),
+            ('traced_mb', traced / (1024 * 1024)),
+            ('top_allocations', top_allocations)])
+        self.stage_started_at = now
+        self.stages.append(stage_record)
+        with open(self.path, 'a') as profile_file:
+            profile_file.write(json.dumps(stage_record) + '\n')
+
+        self.logger.info(
+            'Memory after %s of list %s (%s members): %.1f MB peak RSS, '
+            '%.1f MB RSS, %.1f MB traced. Top allocations: %s', stage,
+            self.list_id, self.member_count, stage_record['peak_rss_mb'],
+            stage_record['rss_mb'], stage_record['traced_mb'],
+            ', '.join('{} ({:.1f} MB, {:+.1f} MB)'.format(
+                allocation['location'], allocation['size_mb'],
+                allocation['growth_mb'])
+                      for allocation in top_allocations))
+        return stage_record
+
+    def stop(self):
+        """Stops sampling, and stops tracing if the profiler started it."""
+        if not self.enabled:
+            return
+        self.sampler.stop()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
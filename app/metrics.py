@@ -0,0 +1,336 @@
+"""This module tallies the list metrics computed from members.
+
+The counts behind every member-derived ListStats field are tallied by one
+vectorized kernel, either over a whole members dataframe or, for lists
+too large to hold in one, over each chunk of members as it arrives. Each
+chunk updates a MemberMetrics instance, which keeps only counts and a
+bounded sample of subscribers, so the memory it needs doesn't grow with
+the list. Instances fed different chunks of the same list can be merged.
+"""
+import zlib
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+# The number of open rate bins, i.e. deciles
+RATE_BIN_COUNT = 10
+
+# Subscribers who open more than this share of emails have a high open rate
+HIGH_OPEN_RATE = 0.8
+
+# The position of HIGH_OPEN_RATE among the decile edges
+HIGH_OPEN_EDGE = 8
+
+def rate_dtype(dtype):
+    """Returns the floating point type rates of a given type are compared
+    in.
+
+    Rates are compared with bin edges and thresholds of their own type, so
+    a float32 rate and the float32 edge it was rounded to compare equal,
+    just as the float64 values they came from did.
+
+    Args:
+        dtype: the numpy dtype of the rates.
+    """
+    return dtype if np.issubdtype(dtype, np.floating) else np.dtype(
+        np.float64)
+
+def rate_bin_edges(dtype):
+    """Returns the edges of the open rate deciles, in a rate dtype.
+
+    Args:
+        dtype: see rate_dtype().
+    """
+    return np.linspace(0, 1, num=RATE_BIN_COUNT + 1).astype(rate_dtype(dtype))
+
+def open_rate_deciles(open_rates):
+    """Returns the decile (0-9) of each open rate.
+
+    Uses the same bins as the open rate histogram. Missing open rates fall
+    in the lowest decile.
+
+    Args:
+        open_rates: an array of open rates between 0 and 1.
+    """
+    open_rates = np.nan_to_num(open_rates)
+    return np.searchsorted(
+        rate_bin_edges(open_rates.dtype)[1:-1], open_rates, side='left')
+
+def tally_open_rates(open_rates):
+    """Bins open rates into deciles and counts the high ones.
+
+    Each rate is located among the decile edges by a single binary search,
+    from which its decile, its histogram bin and whether it's high all
+    follow:
+    - deciles match open_rate_deciles().
+    - the histogram matches pd.cut() with include_lowest=True: each bin
+      includes its upper edge, the lowest also its lower edge, and
+      missing rates or any outside [0, 1] aren't counted.
+    - rates above HIGH_OPEN_RATE, which is a decile edge, are high.
+
+    Args:
+        open_rates: an array of open rates.
+
+    Returns:
+        A tuple containing an int64 array of each rate's decile, an int64
+        array holding the histogram count of each decile, and the number
+        of high rates.
+    """
+    open_rates = np.asarray(open_rates, dtype=rate_dtype(open_rates.dtype))
+    edges = rate_bin_edges(open_rates.dtype)
+    missing = np.isnan(open_rates)
+
+    # Missing rates sort after every edge
+    positions = np.searchsorted(edges, open_rates, side='left')
+    deciles = np.clip(positions - 1, 0, RATE_BIN_COUNT - 1)
+    deciles[missing] = 0
+
+    # Rates of 0 and below share the first position, so tell them apart
+    with np.errstate(invalid='ignore'):
+        binned = (positions <= RATE_BIN_COUNT) & (open_rates >= edges[0])
+    hist_bin_counts = np.bincount(deciles[binned], minlength=RATE_BIN_COUNT)
+    high_open_count = int(np.count_nonzero(
+        (positions > HIGH_OPEN_EDGE) & ~missing))
+    return deciles, hist_bin_counts, high_open_count
+
+class MemberMetrics():
+    """Mergeable accumulators of the metrics computed from list members.
+
+    Members are added chunk by chunk, in any order. Statuses are counted,
+    and subscribers' open rates are counted by decile and against the high
+    open rate threshold. A reservoir of each decile's subscribers is kept
+    for the activity sample: the subscribers with the lowest sample keys,
+    a hash of the list id and their member id. The keys don't depend on the
+    order members arrive in, so a resumed import, or merging the metrics
+    of separately imported chunks, keeps the same subscribers. Once the
+    sampled subscribers' activity is recorded, the share of subscribers
+    without a recent open is estimated from it.
+    """
+
+    # The type rates are stored as, matching MemberColumns.RATE_DTYPE
+    RATE_DTYPE = np.float32
+
+    def __init__(self, list_id, reservoir_size):
+        """Initializes empty accumulators.
+
+        Args:
+            list_id: the list's unique MailChimp id. Seeds the sample keys.
+            reservoir_size: the most subscribers kept from each decile,
+                i.e. the largest sample which may be drawn. No reservoirs
+                are kept if it's 0.
+
+        Other class variables:
+            status_counts: a Counter of the members' statuses.
+            hist_bin_counts: an int64 array holding the number of
+                subscribers with open rates in each decile.
+            high_open_count: the number of subscribers with open rates
+                above HIGH_OPEN_RATE.
+            stratum_sizes: an int64 array holding the number of subscribers
+                in each open rate decile, counting missing open rates in
+                the lowest.
+            reservoir_keys: a list holding an array of the sample keys
+                kept from each decile.
+            reservoir_ids: a list holding an array of the ids belonging to
+                the same keys.
+            recent_open_count: the number of subscribers, or sampled
+                subscribers, known to have opened an email recently.
+            sample_strata: the decile of each sampled subscriber, once a
+                sample is drawn.
+            sample_opened: a boolean array, True for each sampled
+                subscriber with a recent open, once their activity is
+                recorded.
+        """
+        self.seed = zlib.crc32(str(list_id).encode('utf-8'))
+        self.reservoir_size = reservoir_size
+        self.status_counts = Counter()
+        self.hist_bin_counts = np.zeros(RATE_BIN_COUNT, dtype=np.int64)
+        self.high_open_count = 0
+        self.stratum_sizes = np.zeros(RATE_BIN_COUNT, dtype=np.int64)
+        self.reservoir_keys = [np.empty(0, dtype=np.int64)
+                               for _ in range(RATE_BIN_COUNT)]
+        self.reservoir_ids = [np.empty(0, dtype=object)
+                              for _ in range(RATE_BIN_COUNT)]
+        self.recent_open_count = 0
+        self.sample_strata = None
+        self.sample_opened = None
+
+    def __len__(self):
+        return sum(self.status_counts.values())
+
+    @property
+    def subscribers(self):
+        """The number of subscribed members."""
+        return self.status_counts['subscribed']
+
+    def append_members(self, members):
+        """Adds a chunk of members, as MemberColumns.append_members() does.
+
+        Args:
+            members: a list of member dictionaries as returned by the
+                MailChimp API, including the nested stats object.
+        """
+        statuses = []
+        subscriber_ids = []
+        open_rates = []
+        for member in members:
+            status = member.get('status')
+            statuses.append(status)
+            if status == 'subscribed':
+                subscriber_ids.append(member.get('id'))
+                open_rate = (member.get('stats') or {}).get('avg_open_rate')
+                open_rates.append(
+                    float('nan') if open_rate is None else open_rate)
+        self.add(statuses, np.array(subscriber_ids, dtype=object),
+                 np.array(open_rates, dtype=self.RATE_DTYPE))
+
+    def add(self, statuses, subscriber_ids, open_rates):
+        """Adds a chunk of members.
+
+        Args:
+            statuses: an iterable of the status of every member.
+            subscriber_ids: an object array of the subscribers' ids.
+            open_rates: an array of the subscribers' open rates, in the
+                same order.
+        """
+        self.status_counts.update(statuses)
+        strata, hist_bin_counts, high_open_count = tally_open_rates(
+            open_rates)
+        self.hist_bin_counts += hist_bin_counts
+        self.high_open_count += high_open_count
+        self.stratum_sizes += np.bincount(strata, minlength=RATE_BIN_COUNT)
+        if not self.reservoir_size:
+            return
+        keys = np.fromiter(
+            (zlib.crc32(str(subscriber_id).encode('utf-8'), self.seed)
+             for subscriber_id in subscriber_ids),
+            dtype=np.int64, count=len(subscriber_ids))
+        for stratum in range(RATE_BIN_COUNT):
+            in_stratum = strata == stratum
+            self.add_to_reservoir(
+                stratum, keys[in_stratum], subscriber_ids[in_stratum])
+
+    @classmethod
+    def from_frame(cls, df): # pylint: disable=invalid-name
+        """Tallies a members dataframe.
+
+        This is the kernel behind the calc_* methods of MailChimpList.
+        Statuses are counted from their categorical codes, then the
+        subscribers' open rates are tallied by tally_open_rates() and
+        recent opens are counted, each in a single vectorized pass.
+        Columns missing from the dataframe aren't tallied. No reservoirs
+        are kept.
+
+        Args:
+            df: a members dataframe, as created by import_list_members().
+
+        Returns:
+            A MemberMetrics instance.
+        """
+        metrics = cls(None, 0)
+        if 'status' in df:
+            statuses = df['status']
+            if pd.api.types.is_categorical_dtype(statuses):
+                codes = statuses.cat.codes.values
+                categories = np.asarray(statuses.cat.categories)
+            else:
+                codes, categories = pd.factorize(statuses.values)
+            status_counts = np.bincount(codes[codes >= 0],
+                                        minlength=len(categories))
+            metrics.status_counts.update(dict(zip(
+                categories.tolist(), status_counts.tolist())))
+            subscribed_code = np.flatnonzero(categories == 'subscribed')
+            if 'avg_open_rate' in df and len(subscribed_code):
+                strata, metrics.hist_bin_counts, metrics.high_open_count = (
+                    tally_open_rates(df['avg_open_rate'].values[
+                        codes == subscribed_code[0]]))
+                metrics.stratum_sizes = np.bincount(
+                    strata, minlength=RATE_BIN_COUNT)
+        if 'recent_open' in df:
+            metrics.recent_open_count = int(np.count_nonzero(
+                pd.notna(df['recent_open'].values)))
+        return metrics
+
+    def add_to_reservoir(self, stratum, keys, subscriber_ids):
+        """Adds subscribers to a decile's reservoir, keeping those with the
+        lowest keys.
+
+        Args:
+            stratum: the decile.
+            keys: an int64 array of the subscribers' sample keys.
+            subscriber_ids: an object array of their ids.
+        """
+        if not len(keys): # pylint: disable=len-as-condition
+            return
+        keys = np.concatenate([self.reservoir_keys[stratum], keys])
+        subscriber_ids = np.concatenate(
+            [self.reservoir_ids[stratum], subscriber_ids])
+
+        # A member may appear in two chunks if the list changed meanwhile
+        keys, unique_positions = np.unique(keys, return_index=True)
+        subscriber_ids = subscriber_ids[unique_positions]
+        self.reservoir_keys[stratum] = keys[:self.reservoir_size]
+        self.reservoir_ids[stratum] = subscriber_ids[:self.reservoir_size]
+
+    def merge(self, other):
+        """Merges another instance's members into this one.
+
+        Args:
+            other: a MemberMetrics instance of the same list.
+        """
+        self.status_counts.update(other.status_counts)
+        self.hist_bin_counts += other.hist_bin_counts
+        self.high_open_count += other.high_open_count
+        self.stratum_sizes += other.stratum_sizes
+        self.recent_open_count += other.recent_open_count
+        for stratum in range(RATE_BIN_COUNT):
+            self.add_to_reservoir(stratum, other.reservoir_keys[stratum],
+                                  other.reservoir_ids[stratum])
+
+    def sample_subscribers(self, sample_size, min_stratum_sample_size):
+        """Draws a stratified random sample of the subscribers.
+
+        Allocates the sample like MailChimpList.sample_subscribers():
+        each decile is sampled in proportion to its size, but at least
+        min_stratum_sample_size subscribers are drawn from each. The
+        subscribers with the lowest keys in each decile are drawn.
+
+        Args:
+            sample_size: the number of subscribers to draw, at most the
+                reservoir size.
+            min_stratum_sample_size: the fewest subscribers drawn from each
+                decile.
+
+        Returns:
+            A list of the sampled subscribers' ids.
+        """
+        total = max(int(self.stratum_sizes.sum()), 1)
+        sample_ids = []
+        sample_strata = []
+        for stratum, stratum_size in enumerate(self.stratum_sizes):
+            stratum_sample_size = min(
+                stratum_size, self.reservoir_size, max(
+                    min_stratum_sample_size,
+                    int(round(sample_size * stratum_size / total))))
+            sample_ids.extend(
+                self.reservoir_ids[stratum][:stratum_sample_size])
+            sample_strata.append(
+                np.full(stratum_sample_size, stratum, dtype=np.int64))
+        self.sample_strata = np.concatenate(sample_strata)
+        self.sample_opened = None
+        return sample_ids
+
+    @property
+    def fully_sampled(self):
+        """Whether every subscriber is in the sample."""
+        return (self.sample_strata is not None and
+                len(self.sample_strata) == self.subscribers)
+
+    def record_recent_opens(self, opened):
+        """Records which sampled subscribers opened an email recently.
+
+        Args:
+            opened: a boolean array, True for each subscriber of the drawn
+                sample who had a recent open, in sample order.
+        """
+        self.sample_opened = np.asarray(opened, dtype=bool)
+        self.recent_open_count = int(np.count_nonzero(self.sample_opened))
@@ -44,6 +44,8 @@ class ListStats(db.Model): # pylint: disable=too-few-public-methods
     pending_pct = db.Column(db.Float)
     high_open_rt_pct = db.Column(db.Float)
     cur_yr_inactive_pct = db.Column(db.Float)
+    cur_yr_inactive_pct_lower = db.Column(db.Float)
+    cur_yr_inactive_pct_upper = db.Column(db.Float)
     list_id = db.Column(db.String(64), db.ForeignKey('email_list.list_id',
                                                      name='fk_list_id'))
 
@@ -84,3 +86,13 @@ class Organization(db.Model): # pylint: disable=too-few-public-methods
 
     def __repr__(self):
         return '<Organization {}>'.format(self.id)
+
+class ImportLock(db.Model): # pylint: disable=too-few-public-methods
+    """Marks a list as being imported, so concurrent analyses of the list
+    share a single import."""
+    list_id = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(32))
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<ImportLock {}>'.format(self.list_id)
@@ -0,0 +1,366 @@
+"""This module keeps the proxies MailChimp requests are routed through warm."""
+import os
+import time
+import asyncio
+from itertools import cycle
+from aiohttp import ClientError, ClientTimeout
+from billiard import current_process # pylint: disable=no-name-in-module
+from celery.utils.log import get_task_logger
+from app.sessions import SESSION_MANAGER
+
+class ProxyUnavailableError(Exception):
+    """Raised when a proxy provider can't supply a proxy."""
+
+class UsProxiesProvider():
+    """Supplies proxies from US Proxies.
+
+    Each Celery worker controls its corresponding US Proxies processes,
+    which are asked for a fresh IP address in turn whenever a proxy is
+    needed. Rotating a process changes the address of the proxy it served
+    before, so a worker can only keep as many proxies as it has processes.
+    """
+
+    # The US Proxies API endpoint
+    API_URL = 'http://us-proxies.com/api.php'
+
+    def __init__(self, password, process_numbers):
+        """Initializes a provider.
+
+        Args:
+            password: the US Proxies API password.
+            process_numbers: a list of the US Proxies processes to control.
+        """
+        self.password = password
+        self.process_numbers = process_numbers
+        self.capacity = len(process_numbers)
+        self.processes = cycle(process_numbers)
+
+    async def rotate(self, session):
+        """Rotates the next process's IP address.
+
+        Args:
+            session: the aiohttp ClientSession to call the API with.
+
+        Returns:
+            The proxy url.
+
+        Throws:
+            ProxyUnavailableError: the API returned an error or couldn't be
+                reached.
+        """
+        params = (
+            ('api', ''),
+            ('uid', '9557'),
+            ('pwd', self.password),
+            ('cmd', 'rotate'),
+            ('process', next(self.processes)),
+        )
+        try:
+            async with session.get(self.API_URL, params=params) as response:
+                proxy_response_vars = (await response.text()).split(':')
+        except (ClientError, asyncio.TimeoutError):
+            raise ProxyUnavailableError('ConnectionError: proxy provider down.')
+        if proxy_response_vars[0] == 'ERROR' or len(proxy_response_vars) < 3:
+            raise ProxyUnavailableError(proxy_response_vars[-1])
+        return 'http://{}:{}'.format(
+            proxy_response_vars[1], proxy_response_vars[2])
+
+class LocalProxyProvider():
+    """Supplies proxies from a fixed list, e.g. in development and tests.
+
+    Each rotation moves on to the next proxy in the list.
+    """
+
+    def __init__(self, proxies):
+        """Initializes a provider.
+
+        Args:
+            proxies: a list of proxy urls.
+        """
+        self.capacity = len(proxies)
+        self.proxies = cycle(proxies)
+
+    async def rotate(self, session): # pylint: disable=unused-argument
+        """Returns the next proxy url. See UsProxiesProvider.rotate()."""
+        return next(self.proxies)
+
+class ProxyPool(): # pylint: disable=too-many-instance-attributes
+    """Leases a warm, health-checked proxy to imports.
+
+    The current proxy is kept for as long as it stays healthy, so imports
+    normally lease it without waiting. Spare proxies are booted and probed
+    in the background while it is, so once the current proxy is flagged,
+    by an import or by a failed health check, a spare takes its place
+    straight away and another is booted behind it. Imports only wait for
+    a proxy to boot if there's no spare, e.g. on the first lease, and then
+    only until a probe request gets through it rather than a fixed time.
+    """
+
+    # The url requested through a proxy to check that it works
+    # Any HTTP response, even an error status, means it does
+    PROBE_URL = 'https://login.mailchimp.com/'
+
+    # The number of seconds a probe request may take
+    PROBE_TIMEOUT = 5
+
+    # The number of seconds between probes of a booting proxy
+    PROBE_INTERVAL = 1
+
+    # The longest we'll wait for a new proxy to boot, in seconds
+    PROXY_BOOT_TIME = 30
+
+    # The number of seconds between health checks of the current proxy
+    HEALTH_CHECK_INTERVAL = 60
+
+    # The number of probed proxies kept ready to replace the current one
+    # Limited by the number of proxies the provider can keep at once
+    SPARE_PROXIES = 1
+
+    def __init__(self, provider):
+        """Initializes a pool.
+
+        Args:
+            provider: the UsProxiesProvider or LocalProxyProvider which
+                supplies proxies.
+
+        Class variables:
+            proxy: the current proxy url, or None.
+            flagged: whether the current proxy needs replacing.
+            checked_at: the monotonic time the current proxy last worked.
+            spares: a list of probed proxy urls to replace it with.
+            last_error: why the pool couldn't supply a proxy, if it
+                couldn't.
+            health_check_task: the background health check task.
+            refill_task: the background task which replaces a flagged
+                proxy and boots spares.
+            waiters: a list of futures resolved once a flagged proxy has
+                been replaced.
+        """
+        self.provider = provider
+        self.proxy = None
+        self.flagged = True
+        self.checked_at = None
+        self.spares = []
+        self.last_error = None
+        self.health_check_task = None
+        self.refill_task = None
+        self.waiters = []
+        self.lock = None
+        self.lock_loop = None
+        self.logger = get_task_logger(__name__)
+
+    def _get_lock(self):
+        """Returns a lock for the running event loop."""
+        loop = asyncio.get_event_loop()
+        if self.lock_loop is not loop:
+            self.lock = asyncio.Lock()
+            self.lock_loop = loop
+        return self.lock
+
+    @staticmethod
+    def _is_running(task):
+        """Returns whether a background task is running on the running
+        loop."""
+        return task is not None and not task.done() and (
+            task._loop is asyncio.get_event_loop()) # pylint: disable=protected-access
+
+    async def probe(self, proxy):
+        """Returns whether a request gets through a proxy."""
+        async with SESSION_MANAGER as session:
+            try:
+                async with session.get(
+                        self.PROBE_URL, proxy=proxy,
+                        timeout=ClientTimeout(total=self.PROBE_TIMEOUT)):
+                    return True
+            except (ClientError, asyncio.TimeoutError):
+                return False
+
+    async def wait_until_ready(self, proxy):
+        """Probes a new proxy until it works or PROXY_BOOT_TIME has passed.
+
+        Returns:
+            True if the proxy works.
+        """
+        deadline = time.monotonic() + self.PROXY_BOOT_TIME
+        while True:
+            if await self.probe(proxy):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.PROBE_INTERVAL)
+
+    def flag(self, proxy):
+        """Marks a proxy as broken, so the next lease or refill replaces it.
+
+        Proxies other than the current one were replaced already, so
+        flagging them does nothing.
+        """
+        if proxy is not None and proxy == self.proxy:
+            self.flagged = True
+
+    def is_flagged(self, proxy):
+        """Returns whether a leased proxy should be given back."""
+        return proxy != self.proxy or self.flagged
+
+    async def health_check(self):
+        """Flags the current proxy if a probe no longer gets through, and
+        drops spares which no longer work.
+
+        Replacements are booted in the background.
+        """
+        for spare in list(self.spares):
+            if not await self.probe(spare):
+                self.logger.warning('Spare proxy %s failed its health check.',
+                                    spare)
+                self.spares.remove(spare)
+        proxy = self.proxy
+        if proxy is not None and not self.flagged:
+            if await self.probe(proxy):
+                self.checked_at = time.monotonic()
+            else:
+                self.logger.warning('Proxy %s failed its health check.', proxy)
+                self.flag(proxy)
+        self.start_refill()
+
+    async def run_health_checks(self):
+        """Health checks the current proxy every HEALTH_CHECK_INTERVAL."""
+        while True:
+            await asyncio.sleep(self.HEALTH_CHECK_INTERVAL)
+            await self.health_check()
+
+    def start_health_checks(self):
+        """Runs health checks in the background of the running loop."""
+        if not self._is_running(self.health_check_task):
+            self.health_check_task = asyncio.ensure_future(
+                self.run_health_checks())
+
+    async def lease(self):
+        """Returns a working proxy.
+
+        The current proxy is checked first if the event loop wasn't
+        running to check it in the background. If it's flagged, it's
+        replaced with a spare, or if there's none, with a new proxy once
+        it works.
+
+        Returns:
+            The proxy url, or None if no working proxy could be found. The
+            reason is then stored in last_error.
+        """
+        async with self._get_lock():
+            if (not self.flagged and time.monotonic() - self.checked_at >
+                    self.HEALTH_CHECK_INTERVAL):
+                await self.health_check()
+            if self.flagged and self.spares:
+                self.promote(self.spares.pop(0))
+            if self.flagged:
+                waiter = asyncio.get_event_loop().create_future()
+                self.waiters.append(waiter)
+                await asyncio.wait([waiter, self.start_refill()],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if self.flagged:
+                    return None
+            self.start_refill()
+            self.start_health_checks()
+            return self.proxy
+
+    def promote(self, proxy):
+        """Makes a working proxy the current one."""
+        self.proxy = proxy
+        self.flagged = False
+        self.checked_at = time.monotonic()
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(proxy)
+        self.waiters = []
+
+    def start_refill(self):
+        """Runs refill() in the background of the running loop, unless it's
+        running already.
+
+        Returns:
+            The background task.
+        """
+        if not self._is_running(self.refill_task):
+            self.refill_task = asyncio.ensure_future(self.refill())
+        return self.refill_task
+
+    async def refill(self):
+        """Replaces a flagged proxy, then boots spares until there are
+        SPARE_PROXIES, or as many as the provider can keep alongside the
+        current proxy.
+
+        Stops at the first proxy which doesn't come up. The next lease or
+        health check starts again.
+        """
+        spare_proxies = min(self.SPARE_PROXIES, self.provider.capacity - 1)
+        while self.flagged or len(self.spares) < spare_proxies:
+            if self.flagged and self.spares:
+                self.promote(self.spares.pop(0))
+                continue
+
+            # Rotating the only proxy a provider keeps takes it down
+            if self.flagged and self.provider.capacity == 1:
+                self.proxy = None
+            proxy = await self.boot()
+            if proxy is None:
+                return
+            if self.flagged:
+                self.promote(proxy)
+            else:
+                self.spares.append(proxy)
+
+    async def boot(self):
+        """Requests a new proxy from the provider and waits until it works.
+
+        Returns:
+            The proxy url, or None if it didn't come up. The reason is then
+            stored in last_error.
+        """
+        try:
+            async with SESSION_MANAGER as session:
+                proxy = await self.provider.rotate(session)
+        except ProxyUnavailableError as e: # pylint: disable=invalid-name
+            self.last_error = str(e)
+            self.logger.warning('Could not boot a proxy: %s', self.last_error)
+            return None
+        if not await self.wait_until_ready(proxy):
+            self.last_error = 'Proxy {} did not come up in time'.format(proxy)
+            self.logger.warning('%s.', self.last_error)
+            return None
+        self.last_error = None
+        return proxy
+
+# The proxy pool of this worker process. See get_proxy_pool()
+_PROXY_POOL = None
+
+def get_proxy_pool():
+    """Returns the worker process's proxy pool, creating it if necessary.
+
+    Proxies are supplied by US Proxies, unless the LOCAL_PROXIES
+    environment variable holds a comma-separated list of proxy urls to
+    use instead. Each worker controls PROXY_PROCESSES_PER_WORKER US
+    Proxies processes, one by default. Spare proxies need at least two.
+    """
+    global _PROXY_POOL # pylint: disable=global-statement
+    if _PROXY_POOL is None:
+        local_proxies = os.environ.get('LOCAL_PROXIES')
+        if local_proxies:
+            provider = LocalProxyProvider(local_proxies.split(','))
+        else:
+
+            # Each worker controls its corresponding proxy processes
+            # Note that workers are zero-indexed, proxy procceses are not
+            # Fall back to worker #0 if we can't ascertain the worker index
+            # e.g. anyone hacking with this app on windows
+            processes = int(os.environ.get('PROXY_PROCESSES_PER_WORKER', 1))
+            try:
+                worker_index = current_process().index
+            except AttributeError:
+                worker_index = 0
+            provider = UsProxiesProvider(
+                os.environ.get('PROXY_AUTH_PWD'),
+                [str(worker_index * processes + process + 1)
+                 for process in range(processes)])
+        _PROXY_POOL = ProxyPool(provider)
+    return _PROXY_POOL
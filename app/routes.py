@@ -13,6 +13,7 @@ from app.forms import UserForm, OrgForm, ApiKeyForm
 from app.models import AppUser, Organization, EmailList, ListStats
 from app.dbops import store_user, store_org
 from app.tasks import init_list_analysis, send_activated_email
+from app.apiurls import mailchimp_url
 
 @app.route('/')
 def index():
@@ -334,8 +335,7 @@ def get_list_data():
     """
     if 'user_id' not in session or 'key' not in session:
         abort(403)
-    request_uri = ('https://{}.api.mailchimp.com/3.0/lists'.format(
-        session['data_center']))
+    request_uri = mailchimp_url(session['data_center'], 'lists')
     params = (
         ('fields', 'lists.id,'
                    'lists.name,'
@@ -0,0 +1,135 @@
+"""This module keeps HTTP connections to MailChimp open between imports."""
+import asyncio
+from collections import Counter
+from aiohttp import ClientSession, TCPConnector, TraceConfig
+from celery.signals import worker_process_shutdown
+from celery.utils.log import get_task_logger
+
+# The aiodns resolver is optional, e.g. if pycares won't build
+# Without it, aiohttp resolves hostnames in a thread pool
+try:
+    from aiohttp.resolver import AsyncResolver
+    import aiodns # pylint: disable=unused-import
+except ImportError: # pragma: no cover
+    AsyncResolver = None
+
+class SessionManager():
+    """Lends out a single aiohttp session per worker process.
+
+    The session and its connection pool outlive each import, so connections
+    to MailChimp's data centers (and their DNS lookups and TLS handshakes)
+    are reused across import phases and across Celery tasks. The manager
+    doubles as the async context manager which lends the session out.
+    Leaving the context leaves the session open.
+    """
+
+    # The most connections open at once, across every host
+    CONNECTION_LIMIT = 100
+
+    # The most connections open to a single data center at once
+    # MailChimp allows each API key ten simultaneous connections
+    CONNECTIONS_PER_HOST = 10
+
+    # Idle connections are closed after this many seconds
+    KEEPALIVE_TIMEOUT = 60
+
+    # Resolved hostnames are cached for this many seconds
+    DNS_CACHE_TTL = 300
+
+    def __init__(self):
+        """Initializes a manager. The session is only created when needed.
+
+        Class variables:
+            session: the shared aiohttp ClientSession, or None.
+            loop: the event loop the session was created on.
+            stats: a Counter of requests made, connections created and
+                reused, and DNS cache hits and misses.
+        """
+        self.session = None
+        self.loop = None
+        self.stats = Counter()
+        self.logger = get_task_logger(__name__)
+
+    def _trace_config(self):
+        """Returns a TraceConfig which counts requests into stats."""
+        trace_config = TraceConfig()
+
+        def count(stat):
+            async def on_signal(session, context, params): # pylint: disable=unused-argument
+                self.stats[stat] += 1
+            return on_signal
+
+        trace_config.on_request_end.append(count('requests'))
+        trace_config.on_connection_create_end.append(
+            count('connections_created'))
+        trace_config.on_connection_reuseconn.append(
+            count('connections_reused'))
+        trace_config.on_dns_cache_hit.append(count('dns_cache_hits'))
+        trace_config.on_dns_cache_miss.append(count('dns_cache_misses'))
+        return trace_config
+
+    def create_session(self):
+        """Creates a session with a tuned connection pool."""
+        connector = TCPConnector(
+            limit=self.CONNECTION_LIMIT,
+            limit_per_host=self.CONNECTIONS_PER_HOST,
+            keepalive_timeout=self.KEEPALIVE_TIMEOUT,
+            use_dns_cache=True, ttl_dns_cache=self.DNS_CACHE_TTL,
+            resolver=AsyncResolver() if AsyncResolver else None)
+        return ClientSession(connector=connector,
+                             trace_configs=[self._trace_config()])
+
+    def get_session(self):
+        """Returns the shared session, creating it if necessary.
+
+        A session only works on the event loop it was created on, so a new
+        one is created if the loop changed or the session was closed.
+        """
+        loop = asyncio.get_event_loop()
+        if (self.session is None or self.session.closed or
+                self.loop is not loop):
+            self.session = self.create_session()
+            self.loop = loop
+        return self.session
+
+    async def __aenter__(self):
+        return self.get_session()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        pass
+
+    def get_stats(self):
+        """Returns the connection reuse statistics.
+
+        Returns:
+            A dictionary of counts, plus the share of requests which reused
+            an open connection.
+        """
+        stats = dict(self.stats)
+        connections = (self.stats['connections_created'] +
+                       self.stats['connections_reused'])
+        stats['reuse_ratio'] = (self.stats['connections_reused'] /
+                                connections if connections else None)
+        return stats
+
+    def log_stats(self):
+        """Logs the connection reuse statistics."""
+        self.logger.info('HTTP session stats: %s', self.get_stats())
+
+    async def close(self):
+        """Closes the shared session and its connections."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        self.loop = None
+
+# The session manager of this worker process
+SESSION_MANAGER = SessionManager()
+
+@worker_process_shutdown.connect
+def close_shared_session(**kwargs): # pylint: disable=unused-argument
+    """Closes the shared session when a Celery worker process exits."""
+    loop = SESSION_MANAGER.loop
+    if loop is not None and not loop.is_closed():
+        SESSION_MANAGER.log_stats()
+        loop.run_until_complete(SESSION_MANAGER.close())
@@ -0,0 +1,135 @@
+"""This module stores snapshots of imported list data between analyses.
+
+Each snapshot is a compressed Parquet file holding the flattened members
+dataframe of a single analysis, keyed by the list id and the analysis
+timestamp. Metadata about how the members and their activity were fetched
+is stored in the file's schema. Snapshots are read back through memory
+mapping, so re-analyses and incremental refreshes only cost a local read.
+"""
+import os
+import json
+from datetime import datetime, timedelta, timezone
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app.localstate import local_state_path
+
+# The number of snapshots to keep per list
+SNAPSHOT_RETENTION_COUNT = 3
+
+# Snapshots older than this are deleted regardless
+SNAPSHOT_RETENTION_PERIOD = timedelta(days=180)
+
+# The schema metadata key under which we store our own metadata
+METADATA_KEY = b'benchmarks'
+
+# The format of the analysis timestamp in snapshot filenames
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S%fZ'
+
+def snapshot_dir(list_id=None):
+    """Returns the directory holding a list's snapshots, or all snapshots.
+
+    The directory is created if it doesn't exist yet.
+    """
+    directory = local_state_path('snapshots', *([list_id] if list_id else []))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def list_snapshots(list_id):
+    """Lists a list's snapshots, newest first.
+
+    Args:
+        list_id: the list's unique MailChimp id.
+
+    Returns:
+        A list of (analysis timestamp, path) tuples.
+    """
+    directory = snapshot_dir(list_id)
+    snapshots = []
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        if extension != '.parquet':
+            continue
+        try:
+            analysis_timestamp = datetime.strptime(
+                name, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        snapshots.append(
+            (analysis_timestamp, os.path.join(directory, filename)))
+    return sorted(snapshots, reverse=True)
+
+def save_snapshot(list_id, df, analysis_timestamp, metadata): # pylint: disable=invalid-name
+    """Saves a snapshot of a list's data and prunes old snapshots.
+
+    Args:
+        list_id: the list's unique MailChimp id.
+        df: the flattened members dataframe.
+        analysis_timestamp: the datetime of the analysis the data belongs
+            to. Naive datetimes are assumed to be in UTC.
+        metadata: a json-serializable dictionary describing how the data
+            was fetched.
+
+    Returns:
+        The path of the saved snapshot.
+    """
+    if analysis_timestamp.tzinfo is None:
+        analysis_timestamp = analysis_timestamp.replace(tzinfo=timezone.utc)
+    path = os.path.join(snapshot_dir(list_id), '{}.parquet'.format(
+        analysis_timestamp.astimezone(timezone.utc).strftime(
+            TIMESTAMP_FORMAT)))
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+
+    # Write to a temporary file first so readers never see a partial file
+    temp_path = path + '.tmp'
+    pq.write_table(table, temp_path, compression='snappy')
+    os.replace(temp_path, path)
+
+    prune_snapshots(list_id)
+    return path
+
+def load_latest_snapshot(list_id, columns=None):
+    """Loads a list's most recent snapshot.
+
+    Args:
+        list_id: the list's unique MailChimp id.
+        columns: the columns to read. Defaults to all columns.
+
+    Returns:
+        A tuple containing the dataframe and the snapshot's metadata
+        dictionary, or None if there's no usable snapshot.
+    """
+    for _, path in list_snapshots(list_id):
+        try:
+            table = pq.read_table(path, columns=columns, memory_map=True)
+        except (OSError, ValueError, pa.ArrowException):
+            continue
+        metadata = json.loads(
+            (table.schema.metadata or {}).get(METADATA_KEY, b'{}').decode(
+                'utf-8'))
+        return table.to_pandas(), metadata
+    return None
+
+def prune_snapshots(list_id=None, now=None):
+    """Deletes snapshots which fall outside the retention policy.
+
+    Keeps the SNAPSHOT_RETENTION_COUNT newest snapshots of each list, as
+    long as they are younger than SNAPSHOT_RETENTION_PERIOD.
+
+    Args:
+        list_id: the list to prune. Defaults to every list.
+        now: the current datetime. Defaults to datetime.now().
+    """
+    now = now or datetime.now(timezone.utc)
+    list_ids = [list_id] if list_id else [
+        entry for entry in os.listdir(snapshot_dir())
+        if os.path.isdir(os.path.join(snapshot_dir(), entry))]
+    for snapshot_list_id in list_ids:
+        for snapshot_num, (analysis_timestamp, path) in enumerate(
+                list_snapshots(snapshot_list_id)):
+            if (snapshot_num >= SNAPSHOT_RETENTION_COUNT or
+                    now - analysis_timestamp > SNAPSHOT_RETENTION_PERIOD):
+                os.remove(path)
@@ -2,21 +2,51 @@
 import os
 import json
 import time
+import uuid
 import calendar
 from datetime import datetime, timedelta, timezone
 import requests
 import pandas as pd
 import numpy as np
 from sqlalchemy import desc
+from celery.signals import worker_process_init
 from celery.utils.log import get_task_logger
 from app import celery, db
 from app.emails import send_email
-from app.lists import MailChimpList, MailChimpImportError, do_async_import
+from app.lists import (
+    MailChimpList, MailChimpImportError, do_async_import, install_uvloop)
 from app.models import EmailList, ListStats
-from app.dbops import associate_user_with_list
+from app.snapshots import save_snapshot, prune_snapshots
+from app.checkpoints import prune_checkpoints
+from app.sessions import SESSION_MANAGER
+from app.httpcache import prune_response_cache
+from app.apiurls import mailchimp_url
+from app.memprofile import MemoryProfiler
+from app.dbops import (
+    associate_user_with_list, acquire_import_lock, release_import_lock)
 from app.visualizations import (
     draw_bar, draw_stacked_horizontal_bar, draw_histogram, draw_donuts)
 
+# The number of seconds before a task which found a list's import lock
+# Taken tries to take it again
+IMPORT_LOCK_RETRY_DELAY = 60
+
+# How long an import lock may be held before it's assumed the worker
+# holding it died, and the lock is broken
+# A live import fails once it passes its deadline, so allow that long
+# Plus time to analyze and store the list afterwards
+IMPORT_LOCK_TIMEOUT = MailChimpList.IMPORT_DEADLINE + timedelta(hours=1)
+
+# How many times a task tries again to take a list's import lock
+# By the last try, the lock has timed out even if its holder died
+IMPORT_LOCK_MAX_RETRIES = int(
+    IMPORT_LOCK_TIMEOUT.total_seconds() // IMPORT_LOCK_RETRY_DELAY) + 1
+
+@worker_process_init.connect
+def set_event_loop_policy(**kwargs): # pylint: disable=unused-argument
+    """Uses uvloop's event loop in each worker process, if installed."""
+    install_uvloop()
+
 @celery.task
 def send_activated_email(user_email, user_email_hash):
     """Sends an email telling a user that they've been authorized.
@@ -48,78 +78,157 @@ def import_analyze_store_list(list_data, org_id, user_email=None):
             MailChimp API problem.
     """
 
-    # Create a new list instance and import member data/activity
-    mailing_list = MailChimpList(
-        list_data['list_id'], list_data['total_count'], list_data['key'],
-        list_data['data_center'])
+    # Record the memory used by each stage, if profiling is enabled
+    memory_profiler = MemoryProfiler(
+        list_data['list_id'], list_data['total_count'])
 
     try:
 
-        # Import basic list data
-        do_async_import(mailing_list.import_list_members())
-
-        # Import the subscriber activity as well, and merge
-        do_async_import(mailing_list.import_sub_activity())
-
-    except MailChimpImportError as e: # pylint: disable=invalid-name
-        if user_email:
-            send_email(
-                'We Couldn\'t Process Your Email Benchmarking Report',
-                [user_email, os.environ.get('ADMIN_EMAIL') or None],
-                'error-email.html',
-                {'title': 'Looks like something went wrong ☹',
-                 'error_details': e.error_details})
-        raise
-
-    # Remove nested jsons from the dataframe
-    mailing_list.flatten()
-
-    # Do the data science shit
-    mailing_list.calc_list_breakdown()
-    mailing_list.calc_open_rate(list_data['open_rate'])
-    mailing_list.calc_frequency(list_data['creation_timestamp'],
-                                list_data['campaign_count'])
-    mailing_list.calc_histogram()
-    mailing_list.calc_high_open_rate_pct()
-    mailing_list.calc_cur_yr_stats()
-
-    # Create a set of stats
-    list_stats = ListStats(
-        frequency=mailing_list.frequency,
-        subscribers=mailing_list.subscribers,
-        open_rate=mailing_list.open_rate,
-        hist_bin_counts=json.dumps(mailing_list.hist_bin_counts),
-        subscribed_pct=mailing_list.subscribed_pct,
-        unsubscribed_pct=mailing_list.unsubscribed_pct,
-        cleaned_pct=mailing_list.cleaned_pct,
-        pending_pct=mailing_list.pending_pct,
-        high_open_rt_pct=mailing_list.high_open_rt_pct,
-        cur_yr_inactive_pct=mailing_list.cur_yr_inactive_pct,
-        list_id=list_data['list_id'])
-
-    # If the user gave their permission, store the stats in the database
-    if list_data['monthly_updates'] or list_data['store_aggregates']:
-
-        # Create a list object to go with the set of stats
-        email_list = EmailList(
-            list_id=list_data['list_id'],
-            creation_timestamp=list_data['creation_timestamp'],
-            list_name=list_data['list_name'],
-            api_key=list_data['key'],
-            data_center=list_data['data_center'],
-            store_aggregates=list_data['store_aggregates'],
-            monthly_updates=list_data['monthly_updates'],
-            org_id=org_id)
-        email_list = db.session.merge(email_list)
-
-        db.session.add(list_stats)
+        # Create a new list instance and import member data/activity
+        # Only keep a member snapshot if the user let us store the list
+        mailing_list = MailChimpList(
+            list_data['list_id'], list_data['total_count'], list_data['key'],
+            list_data['data_center'],
+            keep_snapshot=bool(list_data['monthly_updates'] or
+                               list_data['store_aggregates']),
+            memory_profiler=memory_profiler)
+
         try:
-            db.session.commit()
-        except:
-            db.session.rollback()
+
+            # Import basic list data and the subscriber activity, and merge
+            # Only members changed since the last snapshot are requested
+            # Activity is requested while the members are still arriving
+            do_async_import(mailing_list.import_list())
+
+            # Report how many connections the worker's session reused
+            SESSION_MANAGER.log_stats()
+
+        except MailChimpImportError as e: # pylint: disable=invalid-name
+            if user_email:
+                send_email(
+                    'We Couldn\'t Process Your Email Benchmarking Report',
+                    [user_email, os.environ.get('ADMIN_EMAIL') or None],
+                    'error-email.html',
+                    {'title': 'Looks like something went wrong ☹',
+                     'error_details': e.error_details})
             raise
 
-    return list_stats
+        finally:
+
+            # Write out the responses cached since the last batch
+            # Including a failed import's, so its retry can use them
+            if mailing_list.response_cache is not None:
+                mailing_list.response_cache.flush()
+
+        # Remove nested jsons from the dataframe
+        mailing_list.flatten()
+        memory_profiler.record('flatten')
+
+        # Do the data science shit
+        mailing_list.calc_list_breakdown()
+        mailing_list.calc_open_rate(list_data['open_rate'])
+        mailing_list.calc_frequency(list_data['creation_timestamp'],
+                                    list_data['campaign_count'])
+        mailing_list.calc_histogram()
+        mailing_list.calc_high_open_rate_pct()
+        mailing_list.calc_cur_yr_stats()
+        memory_profiler.record('calculations')
+
+        # Create a set of stats
+        list_stats = ListStats(
+            frequency=mailing_list.frequency,
+            subscribers=mailing_list.subscribers,
+            open_rate=mailing_list.open_rate,
+            hist_bin_counts=json.dumps(mailing_list.hist_bin_counts),
+            subscribed_pct=mailing_list.subscribed_pct,
+            unsubscribed_pct=mailing_list.unsubscribed_pct,
+            cleaned_pct=mailing_list.cleaned_pct,
+            pending_pct=mailing_list.pending_pct,
+            high_open_rt_pct=mailing_list.high_open_rt_pct,
+            cur_yr_inactive_pct=mailing_list.cur_yr_inactive_pct,
+            cur_yr_inactive_pct_lower=mailing_list.cur_yr_inactive_pct_lower,
+            cur_yr_inactive_pct_upper=mailing_list.cur_yr_inactive_pct_upper,
+            list_id=list_data['list_id'])
+
+        # If the user gave their permission, store the stats in the database
+        if list_data['monthly_updates'] or list_data['store_aggregates']:
+
+            # Create a list object to go with the set of stats
+            email_list = EmailList(
+                list_id=list_data['list_id'],
+                creation_timestamp=list_data['creation_timestamp'],
+                list_name=list_data['list_name'],
+                api_key=list_data['key'],
+                data_center=list_data['data_center'],
+                store_aggregates=list_data['store_aggregates'],
+                monthly_updates=list_data['monthly_updates'],
+                org_id=org_id)
+            email_list = db.session.merge(email_list)
+
+            db.session.add(list_stats)
+            try:
+                db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+            memory_profiler.record('store')
+
+            # Keep a snapshot of the list data for re-analyses and refreshes
+            # Lists analyzed in streaming mode have no dataframe to keep
+            if not mailing_list.streaming:
+                save_snapshot(list_data['list_id'], mailing_list.df,
+                              list_stats.analysis_timestamp,
+                              mailing_list.fetch_metadata)
+                memory_profiler.record('snapshot')
+
+        return list_stats
+
+    finally:
+        memory_profiler.stop()
+
+def import_analyze_store_list_once(list_data, org_id, user_email=None,
+                                   since=None):
+    """Imports a list, unless another worker is already importing it.
+
+    Only one import of each list runs at a time. A caller which finds
+    the list's import lock taken gets None back rather than waiting, and
+    should call again later, e.g. by retrying its Celery task. Once the
+    lock is free, the ListStats stored by the import which held it are
+    reused rather than importing the list again. If it didn't store any,
+    e.g. because the user didn't let us store their data or because it
+    failed, the caller imports the list itself.
+
+    Args:
+        list_data: see init_list_analysis().
+        org_id: see import_analyze_store_list().
+        user_email: see import_analyze_store_list().
+        since: a naive UTC datetime. ListStats analyzed after it are
+            reused. Defaults to the time of the call.
+
+    Returns:
+        A ListStats object, either reused or freshly generated, or None
+        if another worker holds the list's import lock.
+
+    Throws:
+        MailChimpImportError: see import_analyze_store_list().
+    """
+    since = since or datetime.utcnow()
+    owner = uuid.uuid4().hex
+    if not acquire_import_lock(
+            list_data['list_id'], owner, IMPORT_LOCK_TIMEOUT):
+        return None
+    try:
+
+        # Reuse the stats of an import which finished while we waited
+        list_stats = ListStats.query.filter(
+            ListStats.list_id == list_data['list_id'],
+            ListStats.analysis_timestamp > since).order_by(
+                desc('analysis_timestamp')).first()
+        return list_stats or import_analyze_store_list(
+            list_data, org_id, user_email)
+
+    finally:
+        release_import_lock(list_data['list_id'], owner)
 
 def generate_summary_stats(list_stats_objects):
     """Generates summary statistics dictionaries for a list and the database.
@@ -358,8 +467,9 @@ def extract_stats(list_object):
              'cur_yr_inactive_pct': list_object.cur_yr_inactive_pct}
     return stats
 
-@celery.task
-def init_list_analysis(user_data, list_data, org_id):
+@celery.task(bind=True, max_retries=IMPORT_LOCK_MAX_RETRIES)
+def init_list_analysis(self, user_data, list_data, org_id,
+                       requested_at=None):
     """Celery task wrapper for each stage of analyzing a list.
 
     First checks if there is a recently cached analysis/analyses,
@@ -370,19 +480,33 @@ def init_list_analysis(user_data, list_data, org_id):
     cached. Then checks if the user selected monthly updates, if so,
     create the relationship. Finally, generates a benchmarking
     report with the stats.
+    If another worker is importing the list, the task is retried once
+    IMPORT_LOCK_RETRY_DELAY has passed rather than holding the worker.
 
     Args:
         user_data: a dictionary containing information about the user.
         list_data: a dictionary containing information about the list.
         org_id: the id of the organization associated with the list.
+        requested_at: the UTC POSIX timestamp at which the analysis was
+            first requested. Only passed when the task is retried.
     """
 
     # Try to pull the two most recent ListStats records from the database
-    # Otherwise generate one
-    analyses = (ListStats.query.filter_by(
+    # Otherwise generate one, or retry once an import that's already
+    # Running has had time to finish
+    requested_at = requested_at or time.time()
+    analyses = ListStats.query.filter_by(
         list_id=list_data['list_id']).order_by(desc(
-            'analysis_timestamp')).limit(2).all() or [
-                import_analyze_store_list(list_data, org_id, user_data['email'])])
+            'analysis_timestamp')).limit(2).all()
+    if not analyses:
+        list_stats = import_analyze_store_list_once(
+            list_data, org_id, user_data['email'],
+            since=datetime.utcfromtimestamp(requested_at))
+        if list_stats is None:
+            raise self.retry(args=(user_data, list_data, org_id),
+                             kwargs={'requested_at': requested_at},
+                             countdown=IMPORT_LOCK_RETRY_DELAY)
+        analyses = [list_stats]
 
     # If the user chose to store their data, there will be an associated
     # EmailList object
@@ -422,6 +546,14 @@ def update_stored_data():
     """
     logger = get_task_logger(__name__)
 
+    # Drop snapshots which fall outside the retention policy
+    # And checkpoints of failed imports which were never resumed
+    # And cached responses older than a day
+    # Even if no list needs updating, as the privacy policy promises
+    prune_snapshots()
+    prune_checkpoints()
+    prune_response_cache()
+
     # Grab the most recent analyses in the database
     list_analyses = ListStats.query.order_by(
         'list_id', desc('analysis_timestamp')).distinct(
@@ -432,6 +564,7 @@ def update_stored_data():
         return
 
     # Create a list of analyses which are more than 30 days old
+    # Lists analyzed since, e.g. at a user's request, aren't updated again
     now = datetime.now(timezone.utc)
     one_month_ago = now - timedelta(days=30)
     analyses_to_update = [
@@ -458,9 +591,9 @@ def update_stored_data():
 
         # Pull information about the list from the API
         # This may have changed since we originally pulled the list data
-        request_uri = ('https://{}.api.mailchimp.com/3.0/lists/{}'.format(
+        request_uri = mailchimp_url(
             associated_list_object.data_center,
-            associated_list_object.list_id))
+            'lists/{}'.format(associated_list_object.list_id))
         params = (
             ('fields', 'stats.member_count,'
                        'stats.unsubscribe_count,'
@@ -500,9 +633,19 @@ def update_stored_data():
                      'campaign_count': response_stats['campaign_count']}
 
         # Then re-run the calculations and update the database
+        # Lists another worker is importing are handed to update_list()
         try:
-            import_analyze_store_list(list_data, associated_list_object.org_id)
-            logger.info('Finished updating list %s!', analysis.list_id)
+            if import_analyze_store_list_once(
+                    list_data, associated_list_object.org_id,
+                    since=one_month_ago.replace(tzinfo=None)):
+                logger.info('Finished updating list %s!', analysis.list_id)
+            else:
+                update_list.apply_async(
+                    args=(list_data, associated_list_object.org_id,
+                          one_month_ago.timestamp()),
+                    countdown=IMPORT_LOCK_RETRY_DELAY)
+                logger.info('List %s is already being imported, deferring '
+                            'its update.', analysis.list_id)
         except MailChimpImportError:
             logger.error('Error importing new data for list %s.', analysis.list_id)
             failed_updates.append(analysis.list_id)
@@ -513,6 +656,23 @@ def update_stored_data():
             'Some lists failed to update: {}'.format(failed_updates),
             failed_updates)
 
+@celery.task(bind=True, max_retries=IMPORT_LOCK_MAX_RETRIES)
+def update_list(self, list_data, org_id, since):
+    """Celery task which updates a list another worker was importing.
+
+    update_stored_data() defers lists whose import lock is taken to this
+    task rather than waiting for the lock. The task is retried until the
+    lock is free, then reuses the stats stored since or imports the list.
+
+    Args:
+        list_data: see init_list_analysis().
+        org_id: see import_analyze_store_list().
+        since: a UTC POSIX timestamp, see import_analyze_store_list_once().
+    """
+    if import_analyze_store_list_once(
+            list_data, org_id, since=datetime.utcfromtimestamp(since)) is None:
+        raise self.retry(countdown=IMPORT_LOCK_RETRY_DELAY)
+
 @celery.task
 def send_monthly_reports():
     """Celery task which sends monthly benchmarking reports
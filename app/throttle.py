@@ -0,0 +1,547 @@
+"""This module controls how hard we push the MailChimp API."""
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import weakref
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from aiohttp import ClientTimeout
+from app.localstate import local_state_path, load_json_state, save_json_state
+
+# File locks aren't available on every platform, e.g. windows
+# There, the token bucket is only enforced within each process
+try:
+    import fcntl
+except ImportError: # pragma: no cover
+    fcntl = None
+
+class AIMDController(): # pylint: disable=too-many-instance-attributes
+    """Tunes request concurrency and page size while an import runs.
+
+    Uses additive-increase/multiplicative-decrease: every fast response
+    nudges the limits up a little, while congestion (a throttling status
+    code or a dropped request) halves the number of requests in flight and
+    slow responses halve the page size. The controller doubles as the async
+    context manager which limits the number of requests in flight.
+    """
+
+    # The http status codes which indicate MailChimp is overloaded
+    CONGESTION_STATUS_CODES = (429, 504)
+
+    # The factor applied to a limit on a multiplicative decrease
+    DECREASE_FACTOR = 0.5
+
+    def __init__(self, concurrency, chunk_size=None, # pylint: disable=too-many-arguments
+                 min_concurrency=1, max_concurrency=8,
+                 min_chunk_size=1000, max_chunk_size=10000,
+                 chunk_step=1000, target_latency=15,
+                 data_center=None, phase=None):
+        """Initializes a controller.
+
+        Args:
+            concurrency: the initial number of requests allowed in flight.
+            chunk_size: the initial page size. None if the requests this
+                controller governs aren't paginated.
+            min_concurrency: the lowest concurrency we'll back off to.
+            max_concurrency: the highest concurrency we'll grow to.
+            min_chunk_size: the smallest page size we'll back off to.
+            max_chunk_size: the largest page size we'll grow to.
+            chunk_step: how much to grow the page size after a fast response.
+            target_latency: the number of seconds a request should take.
+                Responses slower than this shrink the page size.
+            data_center: the MailChimp data center the tuned state is
+                saved under, e.g. 'us2'.
+            phase: the import phase the controller governs, e.g. 'members'.
+
+        Other class variables:
+            in_flight: the number of requests currently holding a slot.
+            last_decrease: the loop time of the last multiplicative
+                decrease. Used to avoid halving repeatedly for a single
+                congestion event.
+        """
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.chunk_step = chunk_step
+        self.target_latency = target_latency
+        self.data_center = data_center
+        self.phase = phase
+        self.in_flight = 0
+        self.last_decrease = None
+        self._concurrency = float(concurrency)
+        self._chunk_size = chunk_size
+        self._waiters = deque()
+        self._clamp()
+
+    @property
+    def concurrency(self):
+        """The number of requests currently allowed in flight."""
+        return int(self._concurrency)
+
+    @property
+    def chunk_size(self):
+        """The page size to use for the next paginated request."""
+        return self._chunk_size
+
+    def _clamp(self):
+        """Keeps the limits within their configured bounds."""
+        self._concurrency = min(max(self._concurrency, self.min_concurrency),
+                                self.max_concurrency)
+        if self._chunk_size is not None:
+            self._chunk_size = int(min(max(self._chunk_size,
+                                           self.min_chunk_size),
+                                       self.max_chunk_size))
+
+    def _wake_waiters(self):
+        """Wakes up as many waiting requests as there are free slots."""
+        free_slots = self.concurrency - self.in_flight
+        while free_slots > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+    async def acquire(self):
+        """Waits for a free request slot and takes it."""
+        while self.in_flight >= self.concurrency:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self):
+        """Frees a request slot."""
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.release()
+
+    def _should_decrease(self):
+        """Returns True if enough time has passed since the last decrease.
+
+        Requests which were already in flight when we backed off will
+        often report the same congestion event, so we only decrease
+        once per target_latency seconds.
+        """
+        now = asyncio.get_event_loop().time()
+        if (self.last_decrease is not None and
+                now - self.last_decrease < self.target_latency):
+            return False
+        self.last_decrease = now
+        return True
+
+    def record(self, latency, status=None):
+        """Adjusts the limits based on the outcome of a single request.
+
+        Args:
+            latency: the number of seconds the request took.
+            status: the http status code of the response, or None if no
+                response was received (e.g. a timeout or disconnect).
+        """
+        if status is None or status in self.CONGESTION_STATUS_CODES:
+            if self._should_decrease():
+                self._concurrency *= self.DECREASE_FACTOR
+                if self._chunk_size is not None:
+                    self._chunk_size *= self.DECREASE_FACTOR
+        elif status == 200:
+            if latency <= self.target_latency:
+
+                # Add roughly one slot per window of successful requests
+                self._concurrency += 1 / max(self._concurrency, 1)
+                if self._chunk_size is not None:
+                    self._chunk_size += self.chunk_step
+            elif self._chunk_size is not None and self._should_decrease():
+                self._chunk_size *= self.DECREASE_FACTOR
+        self._clamp()
+        self._wake_waiters()
+
+    def get_state(self):
+        """Returns the tuned limits as a dictionary."""
+        return {'concurrency': self._concurrency,
+                'chunk_size': self._chunk_size}
+
+    @staticmethod
+    def state_path(data_center):
+        """Returns the path of the tuned state file for a data center."""
+        return local_state_path('throttle', '{}.json'.format(data_center))
+
+    @classmethod
+    def load(cls, data_center, phase, concurrency, chunk_size=None,
+             **kwargs):
+        """Creates a controller starting from the last saved tuned state.
+
+        Args:
+            data_center: the MailChimp data center, e.g. 'us2'.
+            phase: the import phase the controller governs, e.g. 'members'.
+            concurrency: the concurrency to use if nothing was saved.
+            chunk_size: the page size to use if nothing was saved.
+            kwargs: passed to the constructor.
+
+        Returns:
+            An AIMDController.
+        """
+        saved_state = load_json_state(cls.state_path(data_center), {})
+        phase_state = saved_state.get(phase) or {}
+        return cls(
+            phase_state.get('concurrency', concurrency),
+            (phase_state.get('chunk_size') or chunk_size
+             if chunk_size is not None else None),
+            data_center=data_center, phase=phase, **kwargs)
+
+    def save(self):
+        """Saves the tuned state so the next import can start from it."""
+        path = self.state_path(self.data_center)
+        saved_state = load_json_state(path, {})
+        saved_state[self.phase] = self.get_state()
+        save_json_state(path, saved_state)
+
+class TokenBucketLimiter(): # pylint: disable=too-many-instance-attributes
+    """A token bucket shared by every worker process on a node.
+
+    MailChimp's limits apply per API key, while each import only limits
+    itself. The bucket for a given API key and data center lives in a
+    locked file, so imports running in different Celery workers draw from
+    the same tokens before sending a request. Pointing IMPORT_STATE_DIR at
+    storage shared between nodes extends the limit across nodes.
+    MailChimp also limits each API key to a number of simultaneous
+    connections, so the same file holds a lease for each request in
+    flight. Requests wait until fewer than max_connections leases are
+    held by all processes together.
+    """
+
+    # How long a connection lease is held before it's assumed the process
+    # holding it died, and the lease is broken, in seconds
+    LEASE_TIMEOUT = 300
+
+    # How often to check for a free connection lease, in seconds
+    LEASE_POLL_INTERVAL = 0.1
+
+    # The connection slots of each bucket file, by event loop
+    # These keep a process's own requests from polling for leases
+    # An asyncio semaphore only works on the loop it was created on
+    _connection_slots = weakref.WeakKeyDictionary()
+
+    def __init__(self, api_key, data_center, rate, capacity, # pylint: disable=too-many-arguments
+                 max_connections=None, batch_size=1):
+        """Initializes a limiter.
+
+        Args:
+            api_key: the MailChimp api key the bucket is shared by.
+            data_center: the data center the requests are made to.
+            rate: the number of tokens added to the bucket per second.
+            capacity: the maximum number of tokens the bucket holds, i.e.
+                the largest burst of requests allowed.
+            max_connections: the most requests using the api key allowed
+                in flight at once, across every process. None for no limit.
+            batch_size: the number of tokens taken from the bucket at once.
+                Larger batches lock the bucket file less often, but let a
+                process get up to a batch ahead of the others.
+
+        Other class variables:
+            reserved_tokens: the number of tokens taken from the bucket
+                which no request has used yet.
+            refill_lock: an asyncio lock held while taking tokens, so only
+                one request at a time takes a batch. Created when needed.
+            leases: the ids of the connection leases this limiter holds.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.max_connections = max_connections
+        self.batch_size = batch_size
+        self.reserved_tokens = 0
+        self.refill_lock = None
+        self.leases = []
+
+        # Don't write api keys to disk in plain text
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+        self.path = local_state_path(
+            'ratelimit', '{}-{}.json'.format(key_hash, data_center))
+
+    def update_bucket(self, update, now=None):
+        """Updates the bucket while holding its file lock.
+
+        The bucket is refilled for the time elapsed since it was last
+        updated, and leases past LEASE_TIMEOUT are broken, first.
+
+        Args:
+            update: a function which takes the bucket dictionary and the
+                current time, modifies the bucket in place and returns a
+                result.
+            now: the current unix time. Defaults to time.time().
+
+        Returns:
+            Whatever update returned.
+        """
+        now = time.time() if now is None else now
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            if fcntl:
+                fcntl.flock(descriptor, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(descriptor), 'r+') as bucket_file:
+                try:
+                    bucket = json.loads(bucket_file.read())
+                except ValueError:
+                    bucket = {'tokens': self.capacity, 'updated': now}
+
+                # Refill the bucket for the time elapsed since it was used
+                bucket['tokens'] = min(self.capacity, bucket['tokens'] + max(
+                    now - bucket['updated'], 0) * self.rate)
+                bucket['updated'] = now
+
+                # Break the leases of processes which died holding them
+                bucket['leases'] = {
+                    lease_id: expires_at for lease_id, expires_at
+                    in bucket.get('leases', {}).items() if expires_at > now}
+
+                result = update(bucket, now)
+
+                bucket_file.seek(0)
+                bucket_file.truncate()
+                bucket_file.write(json.dumps(bucket))
+        finally:
+            os.close(descriptor)
+        return result
+
+    def take_tokens(self, count=1, now=None):
+        """Tries to take tokens from the bucket.
+
+        Args:
+            count: the most tokens to take.
+            now: the current unix time. Defaults to time.time().
+
+        Returns:
+            A tuple of the number of tokens taken and, if none were, the
+            number of seconds to wait before a token becomes available.
+        """
+        def take(bucket, now): # pylint: disable=unused-argument
+            taken = int(min(count, bucket['tokens']))
+            bucket['tokens'] -= taken
+            return taken, 0 if taken else (1 - bucket['tokens']) / self.rate
+        return self.update_bucket(take, now)
+
+    def take_lease(self, lease_id, now=None):
+        """Tries to lease one of the api key's connections.
+
+        Args:
+            lease_id: a unique id for the lease.
+            now: the current unix time. Defaults to time.time().
+
+        Returns:
+            True if the connection was leased.
+        """
+        def lease(bucket, now):
+            if len(bucket['leases']) >= self.max_connections:
+                return False
+            bucket['leases'][lease_id] = now + self.LEASE_TIMEOUT
+            return True
+        return self.update_bucket(lease, now)
+
+    def return_lease(self, lease_id, now=None):
+        """Returns a connection lease, so another request can take it.
+
+        Args:
+            lease_id: the id the connection was leased with.
+            now: the current unix time. Defaults to time.time().
+        """
+        self.update_bucket(
+            lambda bucket, now: bucket['leases'].pop(lease_id, None), now)
+
+    def get_connection_slots(self):
+        """Returns the semaphore limiting the api key's connections on the
+        current event loop, or None if they aren't limited."""
+        if self.max_connections is None:
+            return None
+        loop_slots = self._connection_slots.setdefault(
+            asyncio.get_event_loop(), {})
+        if self.path not in loop_slots:
+            loop_slots[self.path] = asyncio.Semaphore(self.max_connections)
+        return loop_slots[self.path]
+
+    async def take_token(self):
+        """Waits until a token can be taken from the bucket, and takes it.
+
+        Tokens are taken batch_size at a time. The bucket file is locked
+        and read in the event loop's default executor, so waiting for
+        other processes to release it doesn't block the loop.
+        """
+        if self.refill_lock is None:
+            self.refill_lock = asyncio.Lock()
+        async with self.refill_lock:
+            while not self.reserved_tokens:
+                taken, wait = await asyncio.get_event_loop().run_in_executor(
+                    None, self.take_tokens, self.batch_size)
+                self.reserved_tokens += taken
+                if wait:
+                    await asyncio.sleep(wait)
+            self.reserved_tokens -= 1
+
+    async def take_connection(self):
+        """Waits until one of the api key's connections can be leased, and
+        leases it. The bucket file is locked in the default executor."""
+        lease_id = uuid.uuid4().hex
+        while not await asyncio.get_event_loop().run_in_executor(
+                None, self.take_lease, lease_id):
+            await asyncio.sleep(self.LEASE_POLL_INTERVAL)
+        self.leases.append(lease_id)
+
+    async def acquire(self):
+        """Waits for a connection lease, then for a token.
+
+        Every call must be followed by a call to release(), e.g. in a
+        finally clause.
+        """
+        connection_slots = self.get_connection_slots()
+        if connection_slots is None:
+            await self.take_token()
+            return
+        await connection_slots.acquire()
+        try:
+            await self.take_connection()
+        except:
+            connection_slots.release()
+            raise
+        try:
+            await self.take_token()
+        except:
+            await self.release()
+            raise
+
+    async def release(self):
+        """Returns the connection lease taken by acquire()."""
+        connection_slots = self.get_connection_slots()
+        if connection_slots is None:
+            return
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.return_lease, self.leases.pop())
+        finally:
+            connection_slots.release()
+
+class RetryPolicy():
+    """Decides whether, and after how long, a failed request is retried.
+
+    Backs off using decorrelated jitter, so retries from different workers
+    spread out instead of arriving in synchronized waves. A Retry-After
+    header sent by MailChimp sets the minimum wait. Each attempt is bounded
+    by separate connect and read timeouts, and every request made under the
+    policy shares an overall deadline, after which nothing is retried.
+    """
+
+    def __init__(self, max_retries=3, base_delay=5, max_delay=125, # pylint: disable=too-many-arguments
+                 max_retry_after=300, connect_timeout=15, read_timeout=120,
+                 deadline=None):
+        """Initializes a policy.
+
+        Args:
+            max_retries: the number of times a single request is retried.
+            base_delay: the shortest backoff, in seconds.
+            max_delay: the longest backoff, in seconds.
+            max_retry_after: the longest Retry-After, in seconds, we're
+                willing to wait. Longer values are capped.
+            connect_timeout: the number of seconds allowed to establish a
+                connection.
+            read_timeout: the number of seconds allowed between reads from
+                the connection.
+            deadline: the number of seconds from now which every request
+                must complete within. None for no deadline.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = (None if deadline is None
+                         else time.monotonic() + deadline)
+
+    def remaining(self):
+        """Returns the number of seconds left before the deadline.
+
+        Returns None if there's no deadline.
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def expired(self):
+        """Returns True if the deadline has passed."""
+        return self.remaining() == 0
+
+    def get_timeout(self):
+        """Returns the aiohttp ClientTimeout to make an attempt with."""
+        return ClientTimeout(total=self.remaining(),
+                             connect=self.connect_timeout,
+                             sock_read=self.read_timeout)
+
+    @staticmethod
+    def parse_retry_after(value, now=None):
+        """Parses a Retry-After header.
+
+        Args:
+            value: the header value, either a number of seconds or an http
+                date. None if the header wasn't sent.
+            now: the current datetime. Defaults to datetime.now().
+
+        Returns:
+            The number of seconds to wait, or None if the header is missing
+            or can't be parsed.
+        """
+        if not isinstance(value, str):
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        now = now or datetime.now(timezone.utc)
+        return max((retry_at - now).total_seconds(), 0)
+
+    def get_delay(self, previous_delay=None, retry_after=None):
+        """Calculates how long to wait before the next attempt.
+
+        Args:
+            previous_delay: the delay before the previous attempt, or None
+                if this is the first retry.
+            retry_after: the Retry-After header of the failed attempt's
+                response, if any.
+
+        Returns:
+            The number of seconds to wait.
+        """
+        delay = min(self.max_delay, random.uniform(
+            self.base_delay, (previous_delay or self.base_delay) * 3))
+        retry_after = self.parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+    def should_retry(self, retries, delay):
+        """Returns True if a request should be attempted again.
+
+        Args:
+            retries: the number of times the request was already retried.
+            delay: the number of seconds we'd wait before retrying.
+        """
+        remaining = self.remaining()
+        return (retries < self.max_retries and
+                (remaining is None or delay < remaining))
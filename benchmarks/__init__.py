@@ -0,0 +1 @@
+"""Tools for load testing and benchmarking list imports without MailChimp."""
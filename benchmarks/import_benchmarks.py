@@ -0,0 +1,417 @@
+"""Benchmarks importing and analyzing lists of different sizes.
+
+Serves a synthetic list of each size from the MailChimp stand-in, run in
+a subprocess so it doesn't skew the measurements, and analyzes each list
+with import_analyze_store_list(). The wall time, requests per second,
+peak RSS and CPU time of each phase of the analysis are written as json:
+member import, activity import, flatten(), each calc_* method, the
+database commit and the snapshot.
+
+Members' activity is prefetched while members are still being imported.
+The import phase spans both imports and the prefetch, so it's longer than
+the two together.
+
+    python -m benchmarks.import_benchmarks --sizes 1000,10000 \\
+        --output results.json
+
+Passing a previous run's results as --baseline reports every phase which
+got slower or used more memory, and exits with status 1 if any did.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from unittest import mock
+from datetime import datetime, timezone
+from contextlib import contextmanager, ExitStack
+from collections import OrderedDict
+import psutil
+import iso8601
+import requests
+
+# The api key lists are requested with. The stand-in accepts any key
+API_KEY = 'benchmarks-us1'
+
+# The MailChimpList methods timed as phases, in the order they start
+# The import phase spans the member and activity imports, and the activity
+# Prefetched in between
+LIST_PHASES = (
+    ('import_list', 'import'),
+    ('import_list_members_incremental', 'import_members'),
+    ('import_sub_activity', 'import_activity'),
+    ('import_sampled_activity', 'import_activity'),
+    ('flatten', 'flatten'),
+    ('calc_list_breakdown', 'calc_list_breakdown'),
+    ('calc_open_rate', 'calc_open_rate'),
+    ('calc_frequency', 'calc_frequency'),
+    ('calc_histogram', 'calc_histogram'),
+    ('calc_high_open_rate_pct', 'calc_high_open_rate_pct'),
+    ('calc_cur_yr_stats', 'calc_cur_yr_stats'),
+)
+
+# The ListStats fields reported with each result, to spot runs which
+# Computed something different
+RESULT_FIELDS = ('subscribers', 'open_rate', 'subscribed_pct',
+                 'unsubscribed_pct', 'cleaned_pct', 'pending_pct',
+                 'high_open_rt_pct', 'cur_yr_inactive_pct')
+
+# Phases are only reported as slower if they also took this many seconds
+# Longer, so noise in very short phases is ignored
+MIN_REGRESSION_SECONDS = 0.05
+
+class RssSampler(threading.Thread):
+    """Samples the process's resident set size in the background, keeping
+    the peak."""
+
+    # The number of seconds between samples
+    SAMPLE_INTERVAL = 0.01
+
+    def __init__(self, process):
+        """Initializes a sampler.
+
+        Args:
+            process: the psutil Process to sample.
+        """
+        super().__init__(daemon=True)
+        self.process = process
+        self.peak_rss = process.memory_info().rss
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def stop(self):
+        """Stops sampling and returns the peak RSS in bytes."""
+        self.stopped.set()
+        self.join()
+        return max(self.peak_rss, self.process.memory_info().rss)
+
+class PhaseRecorder():
+    """Records the resources used by each phase of an analysis."""
+
+    def __init__(self, count_requests):
+        """Initializes a recorder.
+
+        Args:
+            count_requests: a function returning the number of requests
+                made so far.
+        """
+        self.count_requests = count_requests
+        self.process = psutil.Process()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        """Records a phase's wall time, CPU time, requests and peak RSS."""
+        sampler = RssSampler(self.process)
+        sampler.start()
+        requests_before = self.count_requests()
+        cpu_before = self.process.cpu_times()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start_time
+            cpu_after = self.process.cpu_times()
+            request_count = self.count_requests() - requests_before
+            self.phases.append(OrderedDict([
+                ('name', name),
+                ('wall_time', wall_time),
+                ('cpu_time', (cpu_after.user - cpu_before.user) +
+                             (cpu_after.system - cpu_before.system)),
+                ('requests', request_count),
+                ('requests_per_second',
+                 request_count / wall_time if wall_time else 0),
+                ('peak_rss_mb', sampler.stop() / (1024 * 1024))]))
+
+    def wrap(self, name, function):
+        """Returns a version of a function which records a phase each time
+        it's called."""
+        if asyncio.iscoroutinefunction(function):
+            async def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return await function(*args, **kwargs)
+        else:
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+        return wrapper
+
+def find_free_port():
+    """Returns a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=300):
+    """Waits until a local TCP port accepts connections.
+
+    Throws:
+        RuntimeError: the port didn't open within the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise RuntimeError('The stand-in did not start in time.')
+            time.sleep(0.1)
+
+@contextmanager
+def run_standin(sizes, standin_args):
+    """Runs the MailChimp stand-in in a subprocess.
+
+    Args:
+        sizes: the sizes of the lists to serve.
+        standin_args: extra command line arguments for the stand-in.
+
+    Yields:
+        The stand-in's base url and the ids of its lists, in the order of
+        the sizes.
+    """
+    port = find_free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-u', '-m', 'benchmarks.mailchimp_standin',
+         '--port', str(port), '--lists', ','.join(str(size) for size in sizes),
+         *standin_args],
+        stdout=subprocess.PIPE, universal_newlines=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        list_ids = []
+        for line in process.stdout:
+            match = re.match(r'List (\w+): \d+ members', line)
+            if match:
+                list_ids.append(match.group(1))
+            if len(list_ids) == len(sizes):
+                break
+        wait_for_port(port)
+        yield 'http://127.0.0.1:{}/3.0'.format(port), list_ids
+    finally:
+        process.terminate()
+        process.wait()
+
+def configure_environment(state_dir, base_url):
+    """Points the app at the stand-in and at scratch storage.
+
+    Must be called before the app is imported, as its configuration is
+    read on import.
+    """
+    os.environ.update({
+        'MAILCHIMP_API_BASE': base_url,
+        'NO_PROXY': 'True',
+        'NO_EMAIL': 'True',
+        'IMPORT_STATE_DIR': os.path.join(state_dir, 'import_state'),
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(
+            os.path.join(state_dir, 'benchmarks.db'))})
+    os.environ.setdefault('SECRET_KEY', 'benchmarks')
+    os.environ.pop('RESPONSE_CACHE_MB', None)
+
+def benchmark_list(base_url, list_id, rate_limit=None):
+    """Analyzes a list from the stand-in, recording each phase.
+
+    Args:
+        base_url: the stand-in's base url.
+        list_id: the id of the list.
+        rate_limit: the requests per second allowed per api key. Defaults
+            to MailChimpList.API_KEY_RATE_LIMIT.
+
+    Returns:
+        A dictionary of the list's size, analysis results, fetch metadata
+        and phases.
+    """
+    from app import db, tasks # pylint: disable=cyclic-import
+    from app.lists import MailChimpList
+    from app.sessions import SESSION_MANAGER
+
+    response = requests.get('{}/lists/{}'.format(base_url, list_id),
+                            auth=('shorenstein', API_KEY))
+    response.raise_for_status()
+    list_info = response.json()
+    list_stats = list_info['stats']
+    list_data = {
+        'list_id': list_id,
+        'list_name': list_info['name'],
+        'key': API_KEY,
+        'data_center': API_KEY.rsplit('-', 1)[1],
+        'monthly_updates': False,
+        'store_aggregates': True,
+        'total_count': (list_stats['member_count'] +
+                        list_stats['unsubscribe_count'] +
+                        list_stats['cleaned_count']),
+        'open_rate': list_stats['open_rate'],
+        'creation_timestamp': iso8601.parse_date(
+            list_info['date_created']).replace(tzinfo=None),
+        'campaign_count': list_stats['campaign_count']}
+
+    recorder = PhaseRecorder(
+        lambda: SESSION_MANAGER.get_stats().get('requests', 0))
+    mailing_lists = []
+    original_init = MailChimpList.__init__
+
+    def init_and_keep(mailing_list, *args, **kwargs):
+        original_init(mailing_list, *args, **kwargs)
+        mailing_lists.append(mailing_list)
+
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(
+            MailChimpList, '__init__', init_and_keep))
+        if rate_limit is not None:
+            stack.enter_context(mock.patch.object(
+                MailChimpList, 'API_KEY_RATE_LIMIT', rate_limit))
+            stack.enter_context(mock.patch.object(
+                MailChimpList, 'API_KEY_BURST', max(rate_limit, 1)))
+        for attribute, name in LIST_PHASES:
+            stack.enter_context(mock.patch.object(
+                MailChimpList, attribute,
+                recorder.wrap(name, getattr(MailChimpList, attribute))))
+        stack.enter_context(mock.patch.object(
+            db.session, 'commit', recorder.wrap('db_commit', db.session.commit)))
+        stack.enter_context(mock.patch.object(
+            tasks, 'save_snapshot',
+            recorder.wrap('save_snapshot', tasks.save_snapshot)))
+        with recorder.phase('total'):
+            result = tasks.import_analyze_store_list(list_data, None)
+
+    return OrderedDict([
+        ('list_id', list_id),
+        ('members', mailing_lists[0].fetch_metadata['members']),
+        ('results', OrderedDict(
+            (field, getattr(result, field)) for field in RESULT_FIELDS)),
+        ('fetch_metadata', mailing_lists[0].fetch_metadata),
+        ('phases', recorder.phases)])
+
+def run_benchmarks(sizes, standin_args, rate_limit=None):
+    """Benchmarks the analysis of a list of each size.
+
+    Args:
+        sizes: the list sizes to benchmark.
+        standin_args: see run_standin().
+        rate_limit: see benchmark_list().
+
+    Returns:
+        A json-serializable dictionary of the results.
+    """
+    with tempfile.TemporaryDirectory() as state_dir, run_standin(
+            sizes, standin_args) as (base_url, list_ids):
+        configure_environment(state_dir, base_url)
+        from app import app, db # pylint: disable=cyclic-import
+        with app.app_context():
+            db.create_all()
+            lists = []
+            for size, list_id in zip(sizes, list_ids):
+                result = benchmark_list(base_url, list_id, rate_limit)
+                result['size'] = size
+                lists.append(result)
+            db.session.remove()
+
+    return OrderedDict([
+        ('run_at', datetime.now(timezone.utc).isoformat()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('cpu_count', os.cpu_count()),
+        ('standin_args', standin_args),
+        ('rate_limit', rate_limit),
+        ('lists', lists)])
+
+def compare_results(baseline, results, tolerance):
+    """Finds the phases which got slower or used more memory than in a
+    baseline run.
+
+    Args:
+        baseline: the results of the baseline run.
+        results: the results of this run.
+        tolerance: the relative increase allowed, e.g. 0.2 for 20%.
+
+    Returns:
+        A list of descriptions of the regressions.
+    """
+    baseline_phases = {
+        (mailing_list['size'], phase['name']): phase
+        for mailing_list in baseline['lists']
+        for phase in mailing_list['phases']}
+    regressions = []
+    for mailing_list in results['lists']:
+        for phase in mailing_list['phases']:
+            baseline_phase = baseline_phases.get(
+                (mailing_list['size'], phase['name']))
+            if baseline_phase is None:
+                continue
+            if (phase['wall_time'] > baseline_phase['wall_time'] * (
+                    1 + tolerance) and phase['wall_time'] -
+                    baseline_phase['wall_time'] >= MIN_REGRESSION_SECONDS):
+                regressions.append(
+                    '{} ({} members): {:.3f}s, was {:.3f}s'.format(
+                        phase['name'], mailing_list['size'],
+                        phase['wall_time'], baseline_phase['wall_time']))
+            if phase['peak_rss_mb'] > baseline_phase['peak_rss_mb'] * (
+                    1 + tolerance):
+                regressions.append(
+                    '{} ({} members): {:.1f} MB peak RSS, was {:.1f} MB'.format(
+                        phase['name'], mailing_list['size'],
+                        phase['peak_rss_mb'], baseline_phase['peak_rss_mb']))
+    return regressions
+
+def main(argv=None):
+    """Runs the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma-separated list sizes to benchmark')
+    parser.add_argument('--output', default='-',
+                        help='where to write the json results')
+    parser.add_argument('--baseline',
+                        help='json results of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown allowed against the baseline')
+    parser.add_argument('--rate-limit', type=float,
+                        help='requests per second allowed per api key')
+    parser.add_argument('--campaigns', default='52',
+                        help='campaigns sent to each list in the past year')
+    parser.add_argument('--seed', default='0')
+    parser.add_argument('--latency', default='0')
+    parser.add_argument('--latency-sigma', default='0')
+    parser.add_argument('--latency-per-item', default='0')
+    parser.add_argument('--error-429-rate', default='0')
+    parser.add_argument('--error-504-rate', default='0')
+    parser.add_argument('--disconnect-rate', default='0')
+    args = parser.parse_args(argv)
+
+    standin_args = [
+        '--campaigns', args.campaigns, '--seed', args.seed,
+        '--latency', args.latency, '--latency-sigma', args.latency_sigma,
+        '--latency-per-item', args.latency_per_item,
+        '--error-429-rate', args.error_429_rate,
+        '--error-504-rate', args.error_504_rate,
+        '--disconnect-rate', args.disconnect_rate]
+    results = run_benchmarks(
+        [int(size) for size in args.sizes.split(',')], standin_args,
+        args.rate_limit)
+
+    output = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(
+                json.load(baseline_file), results, args.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
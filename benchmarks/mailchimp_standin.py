@@ -0,0 +1,695 @@
+"""A local stand-in for the parts of the MailChimp 3.0 API the app uses.
+
+Serves deterministic synthetic lists of any size, generated from a seed,
+from the endpoints a list import requests: /lists, /lists/{id}, the
+members and member activity endpoints, and the campaigns, open-details
+reports and batch operations used to import activity in bulk. Latency,
+429 and 504 responses, dropped connections and MailChimp's cap on
+simultaneous connections per api key can all be simulated.
+
+Start it with e.g.
+
+    python -m benchmarks.mailchimp_standin --lists 1000,100000 --port 8080
+
+and point the app at it by setting MAILCHIMP_API_BASE to
+http://127.0.0.1:8080/3.0 and NO_PROXY to True. Any api key with a data
+center, e.g. 'standin-us1', is accepted.
+"""
+import io
+import re
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import tarfile
+import argparse
+from collections import Counter, OrderedDict
+import numpy as np
+import iso8601
+from aiohttp import web, BasicAuth
+
+# Seconds in a day and in a year
+DAY = 24 * 60 * 60
+YEAR = 365 * DAY
+
+# The largest member id, plus one. Ids are 128-bit, like md5 hashes
+ID_MODULUS = 1 << 128
+
+# Scrambles member positions into md5-like ids. It's odd, so it has an
+# inverse modulo ID_MODULUS which turns ids back into positions
+ID_MULTIPLIER = 0x9e3779b97f4a7c15f39cc0605cedc835
+
+def invert_multiplier(multiplier, modulus):
+    """Returns the inverse of an odd number modulo a power of two.
+
+    Each Newton iteration doubles the number of correct low bits.
+    """
+    inverse = multiplier
+    for _ in range(7):
+        inverse = inverse * (2 - multiplier * inverse) % modulus
+    return inverse
+
+ID_INVERSE = invert_multiplier(ID_MULTIPLIER, ID_MODULUS)
+
+def format_time(unix_time):
+    """Formats a unix time the way MailChimp formats timestamps."""
+    return time.strftime('%Y-%m-%dT%H:%M:%S+00:00',
+                         time.gmtime(int(unix_time)))
+
+def parse_time(timestamp):
+    """Returns the unix time of an ISO 8601 timestamp."""
+    return iso8601.parse_date(timestamp).timestamp()
+
+def select_fields(body, fields=None, exclude_fields=None):
+    """Filters a response body like MailChimp's fields parameters do.
+
+    Args:
+        body: the response body.
+        fields: a comma-separated list of dotted paths to keep, e.g.
+            'members.id,total_items'. Optional.
+        exclude_fields: a comma-separated list of dotted paths to drop.
+            Optional.
+
+    Returns:
+        The filtered body.
+    """
+    def make_tree(paths):
+        tree = {}
+        for path in paths.split(','):
+            node = tree
+            for part in path.strip().split('.'):
+                node = node.setdefault(part, {})
+        return tree
+
+    def keep(value, tree):
+        if not tree:
+            return value
+        if isinstance(value, list):
+            return [keep(item, tree) for item in value]
+        if not isinstance(value, dict):
+            return value
+        return {key: keep(value[key], subtree)
+                for key, subtree in tree.items() if key in value}
+
+    def drop(value, tree):
+        if isinstance(value, list):
+            return [drop(item, tree) for item in value]
+        if not isinstance(value, dict):
+            return value
+        return {key: drop(item, tree[key]) if tree.get(key) else item
+                for key, item in value.items()
+                if key not in tree or tree[key]}
+
+    if fields:
+        body = keep(body, make_tree(fields))
+    if exclude_fields:
+        body = drop(body, make_tree(exclude_fields))
+    return body
+
+def day_start(unix_time):
+    """Returns the unix time of midnight UTC on the day of a unix time."""
+    return int(unix_time) // DAY * DAY
+
+class SyntheticList(): # pylint: disable=too-many-instance-attributes
+    """A synthetic MailChimp list, generated deterministically from a seed.
+
+    Members are generated as numpy columns rather than dicts, so even lists
+    of millions of members stay small. Each member's id encodes their
+    position in the list, so activity can be looked up without an index.
+    Every member who opened a campaign in the past year last opened one
+    of the list's campaigns, so the activity endpoint and the campaign
+    reports agree.
+    """
+
+    # Member statuses, and the share of members with each
+    STATUSES = ('subscribed', 'unsubscribed', 'cleaned', 'pending')
+    STATUS_WEIGHTS = (0.8, 0.12, 0.06, 0.02)
+
+    # Members signed up at most this many days before the anchor time
+    SIGNUP_DAYS = 5 * 365
+
+    # Members' chance of a recent open grows with their open rate over
+    # At most this many campaigns
+    OPEN_CHANCES = 12
+
+    # The values of last_campaign for members who last opened over a year
+    # Ago, and for members who never opened
+    OLD_OPEN = -1
+    NEVER_OPENED = -2
+
+    def __init__(self, list_id, size, seed, campaign_count=52, anchor=None): # pylint: disable=too-many-arguments
+        """Generates a list.
+
+        Args:
+            list_id: the list's id.
+            size: the number of members, of any status.
+            seed: the random seed the members are generated from.
+            campaign_count: the number of campaigns sent to the list in
+                the past year, evenly spaced.
+            anchor: the unix time campaigns and opens are relative to.
+                Defaults to midnight UTC today, so a list is the same all
+                day.
+
+        Class variables:
+            statuses: each member's index in STATUSES.
+            open_rates, click_rates: each member's average rates.
+            signup_times, opt_times: when each member signed up and opted
+                in, as unix times.
+            campaign_times: when each campaign was sent, most recent
+                first.
+            last_campaign: the index of the campaign each member last
+                opened, or OLD_OPEN or NEVER_OPENED.
+            last_open_times: when each member last opened, or 0.
+        """
+        self.list_id = list_id
+        self.size = size
+        self.campaign_count = campaign_count
+        self.anchor = anchor or day_start(time.time())
+        self.id_mask = int(hashlib.md5(
+            list_id.encode('utf-8')).hexdigest(), 16)
+        rng = np.random.RandomState(seed)
+
+        # Member statuses, rates, and signup times
+        self.statuses = rng.choice(
+            len(self.STATUSES), size, p=self.STATUS_WEIGHTS).astype(np.int8)
+        self.open_rates = np.round(rng.beta(2, 5, size), 2)
+        self.click_rates = np.round(self.open_rates * rng.beta(1, 9, size), 2)
+        self.signup_times = self.anchor - rng.randint(
+            DAY, self.SIGNUP_DAYS * DAY, size)
+        self.opt_times = self.signup_times + rng.randint(0, 60 * 60, size)
+
+        # Campaigns are sent evenly over the past year
+        interval = YEAR / max(campaign_count, 1)
+        self.campaign_times = (self.anchor - interval * (
+            np.arange(campaign_count) + 0.5)).astype(np.int64)
+
+        # Members with higher open rates are likelier to have opened one
+        # Of the campaigns. Some others last opened over a year ago
+        recent = rng.random_sample(size) < (1 - (1 - self.open_rates) ** min(
+            campaign_count, self.OPEN_CHANCES))
+        recent &= campaign_count > 0
+        old = ~recent & (self.open_rates > 0) & (rng.random_sample(size) < .5)
+        self.last_campaign = np.full(size, self.NEVER_OPENED, dtype=np.int32)
+        self.last_campaign[old] = self.OLD_OPEN
+        self.last_campaign[recent] = rng.randint(
+            0, max(campaign_count, 1), size)[recent]
+        self.last_open_times = np.zeros(size, dtype=np.int64)
+        self.last_open_times[recent] = (
+            self.campaign_times[self.last_campaign[recent]] +
+            rng.randint(60, DAY, size)[recent])
+        self.last_open_times[old] = self.anchor - rng.randint(
+            YEAR + DAY, 2 * YEAR, size)[old]
+
+        # The members who last opened each campaign, found when requested
+        self.campaign_openers = {}
+
+    def member_id(self, position):
+        """Returns the id of the member at a position."""
+        return '{:032x}'.format(
+            (position + 1) * ID_MULTIPLIER % ID_MODULUS ^ self.id_mask)
+
+    def member_position(self, member_id):
+        """Returns the position of the member with an id, or None."""
+        try:
+            scrambled = int(member_id, 16) ^ self.id_mask
+        except ValueError:
+            return None
+        position = scrambled * ID_INVERSE % ID_MODULUS - 1
+        return position if 0 <= position < self.size else None
+
+    def member(self, position):
+        """Returns a member as the members endpoint does."""
+        return {
+            'id': self.member_id(position),
+            'email_address': 'member{}@{}.example.com'.format(
+                position, self.list_id),
+            'status': self.STATUSES[self.statuses[position]],
+            'timestamp_signup': format_time(self.signup_times[position]),
+            'timestamp_opt': format_time(self.opt_times[position]),
+            'last_changed': format_time(self.opt_times[position]),
+            'stats': {
+                'avg_open_rate': float(self.open_rates[position]),
+                'avg_click_rate': float(self.click_rates[position])},
+            'list_id': self.list_id}
+
+    def members(self, offset, count, since=None):
+        """Returns a page of members as the members endpoint does.
+
+        Args:
+            offset: the position of the page's first member.
+            count: the number of members in the page.
+            since: only members changed after this unix time are paged
+                through, if given.
+        """
+        if since is None:
+            positions = range(offset, min(offset + count, self.size))
+            total_items = self.size
+        else:
+            changed = np.flatnonzero(self.opt_times > since)
+            positions = changed[offset:offset + count]
+            total_items = len(changed)
+        return {'members': [self.member(position) for position in positions],
+                'list_id': self.list_id,
+                'total_items': total_items}
+
+    def activity(self, position):
+        """Returns a member's activity as the activity endpoint does.
+
+        Subscribers were sent the latest campaign, and members who opened
+        a campaign opened it last.
+        """
+        activity = []
+        if self.statuses[position] == 0 and self.campaign_count:
+            activity.append({
+                'action': 'sent',
+                'timestamp': format_time(self.campaign_times[0]),
+                'campaign_id': self.campaign_id(0)})
+        if self.last_campaign[position] != self.NEVER_OPENED:
+            activity.append({
+                'action': 'open',
+                'timestamp': format_time(self.last_open_times[position])})
+        return {'email_id': self.member_id(position),
+                'list_id': self.list_id,
+                'activity': activity,
+                'total_items': len(activity)}
+
+    def campaign_id(self, index):
+        """Returns the id of the campaign at an index."""
+        return '{}-{}'.format(self.list_id, index)
+
+    def campaigns(self):
+        """Returns the list's campaigns as the campaigns endpoint does."""
+        return [{'id': self.campaign_id(index),
+                 'type': 'regular',
+                 'status': 'sent',
+                 'send_time': format_time(send_time),
+                 'recipients': {'list_id': self.list_id}}
+                for index, send_time in enumerate(self.campaign_times)]
+
+    def open_details(self, index, offset, count, since=None):
+        """Returns a page of a campaign's opens as its open-details report
+        does.
+
+        Args:
+            index: the index of the campaign.
+            offset: the position of the page's first opener.
+            count: the number of openers in the page.
+            since: only opens after this unix time are paged through, if
+                given.
+        """
+        if index not in self.campaign_openers:
+            self.campaign_openers[index] = np.flatnonzero(
+                self.last_campaign == index)
+        openers = self.campaign_openers[index]
+        if since is not None:
+            openers = openers[self.last_open_times[openers] > since]
+        return {'members': [
+            {'email_id': self.member_id(position),
+             'list_id': self.list_id,
+             'opens_count': 1,
+             'opens': [{'timestamp': format_time(
+                 self.last_open_times[position])}]}
+            for position in openers[offset:offset + count]],
+                'campaign_id': self.campaign_id(index),
+                'total_items': len(openers)}
+
+    def info(self):
+        """Returns the list as the list endpoint does."""
+        subscribed = self.statuses == 0
+        return {'id': self.list_id,
+                'name': 'Stand-in list of {} members'.format(self.size),
+                'date_created': format_time(
+                    self.anchor - self.SIGNUP_DAYS * DAY),
+                'stats': {
+                    'member_count': int(np.count_nonzero(subscribed)),
+                    'unsubscribe_count': int(
+                        np.count_nonzero(self.statuses == 1)),
+                    'cleaned_count': int(np.count_nonzero(self.statuses == 2)),
+                    'open_rate': (float(self.open_rates[subscribed].mean()) *
+                                  100 if subscribed.any() else 0),
+                    'campaign_count': self.campaign_count}}
+
+class MailChimpStandIn(): # pylint: disable=too-many-instance-attributes
+    """Serves synthetic lists from a MailChimp-like aiohttp application.
+
+    Faults are drawn from a random generator seeded like the lists, so a
+    run's sequence of faults only varies with the order requests arrive.
+    """
+
+    # Where batch results are downloaded from, like MailChimp's
+    # Pre-signed S3 urls. Downloads need no api key and never fail
+    RESULTS_PATH = '/batch-results/{}.tar.gz'
+
+    # The activity lookups batch operations can contain
+    ACTIVITY_PATH = re.compile(r'^/lists/([^/]+)/members/([^/]+)/activity$')
+
+    def __init__(self, seed=0, latency=0, latency_sigma=0, # pylint: disable=too-many-arguments
+                 latency_per_item=0, error_429_rate=0, error_504_rate=0,
+                 disconnect_rate=0, max_connections_per_key=10,
+                 batch_delay=0):
+        """Initializes a stand-in without any lists.
+
+        Args:
+            seed: the random seed lists and faults are generated from.
+            latency: the median number of seconds a request takes.
+            latency_sigma: the standard deviation of the logarithm of the
+                latency, which is log-normally distributed.
+            latency_per_item: the number of seconds each item requested
+                adds to the latency, e.g. each member in a page.
+            error_429_rate: the share of requests answered with a 429.
+            error_504_rate: the share of requests answered with a 504.
+            disconnect_rate: the share of requests whose connection is
+                dropped without a response.
+            max_connections_per_key: the most simultaneous requests an api
+                key may make. MailChimp allows 10. Requests over the cap
+                are answered with a 429.
+            batch_delay: the number of seconds a batch operation takes.
+        """
+        self.seed = seed
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.latency_per_item = latency_per_item
+        self.error_429_rate = error_429_rate
+        self.error_504_rate = error_504_rate
+        self.disconnect_rate = disconnect_rate
+        self.max_connections_per_key = max_connections_per_key
+        self.batch_delay = batch_delay
+        self.random = random.Random(seed)
+        self.lists = OrderedDict()
+        self.batches = {}
+        self.connections = Counter()
+        self.stats = Counter()
+
+    def add_list(self, size, campaign_count=52, anchor=None):
+        """Generates a list and serves it.
+
+        The list's id and members only depend on the stand-in's seed and
+        the number of lists added before it.
+
+        Args:
+            size: see SyntheticList.
+            campaign_count: see SyntheticList.
+            anchor: see SyntheticList.
+
+        Returns:
+            The SyntheticList.
+        """
+        number = len(self.lists)
+        list_id = hashlib.md5('{}-{}'.format(
+            self.seed, number).encode('utf-8')).hexdigest()[:10]
+        mailing_list = SyntheticList(
+            list_id, size, (self.seed * 1000003 + number) % (1 << 32),
+            campaign_count, anchor)
+        self.lists[list_id] = mailing_list
+        return mailing_list
+
+    def make_app(self):
+        """Returns the aiohttp application serving the stand-in."""
+        app = web.Application(middlewares=[self.simulate_mailchimp])
+        app.router.add_get('/3.0/lists', self.get_lists)
+        app.router.add_get('/3.0/lists/{list_id}', self.get_list)
+        app.router.add_get('/3.0/lists/{list_id}/members', self.get_members)
+        app.router.add_get(
+            '/3.0/lists/{list_id}/members/{member_id}/activity',
+            self.get_activity)
+        app.router.add_get('/3.0/campaigns', self.get_campaigns)
+        app.router.add_get('/3.0/reports/{campaign_id}/open-details',
+                           self.get_open_details)
+        app.router.add_post('/3.0/batches', self.post_batch)
+        app.router.add_get('/3.0/batches/{batch_id}', self.get_batch)
+        app.router.add_get(self.RESULTS_PATH.format('{batch_id}'),
+                           self.get_batch_results)
+        return app
+
+    @staticmethod
+    def error_response(status, title, detail):
+        """Returns an error response formatted like MailChimp's."""
+        return web.json_response(
+            {'type': 'https://developer.mailchimp.com/documentation/'
+                     'mailchimp/guides/error-glossary/',
+             'title': title,
+             'status': status,
+             'detail': detail,
+             'instance': ''},
+            status=status, content_type='application/problem+json')
+
+    @staticmethod
+    def get_api_key(request):
+        """Returns the api key a request was made with, or None."""
+        try:
+            return BasicAuth.decode(
+                request.headers['Authorization']).password or None
+        except (KeyError, ValueError):
+            return None
+
+    def get_latency(self, request):
+        """Draws the number of seconds a request will take."""
+        if not self.latency:
+            latency = 0
+        else:
+            latency = self.latency * math.exp(
+                self.latency_sigma * self.random.gauss(0, 1))
+        return latency + self.latency_per_item * int(
+            request.query.get('count', 1))
+
+    @web.middleware
+    async def simulate_mailchimp(self, request, handler):
+        """Authenticates requests to the API, caps each key's simultaneous
+        connections, and simulates latency and faults."""
+        if not request.path.startswith('/3.0/'):
+            return await handler(request)
+        self.stats['requests'] += 1
+
+        api_key = self.get_api_key(request)
+        if api_key is None:
+            self.stats['401'] += 1
+            return self.error_response(
+                401, 'API Key Missing', 'Your request did not include an '
+                                        'API key.')
+        if self.connections[api_key] >= self.max_connections_per_key:
+            self.stats['capped'] += 1
+            return self.error_response(
+                429, 'Too Many Requests', 'You have exceeded the limit of '
+                                          '{} simultaneous connections.'.format(
+                                              self.max_connections_per_key))
+
+        self.connections[api_key] += 1
+        try:
+            await asyncio.sleep(self.get_latency(request))
+
+            # At most one fault per request
+            roll = self.random.random()
+            if roll < self.disconnect_rate:
+                self.stats['disconnects'] += 1
+                request.transport.close()
+                raise web.HTTPInternalServerError()
+            roll -= self.disconnect_rate
+            if roll < self.error_429_rate:
+                self.stats['429'] += 1
+                return self.error_response(
+                    429, 'Too Many Requests', 'You have exceeded the limit '
+                                              'of requests.')
+            roll -= self.error_429_rate
+            if roll < self.error_504_rate:
+                self.stats['504'] += 1
+                return web.Response(
+                    status=504, text='<html><body><h1>504 Gateway Time-out'
+                                     '</h1></body></html>',
+                    content_type='text/html')
+
+            return await handler(request)
+        finally:
+            self.connections[api_key] -= 1
+
+    @staticmethod
+    def json_response(request, body):
+        """Returns a response body filtered by the request's fields
+        parameters, with an ETag. Answers with a 304 if the request's
+        If-None-Match header matches the ETag."""
+        text = json.dumps(select_fields(
+            body, request.query.get('fields'),
+            request.query.get('exclude_fields')))
+        etag = '"{}"'.format(hashlib.md5(text.encode('utf-8')).hexdigest())
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=text, content_type='application/json',
+                            headers={'ETag': etag})
+
+    @staticmethod
+    def get_page(request, default_count=10):
+        """Returns the offset and count a request asks for."""
+        return (int(request.query.get('offset', 0)),
+                int(request.query.get('count', default_count)))
+
+    def get_synthetic_list(self, request):
+        """Returns the list a request is for.
+
+        Throws:
+            web.HTTPNotFound: there's no such list.
+        """
+        try:
+            return self.lists[request.match_info['list_id']]
+        except KeyError:
+            raise web.HTTPNotFound()
+
+    async def get_lists(self, request):
+        """Serves /lists."""
+        offset, count = self.get_page(request)
+        lists = list(self.lists.values())
+        return self.json_response(request, {
+            'lists': [mailing_list.info()
+                      for mailing_list in lists[offset:offset + count]],
+            'total_items': len(lists)})
+
+    async def get_list(self, request):
+        """Serves /lists/{list_id}."""
+        return self.json_response(
+            request, self.get_synthetic_list(request).info())
+
+    async def get_members(self, request):
+        """Serves /lists/{list_id}/members."""
+        mailing_list = self.get_synthetic_list(request)
+        offset, count = self.get_page(request)
+        since = request.query.get('since_last_changed')
+        return self.json_response(request, mailing_list.members(
+            offset, count, parse_time(since) if since else None))
+
+    async def get_activity(self, request):
+        """Serves /lists/{list_id}/members/{member_id}/activity."""
+        mailing_list = self.get_synthetic_list(request)
+        position = mailing_list.member_position(
+            request.match_info['member_id'])
+        if position is None:
+            return self.error_response(
+                404, 'Resource Not Found', 'The requested resource could '
+                                           'not be found.')
+        return self.json_response(request, mailing_list.activity(position))
+
+    async def get_campaigns(self, request):
+        """Serves /campaigns."""
+        offset, count = self.get_page(request)
+        list_id = request.query.get('list_id')
+        since = request.query.get('since_send_time')
+        campaigns = [
+            campaign for mailing_list in self.lists.values()
+            if list_id in (None, mailing_list.list_id)
+            for campaign in mailing_list.campaigns()
+            if since is None or
+            parse_time(campaign['send_time']) > parse_time(since)]
+        return self.json_response(request, {
+            'campaigns': campaigns[offset:offset + count],
+            'total_items': len(campaigns)})
+
+    async def get_open_details(self, request):
+        """Serves /reports/{campaign_id}/open-details."""
+        list_id, _, index = request.match_info['campaign_id'].rpartition('-')
+        mailing_list = self.lists.get(list_id)
+        if (mailing_list is None or not index.isdigit() or
+                int(index) >= mailing_list.campaign_count):
+            raise web.HTTPNotFound()
+        offset, count = self.get_page(request)
+        since = request.query.get('since')
+        return self.json_response(request, mailing_list.open_details(
+            int(index), offset, count, parse_time(since) if since else None))
+
+    async def post_batch(self, request):
+        """Serves posts to /batches, queueing a batch operation."""
+        operations = (await request.json())['operations']
+        batch_id = '{:010x}'.format(len(self.batches) + 1)
+        self.batches[batch_id] = (operations, time.monotonic())
+        return web.json_response({'id': batch_id,
+                                  'status': 'pending',
+                                  'total_operations': len(operations)})
+
+    async def get_batch(self, request):
+        """Serves /batches/{batch_id}."""
+        batch_id = request.match_info['batch_id']
+        if batch_id not in self.batches:
+            raise web.HTTPNotFound()
+        operations, submitted_at = self.batches[batch_id]
+        finished = time.monotonic() - submitted_at >= self.batch_delay
+        return self.json_response(request, {
+            'id': batch_id,
+            'status': 'finished' if finished else 'started',
+            'total_operations': len(operations),
+            'response_body_url': str(request.url.with_path(
+                self.RESULTS_PATH.format(batch_id))) if finished else ''})
+
+    def run_operation(self, operation):
+        """Returns the result of one of a batch's activity lookups."""
+        match = self.ACTIVITY_PATH.match(operation['path'])
+        mailing_list = match and self.lists.get(match.group(1))
+        position = mailing_list and mailing_list.member_position(
+            match.group(2))
+        if position is None:
+            return {'status_code': 404,
+                    'operation_id': operation.get('operation_id'),
+                    'response': json.dumps({'title': 'Resource Not Found',
+                                            'status': 404})}
+        params = operation.get('params') or {}
+        return {'status_code': 200,
+                'operation_id': operation.get('operation_id'),
+                'response': json.dumps(select_fields(
+                    mailing_list.activity(position), params.get('fields'),
+                    params.get('exclude_fields')))}
+
+    async def get_batch_results(self, request):
+        """Serves a batch's results as a gzipped tarball of json files."""
+        batch_id = request.match_info['batch_id']
+        if batch_id not in self.batches:
+            raise web.HTTPNotFound()
+        operations = self.batches[batch_id][0]
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as results:
+            for start in range(0, max(len(operations), 1), 1000):
+                content = json.dumps([
+                    self.run_operation(operation)
+                    for operation in operations[start:start + 1000]
+                ]).encode('utf-8')
+                info = tarfile.TarInfo('{}/{}.json'.format(batch_id, start))
+                info.size = len(content)
+                results.addfile(info, io.BytesIO(content))
+        return web.Response(body=archive.getvalue(),
+                            content_type='application/x-gzip')
+
+def main(argv=None):
+    """Runs the stand-in from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--lists', default='1000',
+                        help='comma-separated sizes of the lists to serve')
+    parser.add_argument('--campaigns', type=int, default=52,
+                        help='campaigns sent to each list in the past year')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--latency-sigma', type=float, default=0)
+    parser.add_argument('--latency-per-item', type=float, default=0)
+    parser.add_argument('--error-429-rate', type=float, default=0)
+    parser.add_argument('--error-504-rate', type=float, default=0)
+    parser.add_argument('--disconnect-rate', type=float, default=0)
+    parser.add_argument('--max-connections-per-key', type=int, default=10)
+    parser.add_argument('--batch-delay', type=float, default=0)
+    args = parser.parse_args(argv)
+
+    standin = MailChimpStandIn(
+        seed=args.seed, latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        latency_per_item=args.latency_per_item,
+        error_429_rate=args.error_429_rate,
+        error_504_rate=args.error_504_rate,
+        disconnect_rate=args.disconnect_rate,
+        max_connections_per_key=args.max_connections_per_key,
+        batch_delay=args.batch_delay)
+    for size in args.lists.split(','):
+        mailing_list = standin.add_list(int(size), args.campaigns)
+        print('List {}: {} members'.format(mailing_list.list_id, size))
+    print('Set MAILCHIMP_API_BASE=http://{}:{}/3.0'.format(
+        args.host, args.port))
+    web.run_app(standin.make_app(), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Benchmarks computing the member-derived metrics of a large list.
+
+Builds a synthetic members dataframe with the compact member schema and
+times the calc_* methods of MailChimpList, which read the counts tallied
+by MemberMetrics.from_frame() in a single pass, against the separate
+pandas computations they replaced. Both must compute the same metrics.
+
+    python -m benchmarks.metrics_benchmarks --size 1000000
+"""
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from benchmarks.import_benchmarks import API_KEY, configure_environment
+
+# The share of members with each status
+STATUS_SHARES = (
+    ('subscribed', 0.7), ('unsubscribed', 0.15), ('cleaned', 0.1),
+    ('pending', 0.05))
+
+# The share of members with an open in the past year
+RECENT_OPEN_SHARE = 0.6
+
+def make_members(size, seed=0):
+    """Returns a synthetic members dataframe, as flatten() leaves it."""
+    random_state = np.random.RandomState(seed)
+    statuses, shares = zip(*STATUS_SHARES)
+    df = pd.DataFrame({
+        'status': pd.Categorical.from_codes(
+            random_state.choice(len(statuses), size, p=shares), statuses),
+        'avg_open_rate': np.round(
+            random_state.beta(1, 3, size), 2).astype(np.float32),
+        'recent_open': pd.to_datetime(np.where(
+            random_state.random_sample(size) < RECENT_OPEN_SHARE,
+            1.5e18, np.nan), utc=True)})
+
+    # Rates exactly on the decile edges test the binning
+    df.loc[::97, 'avg_open_rate'] = np.float32(0.8)
+    df.loc[::89, 'avg_open_rate'] = np.float32(0.1)
+    return df
+
+def legacy_metrics(df, count, subscribers): # pylint: disable=invalid-name
+    """Computes the metrics the way the calc_* methods used to, with a
+    pass over the members for each."""
+    metrics = {}
+    statuses = df.status.unique()
+    for status in ('subscribed', 'unsubscribed', 'cleaned', 'pending'):
+        metrics['{}_pct'.format(status)] = (
+            0 if status not in statuses
+            else df.status.value_counts()[status] / count)
+    open_rates = df.loc[df['status'] == 'subscribed', 'avg_open_rate']
+    bin_boundaries = np.linspace(0, 1, num=11).astype(open_rates.dtype)
+    bins = pd.cut(open_rates, bin_boundaries, include_lowest=True)
+    metrics['hist_bin_counts'] = pd.value_counts(bins, sort=False).tolist()
+    threshold = open_rates.dtype.type(0.8)
+    metrics['high_open_rt_pct'] = (
+        sum(x > threshold for x in open_rates) / subscribers)
+    metrics['cur_yr_inactive_pct'] = (
+        subscribers - int(df['recent_open'].count())) / subscribers
+    return metrics
+
+def fused_metrics(df, count, subscribers):
+    """Computes the metrics with the calc_* methods of MailChimpList."""
+    from app.lists import MailChimpList
+    mailing_list = MailChimpList('benchmarks', count, API_KEY, 'us1')
+    mailing_list.df = df
+    mailing_list.subscribers = subscribers
+    mailing_list.calc_list_breakdown()
+    mailing_list.calc_histogram()
+    mailing_list.calc_high_open_rate_pct()
+    mailing_list.calc_cur_yr_stats()
+    return {field: getattr(mailing_list, field) for field in (
+        'subscribed_pct', 'unsubscribed_pct', 'cleaned_pct', 'pending_pct',
+        'hist_bin_counts', 'high_open_rt_pct', 'cur_yr_inactive_pct')}
+
+def best_time(function, repeat, *args):
+    """Returns the result of a function and its fastest wall time."""
+    times = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - started_at)
+    return result, min(times)
+
+def main(argv=None):
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=1000000,
+                        help='the number of members')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of times each is timed')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        configure_environment(state_dir, 'http://localhost/3.0')
+        df = make_members(args.size)
+        subscribers = int((df['status'] == 'subscribed').sum())
+        legacy, legacy_time = best_time(
+            legacy_metrics, args.repeat, df, args.size, subscribers)
+        fused, fused_time = best_time(
+            fused_metrics, args.repeat, df, args.size, subscribers)
+    mismatches = [field for field in legacy if legacy[field] != fused[field]]
+    print('{} members: {:.3f}s separately, {:.3f}s fused ({:.1f}x)'.format(
+        args.size, legacy_time, fused_time, legacy_time / fused_time))
+    for field in mismatches:
+        print('Mismatch: {} was {}, is {}'.format(
+            field, legacy[field], fused[field]), file=sys.stderr)
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
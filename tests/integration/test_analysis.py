@@ -4,6 +4,7 @@ import json
 import requests
 from app import db
 from app.models import AppUser, Organization, EmailList
+from app.apiurls import mailchimp_url
 
 def test_analysis(client, caplog):
     """End-to-end test of analyzing a list."""
@@ -34,8 +35,7 @@ def test_analysis(client, caplog):
     for file in chart_files:
         if list_id in file:
             os.remove(file)
-    request_uri = 'https://{}.api.mailchimp.com/3.0/lists/{}'.format(
-        data_center, list_id)
+    request_uri = mailchimp_url(data_center, 'lists/{}'.format(list_id))
     params = (
         ('fields', 'name,'
                    'stats.member_count,'
@@ -119,10 +119,17 @@ def mocked_mailchimp_list(mocker, fake_calculation_results):
     """Mocks the MailChimp list class from app/lists.py and attaches fake calculation
     results to the mock attributes."""
     mocked_mailchimp_list = mocker.patch('app.tasks.MailChimpList')
-    mocked_mailchimp_list.return_value = MagicMock(**fake_calculation_results)
+    mocked_mailchimp_list.return_value = MagicMock(
+        streaming=False, **fake_calculation_results)
     yield mocked_mailchimp_list
 
 @pytest.fixture
-def mailchimp_list():
+def mailchimp_list(state_dir): # pylint: disable=unused-argument
     """Creates a MailChimpList. Used for testing class/instance methiods."""
     yield MailChimpList(1, 2, 'foo-bar1', 'bar1')
+
+@pytest.fixture
+def state_dir(monkeypatch, tmpdir):
+    """Points the local import state directory at a temporary directory."""
+    monkeypatch.setenv('IMPORT_STATE_DIR', str(tmpdir))
+    yield tmpdir
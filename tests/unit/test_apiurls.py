@@ -0,0 +1,14 @@
+"""This module contains tests associated with MailChimp API urls."""
+from app.apiurls import mailchimp_url
+
+def test_mailchimp_url(monkeypatch):
+    """Tests the mailchimp_url function."""
+    monkeypatch.delenv('MAILCHIMP_API_BASE', raising=False)
+    assert mailchimp_url('us1', 'lists/foo') == (
+        'https://us1.api.mailchimp.com/3.0/lists/foo')
+
+def test_mailchimp_url_custom_base(monkeypatch):
+    """Tests that the mailchimp_url function uses the MAILCHIMP_API_BASE
+    environment variable."""
+    monkeypatch.setenv('MAILCHIMP_API_BASE', 'http://127.0.0.1:8080/3.0/')
+    assert mailchimp_url('us1', 'lists') == 'http://127.0.0.1:8080/3.0/lists'
@@ -0,0 +1,73 @@
+import os
+import time
+from app.checkpoints import (
+    ImportCheckpoint, checkpoint_dir, prune_checkpoints, CHECKPOINT_MAX_AGE)
+
+def test_member_chunks(state_dir): # pylint: disable=unused-argument
+    """Tests that saved member chunks can be listed and loaded back."""
+    checkpoint = ImportCheckpoint('foo')
+    checkpoint.save_member_chunk(5000, 2500, [{'id': 'baz'}])
+    checkpoint.save_member_chunk(0, 5000, [{'id': 'bar'}])
+    assert checkpoint.member_chunks() == [(0, 5000), (5000, 2500)]
+    assert checkpoint.load_member_chunk(5000, 2500) == [{'id': 'baz'}]
+    assert ImportCheckpoint('foo').member_chunks() == [
+        (0, 5000), (5000, 2500)]
+
+def test_activity(state_dir): # pylint: disable=unused-argument
+    """Tests that saved activity responses can be loaded back, skipping
+    a line cut short by a crash."""
+    checkpoint = ImportCheckpoint('foo')
+    checkpoint.save_activity({'email_id': 'bar', 'activity': []})
+    with open(os.path.join(checkpoint.directory,
+                           checkpoint.ACTIVITY_FILENAME), 'a') as activity:
+        activity.write('{"email_id": "ba')
+    assert list(checkpoint.load_activity()) == [
+        {'email_id': 'bar', 'activity': []}]
+
+def test_activity_empty(state_dir): # pylint: disable=unused-argument
+    """Tests that the load_activity function yields nothing if no
+    responses were saved."""
+    assert list(ImportCheckpoint('foo').load_activity()) == []
+
+def test_has_activity(state_dir): # pylint: disable=unused-argument
+    """Tests the has_activity function."""
+    checkpoint = ImportCheckpoint('foo')
+    assert not checkpoint.has_activity()
+    checkpoint.save_activity({'email_id': 'bar', 'activity': []})
+    assert checkpoint.has_activity()
+
+def test_clear(state_dir): # pylint: disable=unused-argument
+    """Tests that a cleared checkpoint is empty."""
+    checkpoint = ImportCheckpoint('foo')
+    checkpoint.save_member_chunk(0, 5000, [])
+    directory = checkpoint.directory
+    checkpoint.clear()
+    assert not os.path.exists(directory)
+    assert ImportCheckpoint('foo').member_chunks() == []
+
+def test_campaign_opens(state_dir): # pylint: disable=unused-argument
+    """Tests that campaign opens are saved and listed by campaign."""
+    checkpoint = ImportCheckpoint('foo')
+    assert checkpoint.campaigns() == []
+    checkpoint.save_campaign_opens('qux', {'bar': 5})
+    checkpoint.save_campaign_opens('baz', {})
+    assert checkpoint.campaigns() == ['baz', 'qux']
+    assert checkpoint.load_campaign_opens('qux') == {'bar': 5}
+
+def test_stale_checkpoint(state_dir): # pylint: disable=unused-argument
+    """Tests that a stale checkpoint is discarded rather than resumed."""
+    checkpoint = ImportCheckpoint('foo')
+    checkpoint.save_member_chunk(0, 5000, [])
+    stale = time.time() - CHECKPOINT_MAX_AGE.total_seconds() - 1
+    os.utime(checkpoint.directory, (stale, stale))
+    assert ImportCheckpoint('foo').member_chunks() == []
+
+def test_prune_checkpoints(state_dir): # pylint: disable=unused-argument
+    """Tests that the prune_checkpoints function only deletes stale
+    checkpoints."""
+    ImportCheckpoint('foo').save_member_chunk(0, 5000, [])
+    ImportCheckpoint('bar').save_member_chunk(0, 5000, [])
+    stale = time.time() - CHECKPOINT_MAX_AGE.total_seconds() - 1
+    os.utime(checkpoint_dir('foo'), (stale, stale))
+    prune_checkpoints()
+    assert os.listdir(checkpoint_dir()) == ['bar']
@@ -1,6 +1,9 @@
+from datetime import datetime, timedelta
 import pytest
 from sqlalchemy.exc import IntegrityError
-from app.dbops import update_user, store_user, store_org, associate_user_with_list
+from app.dbops import (
+    update_user, store_user, store_org, associate_user_with_list,
+    acquire_import_lock, release_import_lock)
 
 def test_update_user(mocker):
     """Tests the update_user function."""
@@ -98,3 +101,33 @@ def test_associate_user_with_list_db_exception(mocker):
     with pytest.raises(Exception):
         associate_user_with_list('foo', 'bar')
     mocked_db.session.rollback.assert_called()
+
+def test_acquire_import_lock(mocker):
+    """Tests the acquire_import_lock function."""
+    mocked_import_lock = mocker.patch('app.dbops.ImportLock')
+    mocked_import_lock.acquired_at = datetime(2000, 1, 1)
+    mocked_db = mocker.patch('app.dbops.db')
+    assert acquire_import_lock('foo', 'bar', timedelta(hours=1))
+    mocked_import_lock.query.filter.return_value.delete.assert_called()
+    mocked_import_lock.assert_called_with(list_id='foo', owner='bar')
+    mocked_db.session.add.assert_called_with(mocked_import_lock.return_value)
+    mocked_db.session.commit.assert_called()
+
+def test_acquire_import_lock_held(mocker):
+    """Tests the acquire_import_lock function when another import holds
+    the lock."""
+    mocked_import_lock = mocker.patch('app.dbops.ImportLock')
+    mocked_import_lock.acquired_at = datetime(2000, 1, 1)
+    mocked_db = mocker.patch('app.dbops.db')
+    mocked_db.session.commit.side_effect = IntegrityError('foo', 'bar', 'baz')
+    assert not acquire_import_lock('foo', 'bar', timedelta(hours=1))
+    mocked_db.session.rollback.assert_called()
+
+def test_release_import_lock(mocker):
+    """Tests the release_import_lock function."""
+    mocked_import_lock = mocker.patch('app.dbops.ImportLock')
+    mocked_db = mocker.patch('app.dbops.db')
+    release_import_lock('foo', 'bar')
+    mocked_import_lock.query.filter_by.assert_called_with(
+        list_id='foo', owner='bar')
+    mocked_db.session.commit.assert_called()
@@ -0,0 +1,175 @@
+"""This module contains tests associated with the response cache."""
+import time
+import zlib
+from app.httpcache import (
+    ResponseCache, MAX_RESPONSE_AGE, get_response_cache, prune_response_cache)
+
+MEMBERS_URL = 'https://us1.api.mailchimp.com/3.0/lists/foo/members'
+PARAMS = (('count', '5000'), ('offset', '0'))
+
+def make_cache(tmpdir, max_bytes=1 << 20):
+    """Returns a response cache in a temporary directory."""
+    return ResponseCache(str(tmpdir.join('responses.sqlite3')), max_bytes)
+
+def test_get_ttl():
+    """Tests that the get_ttl function matches endpoints by path."""
+    assert ResponseCache.get_ttl(MEMBERS_URL).total_seconds() == 6 * 3600
+    assert ResponseCache.get_ttl(
+        MEMBERS_URL + '/bar/activity').total_seconds() == 6 * 3600
+    assert ResponseCache.get_ttl(
+        'https://us1.api.mailchimp.com/3.0/batches/bar') is None
+
+def test_put_and_get(tmpdir):
+    """Tests that a cached response is returned while it's fresh, and only
+    for the same api key and parameters."""
+    cache = make_cache(tmpdir)
+    cache.put(MEMBERS_URL, PARAMS, 'key-us1', b'{"foo": "bar"}', 'etag1')
+    cached = cache.get(MEMBERS_URL, PARAMS, 'key-us1')
+    assert cached.body == b'{"foo": "bar"}'
+    assert cached.etag == 'etag1'
+    assert cached.fresh
+    assert cache.get(MEMBERS_URL, PARAMS, 'other-us1') is None
+    assert cache.get(MEMBERS_URL, (('count', '1'),), 'key-us1') is None
+
+def test_put_uncacheable(tmpdir):
+    """Tests that responses from endpoints without a TTL aren't cached."""
+    cache = make_cache(tmpdir)
+    url = 'https://us1.api.mailchimp.com/3.0/batches/bar'
+    cache.put(url, None, 'key-us1', b'{}')
+    assert cache.get(url, None, 'key-us1') is None
+
+def test_get_stale(tmpdir):
+    """Tests that an expired response is returned for revalidation, and
+    that refreshing it makes it fresh again."""
+    cache = make_cache(tmpdir)
+    stored_at = time.time() - 7 * 3600
+    cache.put(MEMBERS_URL, PARAMS, 'key-us1', b'{}', 'etag1', now=stored_at)
+    cached = cache.get(MEMBERS_URL, PARAMS, 'key-us1')
+    assert not cached.fresh
+    cache.refresh(MEMBERS_URL, cached.key)
+    assert cache.get(MEMBERS_URL, PARAMS, 'key-us1').fresh
+
+def test_get_too_old(tmpdir):
+    """Tests that responses older than MAX_RESPONSE_AGE aren't returned,
+    and are pruned."""
+    cache = make_cache(tmpdir)
+    stored_at = time.time() - MAX_RESPONSE_AGE.total_seconds() - 1
+    cache.put(MEMBERS_URL, PARAMS, 'key-us1', b'{}', now=stored_at)
+    assert cache.get(MEMBERS_URL, PARAMS, 'key-us1') is None
+    cache.prune()
+    assert cache.connect().execute(
+        'SELECT COUNT(*) FROM responses').fetchone() == (0,)
+
+def test_evict_least_recently_used(tmpdir):
+    """Tests that the least recently used responses are evicted to keep the
+    cache under its size cap."""
+    cache = make_cache(tmpdir, max_bytes=2 * len(zlib.compress(b'{}', 1)))
+    now = time.time()
+    for offset in range(2):
+        cache.put(MEMBERS_URL, (('offset', str(offset)),), 'key-us1',
+                  b'{}', now=now + offset)
+    cache.get(MEMBERS_URL, (('offset', '0'),), 'key-us1', now=now + 2)
+    cache.put(MEMBERS_URL, (('offset', '2'),), 'key-us1', b'{}',
+              now=now + 3)
+    assert sorted(dict(params)['offset'] for params in cache.fresh_params(
+        MEMBERS_URL, 'key-us1', now=now + 3)) == ['0', '2']
+
+def test_running_total(tmpdir):
+    """Tests that the cache keeps count of the bytes stored as responses
+    are inserted, replaced and evicted."""
+    cache = make_cache(tmpdir, max_bytes=3 * len(zlib.compress(b'{}', 1)))
+
+    def stored_bytes():
+        return cache.connect().execute(
+            'SELECT SUM(size) FROM responses').fetchone()[0]
+
+    for offset in range(5):
+        cache.put(MEMBERS_URL, (('offset', str(offset)),), 'key-us1', b'{}')
+        cache.flush()
+        cache.put(MEMBERS_URL, (('offset', str(offset)),), 'key-us1',
+                  b'{"foo": 1}')
+        cache.flush()
+        assert cache.total_bytes == stored_bytes()
+    assert cache.total_bytes <= cache.max_bytes
+
+def test_last_used_is_batched(tmpdir):
+    """Tests that the last use of cached responses is written in
+    batches."""
+    cache = make_cache(tmpdir)
+    cache.LAST_USED_BATCH_SIZE = 2
+    now = time.time()
+    for offset in range(2):
+        cache.put(MEMBERS_URL, (('offset', str(offset)),), 'key-us1', b'{}',
+                  now=now)
+    cache.flush()
+
+    def last_used():
+        return sorted(row[0] for row in cache.connect().execute(
+            'SELECT last_used FROM responses'))
+
+    cache.get(MEMBERS_URL, (('offset', '0'),), 'key-us1', now=now + 1)
+    assert last_used() == [now, now]
+    cache.get(MEMBERS_URL, (('offset', '1'),), 'key-us1', now=now + 2)
+    assert last_used() == [now + 1, now + 2]
+    assert cache.last_used == {}
+
+def test_puts_are_batched(tmpdir):
+    """Tests that responses are written in batches, and served from memory
+    until then."""
+    cache = make_cache(tmpdir)
+    cache.PUT_BATCH_SIZE = 2
+
+    def stored():
+        return cache.connect().execute(
+            'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    cache.put(MEMBERS_URL, PARAMS, 'key-us1', b'{"foo": "bar"}', 'etag1')
+    assert stored() == 0
+    cached = cache.get(MEMBERS_URL, PARAMS, 'key-us1')
+    assert cached.body == b'{"foo": "bar"}'
+    assert cached.etag == 'etag1'
+    assert cached.fresh
+    cache.put(MEMBERS_URL, (('count', '1'),), 'key-us1', b'{}')
+    assert stored() == 2
+    assert cache.pending == {}
+    assert cache.pending_bytes == 0
+    assert cache.get(MEMBERS_URL, PARAMS, 'key-us1').body == b'{"foo": "bar"}'
+
+def test_puts_are_batched_by_size(tmpdir):
+    """Tests that a batch is written once its responses reach
+    PUT_BATCH_BYTES."""
+    cache = make_cache(tmpdir)
+    cache.PUT_BATCH_BYTES = 10
+    cache.put(MEMBERS_URL, PARAMS, 'key-us1', b'{"a": 1}')
+    assert cache.pending_bytes == 8
+    cache.put(MEMBERS_URL, PARAMS, 'key-us1', b'{"ab": 1}')
+    assert cache.pending_bytes == 9
+    cache.put(MEMBERS_URL, (('count', '1'),), 'key-us1', b'{}')
+    assert cache.pending == {}
+    assert cache.connect().execute(
+        'SELECT COUNT(*) FROM responses').fetchone() == (2,)
+
+def test_fresh_params(tmpdir):
+    """Tests the fresh_params function."""
+    cache = make_cache(tmpdir)
+    cache.put(MEMBERS_URL, PARAMS, 'key-us1', b'{}')
+    cache.put(MEMBERS_URL, (('count', '1'),), 'key-us1', b'{}',
+              now=time.time() - 7 * 3600)
+    assert cache.fresh_params(MEMBERS_URL, 'key-us1') == [PARAMS]
+    assert cache.fresh_params(MEMBERS_URL, 'other-us1') == []
+
+def test_get_response_cache_disabled(monkeypatch):
+    """Tests that the response cache is disabled by default."""
+    monkeypatch.delenv('RESPONSE_CACHE_MB', raising=False)
+    assert get_response_cache() is None
+    prune_response_cache()
+
+def test_get_response_cache(mocker, monkeypatch, state_dir):
+    """Tests that the RESPONSE_CACHE_MB environment variable enables the
+    response cache."""
+    mocker.patch('app.httpcache._RESPONSE_CACHE', new=None)
+    monkeypatch.setenv('RESPONSE_CACHE_MB', '2')
+    cache = get_response_cache()
+    assert cache.max_bytes == 2 * 1024 * 1024
+    assert cache.path == str(state_dir.join('responses.sqlite3'))
+    assert get_response_cache() is cache
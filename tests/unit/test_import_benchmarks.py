@@ -0,0 +1,51 @@
+"""This module contains tests associated with the import benchmarks."""
+import pytest
+from benchmarks.import_benchmarks import PhaseRecorder, compare_results
+
+def make_results(wall_time, peak_rss_mb):
+    """Returns benchmark results with a single phase."""
+    return {'lists': [{'size': 1000, 'phases': [
+        {'name': 'flatten', 'wall_time': wall_time,
+         'peak_rss_mb': peak_rss_mb}]}]}
+
+def test_phase_recorder():
+    """Tests that the phase recorder records a phase's requests and
+    resources."""
+    request_counts = iter([3, 8])
+    recorder = PhaseRecorder(lambda: next(request_counts))
+    with recorder.phase('foo'):
+        bytearray(1024)
+    phase, = recorder.phases
+    assert phase['name'] == 'foo'
+    assert phase['requests'] == 5
+    assert phase['wall_time'] > 0
+    assert phase['requests_per_second'] == 5 / phase['wall_time']
+    assert phase['cpu_time'] >= 0
+    assert phase['peak_rss_mb'] > 0
+
+@pytest.mark.asyncio
+async def test_phase_recorder_wrap():
+    """Tests that wrapped functions and coroutines record a phase per
+    call."""
+    recorder = PhaseRecorder(lambda: 0)
+
+    async def foo(bar):
+        return bar
+
+    assert await recorder.wrap('foo', foo)('baz') == 'baz'
+    assert recorder.wrap('qux', lambda: 'quux')() == 'quux'
+    assert [phase['name'] for phase in recorder.phases] == ['foo', 'qux']
+
+def test_compare_results():
+    """Tests that phases which got slower or used more memory are reported
+    as regressions."""
+    baseline = make_results(1, 100)
+    assert compare_results(baseline, make_results(1.1, 110), 0.2) == []
+    assert compare_results(baseline, make_results(1.5, 130), 0.2) == [
+        'flatten (1000 members): 1.500s, was 1.000s',
+        'flatten (1000 members): 130.0 MB peak RSS, was 100.0 MB']
+
+def test_compare_results_ignores_short_phases():
+    """Tests that tiny slowdowns of very short phases aren't reported."""
+    assert compare_results(
+        make_results(0.001, 100), make_results(0.01, 100), 0.2) == []
@@ -1,8 +1,13 @@
+import io
+import json
+import asyncio
 import logging
+import time
 import random
+import tarfile
 import datetime
 from collections import OrderedDict
-from unittest.mock import call, ANY
+from unittest.mock import MagicMock, call, ANY
 from asyncio import TimeoutError as AsyncTimeoutError
 import pytest
 from aiohttp import ClientHttpProxyError, ServerDisconnectedError
@@ -11,8 +16,12 @@ from asynctest import CoroutineMock
 import pandas as pd
 from pandas.util.testing import assert_frame_equal
 import numpy as np
-from requests.exceptions import ConnectionError as ConnError
-from app.lists import MailChimpImportError
+from app.lists import (
+    MailChimpImportError, MemberColumns, decode_json, decode_json_in_executor,
+    estimate_stratified_proportion, install_uvloop)
+from app.throttle import AIMDController, RetryPolicy
+from app.metrics import MemberMetrics
+from app.httpcache import ResponseCache
 
 def test_mailchimp_import_error():
     """Tests the custom MailChimp Import Error."""
@@ -37,79 +46,30 @@ async def test_enable_proxy_no_proxy(mocker, caplog, mailchimp_list):
 async def test_enable_proxy_successful(mocker, caplog, mailchimp_list):
     """Tests the enable_proxy function."""
     mocked_os = mocker.patch('app.lists.os')
-    mocked_os.environ.get.side_effect = [None, 'foo']
-    mocked_current_proccess = mocker.patch('app.lists.current_process')
-    mocked_current_proccess.return_value.index = 5
-    mocked_requests = mocker.patch('app.lists.requests')
-    mocked_requests.get.return_value.text = 'foo:bar:baz'
+    mocked_os.environ.get.side_effect = [None]
+    mocked_get_proxy_pool = mocker.patch('app.lists.get_proxy_pool')
+    mocked_get_proxy_pool.return_value.lease = CoroutineMock(
+        return_value='http://bar:baz')
     caplog.set_level(logging.INFO)
-    mocked_sleep = mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
     await mailchimp_list.enable_proxy()
-    mocked_requests.get.assert_called_with(
-        'http://us-proxies.com/api.php',
-        params=(
-            ('api', ''),
-            ('uid', '9557'),
-            ('pwd', 'foo'),
-            ('cmd', 'rotate'),
-            ('process', '6'),
-        ),
-    )
     assert mailchimp_list.proxy == 'http://bar:baz'
+    assert mailchimp_list.proxy_pool is mocked_get_proxy_pool.return_value
     assert 'Using proxy: http://bar:baz' in caplog.text
-    mocked_sleep.assert_called()
-
-@pytest.mark.asyncio
-async def test_enable_proxy_unable_to_get_process_number(
-        mocker, mailchimp_list):
-    """Tests the enable_proxy function when current_process().index
-    raises an AttributeError."""
-    mocked_os = mocker.patch('app.lists.os')
-    mocked_os.environ.get.side_effect = [None, 'foo']
-    mocked_current_proccess = mocker.patch('app.lists.current_process')
-    del mocked_current_proccess.return_value.index
-    mocked_requests = mocker.patch('app.lists.requests')
-    mocked_requests.get.return_value.text = 'foo:bar:baz'
-    mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
-    await mailchimp_list.enable_proxy()
-    mocked_requests.get.assert_called_with(
-        'http://us-proxies.com/api.php',
-        params=(
-            ('api', ''),
-            ('uid', '9557'),
-            ('pwd', 'foo'),
-            ('cmd', 'rotate'),
-            ('process', '1'),
-        ),
-    )
 
 @pytest.mark.asyncio
-async def test_enable_proxy_proxy_response_error(
-        mocker, caplog, mailchimp_list):
-    """Tests the enable_proxy function when the request to the proxy provider
-    returns an error."""
+async def test_enable_proxy_unavailable(mocker, caplog, mailchimp_list):
+    """Tests the enable_proxy function when the pool can't supply a
+    proxy."""
     mocked_os = mocker.patch('app.lists.os')
-    mocked_os.environ.get.side_effect = [None, 'foo']
-    mocker.patch('app.lists.current_process')
-    mocked_requests = mocker.patch('app.lists.requests')
-    mocked_requests.get.return_value.text = 'ERROR:bar:baz'
+    mocked_os.environ.get.side_effect = [None]
+    mocked_get_proxy_pool = mocker.patch('app.lists.get_proxy_pool')
+    mocked_get_proxy_pool.return_value.lease = CoroutineMock(
+        return_value=None)
+    mocked_get_proxy_pool.return_value.last_error = 'baz'
     await mailchimp_list.enable_proxy()
     assert mailchimp_list.proxy is None
     assert 'Not using a proxy. Reason: baz.' in caplog.text
 
-@pytest.mark.asyncio
-async def test_enable_proxy_connection_error(mocker, caplog, mailchimp_list):
-    """Tests the enable_proxy function when the request to the proxy provider
-    causes a ConnectionError."""
-    mocked_os = mocker.patch('app.lists.os')
-    mocked_os.environ.get.side_effect = [None, 'foo']
-    mocker.patch('app.lists.current_process')
-    mocked_requests = mocker.patch('app.lists.requests')
-    mocked_requests.get.side_effect = ConnError()
-    await mailchimp_list.enable_proxy()
-    assert mailchimp_list.proxy is None
-    assert 'ConnectionError: proxy provider down.' in caplog.text
-
 @pytest.mark.asyncio
 async def test_make_async_request(mocker, mailchimp_list):
     """Tests the make_async_request function."""
@@ -123,9 +83,98 @@ async def test_make_async_request(mocker, mailchimp_list):
     client_session_mock.get.assert_called_with(
         'www.foo.com', params='foo',
         auth=mocked_basic_auth('shorenstein', 'foo-bar1'),
-        proxy=None)
+        proxy=None, timeout=ANY)
+    assert async_request_response == 'foo'
+
+@pytest.mark.asyncio
+async def test_make_async_request_as_bytes(mocker, mailchimp_list):
+    """Tests that the make_async_request function can return the raw
+    response body."""
+    client_session_mock = CoroutineMock()
+    client_session_mock.get.return_value.__aenter__.return_value.status = 200
+    client_session_mock.get.return_value.__aenter__.return_value.read = (
+        CoroutineMock(return_value=b'foo'))
+    mocker.patch('app.lists.BasicAuth')
+    assert await mailchimp_list.make_async_request(
+        'www.foo.com', 'foo', client_session_mock, as_bytes=True) == b'foo'
+
+@pytest.mark.asyncio
+async def test_make_async_request_post(mocker, mailchimp_list):
+    """Tests that the make_async_request function posts json payloads."""
+    client_session_mock = CoroutineMock()
+    client_session_mock.post.return_value.__aenter__.return_value.status = 200
+    client_session_mock.post.return_value.__aenter__.return_value.text = (
+        CoroutineMock(return_value='foo'))
+    mocked_basic_auth = mocker.patch('app.lists.BasicAuth')
+    async_request_response = await mailchimp_list.make_async_request(
+        'www.foo.com', None, client_session_mock, json_payload={'foo': 'bar'})
+    client_session_mock.post.assert_called_with(
+        'www.foo.com', json={'foo': 'bar'},
+        auth=mocked_basic_auth('shorenstein', 'foo-bar1'),
+        proxy=None, timeout=ANY)
+    client_session_mock.get.assert_not_called()
     assert async_request_response == 'foo'
 
+@pytest.mark.asyncio
+async def test_make_async_request_reports_to_controller(mocker, mailchimp_list):
+    """Tests that the make_async_request function reports each attempt to
+    the controller."""
+    client_session_mock = CoroutineMock()
+    client_session_mock.get.return_value.__aenter__.return_value.status = 429
+    client_session_mock.get.return_value.__aenter__.return_value.reason = 'foo'
+    client_session_mock.get.return_value.__aenter__.return_value.headers = {}
+    mocker.patch('app.lists.BasicAuth')
+    mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
+    mocked_controller = MagicMock()
+    with pytest.raises(MailChimpImportError):
+        await mailchimp_list.make_async_request(
+            'www.foo.com', 'foo', client_session_mock,
+            controller=mocked_controller)
+    assert mocked_controller.record.call_args_list == [
+        call(ANY, 429)] * (mailchimp_list.MAX_RETRIES + 1)
+
+@pytest.mark.asyncio
+async def test_make_async_request_honors_retry_after(mocker, mailchimp_list):
+    """Tests that the make_async_request function waits at least as long
+    as MailChimp's Retry-After header asks before retrying."""
+    throttled_response = MagicMock(status=429, reason='foo',
+                                   headers={'Retry-After': '100'})
+    ok_response = MagicMock(status=200, text=CoroutineMock(return_value='bar'))
+    client_session_mock = asynctest.MagicMock()
+    client_session_mock.get.return_value.__aenter__.side_effect = [
+        throttled_response, ok_response]
+    mocker.patch('app.lists.BasicAuth')
+    mocked_sleep = mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
+    assert await mailchimp_list.make_async_request(
+        'www.foo.com', 'foo', client_session_mock) == 'bar'
+    (delay,), _ = mocked_sleep.call_args
+    assert delay >= 100
+
+@pytest.mark.asyncio
+async def test_make_async_request_deadline_exceeded(mocker, mailchimp_list):
+    """Tests that the make_async_request function fails without making a
+    request once the import's deadline has passed."""
+    client_session_mock = MagicMock()
+    mailchimp_list.retry_policy = RetryPolicy(deadline=0)
+    with pytest.raises(MailChimpImportError) as e:
+        await mailchimp_list.make_async_request(
+            'www.foo.com', 'foo', client_session_mock)
+    assert e.value.error_details['application_exception'] == (
+        'ImportDeadlineExceeded')
+    client_session_mock.get.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_gather_requests_cancels_outstanding(mailchimp_list):
+    """Tests that the gather_requests function cancels outstanding tasks
+    when the deadline passes."""
+    mailchimp_list.retry_policy = RetryPolicy(deadline=0.01)
+    tasks = [asyncio.ensure_future(asyncio.sleep(0)),
+             asyncio.ensure_future(asyncio.sleep(10))]
+    with pytest.raises(MailChimpImportError):
+        await mailchimp_list.gather_requests(tasks, 'www.foo.com')
+    await asyncio.sleep(0)
+    assert all(task.done() for task in tasks)
+
 @pytest.mark.asyncio
 async def test_make_async_request_with_status_code_retry(
         mocker, caplog, mailchimp_list):
@@ -133,6 +182,7 @@ async def test_make_async_request_with_status_code_retry(
     bad status code."""
     client_session_mock = CoroutineMock()
     client_session_mock.get.return_value.__aenter__.return_value.reason = 'foo'
+    client_session_mock.get.return_value.__aenter__.return_value.headers = {}
     mocker.patch('app.lists.BasicAuth')
     mocked_sleep = mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
     status_code = random.choice(mailchimp_list.HTTP_STATUS_CODES_TO_RETRY)
@@ -148,9 +198,11 @@ async def test_make_async_request_with_status_code_retry(
             ('mailchimp_url', 'www.foo.com'),
             ('api_key', 'foo-bar1'),
             ('mailchimp_err_reason', 'foo')])
-    mocked_sleep.assert_has_calls([
-        call(mailchimp_list.BACKOFF_INTERVAL ** x)
-        for x in range(1, mailchimp_list.MAX_RETRIES + 1)])
+    assert mocked_sleep.call_count == mailchimp_list.MAX_RETRIES
+    assert all(
+        mailchimp_list.BACKOFF_INTERVAL <= delay <=
+        mailchimp_list.MAX_BACKOFF_INTERVAL
+        for (delay,), _ in mocked_sleep.call_args_list)
     assert 'Invalid response code from MailChimp' in caplog.text
 
 @pytest.mark.parametrize('error, error_args', [
@@ -176,11 +228,103 @@ async def test_make_async_request_request_error(
             ('application_exception', str(error)),
             ('mailchimp_url', 'www.foo.com'),
             ('api_key', 'foo-bar1')])
-    mocked_sleep.assert_has_calls([
-        call(mailchimp_list.BACKOFF_INTERVAL ** x)
-        for x in range(1, mailchimp_list.MAX_RETRIES + 1)])
+    assert mocked_sleep.call_count == mailchimp_list.MAX_RETRIES
+    assert all(
+        mailchimp_list.BACKOFF_INTERVAL <= delay <=
+        mailchimp_list.MAX_BACKOFF_INTERVAL
+        for (delay,), _ in mocked_sleep.call_args_list)
     assert 'Error in async request to MailChimp' in caplog.text
 
+@pytest.mark.asyncio
+async def test_make_async_request_replaces_flagged_proxy(
+        mocker, mailchimp_list):
+    """Tests that the make_async_request function flags a proxy which
+    fails, and retries through a new one."""
+    client_session_mock = asynctest.MagicMock()
+    response = client_session_mock.get.return_value.__aenter__.return_value
+    client_session_mock.get.return_value.__aenter__.side_effect = [
+        ClientHttpProxyError('foo', 'bar'), response]
+    response.status = 200
+    response.text = CoroutineMock(return_value='foo')
+    mocker.patch('app.lists.BasicAuth')
+    mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
+    mailchimp_list.proxy = 'http://foo:1'
+    mailchimp_list.proxy_pool = MagicMock()
+    mailchimp_list.proxy_pool.is_flagged.return_value = True
+    mailchimp_list.proxy_pool.lease = CoroutineMock(
+        return_value='http://bar:2')
+    assert await mailchimp_list.make_async_request(
+        'www.foo.com', 'foo', client_session_mock) == 'foo'
+    mailchimp_list.proxy_pool.flag.assert_called_with('http://foo:1')
+    assert mailchimp_list.proxy == 'http://bar:2'
+    _, kwargs = client_session_mock.get.call_args
+    assert kwargs['proxy'] == 'http://bar:2'
+
+@pytest.mark.asyncio
+async def test_make_async_request_cached(mocker, mailchimp_list, tmpdir):
+    """Tests that the make_async_request function caches responses, and
+    serves fresh ones without making a request."""
+    client_session_mock = asynctest.MagicMock()
+    response = client_session_mock.get.return_value.__aenter__.return_value
+    response.status = 200
+    response.headers = {'ETag': 'bar'}
+    response.read = CoroutineMock(return_value=b'{"foo": 1}')
+    mocker.patch('app.lists.BasicAuth')
+    mailchimp_list.response_cache = ResponseCache(
+        str(tmpdir.join('responses.sqlite3')), 1 << 20)
+    url = 'https://bar1.api.mailchimp.com/3.0/lists/1/members'
+    for _ in range(2):
+        assert await mailchimp_list.make_async_request(
+            url, (('count', '1'),), client_session_mock) == '{"foo": 1}'
+    assert await mailchimp_list.make_async_request(
+        url, (('count', '1'),), client_session_mock,
+        as_bytes=True) == b'{"foo": 1}'
+    assert client_session_mock.get.call_count == 1
+
+@pytest.mark.asyncio
+async def test_make_async_request_bypasses_cache(
+        mocker, mailchimp_list, tmpdir):
+    """Tests that the make_async_request function neither serves nor
+    stores responses if it mustn't use the cache."""
+    client_session_mock = asynctest.MagicMock()
+    response = client_session_mock.get.return_value.__aenter__.return_value
+    response.status = 200
+    response.headers = {}
+    response.text = CoroutineMock(return_value='{"total_items": 2}')
+    mocker.patch('app.lists.BasicAuth')
+    mailchimp_list.response_cache = ResponseCache(
+        str(tmpdir.join('responses.sqlite3')), 1 << 20)
+    url = 'https://bar1.api.mailchimp.com/3.0/lists/1/members'
+    mailchimp_list.response_cache.put(
+        url, (('count', '1'),), 'foo-bar1', b'{"total_items": 1}')
+    for _ in range(2):
+        assert await mailchimp_list.make_async_request(
+            url, (('count', '1'),), client_session_mock,
+            use_cache=False) == '{"total_items": 2}'
+    assert client_session_mock.get.call_count == 2
+    assert mailchimp_list.response_cache.get(
+        url, (('count', '1'),), 'foo-bar1').body == b'{"total_items": 1}'
+
+@pytest.mark.asyncio
+async def test_make_async_request_revalidates(mocker, mailchimp_list, tmpdir):
+    """Tests that the make_async_request function revalidates a stale
+    cached response with its ETag."""
+    client_session_mock = asynctest.MagicMock()
+    response = client_session_mock.get.return_value.__aenter__.return_value
+    response.status = 304
+    response.headers = {}
+    mocker.patch('app.lists.BasicAuth')
+    mailchimp_list.response_cache = ResponseCache(
+        str(tmpdir.join('responses.sqlite3')), 1 << 20)
+    url = 'https://bar1.api.mailchimp.com/3.0/lists/1/members'
+    mailchimp_list.response_cache.put(
+        url, None, 'foo-bar1', b'{"foo": 1}', 'bar', now=time.time() - 86000)
+    assert await mailchimp_list.make_async_request(
+        url, None, client_session_mock) == '{"foo": 1}'
+    _, kwargs = client_session_mock.get.call_args
+    assert kwargs['headers'] == {'If-None-Match': 'bar'}
+    assert mailchimp_list.response_cache.get(url, None, 'foo-bar1').fresh
+
 @pytest.mark.asyncio
 async def test_make_async_requests(mocker, mailchimp_list):
     """Tests the make_async_requests function."""
@@ -191,7 +335,232 @@ async def test_make_async_requests(mocker, mailchimp_list):
     assert ['foo'] == await mailchimp_list.make_async_requests(
         semaphore_mock, 'www.foo.com', 'foo', 'bar')
     mocked_make_async_request.assert_called_with(
-        'www.foo.com', 'foo', 'bar')
+        'www.foo.com', 'foo', 'bar', controller=None)
+
+@pytest.mark.asyncio
+async def test_make_async_requests_with_controller(mocker, mailchimp_list):
+    """Tests that the make_async_requests function reports back to an
+    AIMDController passed in place of a semaphore."""
+    controller = AIMDController(2)
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock())
+    mocked_make_async_request.return_value = '["foo"]'
+    assert ['foo'] == await mailchimp_list.make_async_requests(
+        controller, 'www.foo.com', 'foo', 'bar')
+    mocked_make_async_request.assert_called_with(
+        'www.foo.com', 'foo', 'bar', controller=controller)
+    assert controller.in_flight == 0
+
+def test_decode_json():
+    """Tests that the decode_json function decodes bytes and str."""
+    assert decode_json(b'{"foo": [1]}') == {'foo': [1]}
+    assert decode_json('{"foo": [1]}') == {'foo': [1]}
+
+@pytest.mark.asyncio
+async def test_decode_json_in_executor():
+    """Tests the decode_json_in_executor function."""
+    assert await decode_json_in_executor(b'{"foo": "bar"}') == {'foo': 'bar'}
+
+@pytest.mark.asyncio
+async def test_make_async_requests_decodes_after_release(
+        mocker, mailchimp_list):
+    """Tests that the make_async_requests function frees its request slot
+    before decoding the response."""
+    controller = AIMDController(1)
+    mocker.patch('app.lists.MailChimpList.make_async_request',
+                 new=CoroutineMock(return_value='{}'))
+
+    def fake_decode_json(body): # pylint: disable=unused-argument
+        assert controller.in_flight == 0
+        return {}
+
+    mocker.patch('app.lists.decode_json', side_effect=fake_decode_json)
+    assert await mailchimp_list.make_async_requests(
+        controller, 'www.foo.com', 'foo', 'bar') == {}
+
+@pytest.mark.asyncio
+async def test_make_async_requests_decodes_in_executor(
+        mocker, mailchimp_list):
+    """Tests that the make_async_requests function decodes responses off
+    the event loop."""
+    mocker.patch('app.lists.MailChimpList.make_async_request',
+                 new=CoroutineMock(return_value='{"foo": 1}'))
+    mocked_decode_json_in_executor = mocker.patch(
+        'app.lists.decode_json_in_executor', new=CoroutineMock(
+            return_value={'foo': 1}))
+    assert await mailchimp_list.make_async_requests(
+        asynctest.MagicMock(), 'www.foo.com', 'foo', 'bar') == {'foo': 1}
+    mocked_decode_json_in_executor.assert_called_with('{"foo": 1}')
+
+def test_member_columns():
+    """Tests the MemberColumns class."""
+    columns = MemberColumns()
+    columns.append_members([
+        {'status': 'subscribed', 'timestamp_opt': '2018-01-01T00:00:00+00:00',
+         'timestamp_signup': '', 'id': 'baz',
+         'stats': {'avg_open_rate': 0.5, 'avg_click_rate': 0.1}}])
+    columns.append_members([
+        {'status': 'cleaned', 'timestamp_opt': '2018-01-02T01:00:00+01:00',
+         'timestamp_signup': '2017-01-01T00:00:00+00:00', 'id': 'quuz',
+         'stats': {}}])
+    assert len(columns) == 2
+    assert_frame_equal(columns.to_frame(), pd.DataFrame({
+        'status': pd.Categorical(['subscribed', 'cleaned']),
+        'timestamp_opt': pd.to_datetime(
+            ['2018-01-01', '2018-01-02'], utc=True),
+        'timestamp_signup': pd.to_datetime([None, '2017-01-01'], utc=True),
+        'id': ['baz', 'quuz'],
+        'avg_open_rate': np.array([0.5, np.NaN], dtype=np.float32),
+        'avg_click_rate': np.array([0.1, np.NaN], dtype=np.float32)
+    }, columns=['status', 'timestamp_opt', 'timestamp_signup', 'id',
+                'avg_open_rate', 'avg_click_rate']))
+
+def test_member_columns_apply_schema():
+    """Tests that the apply_schema function converts frames from older
+    snapshots, and leaves converted frames as they are."""
+    df = MemberColumns.apply_schema(pd.DataFrame({ # pylint: disable=invalid-name
+        'status': ['subscribed', 'pending'],
+        'timestamp_opt': ['2018-01-01T00:00:00+00:00', ''],
+        'id': ['foo', 'bar'],
+        'avg_open_rate': [0.8, 0.1]}))
+    expected_df = pd.DataFrame({
+        'status': pd.Categorical(['subscribed', 'pending']),
+        'timestamp_opt': pd.to_datetime(['2018-01-01', None], utc=True),
+        'id': ['foo', 'bar'],
+        'avg_open_rate': np.array([0.8, 0.1], dtype=np.float32)})
+    assert_frame_equal(df, expected_df)
+    assert_frame_equal(MemberColumns.apply_schema(df.copy()), expected_df)
+
+def test_member_schema_leaves_results_unchanged(mailchimp_list):
+    """Tests that the calc_* functions give the same results whether the
+    rates are float64 or float32, including rates on the bin edges."""
+    open_rates = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.81, 0.9, 1]
+    statuses = ['subscribed'] * (len(open_rates) - 1) + ['cleaned']
+    results = []
+    for schema in (False, True):
+        df = pd.DataFrame({ # pylint: disable=invalid-name
+            'status': statuses, 'id': [str(x) for x in open_rates],
+            'avg_open_rate': open_rates,
+            'recent_open': pd.to_datetime(
+                ['2018-01-01'] * 4 + [None] * 8, utc=True)})
+        mailchimp_list.df = (
+            MemberColumns.apply_schema(df) if schema else df)
+        mailchimp_list.count = len(open_rates)
+        mailchimp_list.subscribers = len(open_rates) - 1
+        mailchimp_list.calc_list_breakdown()
+        mailchimp_list.calc_histogram()
+        mailchimp_list.calc_high_open_rate_pct()
+        mailchimp_list.calc_cur_yr_stats()
+        results.append((
+            mailchimp_list.subscribed_pct, mailchimp_list.cleaned_pct,
+            mailchimp_list.pending_pct, mailchimp_list.hist_bin_counts,
+            mailchimp_list.high_open_rt_pct,
+            mailchimp_list.cur_yr_inactive_pct,
+            mailchimp_list.open_rate_deciles(
+                mailchimp_list.df['avg_open_rate'].values).tolist()))
+    assert results[0] == results[1]
+    assert results[1][3] == [2, 1, 1, 1, 1, 1, 1, 1, 2, 0]
+
+def test_member_columns_empty():
+    """Tests that an empty MemberColumns still yields the expected columns."""
+    frame = MemberColumns().to_frame()
+    assert frame.empty
+    assert list(frame.columns) == [
+        'status', 'timestamp_opt', 'timestamp_signup', 'id',
+        'avg_open_rate', 'avg_click_rate']
+
+def test_plan_member_chunks(mailchimp_list):
+    """Tests the plan_member_chunks function."""
+    controller = AIMDController(1, 5000, min_chunk_size=1000)
+    mailchimp_list.count = 10020
+    chunks = mailchimp_list.plan_member_chunks(controller)
+    assert next(chunks)[1:] == (('count', '5000'), ('offset', '0'))
+    controller.record(0, 429)
+    assert next(chunks)[1:] == (('count', '2500'), ('offset', '5000'))
+    assert next(chunks)[1:] == (('count', '2500'), ('offset', '7500'))
+    assert next(chunks)[1:] == (('count', '20'), ('offset', '10000'))
+    assert next(chunks, None) is None
+
+def test_plan_member_chunks_exact_multiple(mailchimp_list):
+    """Tests that the plan_member_chunks function doesn't plan an empty
+    chunk when the list size is a multiple of the chunk size."""
+    mailchimp_list.count = 10000
+    chunks = list(mailchimp_list.plan_member_chunks(AIMDController(1, 5000)))
+    assert [chunk[1:] for chunk in chunks] == [
+        (('count', '5000'), ('offset', '0')),
+        (('count', '5000'), ('offset', '5000'))]
+
+def test_plan_member_chunks_skips_completed(mailchimp_list):
+    """Tests that the plan_member_chunks function only plans the gaps
+    between chunks which have already been imported."""
+    mailchimp_list.count = 10000
+    chunks = list(mailchimp_list.plan_member_chunks(
+        AIMDController(1, 5000), [(0, 2000), (5000, 2500)]))
+    assert [chunk[1:] for chunk in chunks] == [
+        (('count', '3000'), ('offset', '2000')),
+        (('count', '2500'), ('offset', '7500'))]
+
+def test_plan_member_chunks_reuses_cached_pages(mailchimp_list):
+    """Tests that the plan_member_chunks function takes the size of a
+    cached page starting where a chunk does."""
+    mailchimp_list.count = 10000
+    chunks = list(mailchimp_list.plan_member_chunks(
+        AIMDController(1, 5000), cached=[(0, 3000), (4000, 1000)]))
+    assert [chunk[1:] for chunk in chunks] == [
+        (('count', '3000'), ('offset', '0')),
+        (('count', '5000'), ('offset', '3000')),
+        (('count', '2000'), ('offset', '8000'))]
+
+def test_cached_member_chunks(mocker, mailchimp_list):
+    """Tests the cached_member_chunks function."""
+    assert mailchimp_list.cached_member_chunks('foo') == []
+    mailchimp_list.response_cache = mocker.MagicMock()
+    mailchimp_list.response_cache.fresh_params.return_value = [
+        (('fields', mailchimp_list.MEMBER_FIELDS), ('count', '10'),
+         ('offset', '20')),
+        (('fields', mailchimp_list.MEMBER_FIELDS), ('count', '1')),
+        (('fields', mailchimp_list.MEMBER_FIELDS), ('count', '10'),
+         ('offset', '0'))]
+    assert mailchimp_list.cached_member_chunks('foo') == [(0, 10), (20, 10)]
+    mailchimp_list.response_cache.fresh_params.assert_called_with(
+        'foo', 'foo-bar1')
+
+@pytest.mark.asyncio
+async def test_import_members_worker(mocker, mailchimp_list):
+    """Tests the import_members_worker function."""
+    controller = AIMDController(1)
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            return_value='{"members": [{"foo": "bar"}]}'))
+    mocked_columns = MagicMock()
+    chunks = [(('count', '2'), ('offset', '0')),
+              (('count', '2'), ('offset', '2'))]
+    await mailchimp_list.import_members_worker(
+        controller, 'foo', iter(chunks), 'qux', mocked_columns)
+    mocked_make_async_request.assert_has_calls([
+        call('foo', chunks[0], 'qux', controller=controller, as_bytes=True,
+             use_cache=True),
+        call('foo', chunks[1], 'qux', controller=controller, as_bytes=True,
+             use_cache=True)])
+    assert mocked_columns.append_members.call_args_list == [
+        call([{'foo': 'bar'}])] * 2
+    assert controller.in_flight == 0
+    assert mailchimp_list.checkpoint.member_chunks() == [(0, 2), (2, 2)]
+
+@pytest.mark.asyncio
+async def test_import_members_worker_feeds_subscriber_queue(
+        mocker, mailchimp_list):
+    """Tests that the import_members_worker function hands each chunk's
+    subscribers to the activity prefetcher."""
+    mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            return_value='{"members": [{"id": "foo", "status": "subscribed"}, '
+                         '{"id": "bar", "status": "cleaned"}]}'))
+    mailchimp_list.subscriber_queue = asyncio.Queue()
+    await mailchimp_list.import_members_worker(
+        AIMDController(1), 'foo', iter([(('count', '2'), ('offset', '0'))]),
+        'qux', MagicMock())
+    assert mailchimp_list.subscriber_queue.get_nowait() == ['foo']
 
 @pytest.mark.asyncio
 async def test_import_list_members(mocker, mailchimp_list):
@@ -199,33 +568,225 @@ async def test_import_list_members(mocker, mailchimp_list):
     mocked_enable_proxy = mocker.patch(
         'app.lists.MailChimpList.enable_proxy', new=CoroutineMock())
     mocked_asyncio = mocker.patch('app.lists.asyncio')
-    mocked_sem = mocked_asyncio.Semaphore.return_value
-    mocked_make_async_requests = mocker.patch(
-        'app.lists.MailChimpList.make_async_requests')
-    mocked_asyncio.gather = CoroutineMock(return_value=(
-        [{'foo': [{'foo': 'bar'}]}, {'bar': [{'foo': 'baz'}]}]))
-    mailchimp_list.count = 10020
+    mocked_asyncio.wait_for = CoroutineMock()
+    mocked_controller = mocker.patch('app.lists.AIMDController')
+    mocked_controller.load.return_value.max_concurrency = 3
+    mocked_import_members_worker = mocker.patch(
+        'app.lists.MailChimpList.import_members_worker', new=CoroutineMock())
+    mocked_plan_member_chunks = mocker.patch(
+        'app.lists.MailChimpList.plan_member_chunks')
+    mocked_plan_member_chunks.return_value = iter([])
+    mocked_member_columns = mocker.patch('app.lists.MemberColumns')
+    mocked_count_list_members = mocker.patch(
+        'app.lists.MailChimpList.count_list_members',
+        new=CoroutineMock(return_value=5))
     await mailchimp_list.import_list_members()
     mocked_enable_proxy.assert_called()
-    mocked_asyncio.Semaphore.assert_called_with(mailchimp_list.MAX_CONNECTIONS)
-    async_requests_calls_args_list = [
-        arg
-        for args, _ in mocked_make_async_requests.call_args_list
-        for arg in args]
-    assert all(
-        requests_arg in async_requests_calls_args_list
-        for requests_arg in [
-            'https://bar1.api.mailchimp.com/3.0/lists/1/members',
-            (ANY, ('count', '5000'), ('offset', '0')),
-            (ANY, ('count', '5000'), ('offset', '5000')),
-            (ANY, ('count', '20'), ('offset', '10000')),
-            mocked_sem
-        ])
+    mocked_controller.load.assert_called_with(
+        'bar1', 'members', mailchimp_list.MAX_CONNECTIONS,
+        mailchimp_list.CHUNK_SIZE, min_chunk_size=ANY, max_chunk_size=ANY,
+        max_concurrency=ANY, target_latency=ANY)
+    mocked_plan_member_chunks.assert_called_with(
+        mocked_controller.load.return_value, [])
+    mocked_import_members_worker.assert_called_with(
+        mocked_controller.load.return_value,
+        'https://bar1.api.mailchimp.com/3.0/lists/1/members',
+        mocked_plan_member_chunks.return_value, ANY,
+        mocked_member_columns.return_value)
+    assert mocked_import_members_worker.call_count == 4
+    mocked_count_list_members.assert_called_with(
+        'https://bar1.api.mailchimp.com/3.0/lists/1/members', ANY)
+    assert mailchimp_list.count == 5
     assert mocked_asyncio.ensure_future.call_count == 3
     args, _ = mocked_asyncio.gather.call_args
     assert len(args) == 3
-    fake_df = pd.DataFrame({'foo': ['bar', 'baz']})
-    assert_frame_equal(fake_df, mailchimp_list.df)
+    mocked_controller.load.return_value.save.assert_called()
+    assert mailchimp_list.df == (
+        mocked_member_columns.return_value.to_frame.return_value)
+
+@pytest.mark.asyncio
+async def test_import_list_members_resumes(mocker, mailchimp_list):
+    """Tests that the import_list_members function loads checkpointed
+    chunks instead of requesting them again."""
+    mocker.patch('app.lists.MailChimpList.enable_proxy', new=CoroutineMock())
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            side_effect=[
+                json.dumps({'members': [{
+                    'id': 'bar', 'status': 'subscribed',
+                    'stats': {'avg_open_rate': 0.5, 'avg_click_rate': 0.1}}],
+                            'total_items': 2}),
+                json.dumps({'total_items': 2})]))
+    mailchimp_list.count = 2
+    mailchimp_list.checkpoint.save_member_chunk(0, 1, [{
+        'id': 'foo', 'status': 'cleaned',
+        'stats': {'avg_open_rate': 0.2, 'avg_click_rate': 0}}])
+    await mailchimp_list.import_list_members()
+    assert mocked_make_async_request.call_args_list[0] == call(
+        ANY, (ANY, ('count', '1'), ('offset', '1')), ANY, controller=ANY,
+        as_bytes=True, use_cache=False)
+    assert mailchimp_list.df['id'].tolist() == ['foo', 'bar']
+    assert mailchimp_list.checkpoint.member_chunks() == [(0, 1), (1, 1)]
+
+@pytest.mark.asyncio
+async def test_import_list_members_corrects_count(mocker, mailchimp_list):
+    """Tests that the import_list_members function plans its chunks from
+    MailChimp's count rather than a stale one, and imports members added
+    during the import."""
+    mocker.patch('app.lists.MailChimpList.enable_proxy', new=CoroutineMock())
+    mocker.patch('app.lists.AIMDController.load',
+                 return_value=AIMDController(1, 2, min_chunk_size=1))
+
+    def fake_members(start, end, total_items):
+        return json.dumps({'members': [
+            {'id': str(member_num), 'status': 'subscribed'}
+            for member_num in range(start, end)], 'total_items': total_items})
+
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            side_effect=[fake_members(0, 2, 3), fake_members(2, 3, 3),
+                         json.dumps({'total_items': 4}),
+                         fake_members(3, 4, 4),
+                         json.dumps({'total_items': 4})]))
+    mailchimp_list.count = 10
+    await mailchimp_list.import_list_members()
+    chunks = [args[1][1:] for args, _
+              in mocked_make_async_request.call_args_list
+              if len(args[1]) == 3]
+    assert chunks == [
+        (('count', '2'), ('offset', '0')), (('count', '1'), ('offset', '2')),
+        (('count', '1'), ('offset', '3'))]
+    assert mailchimp_list.df['id'].tolist() == ['0', '1', '2', '3']
+    assert mailchimp_list.count == 4
+
+@pytest.mark.asyncio
+async def test_count_list_members(mocker, mailchimp_list):
+    """Tests the count_list_members function."""
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            return_value='{"total_items": 5}'))
+    assert await mailchimp_list.count_list_members('foo', 'bar') == 5
+    mocked_make_async_request.assert_called_with(
+        'foo', (('fields', 'total_items'), ('count', '1')), 'bar',
+        use_cache=False)
+
+@pytest.mark.asyncio
+async def test_import_changed_members(mocker, mailchimp_list):
+    """Tests the import_changed_members function."""
+    member = {'status': 'subscribed', 'timestamp_opt': 'foo',
+              'timestamp_signup': 'bar', 'id': 'baz',
+              'stats': {'avg_open_rate': 0.5, 'avg_click_rate': 0.1}}
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            side_effect=[
+                json.dumps({'members': [member, member], 'total_items': 3}),
+                json.dumps({'members': [member], 'total_items': 3})]))
+    mailchimp_list.CHUNK_SIZE = 2
+    changed_members = await mailchimp_list.import_changed_members(
+        datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc))
+    assert len(changed_members) == 3
+    assert mocked_make_async_request.call_count == 2
+    args, _ = mocked_make_async_request.call_args
+    assert args[1][1:] == (
+        ('since_last_changed', '2000-01-01T00:00:00+00:00'),
+        ('count', '2'),
+        ('offset', '2'))
+
+@pytest.mark.asyncio
+async def test_import_list_members_incremental_no_snapshot(
+        mocker, mailchimp_list):
+    """Tests the import_list_members_incremental function when there's no
+    snapshot to update."""
+    mocker.patch('app.lists.load_latest_snapshot', return_value=None)
+    mocked_import_list_members = mocker.patch(
+        'app.lists.MailChimpList.import_list_members', new=CoroutineMock())
+    mailchimp_list.keep_snapshot = True
+    mailchimp_list.df = pd.DataFrame({'id': ['foo']})
+    await mailchimp_list.import_list_members_incremental()
+    mocked_import_list_members.assert_called()
+    assert mailchimp_list.fetch_metadata == {
+        'members_mode': 'full', 'members_fetched_at': ANY,
+        'members_full_fetched_at': ANY, 'members': 1}
+    assert (mailchimp_list.fetch_metadata['members_full_fetched_at'] ==
+            mailchimp_list.fetch_metadata['members_fetched_at'])
+
+@pytest.mark.asyncio
+async def test_import_list_members_incremental_without_keep_snapshot(
+        mocker, mailchimp_list):
+    """Tests that the import_list_members_incremental function doesn't use
+    snapshots unless the user allowed us to store the list."""
+    mocked_load_latest_snapshot = mocker.patch(
+        'app.lists.load_latest_snapshot')
+    mocked_import_list_members = mocker.patch(
+        'app.lists.MailChimpList.import_list_members', new=CoroutineMock())
+    mailchimp_list.df = pd.DataFrame({'id': ['foo']})
+    await mailchimp_list.import_list_members_incremental()
+    mocked_import_list_members.assert_called()
+    mocked_load_latest_snapshot.assert_not_called()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('count, full_import', [(3, False), (10, True)])
+async def test_import_list_members_incremental_with_snapshot(
+        mocker, mailchimp_list, count, full_import):
+    """Tests the import_list_members_incremental function when there's a
+    snapshot to update."""
+    fetched_at = datetime.datetime.now(datetime.timezone.utc).replace(
+        microsecond=0)
+    mocked_load_latest_snapshot = mocker.patch(
+        'app.lists.load_latest_snapshot', return_value=(
+            pd.DataFrame({'id': ['foo', 'bar'], 'avg_open_rate': [0.1, 0.2]}),
+            {'members_fetched_at': fetched_at.timestamp(),
+             'members_full_fetched_at': fetched_at.timestamp() - 3600}))
+    mocker.patch('app.lists.MailChimpList.enable_proxy', new=CoroutineMock())
+    mocked_import_changed_members = mocker.patch(
+        'app.lists.MailChimpList.import_changed_members', new=CoroutineMock(
+            return_value=pd.DataFrame({
+                'id': ['bar', 'baz'], 'avg_open_rate': [0.3, 0.4]})))
+    mocked_import_list_members = mocker.patch(
+        'app.lists.MailChimpList.import_list_members', new=CoroutineMock())
+    mailchimp_list.keep_snapshot = True
+    mailchimp_list.count = count
+    await mailchimp_list.import_list_members_incremental()
+    mocked_load_latest_snapshot.assert_called_with(1, columns=[
+        'status', 'timestamp_opt', 'timestamp_signup', 'id',
+        'avg_open_rate', 'avg_click_rate'])
+    mocked_import_changed_members.assert_called_with(fetched_at)
+    if full_import:
+        mocked_import_list_members.assert_called()
+        assert mailchimp_list.fetch_metadata['members_mode'] == 'full'
+    else:
+        mocked_import_list_members.assert_not_called()
+        assert_frame_equal(mailchimp_list.df, pd.DataFrame({
+            'id': ['foo', 'bar', 'baz'],
+            'avg_open_rate': np.array([0.1, 0.3, 0.4], dtype=np.float32)}))
+        assert mailchimp_list.fetch_metadata == {
+            'members_mode': 'incremental', 'members_changed': 2,
+            'members_fetched_at': ANY,
+            'members_full_fetched_at': fetched_at.timestamp() - 3600,
+            'members': 3}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('metadata', [
+    {'members_full_fetched_at': 0},
+    {}])
+async def test_import_list_members_incremental_stale_stats(
+        mocker, mailchimp_list, metadata):
+    """Tests that the import_list_members_incremental function imports
+    every member again once the snapshot's last full import is older than
+    SNAPSHOT_MAX_AGE, however recently it was updated."""
+    mocker.patch('app.lists.load_latest_snapshot', return_value=(
+        pd.DataFrame({'id': ['foo']}),
+        {'members_fetched_at': time.time(), **metadata}))
+    mocked_import_changed_members = mocker.patch(
+        'app.lists.MailChimpList.import_changed_members', new=CoroutineMock())
+    mocked_import_list_members = mocker.patch(
+        'app.lists.MailChimpList.import_list_members', new=CoroutineMock())
+    mailchimp_list.keep_snapshot = True
+    mailchimp_list.df = pd.DataFrame({'id': ['foo']})
+    await mailchimp_list.import_list_members_incremental()
+    mocked_import_changed_members.assert_not_called()
+    mocked_import_list_members.assert_called()
+    assert mailchimp_list.fetch_metadata['members_mode'] == 'full'
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize('api_results, output_df', [
@@ -252,7 +813,7 @@ async def test_import_list_members(mocker, mailchimp_list):
         }],
      pd.DataFrame({
          'id': ['foo', 'bar'],
-         'recent_open': ['2000-10-1T00:00:00+00:00', np.NaN]
+         'recent_open': pd.to_datetime(['2000-10-01', None], utc=True)
      })
     ),
     ([
@@ -278,7 +839,7 @@ async def test_import_list_members(mocker, mailchimp_list):
         }],
      pd.DataFrame({
          'id': ['foo', 'bar'],
-         'recent_open': [np.NaN, np.NaN]
+         'recent_open': pd.to_datetime([None, None], utc=True)
      }),
     )
 ])
@@ -286,22 +847,30 @@ async def test_import_sub_activity(
         mocker, mailchimp_list, api_results, output_df):
     """Tests the import_sub_activity function."""
     mocked_asyncio = mocker.patch('app.lists.asyncio')
-    mocked_sem = mocked_asyncio.Semaphore.return_value
+    mocked_controller = mocker.patch('app.lists.AIMDController')
+    mocked_sem = mocked_controller.load.return_value
     mocker.patch('app.lists.MailChimpList.get_list_ids',
                  return_value=['foo', 'bar'])
-    mocked_make_async_requests = mocker.patch(
-        'app.lists.MailChimpList.make_async_requests')
-    mocked_asyncio.gather = CoroutineMock(return_value=api_results)
+    mocked_request_checkpointed_activity = mocker.patch(
+        'app.lists.MailChimpList.request_checkpointed_activity')
+
+    def fake_wait_for(awaitable, timeout): # pylint: disable=unused-argument
+        for response in api_results:
+            mailchimp_list.record_sub_activity(response)
+
+    mocked_asyncio.wait_for = CoroutineMock(side_effect=fake_wait_for)
     mocked_datetime = mocker.patch('app.lists.datetime')
     mocked_datetime.now.return_value = datetime.datetime(
         2001, 1, 1, tzinfo=datetime.timezone.utc)
     mailchimp_list.df = pd.DataFrame({'id': ['foo', 'bar']})
     await mailchimp_list.import_sub_activity()
-    mocked_asyncio.Semaphore.assert_called_with(
-        mailchimp_list.MAX_ACTIVITY_CONNECTIONS)
+    mocked_controller.load.assert_called_with(
+        'bar1', 'activity', mailchimp_list.MAX_ACTIVITY_CONNECTIONS,
+        max_concurrency=ANY, target_latency=ANY)
+    mocked_sem.save.assert_called()
     async_requests_calls_args_list = [
         arg
-        for args, _ in mocked_make_async_requests.call_args_list
+        for args, _ in mocked_request_checkpointed_activity.call_args_list
         for arg in args]
     assert all(
         request_arg in async_requests_calls_args_list
@@ -314,6 +883,637 @@ async def test_import_sub_activity(
     assert len(args) == 2
     assert_frame_equal(output_df, mailchimp_list.df)
 
+@pytest.mark.asyncio
+async def test_import_sub_activity_resumes(mocker, mailchimp_list):
+    """Tests that the import_sub_activity function only requests the
+    activity of subscribers who weren't checkpointed, and clears the
+    checkpoint once it's done."""
+    mocker.patch('app.lists.MailChimpList.get_list_ids',
+                 return_value=['foo', 'bar'])
+    mocked_request_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.request_sub_activity', new=CoroutineMock())
+    recent_open = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    mailchimp_list.checkpoint.save_activity({
+        'email_id': 'foo',
+        'activity': [{'action': 'open', 'timestamp': recent_open}]})
+    mailchimp_list.checkpoint.save_member_chunk(0, 2, [])
+    mailchimp_list.df = pd.DataFrame({'id': ['foo', 'bar']})
+    await mailchimp_list.import_sub_activity()
+    mocked_request_sub_activity.assert_called_with(['bar'])
+    assert_frame_equal(mailchimp_list.df, pd.DataFrame({
+        'id': ['foo', 'bar'],
+        'recent_open': pd.to_datetime([recent_open, None], utc=True)}))
+    assert mailchimp_list.checkpoint.member_chunks() == []
+    assert list(mailchimp_list.checkpoint.load_activity()) == []
+
+@pytest.mark.asyncio
+async def test_import_sub_activity_samples_large_lists(mocker, mailchimp_list):
+    """Tests that the import_sub_activity function only requests a
+    sample's activity on very large lists."""
+    mocker.patch('app.lists.MailChimpList.get_list_ids',
+                 return_value=['foo', 'bar', 'baz', 'qux'])
+    mocked_request_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.request_sub_activity', new=CoroutineMock())
+    mailchimp_list.ACTIVITY_SAMPLING_THRESHOLD = 4
+    mailchimp_list.ACTIVITY_SAMPLE_SIZE = 2
+    mailchimp_list.MIN_STRATUM_SAMPLE_SIZE = 1
+    mailchimp_list.df = pd.DataFrame({
+        'id': ['foo', 'bar', 'baz', 'qux'],
+        'status': ['subscribed'] * 4,
+        'avg_open_rate': [0.05, 0.05, 0.95, 0.95]})
+    await mailchimp_list.import_sub_activity()
+    args, _ = mocked_request_sub_activity.call_args
+    assert len(args[0]) == 2
+    assert set(args[0]) & {'foo', 'bar'} and set(args[0]) & {'baz', 'qux'}
+    assert mailchimp_list.fetch_metadata['activity_sample'] == 2
+
+def test_open_rate_deciles(mailchimp_list):
+    """Tests the open_rate_deciles function."""
+    assert mailchimp_list.open_rate_deciles(
+        np.array([0, 0.1, 0.15, 0.95, 1, np.NaN])).tolist() == [
+            0, 0, 1, 9, 9, 0]
+
+def test_sample_subscribers(mailchimp_list):
+    """Tests that the sample_subscribers function samples each decile
+    in proportion, with a floor, and draws the same sample every time."""
+    mailchimp_list.ACTIVITY_SAMPLE_SIZE = 100
+    mailchimp_list.MIN_STRATUM_SAMPLE_SIZE = 10
+    mailchimp_list.df = pd.DataFrame({
+        'id': ['id{}'.format(i) for i in range(1001)],
+        'status': ['subscribed'] * 1000 + ['unsubscribed'],
+        'avg_open_rate': [0.05] * 900 + [0.55] * 50 + [0.95] * 51})
+    sample = mailchimp_list.sample_subscribers()
+    assert 'id1000' not in sample
+    assert mailchimp_list.stratum_sizes.tolist() == [
+        900, 0, 0, 0, 0, 50, 0, 0, 0, 50]
+    assert mailchimp_list.activity_sample.value_counts().to_dict() == {
+        0: 90, 5: 10, 9: 10}
+    assert sample == mailchimp_list.sample_subscribers()
+
+def test_estimate_stratified_proportion():
+    """Tests the estimate_stratified_proportion function."""
+    estimate, lower, upper = estimate_stratified_proportion(
+        np.array([0, 0, 0, 0, 1, 1]),
+        np.array([True, True, False, False, True, True]),
+        np.array([100, 100]))
+    assert estimate == 0.75
+    assert 0 < lower < estimate < upper == 1
+
+def test_estimate_stratified_proportion_census():
+    """Tests that the estimate_stratified_proportion function reports no
+    uncertainty when every unit is sampled."""
+    assert estimate_stratified_proportion(
+        np.array([0, 0, 1]), np.array([True, False, True]),
+        np.array([2, 1])) == (2 / 3, 2 / 3, 2 / 3)
+
+@pytest.mark.asyncio
+async def test_import_sub_activity_uses_prefetched(mocker, mailchimp_list):
+    """Tests that the import_sub_activity function only requests the
+    activity of subscribers who weren't prefetched."""
+    mocker.patch('app.lists.MailChimpList.get_list_ids',
+                 return_value=['foo', 'bar'])
+    mocked_request_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.request_sub_activity', new=CoroutineMock())
+    recent_open = pd.Timestamp.now(tz='UTC')
+    mailchimp_list.prefetched_opens = {'foo': recent_open.value}
+    mailchimp_list.df = pd.DataFrame({'id': ['foo', 'bar']})
+    await mailchimp_list.import_sub_activity()
+    mocked_request_sub_activity.assert_called_with(['bar'])
+    assert mailchimp_list.df['recent_open'].tolist()[0] == recent_open
+
+def test_install_uvloop(mocker):
+    """Tests that the install_uvloop function sets uvloop's event loop
+    policy."""
+    mocked_uvloop = mocker.patch('app.lists.uvloop')
+    mocked_set_event_loop_policy = mocker.patch(
+        'app.lists.asyncio.set_event_loop_policy')
+    install_uvloop()
+    mocked_set_event_loop_policy.assert_called_with(
+        mocked_uvloop.EventLoopPolicy.return_value)
+
+def test_install_uvloop_not_installed(mocker):
+    """Tests that the install_uvloop function does nothing without
+    uvloop."""
+    mocker.patch('app.lists.uvloop', new=None)
+    mocked_set_event_loop_policy = mocker.patch(
+        'app.lists.asyncio.set_event_loop_policy')
+    install_uvloop()
+    mocked_set_event_loop_policy.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_request_checkpointed_activity(mocker, mailchimp_list):
+    """Tests the request_checkpointed_activity function."""
+    mocked_make_async_requests = mocker.patch(
+        'app.lists.MailChimpList.make_async_requests', new=CoroutineMock(
+            return_value={'email_id': 'foo', 'activity': []}))
+    mocked_record_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.record_sub_activity')
+    await mailchimp_list.request_checkpointed_activity('bar', 'baz', 'qux')
+    mocked_record_sub_activity.assert_called_with(
+        {'email_id': 'foo', 'activity': []})
+    mocked_make_async_requests.assert_called_with(
+        'bar', 'baz', mailchimp_list.ACTIVITY_FIELDS, 'qux')
+    assert list(mailchimp_list.checkpoint.load_activity()) == [
+        {'email_id': 'foo', 'activity': []}]
+
+@pytest.mark.asyncio
+async def test_import_sub_activity_uses_batches(mocker, mailchimp_list):
+    """Tests that the import_sub_activity function uses the Batch
+    Operations API for large lists."""
+    mocker.patch('app.lists.MailChimpList.get_list_ids',
+                 return_value=['foo', 'bar'])
+    mocked_import_sub_activity_batch = mocker.patch(
+        'app.lists.MailChimpList.import_sub_activity_batch',
+        new=CoroutineMock())
+    mocked_request_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.request_sub_activity', new=CoroutineMock())
+    mailchimp_list.BATCH_ACTIVITY_THRESHOLD = 2
+    mailchimp_list.df = pd.DataFrame({'id': ['foo', 'bar']})
+    await mailchimp_list.import_sub_activity()
+    mocked_import_sub_activity_batch.assert_called_with(['foo', 'bar'])
+    mocked_request_sub_activity.assert_not_called()
+    assert mailchimp_list.fetch_metadata['activity_mode'] == 'batch'
+
+@pytest.mark.asyncio
+async def test_import_sub_activity_batch(mocker, mailchimp_list):
+    """Tests the import_sub_activity_batch function."""
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            side_effect=['{"id": "batch1"}', '{"id": "batch2"}']))
+    mocked_wait_for_batch = mocker.patch(
+        'app.lists.MailChimpList.wait_for_batch',
+        new=CoroutineMock(side_effect=['url1', 'url2']))
+
+    async def fake_read_batch_results( # pylint: disable=unused-argument
+            results_url, session, failed_ids):
+        failed_ids.append('qux')
+
+    mocked_read_batch_results = mocker.patch(
+        'app.lists.MailChimpList.read_batch_results',
+        side_effect=fake_read_batch_results)
+    mocked_request_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.request_sub_activity', new=CoroutineMock())
+    mailchimp_list.BATCH_SIZE = 2
+    await mailchimp_list.import_sub_activity_batch(['foo', 'bar', 'baz'])
+    _, first_batch_kwargs = mocked_make_async_request.call_args_list[0]
+    assert [operation['operation_id'] for operation in
+            first_batch_kwargs['json_payload']['operations']] == ['foo', 'bar']
+    assert first_batch_kwargs['json_payload']['operations'][0] == {
+        'method': 'GET',
+        'path': '/lists/1/members/foo/activity',
+        'params': {'fields': 'activity.action,activity.timestamp,email_id',
+                   'exclude_fields': 'total_items,_links'},
+        'operation_id': 'foo'}
+    mocked_make_async_request.assert_called_with(
+        'https://bar1.api.mailchimp.com/3.0/batches', None, ANY,
+        json_payload={'operations': [ANY]})
+    mocked_wait_for_batch.assert_has_calls([
+        call('https://bar1.api.mailchimp.com/3.0/batches', 'batch1', ANY),
+        call('https://bar1.api.mailchimp.com/3.0/batches', 'batch2', ANY)])
+    mocked_read_batch_results.assert_has_calls([
+        call('url1', ANY, ANY), call('url2', ANY, ANY)])
+    mocked_request_sub_activity.assert_called_with(['qux', 'qux'])
+
+@pytest.mark.asyncio
+async def test_wait_for_batch(mocker, mailchimp_list):
+    """Tests the wait_for_batch function."""
+    mocker.patch('app.lists.MailChimpList.make_async_request',
+                 new=CoroutineMock(side_effect=[
+                     '{"status": "started"}',
+                     '{"status": "finished", "response_body_url": "foo"}']))
+    mocked_sleep = mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
+    assert await mailchimp_list.wait_for_batch('bar', 'baz', 'qux') == 'foo'
+    mocked_sleep.assert_called_once_with(mailchimp_list.BATCH_POLL_INTERVAL)
+
+@pytest.mark.asyncio
+async def test_wait_for_batch_timeout(mocker, mailchimp_list):
+    """Tests that the wait_for_batch function gives up eventually."""
+    mocker.patch('app.lists.MailChimpList.make_async_request',
+                 new=CoroutineMock(return_value='{"status": "started"}'))
+    mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
+    mailchimp_list.BATCH_TIMEOUT = mailchimp_list.BATCH_POLL_INTERVAL * 2
+    with pytest.raises(MailChimpImportError):
+        await mailchimp_list.wait_for_batch('bar', 'baz', 'qux')
+
+class FakeArchiveResponse(): # pylint: disable=too-few-public-methods
+    """A fake aiohttp response which streams a batch results archive."""
+    def __init__(self, body, status=200):
+        self.status = status
+        self.reason = 'foo'
+        self.headers = {}
+        self.body = body
+        self.content = self
+
+    async def iter_chunked(self, size):
+        """Yields the body in chunks."""
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+@pytest.mark.asyncio
+async def test_read_batch_results(mocker, mailchimp_list):
+    """Tests the read_batch_results function."""
+    results = json.dumps([
+        {'status_code': 200, 'operation_id': 'foo', 'response': json.dumps({
+            'email_id': 'foo',
+            'activity': [{'action': 'open',
+                          'timestamp': '2000-10-1T00:00:00+00:00'}]})},
+        {'status_code': 404, 'operation_id': 'bar', 'response': '{}'}
+    ]).encode('utf-8')
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+        directory = tarfile.TarInfo('results')
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+        info = tarfile.TarInfo('results/foo.json')
+        info.size = len(results)
+        tar.addfile(info, io.BytesIO(results))
+    client_session_mock = MagicMock()
+    client_session_mock.get.return_value = asynctest.MagicMock()
+    client_session_mock.get.return_value.__aenter__.return_value = (
+        FakeArchiveResponse(archive.getvalue()))
+    mocked_record_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.record_sub_activity')
+    failed_ids = []
+    await mailchimp_list.read_batch_results(
+        'baz', client_session_mock, failed_ids)
+    client_session_mock.get.assert_called_with(
+        'baz', params=None, auth=None, proxy=None, timeout=ANY)
+    mocked_record_sub_activity.assert_called_once_with({
+        'email_id': 'foo',
+        'activity': [{'action': 'open',
+                      'timestamp': '2000-10-1T00:00:00+00:00'}]})
+    assert failed_ids == ['bar']
+
+@pytest.mark.asyncio
+async def test_read_batch_results_download_error(mailchimp_list):
+    """Tests the read_batch_results function when the download fails."""
+    client_session_mock = MagicMock()
+    client_session_mock.get.return_value = asynctest.MagicMock()
+    client_session_mock.get.return_value.__aenter__.return_value = (
+        FakeArchiveResponse(b'', status=403))
+    with pytest.raises(MailChimpImportError):
+        await mailchimp_list.read_batch_results(
+            'baz', client_session_mock, [])
+
+@pytest.mark.asyncio
+async def test_make_async_request_retries_download(mocker, mailchimp_list):
+    """Tests that the make_async_request function retries a download,
+    keeping only the last attempt's body."""
+    mocker.patch('app.lists.asyncio.sleep', new=CoroutineMock())
+    client_session_mock = MagicMock()
+    client_session_mock.get.return_value = asynctest.MagicMock()
+    client_session_mock.get.return_value.__aenter__.side_effect = [
+        FakeArchiveResponse(b'foo', status=504), FakeArchiveResponse(b'bar')]
+    download = io.BytesIO(b'baz')
+    assert await mailchimp_list.make_async_request(
+        'qux', None, client_session_mock, download_to=download) is download
+    assert download.getvalue() == b'bar'
+    assert client_session_mock.get.call_count == 2
+
+def test_reduce_sub_activity(mailchimp_list):
+    """Tests that the reduce_sub_activity function finds the most recent
+    open."""
+    assert mailchimp_list.reduce_sub_activity({'activity': [
+        {'action': 'open', 'timestamp': '2000-01-01T00:00:00+00:00'},
+        {'action': 'click', 'timestamp': '2001-01-01T00:00:00+00:00'},
+        {'action': 'open', 'timestamp': '2000-06-01T00:00:00+00:00'}]}) == (
+            pd.Timestamp('2000-06-01', tz='UTC').value)
+    assert mailchimp_list.reduce_sub_activity({'activity': [
+        {'action': 'bounce', 'timestamp': '2000-01-01T00:00:00+00:00'}]}) == (
+            mailchimp_list.NO_OPEN)
+
+def test_record_sub_activity(mailchimp_list):
+    """Tests that the record_sub_activity function stores the open in the
+    subscriber's row, ignoring unknown subscribers."""
+    mailchimp_list.subscriber_positions = {'foo': 1}
+    mailchimp_list.recent_opens = np.full(
+        2, mailchimp_list.NO_OPEN, dtype=np.int64)
+    activity = [{'action': 'open', 'timestamp': '2000-01-01T00:00:00+00:00'}]
+    mailchimp_list.record_sub_activity({'email_id': 'foo',
+                                        'activity': activity})
+    mailchimp_list.record_sub_activity({'email_id': 'bar',
+                                        'activity': activity})
+    assert mailchimp_list.recent_opens.tolist() == [
+        mailchimp_list.NO_OPEN, pd.Timestamp('2000-01-01', tz='UTC').value]
+
+def test_record_open_keeps_latest(mailchimp_list):
+    """Tests that the record_open function doesn't overwrite a later
+    open."""
+    mailchimp_list.subscriber_positions = {'foo': 0}
+    mailchimp_list.recent_opens = np.array([5], dtype=np.int64)
+    mailchimp_list.record_open('foo', 3)
+    assert mailchimp_list.recent_opens.tolist() == [5]
+    mailchimp_list.record_open('foo', 7)
+    assert mailchimp_list.recent_opens.tolist() == [7]
+
+def test_record_open_prefetched(mailchimp_list):
+    """Tests that the record_open function records opens by id while
+    activity is prefetched."""
+    mailchimp_list.prefetched_opens = {}
+    mailchimp_list.record_open('foo', 5)
+    mailchimp_list.record_open('foo', 3)
+    mailchimp_list.record_open('bar', mailchimp_list.NO_OPEN)
+    assert mailchimp_list.prefetched_opens == {
+        'foo': 5, 'bar': mailchimp_list.NO_OPEN}
+
+@pytest.mark.asyncio
+async def test_prefetch_sub_activity(mocker, mailchimp_list):
+    """Tests that the prefetch_sub_activity function requests each
+    queued subscriber's activity once."""
+    mocker.patch('app.lists.AIMDController')
+    mocked_request_checkpointed_activity = mocker.patch(
+        'app.lists.MailChimpList.request_checkpointed_activity',
+        new=CoroutineMock())
+    mailchimp_list.prefetched_opens = {}
+    queue = asyncio.Queue()
+    for subscriber_ids in (['foo', 'bar'], ['foo', 'baz'], None):
+        queue.put_nowait(subscriber_ids)
+    await mailchimp_list.prefetch_sub_activity(queue)
+    assert [args[1] for args, _ in
+            mocked_request_checkpointed_activity.call_args_list] == [
+                'https://bar1.api.mailchimp.com/3.0/lists/1/members/{}/'
+                'activity'.format(subscriber_id)
+                for subscriber_id in ('foo', 'bar', 'baz')]
+
+@pytest.mark.asyncio
+async def test_prefetch_sub_activity_batches(mocker, mailchimp_list):
+    """Tests that the prefetch_sub_activity function submits batches as
+    subscribers arrive on larger lists."""
+    mocker.patch('app.lists.AIMDController')
+    mocked_import_sub_activity_batch = mocker.patch(
+        'app.lists.MailChimpList.import_sub_activity_batch',
+        new=CoroutineMock())
+    mailchimp_list.prefetched_opens = {}
+    mailchimp_list.count = 5
+    mailchimp_list.BATCH_ACTIVITY_THRESHOLD = 3
+    mailchimp_list.PIPELINE_BATCH_SIZE = 2
+    queue = asyncio.Queue()
+    for subscriber_ids in (['foo', 'bar', 'baz'], None):
+        queue.put_nowait(subscriber_ids)
+    await mailchimp_list.prefetch_sub_activity(queue)
+    assert mocked_import_sub_activity_batch.call_args_list == [
+        call(['foo', 'bar']), call(['baz'])]
+
+@pytest.mark.asyncio
+async def test_prefetch_sub_activity_skips_campaign_lists(
+        mocker, mailchimp_list):
+    """Tests that the prefetch_sub_activity function doesn't prefetch
+    anything for lists which may be imported campaign by campaign."""
+    mocker.patch('app.lists.MailChimpList.request_recent_campaign_ids',
+                 new=CoroutineMock(return_value=['qux']))
+    mocked_request_checkpointed_activity = mocker.patch(
+        'app.lists.MailChimpList.request_checkpointed_activity',
+        new=CoroutineMock())
+    mailchimp_list.count = mailchimp_list.CAMPAIGN_ACTIVITY_RATIO
+    mailchimp_list.subscriber_queue = queue = asyncio.Queue()
+    queue.put_nowait(['foo'])
+    await mailchimp_list.prefetch_sub_activity(queue)
+    mocked_request_checkpointed_activity.assert_not_called()
+    assert mailchimp_list.subscriber_queue is None
+    assert mailchimp_list.recent_campaign_ids == ['qux']
+
+@pytest.mark.asyncio
+async def test_prefetch_sub_activity_no_recent_campaigns(
+        mocker, mailchimp_list):
+    """Tests that the prefetch_sub_activity function prefetches activity
+    for lists which haven't sent any campaigns in the past year."""
+    mocker.patch('app.lists.AIMDController')
+    mocker.patch('app.lists.MailChimpList.request_recent_campaign_ids',
+                 new=CoroutineMock(return_value=[]))
+    mocked_request_checkpointed_activity = mocker.patch(
+        'app.lists.MailChimpList.request_checkpointed_activity',
+        new=CoroutineMock())
+    mailchimp_list.count = mailchimp_list.CAMPAIGN_ACTIVITY_RATIO
+    mailchimp_list.subscriber_queue = queue = asyncio.Queue()
+    queue.put_nowait(['foo'])
+    queue.put_nowait(None)
+    mailchimp_list.prefetched_opens = {}
+    await mailchimp_list.prefetch_sub_activity(queue)
+    mocked_request_checkpointed_activity.assert_called()
+
+@pytest.mark.asyncio
+async def test_import_list(mocker, mailchimp_list):
+    """Tests that the import_list function prefetches activity while
+    members are imported, then imports the rest."""
+    async def fake_import_members():
+        mailchimp_list.subscriber_queue.put_nowait(['foo'])
+
+    async def fake_request_activity(controller, url, session): # pylint: disable=unused-argument
+        mailchimp_list.record_open('foo', 5)
+
+    async def fake_import_sub_activity():
+        assert mailchimp_list.prefetched_opens == {'foo': 5}
+
+    mocker.patch('app.lists.AIMDController')
+    mocker.patch('app.lists.MailChimpList.import_list_members_incremental',
+                 side_effect=fake_import_members)
+    mocker.patch('app.lists.MailChimpList.request_checkpointed_activity',
+                 side_effect=fake_request_activity)
+    mocked_import_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.import_sub_activity',
+        side_effect=fake_import_sub_activity)
+    await mailchimp_list.import_list()
+    mocked_import_sub_activity.assert_called()
+    assert mailchimp_list.subscriber_queue is None
+    assert mailchimp_list.prefetched_opens is None
+
+@pytest.mark.asyncio
+async def test_import_list_resumes(mocker, mailchimp_list):
+    """Tests that the import_list function doesn't prefetch activity when
+    it resumes a previous attempt's."""
+    mocked_import_members = mocker.patch(
+        'app.lists.MailChimpList.import_list_members_incremental',
+        new=CoroutineMock())
+    mocked_prefetch_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.prefetch_sub_activity', new=CoroutineMock())
+    mocked_import_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.import_sub_activity', new=CoroutineMock())
+    mailchimp_list.checkpoint.save_activity({'email_id': 'foo',
+                                             'activity': []})
+    await mailchimp_list.import_list()
+    mocked_import_members.assert_called()
+    mocked_prefetch_sub_activity.assert_not_called()
+    mocked_import_sub_activity.assert_called()
+
+@pytest.mark.asyncio
+async def test_import_list_records_memory(mocker, mailchimp_list):
+    """Tests that the import_list function records the memory used by the
+    member and activity imports."""
+    mocker.patch('app.lists.MailChimpList.import_list_members_incremental',
+                 new=CoroutineMock())
+    mocker.patch('app.lists.MailChimpList.prefetch_sub_activity',
+                 new=CoroutineMock())
+    mocker.patch('app.lists.MailChimpList.import_sub_activity',
+                 new=CoroutineMock())
+    mailchimp_list.memory_profiler = MagicMock()
+    await mailchimp_list.import_list()
+    mailchimp_list.memory_profiler.record.assert_has_calls(
+        [call('import_members'), call('import_activity')])
+
+def test_since_param(mailchimp_list):
+    """Tests that the since_param function truncates a time to its day, so
+    imports on the same day make the same requests."""
+    since = datetime.datetime(
+        2000, 1, 1, 12, 34, 56, 789, tzinfo=datetime.timezone.utc)
+    assert mailchimp_list.since_param(since) == '2000-01-01T00:00:00+00:00'
+
+@pytest.mark.asyncio
+async def test_request_recent_campaign_ids(mocker, mailchimp_list):
+    """Tests the request_recent_campaign_ids function."""
+    mailchimp_list.CAMPAIGN_OPENS_PAGE_SIZE = 2
+    mocked_make_async_request = mocker.patch(
+        'app.lists.MailChimpList.make_async_request', new=CoroutineMock(
+            side_effect=[
+                '{"campaigns": [{"id": "foo"}, {"id": "bar"}], '
+                '"total_items": 3}',
+                '{"campaigns": [{"id": "baz"}], "total_items": 3}']))
+    since = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    assert await mailchimp_list.request_recent_campaign_ids(since) == [
+        'foo', 'bar', 'baz']
+    mocked_make_async_request.assert_called_with(
+        'https://bar1.api.mailchimp.com/3.0/campaigns', (
+            ('fields', 'campaigns.id,total_items'), ('list_id', 1),
+            ('status', 'sent'), ('since_send_time', since.isoformat()),
+            ('count', '2'), ('offset', '2')), ANY)
+
+@pytest.mark.asyncio
+async def test_import_campaign_opens(mocker, mailchimp_list):
+    """Tests that the import_campaign_opens function records each
+    member's latest open."""
+    mailchimp_list.CAMPAIGN_OPENS_PAGE_SIZE = 1
+    mocked_make_async_requests = mocker.patch(
+        'app.lists.MailChimpList.make_async_requests', new=CoroutineMock(
+            side_effect=[
+                {'members': [{'email_id': 'foo', 'opens': [
+                    {'timestamp': '2000-01-01T00:00:00+00:00'},
+                    {'timestamp': '2000-02-01T00:00:00+00:00'}]}],
+                 'total_items': 2},
+                {'members': [{'email_id': 'bar', 'opens': []}],
+                 'total_items': 2}]))
+    mocked_record_open = mocker.patch('app.lists.MailChimpList.record_open')
+    since = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    opens = await mailchimp_list.import_campaign_opens(
+        'baz', 'qux', since, 'quux')
+    assert opens == {'foo': pd.Timestamp('2000-02-01', tz='UTC').value}
+    mocked_make_async_requests.assert_called_with(
+        'baz', 'qux', (
+            ('fields', 'members.email_id,members.opens,total_items'),
+            ('since', since.isoformat()), ('count', '1'), ('offset', '1')),
+        'quux')
+    assert mocked_record_open.call_args_list == [
+        call('foo', pd.Timestamp('2000-02-01', tz='UTC').value),
+        call('bar', mailchimp_list.NO_OPEN)]
+
+@pytest.mark.asyncio
+async def test_import_sub_activity_by_campaign(mocker, mailchimp_list):
+    """Tests the import_sub_activity_by_campaign function."""
+    mocked_controller = mocker.patch('app.lists.AIMDController')
+    mocked_import_campaign_opens = mocker.patch(
+        'app.lists.MailChimpList.import_campaign_opens', new=CoroutineMock(
+            return_value={'qux': 5}))
+    await mailchimp_list.import_sub_activity_by_campaign(
+        ['foo', 'bar'], 'baz')
+    mocked_controller.load.assert_called_with(
+        'bar1', 'campaign_opens', mailchimp_list.MAX_CONNECTIONS,
+        max_concurrency=ANY, target_latency=ANY)
+    mocked_import_campaign_opens.assert_has_calls([
+        call(mocked_controller.load.return_value,
+             'https://bar1.api.mailchimp.com/3.0/reports/foo/open-details',
+             'baz', ANY),
+        call(mocked_controller.load.return_value,
+             'https://bar1.api.mailchimp.com/3.0/reports/bar/open-details',
+             'baz', ANY)])
+    mocked_controller.load.return_value.save.assert_called()
+    assert mailchimp_list.checkpoint.campaigns() == ['bar', 'foo']
+    assert mailchimp_list.checkpoint.load_campaign_opens('foo') == {'qux': 5}
+
+@pytest.mark.asyncio
+async def test_import_sub_activity_by_campaign_resumes(
+        mocker, mailchimp_list):
+    """Tests that the import_sub_activity_by_campaign function records
+    the opens of checkpointed campaigns and only requests the others."""
+    mocker.patch('app.lists.AIMDController')
+    mocked_import_campaign_opens = mocker.patch(
+        'app.lists.MailChimpList.import_campaign_opens', new=CoroutineMock(
+            return_value={}))
+    mocked_record_open = mocker.patch('app.lists.MailChimpList.record_open')
+    mailchimp_list.checkpoint.save_campaign_opens('foo', {'qux': 5})
+    await mailchimp_list.import_sub_activity_by_campaign(
+        ['foo', 'bar'], 'baz')
+    mocked_record_open.assert_called_once_with('qux', 5)
+    mocked_import_campaign_opens.assert_called_once_with(
+        ANY, 'https://bar1.api.mailchimp.com/3.0/reports/bar/open-details',
+        'baz', ANY)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('campaign_count, activity_mode', [
+    (1, 'campaign'), (2, 'direct'), (0, 'direct')])
+async def test_import_sub_activity_picks_campaigns(
+        mocker, mailchimp_list, campaign_count, activity_mode):
+    """Tests that the import_sub_activity function imports opens campaign
+    by campaign when subscribers greatly outnumber campaigns."""
+    mocker.patch('app.lists.MailChimpList.get_list_ids',
+                 return_value=['foo', 'bar'])
+    mocker.patch('app.lists.MailChimpList.estimate_campaign_requests',
+                 return_value=campaign_count)
+    mocker.patch('app.lists.MailChimpList.request_recent_campaign_ids',
+                 new=CoroutineMock(return_value=['baz'] * campaign_count))
+    mocked_import_sub_activity_by_campaign = mocker.patch(
+        'app.lists.MailChimpList.import_sub_activity_by_campaign',
+        new=CoroutineMock())
+    mocked_request_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.request_sub_activity', new=CoroutineMock())
+    mailchimp_list.CAMPAIGN_ACTIVITY_RATIO = 2
+    mailchimp_list.df = pd.DataFrame({'id': ['foo', 'bar']})
+    await mailchimp_list.import_sub_activity()
+    assert mailchimp_list.fetch_metadata['activity_mode'] == activity_mode
+    assert mocked_import_sub_activity_by_campaign.called == (
+        activity_mode == 'campaign')
+    assert mocked_request_sub_activity.called == (activity_mode == 'direct')
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('campaign_count, open_rate, activity_mode', [
+    (250, 0.2, 'direct'), (52, 0.1, 'campaign')])
+async def test_import_sub_activity_samples_or_picks_campaigns(
+        mocker, mailchimp_list, campaign_count, open_rate, activity_mode):
+    """Tests that the import_sub_activity function samples a list above
+    the sampling threshold unless paging through its campaigns' opens
+    takes fewer requests than the sample."""
+    subscribers = mailchimp_list.ACTIVITY_SAMPLING_THRESHOLD + 50000
+    mocker.patch('app.lists.MailChimpList.request_recent_campaign_ids',
+                 new=CoroutineMock(return_value=['baz'] * campaign_count))
+    mocked_import_sub_activity_by_campaign = mocker.patch(
+        'app.lists.MailChimpList.import_sub_activity_by_campaign',
+        new=CoroutineMock())
+    mocked_request_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.request_sub_activity', new=CoroutineMock())
+    mailchimp_list.df = pd.DataFrame({
+        'id': ['id{}'.format(i) for i in range(subscribers)],
+        'status': 'subscribed',
+        'avg_open_rate': np.float32(open_rate)})
+    await mailchimp_list.import_sub_activity()
+    assert mailchimp_list.fetch_metadata['activity_mode'] == activity_mode
+    assert mocked_import_sub_activity_by_campaign.called == (
+        activity_mode == 'campaign')
+    if activity_mode == 'direct':
+        args, _ = mocked_request_sub_activity.call_args
+        assert len(args[0]) == pytest.approx(
+            mailchimp_list.ACTIVITY_SAMPLE_SIZE, rel=0.01)
+        assert mailchimp_list.fetch_metadata['activity_sample'] == len(args[0])
+        assert mailchimp_list.activity_sample is not None
+    else:
+        assert 'activity_sample' not in mailchimp_list.fetch_metadata
+        assert mailchimp_list.activity_sample is None
+
+@pytest.mark.parametrize('open_rate, pages', [(0.3, 2), (0.001, 1)])
+def test_estimate_campaign_requests(mailchimp_list, open_rate, pages):
+    """Tests the estimate_campaign_requests function."""
+    mailchimp_list.df = pd.DataFrame({
+        'status': ['subscribed'] * 5000 + ['unsubscribed'] * 5000,
+        'avg_open_rate': [open_rate] * 10000})
+    assert mailchimp_list.estimate_campaign_requests(
+        ['foo', 'bar', 'baz']) == 3 * pages
+
 def test_get_list_ids(mailchimp_list):
     """Tests the get_list_ids function."""
     mailchimp_list.df = pd.DataFrame({
@@ -353,6 +1553,17 @@ def test_flatten(mailchimp_list):
         check_like=True
     )
 
+def test_flatten_already_flat(mailchimp_list):
+    """Tests that the flatten function leaves flat dataframes untouched."""
+    flat_df = pd.DataFrame({
+        'id': ['foo', 'bar'],
+        'status': ['subscribed', 'subscribed'],
+        'avg_open_rate': [0.5, 0.1]
+    })
+    mailchimp_list.df = flat_df
+    mailchimp_list.flatten()
+    assert mailchimp_list.df is flat_df
+
 def test_calc_list_breakdown(mailchimp_list):
     """Tests the calc_list_breakdown function."""
     mailchimp_list.df = pd.DataFrame({
@@ -413,6 +1624,62 @@ def test_calc_cur_yr_stats(mailchimp_list):
     mailchimp_list.calc_cur_yr_stats()
     assert mailchimp_list.cur_yr_inactive_pct == 0.25
 
+def test_calc_cur_yr_stats_sampled(mailchimp_list):
+    """Tests the calc_cur_yr_stats function when only a sample's activity
+    was imported."""
+    mailchimp_list.df = pd.DataFrame({
+        'id': ['foo', 'bar', 'baz', 'qux'],
+        'recent_open': pd.to_datetime(
+            ['2000-01-01', None, '2000-01-01', None], utc=True)})
+    mailchimp_list.subscribers = 400
+    mailchimp_list.activity_sample = pd.Series(
+        [0, 0, 1], index=['foo', 'bar', 'baz'])
+    mailchimp_list.stratum_sizes = np.array([300, 100])
+    mailchimp_list.calc_cur_yr_stats()
+    assert mailchimp_list.cur_yr_inactive_pct == 0.375
+    assert (mailchimp_list.cur_yr_inactive_pct_lower <
+            mailchimp_list.cur_yr_inactive_pct <
+            mailchimp_list.cur_yr_inactive_pct_upper)
+
+def test_calc_cur_yr_stats_streaming(mailchimp_list):
+    """Tests that the calc_cur_yr_stats function estimates the inactive
+    subscribers from the sampled metrics in streaming mode."""
+    metrics = MemberMetrics('foo', 10)
+    metrics.append_members(
+        [{'id': str(index), 'status': 'subscribed',
+          'stats': {'avg_open_rate': 0.05}} for index in range(300)] +
+        [{'id': str(index), 'status': 'subscribed',
+          'stats': {'avg_open_rate': 0.95}} for index in range(300, 400)])
+    metrics.sample_subscribers(4, 2)
+    metrics.record_recent_opens([True, False, True, False, False])
+    mailchimp_list.streaming = True
+    mailchimp_list.member_metrics = metrics
+    mailchimp_list.subscribers = 400
+    mailchimp_list.calc_cur_yr_stats()
+    assert mailchimp_list.cur_yr_inactive_pct == 0.5
+    assert (mailchimp_list.cur_yr_inactive_pct_lower <
+            mailchimp_list.cur_yr_inactive_pct <
+            mailchimp_list.cur_yr_inactive_pct_upper)
+
+@pytest.mark.asyncio
+async def test_import_list_streaming(mocker, mailchimp_list):
+    """Tests that the import_list function imports sampled activity rather
+    than every subscriber's in streaming mode."""
+    mocked_import_members = mocker.patch(
+        'app.lists.MailChimpList.import_list_members', new=CoroutineMock())
+    mocked_import_sub_activity = mocker.patch(
+        'app.lists.MailChimpList.import_sub_activity', new=CoroutineMock())
+    mocked_import_sampled_activity = mocker.patch(
+        'app.lists.MailChimpList.import_sampled_activity',
+        new=CoroutineMock())
+    mailchimp_list.streaming = True
+    mailchimp_list.member_metrics = MemberMetrics('foo', 10)
+    await mailchimp_list.import_list()
+    mocked_import_members.assert_called()
+    mocked_import_sampled_activity.assert_called()
+    mocked_import_sub_activity.assert_not_called()
+    assert mailchimp_list.fetch_metadata['members_mode'] == 'streaming'
+
 def test_get_list_as_csv(mailchimp_list):
     """Tests the get_list_as_csv."""
     mailchimp_list.df = pd.DataFrame(
@@ -0,0 +1,23 @@
+import os
+from app.localstate import local_state_path, load_json_state, save_json_state
+
+def test_local_state_path(state_dir):
+    """Tests the local_state_path function."""
+    path = local_state_path('foo', 'bar.json')
+    assert path == os.path.join(str(state_dir), 'foo', 'bar.json')
+    assert os.path.isdir(os.path.join(str(state_dir), 'foo'))
+
+def test_save_and_load_json_state(state_dir): # pylint: disable=unused-argument
+    """Tests that saved json state can be loaded back."""
+    path = local_state_path('foo.json')
+    save_json_state(path, {'foo': [1, 2]})
+    assert load_json_state(path) == {'foo': [1, 2]}
+    assert [name for name in os.listdir(str(state_dir))] == ['foo.json']
+
+def test_load_json_state_missing_or_corrupt(state_dir): # pylint: disable=unused-argument
+    """Tests that the load_json_state function falls back to the default."""
+    path = local_state_path('foo.json')
+    assert load_json_state(path, 'bar') == 'bar'
+    with open(path, 'w') as state_file:
+        state_file.write('{not json')
+    assert load_json_state(path, 'bar') == 'bar'
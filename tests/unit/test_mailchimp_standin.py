@@ -0,0 +1,292 @@
+"""This module contains tests associated with the MailChimp stand-in."""
+import io
+import json
+import tarfile
+import asyncio
+import pytest
+from aiohttp import BasicAuth, ClientSession, ServerDisconnectedError
+from aiohttp.test_utils import TestServer
+from app.lists import MailChimpList
+from app.sessions import SessionManager
+from benchmarks.mailchimp_standin import (
+    MailChimpStandIn, SyntheticList, select_fields)
+
+AUTH = BasicAuth('shorenstein', 'standin-us1')
+
+@pytest.fixture
+async def standin_server():
+    """Serves a stand-in with one list of 200 members."""
+    standin = MailChimpStandIn(seed=1)
+    standin.add_list(200, campaign_count=2)
+    server = TestServer(standin.make_app())
+    await server.start_server()
+    yield standin, server
+    await server.close()
+
+def test_synthetic_list_is_deterministic():
+    """Tests that lists generated from the same seed are the same, and that
+    member ids can be turned back into positions."""
+    first_list = SyntheticList('foo', 100, 1)
+    second_list = SyntheticList('foo', 100, 1)
+    assert first_list.members(0, 100) == second_list.members(0, 100)
+    assert SyntheticList('foo', 100, 2).members(0, 100) != (
+        first_list.members(0, 100))
+    member_id = first_list.member_id(42)
+    assert len(member_id) == 32
+    assert first_list.member_position(member_id) == 42
+    assert first_list.member_position(SyntheticList(
+        'bar', 100, 1).member_id(42)) is None
+    assert first_list.member_position('foo') is None
+
+def test_synthetic_list_campaign_opens_match_activity():
+    """Tests that each campaign's openers had their last open on it."""
+    mailing_list = SyntheticList('foo', 500, 1, campaign_count=3)
+    openers = 0
+    for index in range(3):
+        for member in mailing_list.open_details(index, 0, 500)['members']:
+            position = mailing_list.member_position(member['email_id'])
+            assert mailing_list.activity(position)['activity'][-1] == {
+                'action': 'open', 'timestamp': member['opens'][0]['timestamp']}
+            openers += 1
+    assert openers == (mailing_list.last_campaign >= 0).sum()
+
+def test_select_fields():
+    """Tests the select_fields function."""
+    body = {'members': [{'id': 'foo', 'stats': {'bar': 1, 'baz': 2},
+                         'status': 'qux'}],
+            'total_items': 1,
+            '_links': []}
+    assert select_fields(body, 'members.id,members.stats,total_items') == {
+        'members': [{'id': 'foo', 'stats': {'bar': 1, 'baz': 2}}],
+        'total_items': 1}
+    assert select_fields(body, exclude_fields='_links,members.stats.bar') == {
+        'members': [{'id': 'foo', 'stats': {'baz': 2}, 'status': 'qux'}],
+        'total_items': 1}
+
+@pytest.mark.asyncio
+async def test_members_endpoint(standin_server): # pylint: disable=redefined-outer-name
+    """Tests that the members endpoint pages through the list."""
+    standin, server = standin_server
+    list_id = next(iter(standin.lists))
+    async with ClientSession() as session:
+        async with session.get(
+                server.make_url('/3.0/lists/{}/members'.format(list_id)),
+                params={'fields': MailChimpList.MEMBER_FIELDS,
+                        'count': '150', 'offset': '100'},
+                auth=AUTH) as response:
+            body = await response.json()
+            etag = response.headers['ETag']
+        async with session.get(
+                server.make_url('/3.0/lists/{}/members'.format(list_id)),
+                params={'fields': MailChimpList.MEMBER_FIELDS,
+                        'count': '150', 'offset': '100'},
+                headers={'If-None-Match': etag}, auth=AUTH) as response:
+            assert response.status == 304
+    assert body['total_items'] == 200
+    assert len(body['members']) == 100
+    assert set(body['members'][0]) == {
+        'id', 'status', 'timestamp_opt', 'timestamp_signup', 'stats'}
+
+@pytest.mark.asyncio
+async def test_requests_need_api_key(standin_server): # pylint: disable=redefined-outer-name
+    """Tests that requests without an api key are refused."""
+    server = standin_server[1]
+    async with ClientSession() as session:
+        async with session.get(server.make_url('/3.0/lists')) as response:
+            assert response.status == 401
+
+@pytest.mark.asyncio
+async def test_connection_cap():
+    """Tests that requests over an api key's connection cap get a 429."""
+    standin = MailChimpStandIn(latency=0.2, max_connections_per_key=1)
+    server = TestServer(standin.make_app())
+    await server.start_server()
+    try:
+        async with ClientSession() as session:
+
+            async def get_status():
+                async with session.get(server.make_url('/3.0/lists'),
+                                       auth=AUTH) as response:
+                    return response.status
+
+            statuses = await asyncio.gather(get_status(), get_status())
+    finally:
+        await server.close()
+    assert sorted(statuses) == [200, 429]
+    assert standin.stats['capped'] == 1
+
+@pytest.mark.asyncio
+async def test_fault_injection():
+    """Tests that faults are injected at the configured rates."""
+    standin = MailChimpStandIn(error_504_rate=1)
+    server = TestServer(standin.make_app())
+    await server.start_server()
+    try:
+        async with ClientSession() as session:
+            async with session.get(server.make_url('/3.0/lists'),
+                                   auth=AUTH) as response:
+                assert response.status == 504
+            standin.error_504_rate = 0
+            standin.disconnect_rate = 1
+            with pytest.raises(ServerDisconnectedError):
+                async with session.get(server.make_url('/3.0/lists'),
+                                       auth=AUTH):
+                    pass
+    finally:
+        await server.close()
+    assert standin.stats['504'] == 1
+    assert standin.stats['disconnects'] == 1
+
+@pytest.mark.asyncio
+async def test_batch_operations(standin_server): # pylint: disable=redefined-outer-name
+    """Tests that batches of activity lookups can be run and their results
+    downloaded."""
+    standin, server = standin_server
+    mailing_list = next(iter(standin.lists.values()))
+    member_id = mailing_list.member_id(0)
+    operations = [
+        {'method': 'GET',
+         'path': '/lists/{}/members/{}/activity'.format(
+             mailing_list.list_id, operation_id),
+         'params': dict(MailChimpList.ACTIVITY_FIELDS),
+         'operation_id': operation_id}
+        for operation_id in (member_id, 'foo')]
+    async with ClientSession() as session:
+        async with session.post(server.make_url('/3.0/batches'),
+                                json={'operations': operations},
+                                auth=AUTH) as response:
+            batch_id = (await response.json())['id']
+        async with session.get(
+                server.make_url('/3.0/batches/{}'.format(batch_id)),
+                auth=AUTH) as response:
+            batch = await response.json()
+        async with session.get(batch['response_body_url']) as response:
+            archive = await response.read()
+    assert batch['status'] == 'finished'
+    with tarfile.open(fileobj=io.BytesIO(archive), mode='r:gz') as results:
+        result_file = results.extractfile(results.getmembers()[0])
+        first_result, second_result = json.loads(result_file.read())
+    assert first_result['status_code'] == 200
+    assert json.loads(first_result['response']) == select_fields(
+        mailing_list.activity(0), *dict(MailChimpList.ACTIVITY_FIELDS).values())
+    assert second_result['status_code'] == 404
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'campaign_count,batch_threshold,activity_mode,batched', [
+        (1, 10000, 'campaign', False),
+        (10, 10000, 'direct', False),
+        (10, 50, 'direct', True),
+    ])
+async def test_import_list_from_standin( # pylint: disable=too-many-arguments
+        mocker, monkeypatch, state_dir, campaign_count, batch_threshold, # pylint: disable=unused-argument
+        activity_mode, batched):
+    """Tests that a list can be imported from the stand-in when
+    MAILCHIMP_API_BASE points at it, whichever way its activity is
+    imported."""
+    standin = MailChimpStandIn(seed=1)
+    synthetic_list = standin.add_list(200, campaign_count=campaign_count)
+    server = TestServer(standin.make_app())
+    await server.start_server()
+    monkeypatch.setenv('MAILCHIMP_API_BASE', str(server.make_url('/3.0')))
+    monkeypatch.setenv('NO_PROXY', 'true')
+    mocker.patch('app.lists.MailChimpList.API_KEY_RATE_LIMIT', new=1000)
+    mocker.patch('app.lists.MailChimpList.API_KEY_BURST', new=1000)
+    mocker.patch('app.lists.MailChimpList.BATCH_ACTIVITY_THRESHOLD',
+                 new=batch_threshold)
+    mocker.patch('app.lists.MailChimpList.BATCH_POLL_INTERVAL', new=0)
+    mailing_list = MailChimpList(
+        synthetic_list.list_id, 200, 'standin-us1', 'us1',
+        session_manager=SessionManager())
+    try:
+        await mailing_list.import_list()
+    finally:
+        await mailing_list.session_manager.close()
+        await server.close()
+    mailing_list.flatten()
+    assert len(mailing_list.df) == 200
+    assert mailing_list.subscribers == (synthetic_list.statuses == 0).sum()
+    assert mailing_list.fetch_metadata['activity_mode'] == activity_mode
+    assert bool(standin.batches) == batched
+    subscribers = mailing_list.df[mailing_list.df['status'] == 'subscribed']
+    assert subscribers['recent_open'].notna().sum() == (
+        (synthetic_list.statuses == 0) & (synthetic_list.last_campaign >= 0)
+    ).sum()
+
+@pytest.mark.asyncio
+async def test_second_import_from_standin_is_cached( # pylint: disable=unused-argument
+        mocker, monkeypatch, state_dir):
+    """Tests that a list imported again soon after is served from the
+    response cache, campaign opens included."""
+    standin = MailChimpStandIn(seed=1)
+    synthetic_list = standin.add_list(200, campaign_count=1)
+    get_campaigns = mocker.spy(standin, 'get_campaigns')
+    get_open_details = mocker.spy(standin, 'get_open_details')
+    server = TestServer(standin.make_app())
+    await server.start_server()
+    monkeypatch.setenv('MAILCHIMP_API_BASE', str(server.make_url('/3.0')))
+    monkeypatch.setenv('NO_PROXY', 'true')
+    monkeypatch.setenv('RESPONSE_CACHE_MB', '8')
+    mocker.patch('app.httpcache._RESPONSE_CACHE', new=None)
+    mocker.patch('app.lists.MailChimpList.API_KEY_RATE_LIMIT', new=1000)
+    mocker.patch('app.lists.MailChimpList.API_KEY_BURST', new=1000)
+    try:
+        for _ in range(2):
+            mailing_list = MailChimpList(
+                synthetic_list.list_id, 200, 'standin-us1', 'us1',
+                session_manager=SessionManager())
+            try:
+                await mailing_list.import_list()
+            finally:
+                mailing_list.response_cache.flush()
+                await mailing_list.session_manager.close()
+            assert mailing_list.fetch_metadata['activity_mode'] == 'campaign'
+            assert get_campaigns.call_count == 1
+            assert get_open_details.call_count == 1
+    finally:
+        await server.close()
+
+@pytest.mark.asyncio
+async def test_streaming_analysis_matches_dataframe( # pylint: disable=unused-argument
+        mocker, monkeypatch, state_dir):
+    """Tests that a list analyzed in streaming mode gets the same results as
+    one analyzed from a dataframe."""
+    standin = MailChimpStandIn(seed=1)
+    synthetic_list = standin.add_list(500, campaign_count=10)
+    server = TestServer(standin.make_app())
+    await server.start_server()
+    monkeypatch.setenv('MAILCHIMP_API_BASE', str(server.make_url('/3.0')))
+    monkeypatch.setenv('NO_PROXY', 'true')
+    mocker.patch('app.lists.MailChimpList.API_KEY_RATE_LIMIT', new=1000)
+    mocker.patch('app.lists.MailChimpList.API_KEY_BURST', new=1000)
+    results = []
+    try:
+        for threshold in (0, 1):
+            mocker.patch(
+                'app.lists.MailChimpList.STREAMING_ANALYSIS_THRESHOLD',
+                new=threshold)
+            mailing_list = MailChimpList(
+                synthetic_list.list_id, 500, 'standin-us1', 'us1',
+                session_manager=SessionManager())
+            try:
+                await mailing_list.import_list()
+            finally:
+                await mailing_list.session_manager.close()
+            mailing_list.flatten()
+            mailing_list.calc_list_breakdown()
+            mailing_list.calc_histogram()
+            mailing_list.calc_high_open_rate_pct()
+            mailing_list.calc_cur_yr_stats()
+            results.append(mailing_list)
+    finally:
+        await server.close()
+    frame_list, streamed_list = results
+    assert not frame_list.streaming
+    assert streamed_list.streaming
+    assert streamed_list.df is None
+    assert streamed_list.fetch_metadata['members_mode'] == 'streaming'
+    for attribute in ('subscribers', 'subscribed_pct', 'unsubscribed_pct',
+                      'cleaned_pct', 'pending_pct', 'hist_bin_counts',
+                      'high_open_rt_pct', 'cur_yr_inactive_pct'):
+        assert getattr(streamed_list, attribute) == getattr(
+            frame_list, attribute)
@@ -0,0 +1,79 @@
+"""This module contains tests associated with memory profiling."""
+import os
+import tracemalloc
+from app.memprofile import (
+    MemoryProfiler, memory_profiling_enabled, load_memory_profiles,
+    compare_memory_profiles, profile_dir, PROFILE_RETENTION_COUNT)
+
+def make_profile(*peak_rss_mbs):
+    """Returns a profile with a stage of each peak RSS."""
+    return {'started_at': 'foo', 'stages': [
+        {'stage': 'stage{}'.format(index), 'member_count': 1000,
+         'peak_rss_mb': peak_rss_mb}
+        for index, peak_rss_mb in enumerate(peak_rss_mbs)]}
+
+def test_memory_profiling_enabled(monkeypatch):
+    """Tests the memory_profiling_enabled function."""
+    monkeypatch.delenv('MEMORY_PROFILING', raising=False)
+    assert not memory_profiling_enabled()
+    monkeypatch.setenv('MEMORY_PROFILING', 'true')
+    assert memory_profiling_enabled()
+
+def test_memory_profiler(state_dir): # pylint: disable=unused-argument
+    """Tests that the memory profiler records and stores each stage."""
+    profiler = MemoryProfiler('foo', 2, enabled=True)
+    try:
+        assert tracemalloc.is_tracing()
+        buffers = [bytearray(1024 * 1024) for _ in range(4)]
+        stage = profiler.record('bar')
+        del buffers
+        profiler.record('baz')
+    finally:
+        profiler.stop()
+    assert not tracemalloc.is_tracing()
+    assert stage['stage'] == 'bar'
+    assert stage['list_id'] == 'foo'
+    assert stage['member_count'] == 2
+    assert stage['peak_rss_mb'] >= stage['rss_mb'] > 0
+    assert stage['traced_mb'] >= 4
+    top_allocation = stage['top_allocations'][0]
+    assert top_allocation['location'].startswith(__file__)
+    assert top_allocation['size_mb'] >= 4
+    assert top_allocation['growth_mb'] >= 4
+    profile, = load_memory_profiles('foo')
+    assert profile['stages'] == profiler.stages
+    assert [stage['stage'] for stage in profile['stages']] == ['bar', 'baz']
+
+def test_memory_profiler_disabled(state_dir): # pylint: disable=unused-argument
+    """Tests that a profiler which isn't enabled records nothing."""
+    profiler = MemoryProfiler('foo', 2, enabled=False)
+    assert profiler.record('bar') is None
+    profiler.stop()
+    assert not tracemalloc.is_tracing()
+    assert load_memory_profiles('foo') == []
+
+def test_memory_profiler_prunes_profiles(state_dir): # pylint: disable=unused-argument
+    """Tests that only the newest profiles of each list are kept."""
+    directory = profile_dir('foo')
+    for index in range(PROFILE_RETENTION_COUNT + 2):
+        with open(os.path.join(
+                directory, '2000{:04d}.jsonl'.format(index)), 'w'):
+            pass
+    profiler = MemoryProfiler('foo', 2, enabled=True)
+    profiler.record('bar')
+    profiler.stop()
+    filenames = sorted(os.listdir(directory))
+    assert len(filenames) == PROFILE_RETENTION_COUNT
+    assert filenames[0] == '2000{:04d}.jsonl'.format(3)
+
+def test_compare_memory_profiles():
+    """Tests that stages which used more memory are reported."""
+    baseline = make_profile(100, 100)
+    assert compare_memory_profiles(baseline, make_profile(110, 105)) == []
+    assert compare_memory_profiles(baseline, make_profile(150, 105)) == [
+        'stage0 (1000 members): 150.0 MB peak RSS, was 100.0 MB '
+        '(1000 members)']
+
+def test_compare_memory_profiles_ignores_small_growth():
+    """Tests that growth of a few megabytes isn't reported."""
+    assert compare_memory_profiles(make_profile(10), make_profile(15)) == []
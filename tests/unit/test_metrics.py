@@ -0,0 +1,148 @@
+"""This module contains tests associated with streamed list metrics."""
+import numpy as np
+import pandas as pd
+from app.metrics import (
+    MemberMetrics, tally_open_rates, open_rate_deciles, rate_bin_edges)
+
+def fake_members(count, seed=0):
+    """Returns member dictionaries with random statuses and open rates."""
+    random_state = np.random.RandomState(seed)
+    statuses = random_state.choice(
+        ['subscribed', 'subscribed', 'unsubscribed', 'cleaned', 'pending'],
+        count)
+    open_rates = np.round(random_state.random_sample(count), 2)
+    return [{'id': 'member{}'.format(index), 'status': str(status),
+             'stats': {'avg_open_rate': float(open_rate)}}
+            for index, (status, open_rate)
+            in enumerate(zip(statuses, open_rates))]
+
+def test_tally_open_rates():
+    """Tests that the tally_open_rates function matches pd.cut(),
+    open_rate_deciles() and comparing with the high open rate."""
+    for dtype in (np.float32, np.float64):
+        open_rates = np.array(
+            [0, 0.1, 0.15, 0.2, 0.8, 0.81, 1, np.nan, 1.5, -1], dtype=dtype)
+        expected_counts = pd.value_counts(pd.cut(
+            open_rates, rate_bin_edges(open_rates.dtype),
+            include_lowest=True), sort=False).tolist()
+        deciles, hist_bin_counts, high_open_count = tally_open_rates(
+            open_rates)
+        assert deciles.tolist() == open_rate_deciles(open_rates).tolist()
+        assert hist_bin_counts.tolist() == expected_counts
+        assert expected_counts == [2, 2, 0, 0, 0, 0, 0, 1, 1, 1]
+        with np.errstate(invalid='ignore'):
+            assert high_open_count == (
+                open_rates > dtype(0.8)).sum() == 3
+
+def test_open_rate_deciles():
+    """Tests the open_rate_deciles function."""
+    assert open_rate_deciles(np.array(
+        [np.nan, 0, 0.1, 0.11, 0.8, 1], dtype=np.float32)).tolist() == [
+            0, 0, 0, 1, 7, 9]
+
+def test_member_metrics():
+    """Tests that members are counted by status and open rate."""
+    metrics = MemberMetrics('foo', 10)
+    metrics.append_members([
+        {'id': 'a', 'status': 'subscribed', 'stats': {'avg_open_rate': 0.8}},
+        {'id': 'b', 'status': 'subscribed', 'stats': {'avg_open_rate': 0.9}},
+        {'id': 'c', 'status': 'cleaned', 'stats': {'avg_open_rate': 0.1}}])
+    metrics.append_members([
+        {'id': 'd', 'status': 'subscribed', 'stats': {}}])
+    assert len(metrics) == 4
+    assert metrics.subscribers == 3
+    assert metrics.status_counts == {'subscribed': 3, 'cleaned': 1}
+    assert metrics.hist_bin_counts.tolist() == [0] * 7 + [1, 1, 0]
+    assert metrics.high_open_count == 1
+    assert metrics.stratum_sizes.tolist() == [1] + [0] * 6 + [1, 1, 0]
+
+def test_member_metrics_merge():
+    """Tests that metrics of separate chunks merge into the metrics of the
+    whole list, whatever order the chunks arrive in."""
+    members = fake_members(1000)
+    whole = MemberMetrics('foo', 20)
+    whole.append_members(members)
+    merged = MemberMetrics('foo', 20)
+    for offset in (600, 200, 0, 400, 800):
+        chunk = MemberMetrics('foo', 20)
+        chunk.append_members(members[offset:offset + 200])
+        merged.merge(chunk)
+    assert merged.status_counts == whole.status_counts
+    assert merged.hist_bin_counts.tolist() == whole.hist_bin_counts.tolist()
+    assert merged.high_open_count == whole.high_open_count
+    assert merged.stratum_sizes.tolist() == whole.stratum_sizes.tolist()
+    assert merged.sample_subscribers(100, 5) == whole.sample_subscribers(
+        100, 5)
+
+def test_member_metrics_reservoirs_are_bounded():
+    """Tests that at most the reservoir size is kept from each decile, even
+    if members arrive twice."""
+    members = fake_members(1000)
+    metrics = MemberMetrics('foo', 20)
+    metrics.append_members(members)
+    metrics.append_members(members[:500])
+    for reservoir_ids in metrics.reservoir_ids:
+        assert len(reservoir_ids) == len(set(reservoir_ids)) == 20
+
+def test_member_metrics_sample_subscribers():
+    """Tests that the sample is allocated across deciles in proportion to
+    their size, with a minimum per decile."""
+    metrics = MemberMetrics('foo', 100)
+    metrics.append_members(
+        [{'id': str(index), 'status': 'subscribed',
+          'stats': {'avg_open_rate': 0.05}} for index in range(900)] +
+        [{'id': str(index), 'status': 'subscribed',
+          'stats': {'avg_open_rate': 0.95}} for index in range(900, 1000)])
+    sample = metrics.sample_subscribers(50, 10)
+    assert len(sample) == 55
+    assert np.bincount(metrics.sample_strata).tolist() == [45] + [0] * 8 + [10]
+    assert all(int(subscriber_id) < 900 for subscriber_id in sample[:45])
+    assert not metrics.fully_sampled
+    metrics.record_recent_opens([True] * 5 + [False] * 50)
+    assert metrics.recent_open_count == 5
+
+def test_member_metrics_fully_sampled():
+    """Tests that every subscriber of a small list is sampled."""
+    metrics = MemberMetrics('foo', 100)
+    metrics.append_members(fake_members(50))
+    sample = metrics.sample_subscribers(100, 10)
+    assert len(sample) == metrics.subscribers
+    assert metrics.fully_sampled
+
+def test_member_metrics_from_frame():
+    """Tests that a members dataframe is tallied like the same members
+    appended as dictionaries, whether or not its statuses are
+    categorical."""
+    members = fake_members(1000)
+    appended = MemberMetrics('foo', 0)
+    appended.append_members(members)
+    df = pd.DataFrame({
+        'status': [member['status'] for member in members],
+        'avg_open_rate': np.array(
+            [member['stats']['avg_open_rate'] for member in members],
+            dtype=np.float32),
+        'recent_open': [None, '2018-01-01'] * 500})
+    for status_dtype in ('object', 'category'):
+        df['status'] = df['status'].astype(status_dtype)
+        metrics = MemberMetrics.from_frame(df)
+        assert metrics.status_counts == appended.status_counts
+        assert (metrics.hist_bin_counts.tolist() ==
+                appended.hist_bin_counts.tolist())
+        assert metrics.high_open_count == appended.high_open_count
+        assert (metrics.stratum_sizes.tolist() ==
+                appended.stratum_sizes.tolist())
+        assert metrics.recent_open_count == 500
+
+def test_member_metrics_from_frame_without_subscribers():
+    """Tests that a dataframe without subscribers or activity tallies
+    nothing but its statuses."""
+    metrics = MemberMetrics.from_frame(pd.DataFrame({
+        'status': pd.Categorical(['cleaned', 'pending'],
+                                 categories=['cleaned', 'pending',
+                                             'subscribed']),
+        'avg_open_rate': [0.5, 0.5]}))
+    assert metrics.status_counts == {'cleaned': 1, 'pending': 1,
+                                     'subscribed': 0}
+    assert metrics.subscribers == 0
+    assert metrics.hist_bin_counts.tolist() == [0] * 10
+    assert metrics.recent_open_count == 0
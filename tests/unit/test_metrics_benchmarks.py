@@ -0,0 +1,15 @@
+"""This module contains tests associated with the metrics benchmark."""
+from benchmarks.metrics_benchmarks import legacy_metrics, main, make_members
+
+def test_make_members():
+    """Tests that synthetic members have the compact member schema."""
+    df = make_members(1000)
+    assert len(df) == 1000
+    assert str(df['status'].dtype) == 'category'
+    assert str(df['avg_open_rate'].dtype) == 'float32'
+    assert legacy_metrics(df, 1000, 1)['hist_bin_counts'] != [0] * 10
+
+def test_metrics_benchmark(mocker):
+    """Tests that the fused metrics match the separately computed ones."""
+    mocker.patch.dict('os.environ')
+    assert main(['--size', '5000', '--repeat', '1']) == 0
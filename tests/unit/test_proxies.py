@@ -0,0 +1,281 @@
+"""This module contains tests associated with the proxy pool."""
+import os
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asynctest import CoroutineMock
+from app.proxies import (
+    ProxyPool, ProxyUnavailableError, LocalProxyProvider, UsProxiesProvider,
+    get_proxy_pool)
+from app.sessions import SessionManager
+
+@pytest.fixture
+def proxy_pool():
+    """Returns a pool of two local stand-in proxies."""
+    return ProxyPool(LocalProxyProvider(['http://foo:1', 'http://bar:2']))
+
+@pytest.fixture
+def single_proxy_pool():
+    """Returns a pool of one local stand-in proxy, which can't keep a
+    spare."""
+    return ProxyPool(LocalProxyProvider(['http://foo:1']))
+
+class FakeProxyResponse(): # pylint: disable=too-few-public-methods
+    """A fake aiohttp response from the US Proxies API."""
+    def __init__(self, text):
+        self.body = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        pass
+
+    async def text(self):
+        """Returns the response body."""
+        return self.body
+
+@pytest.mark.asyncio
+async def test_us_proxies_provider_rotate(mocker):
+    """Tests the UsProxiesProvider's rotate function."""
+    session = mocker.MagicMock()
+    session.get.return_value = FakeProxyResponse('foo:bar:baz')
+    provider = UsProxiesProvider('foo', ['6'])
+    assert provider.capacity == 1
+    assert await provider.rotate(session) == 'http://bar:baz'
+    session.get.assert_called_with(
+        'http://us-proxies.com/api.php',
+        params=(
+            ('api', ''),
+            ('uid', '9557'),
+            ('pwd', 'foo'),
+            ('cmd', 'rotate'),
+            ('process', '6'),
+        ))
+
+@pytest.mark.asyncio
+async def test_us_proxies_provider_rotates_processes_in_turn(mocker):
+    """Tests that the UsProxiesProvider rotates each of its processes in
+    turn."""
+    session = mocker.MagicMock()
+    session.get.return_value = FakeProxyResponse('foo:bar:baz')
+    provider = UsProxiesProvider('foo', ['6', '7'])
+    assert provider.capacity == 2
+    for _ in range(3):
+        await provider.rotate(session)
+    assert [dict(kwargs['params'])['process'] for _, kwargs in (
+        session.get.call_args_list)] == ['6', '7', '6']
+
+@pytest.mark.asyncio
+async def test_us_proxies_provider_rotate_error(mocker):
+    """Tests the UsProxiesProvider's rotate function when the API returns
+    an error."""
+    session = mocker.MagicMock()
+    session.get.return_value = FakeProxyResponse('ERROR:bar:baz')
+    with pytest.raises(ProxyUnavailableError) as e: # pylint: disable=invalid-name
+        await UsProxiesProvider('foo', ['6']).rotate(session)
+    assert str(e.value) == 'baz'
+
+@pytest.mark.asyncio
+async def test_us_proxies_provider_rotate_unreachable():
+    """Tests the UsProxiesProvider's rotate function when the API can't be
+    reached."""
+    server = TestServer(web.Application())
+    await server.start_server()
+    provider = UsProxiesProvider('foo', ['6'])
+    provider.API_URL = str(server.make_url('/'))
+    await server.close()
+    manager = SessionManager()
+    with pytest.raises(ProxyUnavailableError) as e: # pylint: disable=invalid-name
+        await provider.rotate(manager.get_session())
+    await manager.close()
+    assert str(e.value) == 'ConnectionError: proxy provider down.'
+
+@pytest.mark.asyncio
+async def test_local_proxy_provider_rotate():
+    """Tests that the LocalProxyProvider cycles through its proxies."""
+    provider = LocalProxyProvider(['foo', 'bar'])
+    assert [await provider.rotate(None) for _ in range(3)] == [
+        'foo', 'bar', 'foo']
+
+@pytest.mark.asyncio
+async def test_probe():
+    """Tests that the probe function sends a request through the proxy."""
+    seen = []
+
+    async def handler(request):
+        seen.append(request.url)
+        return web.Response(status=404)
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    server = TestServer(app)
+    await server.start_server()
+    proxy = str(server.make_url('/'))
+    pool = ProxyPool(LocalProxyProvider([]))
+    pool.PROBE_URL = 'http://example.com/'
+    try:
+        assert await pool.probe(proxy)
+    finally:
+        await server.close()
+    assert len(seen) == 1
+    assert not await pool.probe(proxy)
+
+@pytest.mark.asyncio
+async def test_lease_reuses_warm_proxy(mocker, proxy_pool):
+    """Tests that the lease function reuses a healthy proxy without
+    probing it again, and boots a spare in the background."""
+    mocked_probe = mocker.patch('app.proxies.ProxyPool.probe',
+                                new=CoroutineMock(return_value=True))
+    assert await proxy_pool.lease() == 'http://foo:1'
+    assert await proxy_pool.lease() == 'http://foo:1'
+    await proxy_pool.refill_task
+    assert proxy_pool.spares == ['http://bar:2']
+    assert mocked_probe.call_count == 2
+    proxy_pool.health_check_task.cancel()
+
+@pytest.mark.asyncio
+async def test_lease_rotates_flagged_proxy(mocker, proxy_pool):
+    """Tests that the lease function only replaces a flagged proxy, with
+    its spare, without waiting for a new proxy to boot."""
+    mocked_probe = mocker.patch('app.proxies.ProxyPool.probe',
+                                new=CoroutineMock(return_value=True))
+    proxy = await proxy_pool.lease()
+    await proxy_pool.refill_task
+    proxy_pool.flag('http://other:3')
+    assert not proxy_pool.is_flagged(proxy)
+    proxy_pool.flag(proxy)
+    assert proxy_pool.is_flagged(proxy)
+    mocked_probe.reset_mock()
+    assert await proxy_pool.lease() == 'http://bar:2'
+    mocked_probe.assert_not_called()
+    assert proxy_pool.is_flagged(proxy)
+    await proxy_pool.refill_task
+    assert proxy_pool.spares == ['http://foo:1']
+    proxy_pool.health_check_task.cancel()
+
+@pytest.mark.asyncio
+async def test_lease_waits_for_proxy_to_boot(mocker, single_proxy_pool):
+    """Tests that the lease function probes a new proxy until it's up,
+    rather than sleeping a fixed time."""
+    mocker.patch('app.proxies.ProxyPool.probe',
+                 new=CoroutineMock(side_effect=[False, False, True]))
+    mocked_sleep = mocker.patch('app.proxies.asyncio.sleep',
+                                new=CoroutineMock())
+    single_proxy_pool.start_health_checks = mocker.MagicMock()
+    assert await single_proxy_pool.lease() == 'http://foo:1'
+    assert mocked_sleep.call_count == 2
+    assert single_proxy_pool.spares == []
+
+@pytest.mark.asyncio
+async def test_lease_proxy_never_boots(mocker, proxy_pool):
+    """Tests that the lease function gives up on a proxy which doesn't
+    come up in time."""
+    mocker.patch('app.proxies.ProxyPool.probe',
+                 new=CoroutineMock(return_value=False))
+    mocker.patch('app.proxies.asyncio.sleep', new=CoroutineMock())
+    proxy_pool.PROXY_BOOT_TIME = 0
+    assert await proxy_pool.lease() is None
+    assert proxy_pool.last_error == 'Proxy http://foo:1 did not come up in time'
+    assert proxy_pool.refill_task.done()
+
+@pytest.mark.asyncio
+async def test_lease_provider_unavailable(mocker):
+    """Tests the lease function when the provider can't supply a proxy."""
+    provider = mocker.MagicMock()
+    provider.capacity = 1
+    provider.rotate = CoroutineMock(side_effect=ProxyUnavailableError('foo'))
+    proxy_pool = ProxyPool(provider)
+    assert await proxy_pool.lease() is None
+    assert proxy_pool.last_error == 'foo'
+
+@pytest.mark.asyncio
+async def test_health_check_flags_broken_proxy(mocker, single_proxy_pool):
+    """Tests that a failed health check flags the current proxy, and
+    replaces it in the background."""
+    mocker.patch('app.proxies.ProxyPool.probe',
+                 new=CoroutineMock(side_effect=[True, False, True]))
+    single_proxy_pool.start_health_checks = mocker.MagicMock()
+    proxy = await single_proxy_pool.lease()
+    await single_proxy_pool.health_check()
+    assert single_proxy_pool.is_flagged(proxy)
+    await single_proxy_pool.refill_task
+    assert not single_proxy_pool.flagged
+
+@pytest.mark.asyncio
+async def test_health_check_promotes_spare(mocker, proxy_pool):
+    """Tests that a failed health check replaces the current proxy with
+    its spare, and drops spares which stopped working."""
+    mocked_probe = mocker.patch('app.proxies.ProxyPool.probe',
+                                new=CoroutineMock(return_value=True))
+    proxy_pool.start_health_checks = mocker.MagicMock()
+    await proxy_pool.lease()
+    await proxy_pool.refill_task
+    mocked_probe.side_effect = [True, False]
+    await proxy_pool.health_check()
+    assert proxy_pool.is_flagged('http://foo:1')
+    mocked_probe.side_effect = None
+    await proxy_pool.refill_task
+    assert proxy_pool.proxy == 'http://bar:2'
+    assert not proxy_pool.flagged
+    assert proxy_pool.spares == ['http://foo:1']
+    mocked_probe.side_effect = [False, True]
+    await proxy_pool.health_check()
+    assert proxy_pool.spares == []
+    assert not proxy_pool.flagged
+    mocked_probe.side_effect = None
+    await proxy_pool.refill_task
+
+@pytest.mark.asyncio
+async def test_lease_checks_stale_proxy(mocker, proxy_pool):
+    """Tests that the lease function health checks a proxy which hasn't
+    been checked in a while."""
+    mocker.patch('app.proxies.ProxyPool.probe', new=CoroutineMock(
+        side_effect=[True, True, True, False, True]))
+    proxy_pool.start_health_checks = mocker.MagicMock()
+    await proxy_pool.lease()
+    await proxy_pool.refill_task
+    proxy_pool.checked_at -= proxy_pool.HEALTH_CHECK_INTERVAL + 1
+    assert await proxy_pool.lease() == 'http://bar:2'
+    await proxy_pool.refill_task
+
+def test_get_proxy_pool_local(mocker):
+    """Tests that the get_proxy_pool function uses local proxies if the
+    LOCAL_PROXIES environment variable is set."""
+    mocker.patch('app.proxies._PROXY_POOL', new=None)
+    mocker.patch.dict('os.environ', {'LOCAL_PROXIES': 'http://foo:1'})
+    pool = get_proxy_pool()
+    assert isinstance(pool.provider, LocalProxyProvider)
+    assert get_proxy_pool() is pool
+
+def test_get_proxy_pool_us_proxies(mocker):
+    """Tests that the get_proxy_pool function controls the worker's
+    US Proxies process."""
+    mocker.patch('app.proxies._PROXY_POOL', new=None)
+    mocker.patch.dict('os.environ', {'PROXY_AUTH_PWD': 'foo'})
+    os.environ.pop('LOCAL_PROXIES', None)
+    mocked_current_process = mocker.patch('app.proxies.current_process')
+    mocked_current_process.return_value.index = 5
+    pool = get_proxy_pool()
+    assert pool.provider.process_numbers == ['6']
+    assert pool.provider.password == 'foo'
+
+def test_get_proxy_pool_us_proxies_spares(mocker):
+    """Tests that the get_proxy_pool function gives each worker
+    PROXY_PROCESSES_PER_WORKER US Proxies processes."""
+    mocker.patch('app.proxies._PROXY_POOL', new=None)
+    mocker.patch.dict('os.environ', {'PROXY_PROCESSES_PER_WORKER': '2'})
+    os.environ.pop('LOCAL_PROXIES', None)
+    mocked_current_process = mocker.patch('app.proxies.current_process')
+    mocked_current_process.return_value.index = 5
+    assert get_proxy_pool().provider.process_numbers == ['11', '12']
+
+def test_get_proxy_pool_unknown_process(mocker):
+    """Tests that the get_proxy_pool function falls back to proxy process 1
+    if the worker index is unknown."""
+    mocker.patch('app.proxies._PROXY_POOL', new=None)
+    mocker.patch.dict('os.environ')
+    os.environ.pop('LOCAL_PROXIES', None)
+    mocked_current_process = mocker.patch('app.proxies.current_process')
+    del mocked_current_process.return_value.index
+    assert get_proxy_pool().provider.process_numbers == ['1']
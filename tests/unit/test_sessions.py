@@ -0,0 +1,86 @@
+"""This module contains tests associated with the shared session manager."""
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from app.sessions import SessionManager, close_shared_session
+
+@pytest.mark.asyncio
+async def test_session_manager_reuses_session():
+    """Tests that the session manager lends out the same session, and that
+    leaving its context leaves the session open."""
+    manager = SessionManager()
+    async with manager as session:
+        pass
+    assert not session.closed
+    async with manager as other_session:
+        assert other_session is session
+    await manager.close()
+    assert session.closed
+
+@pytest.mark.asyncio
+async def test_session_manager_replaces_closed_session():
+    """Tests that the session manager creates a new session if the shared
+    one was closed."""
+    manager = SessionManager()
+    session = manager.get_session()
+    await session.close()
+    assert manager.get_session() is not session
+    await manager.close()
+
+@pytest.mark.asyncio
+async def test_session_manager_replaces_session_on_new_loop(mocker):
+    """Tests that the session manager creates a new session if the event
+    loop changed."""
+    manager = SessionManager()
+    session = manager.get_session()
+    mocker.patch('app.sessions.asyncio.get_event_loop')
+    mocked_create_session = mocker.patch(
+        'app.sessions.SessionManager.create_session')
+    assert manager.get_session() is mocked_create_session.return_value
+    await session.close()
+
+@pytest.mark.asyncio
+async def test_session_manager_counts_reused_connections():
+    """Tests that requests reuse pooled connections, and that the session
+    manager counts them."""
+    async def handler(request): # pylint: disable=unused-argument
+        return web.Response(text='foo')
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    server = TestServer(app)
+    await server.start_server()
+    manager = SessionManager()
+    try:
+        for _ in range(3):
+            async with manager as session:
+                async with session.get(server.make_url('/')) as response:
+                    assert await response.text() == 'foo'
+    finally:
+        await manager.close()
+        await server.close()
+    stats = manager.get_stats()
+    assert stats['requests'] == 3
+    assert stats['connections_created'] == 1
+    assert stats['connections_reused'] == 2
+    assert stats['reuse_ratio'] == 2 / 3
+
+def test_get_stats_without_connections():
+    """Tests the get_stats function before any connection was made."""
+    assert SessionManager().get_stats() == {'reuse_ratio': None}
+
+def test_close_shared_session(mocker):
+    """Tests that the shutdown hook closes the worker's session."""
+    mocked_manager = mocker.patch('app.sessions.SESSION_MANAGER')
+    mocked_manager.loop.is_closed.return_value = False
+    close_shared_session()
+    mocked_manager.log_stats.assert_called()
+    mocked_manager.loop.run_until_complete.assert_called_with(
+        mocked_manager.close.return_value)
+
+def test_close_shared_session_unused(mocker):
+    """Tests that the shutdown hook does nothing if no session was made."""
+    mocked_manager = mocker.patch('app.sessions.SESSION_MANAGER')
+    mocked_manager.loop = None
+    close_shared_session()
+    mocked_manager.log_stats.assert_not_called()
@@ -0,0 +1,61 @@
+import os
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+from app.snapshots import (
+    save_snapshot, load_latest_snapshot, list_snapshots, prune_snapshots,
+    SNAPSHOT_RETENTION_COUNT, SNAPSHOT_RETENTION_PERIOD)
+
+def fake_df():
+    """Returns a small flattened members dataframe."""
+    return pd.DataFrame({
+        'id': ['foo', 'bar'],
+        'status': ['subscribed', 'cleaned'],
+        'avg_open_rate': [0.1, 0.2],
+        'recent_open': ['baz', None]})
+
+def test_save_and_load_latest_snapshot(state_dir): # pylint: disable=unused-argument
+    """Tests that the latest saved snapshot can be loaded back."""
+    now = datetime.now(timezone.utc)
+    save_snapshot('qux', fake_df().iloc[:1], now - timedelta(days=1),
+                  {'members_mode': 'full'})
+    path = save_snapshot('qux', fake_df(), now, {'members_mode': 'incremental'})
+    assert path.endswith('.parquet')
+    df, metadata = load_latest_snapshot('qux') # pylint: disable=invalid-name
+    assert_frame_equal(df, fake_df())
+    assert metadata == {'members_mode': 'incremental'}
+
+def test_load_latest_snapshot_columns(state_dir): # pylint: disable=unused-argument
+    """Tests that the load_latest_snapshot function reads selected columns."""
+    save_snapshot('qux', fake_df(), datetime.utcnow(), {})
+    df, _ = load_latest_snapshot('qux', columns=['id', 'avg_open_rate']) # pylint: disable=invalid-name
+    assert list(df.columns) == ['id', 'avg_open_rate']
+    assert np.allclose(df['avg_open_rate'], [0.1, 0.2])
+
+def test_load_latest_snapshot_missing(state_dir): # pylint: disable=unused-argument
+    """Tests that the load_latest_snapshot function returns None if there's
+    no snapshot."""
+    assert load_latest_snapshot('foo') is None
+
+def test_load_latest_snapshot_skips_corrupt_files(state_dir): # pylint: disable=unused-argument
+    """Tests that corrupt snapshots are skipped."""
+    now = datetime.now(timezone.utc)
+    save_snapshot('qux', fake_df(), now - timedelta(days=1), {'foo': 'bar'})
+    path = save_snapshot('qux', fake_df(), now, {})
+    with open(path, 'wb') as snapshot_file:
+        snapshot_file.write(b'not parquet')
+    _, metadata = load_latest_snapshot('qux')
+    assert metadata == {'foo': 'bar'}
+
+def test_prune_snapshots(state_dir): # pylint: disable=unused-argument
+    """Tests that old and excess snapshots are pruned."""
+    now = datetime.now(timezone.utc)
+    for days_ago in range(SNAPSHOT_RETENTION_COUNT + 2):
+        save_snapshot('qux', fake_df(), now - timedelta(days=days_ago), {})
+    assert len(list_snapshots('qux')) == SNAPSHOT_RETENTION_COUNT
+    save_snapshot('quux', fake_df(), now - timedelta(days=1), {})
+    prune_snapshots(now=now + SNAPSHOT_RETENTION_PERIOD)
+    assert [timestamp for timestamp, _ in list_snapshots('qux')] == [now]
+    assert not list_snapshots('quux')
+    assert all(os.path.exists(path) for _, path in list_snapshots('qux'))
@@ -5,12 +5,20 @@ import json
 import pytest
 import pandas as pd
 from app.tasks import (
-    send_activated_email, import_analyze_store_list, generate_summary_stats,
-    send_report, extract_stats, init_list_analysis, update_stored_data,
-    send_monthly_reports, generate_diffs)
-from app.lists import MailChimpImportError
+    send_activated_email, import_analyze_store_list,
+    import_analyze_store_list_once, generate_summary_stats, send_report,
+    extract_stats, init_list_analysis, update_stored_data, update_list,
+    send_monthly_reports, generate_diffs, set_event_loop_policy,
+    IMPORT_LOCK_RETRY_DELAY, IMPORT_LOCK_TIMEOUT, IMPORT_LOCK_MAX_RETRIES)
+from app.lists import MailChimpList, MailChimpImportError
 from app.models import ListStats
 
+def test_set_event_loop_policy(mocker):
+    """Tests the set_event_loop_policy function."""
+    mocked_install_uvloop = mocker.patch('app.tasks.install_uvloop')
+    set_event_loop_policy()
+    mocked_install_uvloop.assert_called()
+
 def test_send_activated_email(mocker):
     """Tests the send_activated_email function."""
     mocked_send_email = mocker.patch('app.tasks.send_email')
@@ -35,7 +43,8 @@ def test_import_analyze_store_list_maichimpimporterror(mocker, user_email):
     mocked_os.environ.get.side_effect = ['admin@foo.com']
     import_analyze_store_list(
         {'list_id': 'foo', 'total_count': 'bar', 'key': 'foo-bar1',
-         'data_center': 'bar1'}, 1, user_email=user_email)
+         'data_center': 'bar1', 'monthly_updates': False,
+         'store_aggregates': False}, 1, user_email=user_email)
     if user_email:
         mocked_send_email.assert_called_with(
             ANY,
@@ -52,14 +61,19 @@ def test_import_analyze_store_list(
     mocked_mailchimp_list_instance = mocked_mailchimp_list.return_value
     mocked_do_async_import = mocker.patch('app.tasks.do_async_import')
     mocked_list_stats = mocker.patch('app.tasks.ListStats', spec=ListStats)
+    mocked_memory_profiler = mocker.patch('app.tasks.MemoryProfiler')
     list_stats = import_analyze_store_list(
         fake_list_data, fake_list_data['org_id'])
+    mocked_memory_profiler.assert_called_with(
+        fake_list_data['list_id'], fake_list_data['total_count'])
     mocked_mailchimp_list.assert_called_with(
         fake_list_data['list_id'], fake_list_data['total_count'],
-        fake_list_data['key'], fake_list_data['data_center'])
-    mocked_do_async_import.assert_has_calls(
-        mocked_mailchimp_list_instance.import_list_members.return_value,
-        mocked_mailchimp_list_instance.import_sub_activity.return_value)
+        fake_list_data['key'], fake_list_data['data_center'],
+        keep_snapshot=False,
+        memory_profiler=mocked_memory_profiler.return_value)
+    mocked_do_async_import.assert_called_once_with(
+        mocked_mailchimp_list_instance.import_list.return_value)
+    mocked_mailchimp_list_instance.response_cache.flush.assert_called()
     mocked_mailchimp_list_instance.flatten.assert_called()
     mocked_mailchimp_list_instance.calc_list_breakdown.assert_called()
     mocked_mailchimp_list_instance.calc_open_rate.assert_called_with(
@@ -73,6 +87,10 @@ def test_import_analyze_store_list(
     mocked_list_stats.assert_called_with(
         **{k: (v if k != 'hist_bin_counts' else json.dumps(v))
            for k, v in fake_calculation_results.items()},
+        cur_yr_inactive_pct_lower=(
+            mocked_mailchimp_list_instance.cur_yr_inactive_pct_lower),
+        cur_yr_inactive_pct_upper=(
+            mocked_mailchimp_list_instance.cur_yr_inactive_pct_upper),
         list_id=fake_list_data['list_id'])
 
 def test_import_analyze_store_list_store_results_in_db( # pylint: disable=unused-argument
@@ -83,8 +101,15 @@ def test_import_analyze_store_list_store_results_in_db( # pylint: disable=unused
     mocked_list_stats = mocker.patch('app.tasks.ListStats')
     mocked_email_list = mocker.patch('app.tasks.EmailList')
     mocked_db = mocker.patch('app.tasks.db')
+    mocked_save_snapshot = mocker.patch('app.tasks.save_snapshot')
     fake_list_data['monthly_updates'] = True
     import_analyze_store_list(fake_list_data, 'foo')
+    mocked_save_snapshot.assert_called_with(
+        fake_list_data['list_id'], mocked_mailchimp_list.return_value.df,
+        mocked_list_stats.return_value.analysis_timestamp,
+        mocked_mailchimp_list.return_value.fetch_metadata)
+    _, mailchimp_list_kwargs = mocked_mailchimp_list.call_args
+    assert mailchimp_list_kwargs['keep_snapshot']
     mocked_email_list.assert_called_with(
         list_id=fake_list_data['list_id'],
         creation_timestamp=fake_list_data['creation_timestamp'],
@@ -98,6 +123,49 @@ def test_import_analyze_store_list_store_results_in_db( # pylint: disable=unused
     mocked_db.session.add.assert_called_with(mocked_list_stats.return_value)
     mocked_db.session.commit.assert_called()
 
+def test_import_analyze_store_list_streaming( # pylint: disable=unused-argument
+        mocker, fake_list_data, mocked_mailchimp_list):
+    """Tests that import_analyze_store_list doesn't save a snapshot of lists
+    analyzed in streaming mode."""
+    mocker.patch('app.tasks.do_async_import')
+    mocker.patch('app.tasks.ListStats')
+    mocker.patch('app.tasks.EmailList')
+    mocked_db = mocker.patch('app.tasks.db')
+    mocked_save_snapshot = mocker.patch('app.tasks.save_snapshot')
+    mocked_mailchimp_list.return_value.streaming = True
+    fake_list_data['monthly_updates'] = True
+    import_analyze_store_list(fake_list_data, 'foo')
+    mocked_db.session.commit.assert_called()
+    mocked_save_snapshot.assert_not_called()
+
+def test_import_analyze_store_list_records_memory( # pylint: disable=unused-argument
+        mocker, fake_list_data, mocked_mailchimp_list):
+    """Tests that import_analyze_store_list records the memory used by each
+    stage, and stops profiling once it's done."""
+    mocker.patch('app.tasks.do_async_import')
+    mocker.patch('app.tasks.ListStats')
+    mocker.patch('app.tasks.EmailList')
+    mocker.patch('app.tasks.db')
+    mocker.patch('app.tasks.save_snapshot')
+    mocked_memory_profiler = mocker.patch('app.tasks.MemoryProfiler')
+    fake_list_data['monthly_updates'] = True
+    import_analyze_store_list(fake_list_data, 'foo')
+    mocked_memory_profiler.return_value.record.assert_has_calls([
+        call('flatten'), call('calculations'), call('store'),
+        call('snapshot')])
+    mocked_memory_profiler.return_value.stop.assert_called_once_with()
+
+def test_import_analyze_store_list_stops_memory_profiling_on_error( # pylint: disable=unused-argument
+        mocker, fake_list_data, mocked_mailchimp_list):
+    """Tests that memory profiling stops when an analysis fails."""
+    mocked_do_async_import = mocker.patch('app.tasks.do_async_import')
+    mocked_do_async_import.side_effect = MailChimpImportError('foo', 'bar')
+    mocked_memory_profiler = mocker.patch('app.tasks.MemoryProfiler')
+    with pytest.raises(MailChimpImportError):
+        import_analyze_store_list(fake_list_data, 'foo')
+    mocked_memory_profiler.return_value.record.assert_not_called()
+    mocked_memory_profiler.return_value.stop.assert_called_once_with()
+
 def test_import_analyze_store_list_store_results_in_db_exception( # pylint: disable=unused-argument
         mocker, fake_list_data, mocked_mailchimp_list):
     """Tests the import_analyze_store_list function when data
@@ -107,10 +175,83 @@ def test_import_analyze_store_list_store_results_in_db_exception( # pylint: disa
     mocker.patch('app.tasks.EmailList')
     mocked_db = mocker.patch('app.tasks.db')
     mocked_db.session.commit.side_effect = Exception()
+    mocked_save_snapshot = mocker.patch('app.tasks.save_snapshot')
     fake_list_data['monthly_updates'] = True
     with pytest.raises(Exception):
         import_analyze_store_list(fake_list_data, 'foo')
     mocked_db.session.rollback.assert_called()
+    mocked_save_snapshot.assert_not_called()
+
+def test_import_analyze_store_list_once(mocker, fake_list_data):
+    """Tests the import_analyze_store_list_once function when no other
+    import of the list is running."""
+    mocked_acquire_import_lock = mocker.patch(
+        'app.tasks.acquire_import_lock', return_value=True)
+    mocked_release_import_lock = mocker.patch('app.tasks.release_import_lock')
+    mocked_list_stats = mocker.patch('app.tasks.ListStats')
+    mocked_list_stats.analysis_timestamp = datetime(2000, 1, 1)
+    (mocked_list_stats.query.filter.return_value.order_by
+     .return_value.first.return_value) = None
+    mocked_import_analyze_store_list = mocker.patch(
+        'app.tasks.import_analyze_store_list')
+    list_stats = import_analyze_store_list_once(
+        fake_list_data, 1, 'foo@bar.com')
+    mocked_import_analyze_store_list.assert_called_with(
+        fake_list_data, 1, 'foo@bar.com')
+    assert list_stats == mocked_import_analyze_store_list.return_value
+    owner = mocked_acquire_import_lock.call_args[0][1]
+    mocked_release_import_lock.assert_called_with('foo', owner)
+
+def test_import_lock_outlives_imports():
+    """Tests that an import lock isn't broken while its import may still
+    be running, and that waiting tasks retry for at least as long."""
+    assert IMPORT_LOCK_TIMEOUT > MailChimpList.IMPORT_DEADLINE
+    assert (IMPORT_LOCK_MAX_RETRIES * IMPORT_LOCK_RETRY_DELAY >=
+            IMPORT_LOCK_TIMEOUT.total_seconds())
+
+def test_import_analyze_store_list_once_locked(mocker, fake_list_data):
+    """Tests that the import_analyze_store_list_once function returns None
+    rather than waiting when another worker is importing the list."""
+    mocker.patch('app.tasks.acquire_import_lock', return_value=False)
+    mocked_release_import_lock = mocker.patch('app.tasks.release_import_lock')
+    mocked_import_analyze_store_list = mocker.patch(
+        'app.tasks.import_analyze_store_list')
+    assert import_analyze_store_list_once(fake_list_data, 1) is None
+    mocked_import_analyze_store_list.assert_not_called()
+    mocked_release_import_lock.assert_not_called()
+
+def test_import_analyze_store_list_once_reuses_stats(mocker, fake_list_data):
+    """Tests that the import_analyze_store_list_once function reuses the
+    ListStats stored by an import which finished since."""
+    mocker.patch('app.tasks.acquire_import_lock', return_value=True)
+    mocker.patch('app.tasks.release_import_lock')
+    mocked_list_stats = mocker.patch('app.tasks.ListStats')
+    mocked_list_stats.analysis_timestamp = datetime(2000, 1, 2)
+    mocked_recent_stats = (
+        mocked_list_stats.query.filter.return_value.order_by
+        .return_value.first.return_value)
+    mocked_import_analyze_store_list = mocker.patch(
+        'app.tasks.import_analyze_store_list')
+    list_stats = import_analyze_store_list_once(
+        fake_list_data, 1, since=datetime(2000, 1, 1))
+    mocked_import_analyze_store_list.assert_not_called()
+    assert list_stats == mocked_recent_stats
+
+def test_import_analyze_store_list_once_releases_lock_on_error(
+        mocker, fake_list_data):
+    """Tests that the import_analyze_store_list_once function releases the
+    list's import lock if the import fails."""
+    mocker.patch('app.tasks.acquire_import_lock', return_value=True)
+    mocked_release_import_lock = mocker.patch('app.tasks.release_import_lock')
+    mocked_list_stats = mocker.patch('app.tasks.ListStats')
+    mocked_list_stats.analysis_timestamp = datetime(2000, 1, 1)
+    (mocked_list_stats.query.filter.return_value.order_by
+     .return_value.first.return_value) = None
+    mocker.patch('app.tasks.import_analyze_store_list',
+                 side_effect=MailChimpImportError('foo', 'bar'))
+    with pytest.raises(MailChimpImportError):
+        import_analyze_store_list_once(fake_list_data, 1)
+    mocked_release_import_lock.assert_called()
 
 def test_generate_summary_stats_single_analysis(
         mocker, fake_list_stats_query_result_as_df,
@@ -305,16 +446,35 @@ def test_init_list_analysis_new_list_no_store(mocker, fake_list_data):
     mocked_list_stats = mocker.patch('app.tasks.ListStats')
     (mocked_list_stats.query.filter_by.return_value.order_by
      .return_value.limit.return_value.all.return_value) = None
-    mocked_import_analyze_store_list = mocker.patch(
-        'app.tasks.import_analyze_store_list')
+    mocked_import_analyze_store_list_once = mocker.patch(
+        'app.tasks.import_analyze_store_list_once')
     mocked_email_list = mocker.patch('app.tasks.EmailList')
     mocked_email_list.query.filter_by.return_value.first.return_value = None
     mocker.patch('app.tasks.generate_summary_stats', return_value=(
         'foo', 'bar'))
     mocker.patch('app.tasks.send_report')
     init_list_analysis({'email': 'foo@bar.com'}, fake_list_data, 1)
-    mocked_import_analyze_store_list.assert_called_with(
-        fake_list_data, 1, 'foo@bar.com')
+    mocked_import_analyze_store_list_once.assert_called_with(
+        fake_list_data, 1, 'foo@bar.com', since=ANY)
+
+def test_init_list_analysis_new_list_locked(mocker, fake_list_data):
+    """Tests that the init_list_analysis function retries later when
+    another worker is importing the list."""
+    mocked_list_stats = mocker.patch('app.tasks.ListStats')
+    (mocked_list_stats.query.filter_by.return_value.order_by
+     .return_value.limit.return_value.all.return_value) = []
+    mocker.patch('app.tasks.import_analyze_store_list_once',
+                 return_value=None)
+    mocked_retry = mocker.patch.object(
+        init_list_analysis, 'retry', return_value=Exception())
+    mocked_send_report = mocker.patch('app.tasks.send_report')
+    with pytest.raises(Exception):
+        init_list_analysis({'email': 'foo@bar.com'}, fake_list_data, 1,
+                           requested_at=5)
+    mocked_retry.assert_called_with(
+        args=({'email': 'foo@bar.com'}, fake_list_data, 1),
+        kwargs={'requested_at': 5}, countdown=IMPORT_LOCK_RETRY_DELAY)
+    mocked_send_report.assert_not_called()
 
 def test_init_list_analysis_new_list_monthly_updates(mocker, fake_list_data):
     """Tests the init_list_analysis function when the list does not
@@ -323,7 +483,7 @@ def test_init_list_analysis_new_list_monthly_updates(mocker, fake_list_data):
     mocked_list_stats = mocker.patch('app.tasks.ListStats')
     (mocked_list_stats.query.filter_by.return_value.order_by
      .return_value.limit.return_value.all.return_value) = None
-    mocker.patch('app.tasks.import_analyze_store_list')
+    mocker.patch('app.tasks.import_analyze_store_list_once')
     mocked_email_list = mocker.patch('app.tasks.EmailList')
     mocked_list_object = (
         mocked_email_list.query.filter_by.return_value.first.return_value)
@@ -345,8 +505,15 @@ def test_update_stored_data_empty_db(mocker, caplog):
     mocked_list_stats = mocker.patch('app.tasks.ListStats')
     (mocked_list_stats.query.order_by.return_value.distinct
      .return_value.all.return_value) = None
+    mocked_prune_snapshots = mocker.patch('app.tasks.prune_snapshots')
+    mocked_prune_checkpoints = mocker.patch('app.tasks.prune_checkpoints')
+    mocked_prune_response_cache = mocker.patch(
+        'app.tasks.prune_response_cache')
     update_stored_data()
     assert 'No lists in the database!' in caplog.text
+    mocked_prune_snapshots.assert_called()
+    mocked_prune_checkpoints.assert_called()
+    mocked_prune_response_cache.assert_called()
 
 def test_update_stored_data_no_old_analyses(mocker, caplog):
     """Tests the update_stored_data function when there are no analyses older
@@ -356,9 +523,16 @@ def test_update_stored_data_no_old_analyses(mocker, caplog):
         analysis_timestamp=datetime.now(timezone.utc))
     (mocked_list_stats.query.order_by.return_value.distinct
      .return_value.all.return_value) = [mocked_analysis]
+    mocked_prune_snapshots = mocker.patch('app.tasks.prune_snapshots')
+    mocked_prune_checkpoints = mocker.patch('app.tasks.prune_checkpoints')
+    mocked_prune_response_cache = mocker.patch(
+        'app.tasks.prune_response_cache')
     caplog.set_level(logging.INFO)
     update_stored_data()
     assert 'No old lists to update' in caplog.text
+    mocked_prune_snapshots.assert_called()
+    mocked_prune_checkpoints.assert_called()
+    mocked_prune_response_cache.assert_called()
 
 
 def test_update_stored_data(mocker, fake_list_data):
@@ -375,8 +549,12 @@ def test_update_stored_data(mocker, fake_list_data):
     (mocked_list_stats.query.order_by.return_value.distinct
      .return_value.all.return_value) = [mocked_analysis]
     mocked_requests = mocker.patch('app.tasks.requests')
-    mocked_import_analyze_store_list = mocker.patch(
-        'app.tasks.import_analyze_store_list')
+    mocked_import_analyze_store_list_once = mocker.patch(
+        'app.tasks.import_analyze_store_list_once')
+    mocked_prune_snapshots = mocker.patch('app.tasks.prune_snapshots')
+    mocked_prune_checkpoints = mocker.patch('app.tasks.prune_checkpoints')
+    mocked_prune_response_cache = mocker.patch(
+        'app.tasks.prune_response_cache')
     mocked_requests.get.return_value.json.return_value = {
         'stats': {
             'member_count': 5,
@@ -397,7 +575,7 @@ def test_update_stored_data(mocker, fake_list_data):
                        'stats.campaign_count'),
         ),
         auth=('shorenstein', 'foo-bar1'))
-    mocked_import_analyze_store_list.assert_called_with(
+    mocked_import_analyze_store_list_once.assert_called_with(
         {'list_id': 'foo',
          'list_name': 'bar',
          'key': 'foo-bar1',
@@ -408,7 +586,65 @@ def test_update_stored_data(mocker, fake_list_data):
          'open_rate': 1,
          'creation_timestamp': 'quux',
          'campaign_count': 10},
-        1)
+        1, since=ANY)
+    assert mocked_import_analyze_store_list_once.call_args[1][
+        'since'].tzinfo is None
+    mocked_prune_snapshots.assert_called()
+    mocked_prune_checkpoints.assert_called()
+    mocked_prune_response_cache.assert_called()
+
+def test_update_stored_data_locked(mocker, fake_list_data, caplog):
+    """Tests that the update_stored_data function defers lists another
+    worker is importing to the update_list task."""
+    mocked_list_stats = mocker.patch('app.tasks.ListStats')
+    mocked_list_to_update = MagicMock(
+        **{('api_key' if k == 'key' else k): v
+           for k, v in fake_list_data.items()}
+    )
+    mocked_analysis = MagicMock(
+        analysis_timestamp=datetime(2000, 1, 1, tzinfo=timezone.utc),
+        list=mocked_list_to_update,
+        list_id=fake_list_data['list_id'])
+    (mocked_list_stats.query.order_by.return_value.distinct
+     .return_value.all.return_value) = [mocked_analysis]
+    mocked_requests = mocker.patch('app.tasks.requests')
+    mocker.patch('app.tasks.import_analyze_store_list_once',
+                 return_value=None)
+    mocked_update_list = mocker.patch('app.tasks.update_list')
+    mocker.patch('app.tasks.prune_snapshots')
+    mocker.patch('app.tasks.prune_checkpoints')
+    mocker.patch('app.tasks.prune_response_cache')
+    mocked_requests.get.return_value.json.return_value = {
+        'stats': {
+            'member_count': 5,
+            'unsubscribe_count': 6,
+            'cleaned_count': 7,
+            'open_rate': 1,
+            'campaign_count': 10
+        }
+    }
+    caplog.set_level(logging.INFO)
+    update_stored_data()
+    mocked_update_list.apply_async.assert_called_with(
+        args=(ANY, 1, ANY), countdown=IMPORT_LOCK_RETRY_DELAY)
+    assert 'List foo is already being imported' in caplog.text
+
+@pytest.mark.parametrize('list_stats, retried', [
+    (None, True), (MagicMock(), False)])
+def test_update_list(mocker, fake_list_data, list_stats, retried):
+    """Tests the update_list function."""
+    mocked_import_analyze_store_list_once = mocker.patch(
+        'app.tasks.import_analyze_store_list_once', return_value=list_stats)
+    mocked_retry = mocker.patch.object(
+        update_list, 'retry', return_value=Exception())
+    if retried:
+        with pytest.raises(Exception):
+            update_list(fake_list_data, 1, 946684800)
+    else:
+        update_list(fake_list_data, 1, 946684800)
+    mocked_import_analyze_store_list_once.assert_called_with(
+        fake_list_data, 1, since=datetime(2000, 1, 1))
+    assert mocked_retry.called == retried
 
 def test_update_stored_data_keyerror(mocker, fake_list_data, caplog):
     """Tests the update_stored_data function when the list raises a KeyError."""
@@ -424,6 +660,9 @@ def test_update_stored_data_keyerror(mocker, fake_list_data, caplog):
     (mocked_list_stats.query.order_by.return_value.distinct
      .return_value.all.return_value) = [mocked_analysis]
     mocked_requests = mocker.patch('app.tasks.requests')
+    mocker.patch('app.tasks.prune_snapshots')
+    mocker.patch('app.tasks.prune_checkpoints')
+    mocker.patch('app.tasks.prune_response_cache')
     mocked_requests.get.return_value.json.return_value = {}
     with pytest.raises(MailChimpImportError):
         update_stored_data()
@@ -444,10 +683,13 @@ def test_update_stored_data_import_error(mocker, fake_list_data, caplog):
     (mocked_list_stats.query.order_by.return_value.distinct
      .return_value.all.return_value) = [mocked_analysis]
     mocked_requests = mocker.patch('app.tasks.requests')
-    mocked_import_analyze_store_list = mocker.patch(
-        'app.tasks.import_analyze_store_list')
-    mocked_import_analyze_store_list.side_effect = MailChimpImportError(
+    mocked_import_analyze_store_list_once = mocker.patch(
+        'app.tasks.import_analyze_store_list_once')
+    mocked_import_analyze_store_list_once.side_effect = MailChimpImportError(
         'foo', 'bar')
+    mocker.patch('app.tasks.prune_snapshots')
+    mocker.patch('app.tasks.prune_checkpoints')
+    mocker.patch('app.tasks.prune_response_cache')
     mocked_requests.get.return_value.json.return_value = {
         'stats': {
             'member_count': 5,
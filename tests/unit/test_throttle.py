@@ -0,0 +1,230 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import call
+import pytest
+from asynctest import CoroutineMock
+from app.throttle import AIMDController, TokenBucketLimiter, RetryPolicy
+
+def test_aimd_controller_clamps_initial_limits():
+    """Tests that the AIMDController keeps its limits within bounds."""
+    controller = AIMDController(
+        20, 50, max_concurrency=8, min_chunk_size=1000)
+    assert controller.concurrency == 8
+    assert controller.chunk_size == 1000
+
+def test_aimd_controller_additive_increase():
+    """Tests that fast responses grow the limits additively."""
+    controller = AIMDController(2, 5000, chunk_step=1000, target_latency=10)
+    controller.record(1, 200)
+    controller.record(1, 200)
+    assert controller.concurrency == 2
+    controller.record(1, 200)
+    assert controller.concurrency == 3
+    assert controller.chunk_size == 8000
+
+@pytest.mark.parametrize('status', [429, 504, None])
+def test_aimd_controller_multiplicative_decrease(status):
+    """Tests that congestion halves the limits, once per congestion event."""
+    controller = AIMDController(8, 8000, target_latency=10)
+    controller.record(1, status)
+    assert controller.concurrency == 4
+    assert controller.chunk_size == 4000
+    controller.record(1, status)
+    assert controller.concurrency == 4
+    assert controller.chunk_size == 4000
+
+def test_aimd_controller_slow_response_shrinks_chunk():
+    """Tests that slow responses shrink the page size only."""
+    controller = AIMDController(4, 8000, target_latency=10)
+    controller.record(20, 200)
+    assert controller.concurrency == 4
+    assert controller.chunk_size == 4000
+
+def test_aimd_controller_ignores_other_errors():
+    """Tests that non-congestion errors leave the limits alone."""
+    controller = AIMDController(4, 8000)
+    controller.record(1, 404)
+    assert controller.get_state() == {'concurrency': 4, 'chunk_size': 8000}
+
+@pytest.mark.asyncio
+async def test_aimd_controller_limits_in_flight_requests():
+    """Tests that the AIMDController only lets concurrency requests in."""
+    controller = AIMDController(2, target_latency=10)
+    running = []
+    max_running = []
+    release = asyncio.Event()
+
+    async def request():
+        async with controller:
+            running.append(1)
+            max_running.append(len(running))
+            await release.wait()
+            running.pop()
+
+    tasks = [asyncio.ensure_future(request()) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert controller.in_flight == 2
+
+    # Growing the limit lets a waiting request in straight away
+    for _ in range(3):
+        controller.record(1, 200)
+    await asyncio.sleep(0)
+    assert controller.in_flight == 3
+    release.set()
+    await asyncio.gather(*tasks)
+    assert controller.in_flight == 0
+    assert max(max_running) == 3
+
+def test_aimd_controller_save_and_load(state_dir): # pylint: disable=unused-argument
+    """Tests that tuned state is saved and loaded per data center."""
+    controller = AIMDController.load('us1', 'members', 4, 5000)
+    assert controller.get_state() == {'concurrency': 4, 'chunk_size': 5000}
+    controller.record(1, 200)
+    controller.save()
+    AIMDController.load('us1', 'activity', 2).save()
+    loaded = AIMDController.load('us1', 'members', 4, 5000)
+    assert loaded.get_state() == controller.get_state()
+    assert AIMDController.load('us1', 'activity', 2).chunk_size is None
+    assert AIMDController.load('us2', 'members', 4, 5000).get_state() == {
+        'concurrency': 4, 'chunk_size': 5000}
+
+def test_token_bucket_limiter(state_dir): # pylint: disable=unused-argument
+    """Tests that the TokenBucketLimiter allows a burst and then the rate."""
+    limiter = TokenBucketLimiter('foo-us1', 'us1', 2, 3)
+    assert [limiter.take_tokens(now=100) for _ in range(3)] == [(1, 0)] * 3
+    assert limiter.take_tokens(now=100) == (0, 0.5)
+    assert limiter.take_tokens(now=100.5) == (1, 0)
+    assert limiter.take_tokens(now=100.5) == (0, 0.5)
+
+def test_token_bucket_limiter_batch(state_dir): # pylint: disable=unused-argument
+    """Tests that the TokenBucketLimiter takes as many tokens of a batch
+    as the bucket holds."""
+    limiter = TokenBucketLimiter('foo-us1', 'us1', 2, 3)
+    assert limiter.take_tokens(2, now=100) == (2, 0)
+    assert limiter.take_tokens(2, now=100) == (1, 0)
+    assert limiter.take_tokens(2, now=100) == (0, 0.5)
+
+def test_token_bucket_limiter_shared_by_api_key(state_dir): # pylint: disable=unused-argument
+    """Tests that limiters for the same api key share a single bucket."""
+    limiter = TokenBucketLimiter('foo-us1', 'us1', 1, 1)
+    other_process_limiter = TokenBucketLimiter('foo-us1', 'us1', 1, 1)
+    other_key_limiter = TokenBucketLimiter('bar-us1', 'us1', 1, 1)
+    assert limiter.take_tokens(now=100) == (1, 0)
+    assert other_process_limiter.take_tokens(now=100) == (0, 1)
+    assert other_key_limiter.take_tokens(now=100) == (1, 0)
+    assert 'foo' not in limiter.path
+
+@pytest.mark.asyncio
+async def test_token_bucket_limiter_acquire(mocker, state_dir): # pylint: disable=unused-argument
+    """Tests that the acquire function waits until a token is available,
+    and uses up a batch before taking another."""
+    limiter = TokenBucketLimiter('foo-us1', 'us1', 1, 1, batch_size=2)
+    mocked_take_tokens = mocker.patch.object(
+        limiter, 'take_tokens', side_effect=[(0, 0.5), (0, 0.25), (2, 0)])
+    mocked_sleep = mocker.patch(
+        'app.throttle.asyncio.sleep', new=CoroutineMock())
+    await limiter.acquire()
+    await limiter.acquire()
+    mocked_sleep.assert_has_calls([call(0.5), call(0.25)])
+    assert mocked_take_tokens.call_count == 3
+    mocked_take_tokens.assert_called_with(2)
+    assert limiter.reserved_tokens == 0
+
+@pytest.mark.asyncio
+async def test_token_bucket_limiter_limits_connections(state_dir): # pylint: disable=unused-argument
+    """Tests that limiters for the same api key share a limit on the
+    requests in flight."""
+    limiter = TokenBucketLimiter('foo-us1', 'us1', 100, 100,
+                                 max_connections=2)
+    other_import_limiter = TokenBucketLimiter('foo-us1', 'us1', 100, 100,
+                                              max_connections=2)
+    await limiter.acquire()
+    await other_import_limiter.acquire()
+    third_request = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not third_request.done()
+    await other_import_limiter.release()
+    await asyncio.wait_for(third_request, 1)
+    await limiter.release()
+    await limiter.release()
+    assert limiter.take_lease('foo') and limiter.take_lease('bar')
+
+@pytest.mark.asyncio
+async def test_token_bucket_limiter_shares_connections_across_processes(
+        mocker, state_dir): # pylint: disable=unused-argument
+    """Tests that connection leases taken by another process count
+    towards the limit, until they're returned."""
+    mocker.patch.object(TokenBucketLimiter, 'LEASE_POLL_INTERVAL', new=0.01)
+    limiter = TokenBucketLimiter('foo-us1', 'us1', 100, 100,
+                                 max_connections=1)
+    other_process_limiter = TokenBucketLimiter('foo-us1', 'us1', 100, 100,
+                                               max_connections=1)
+    assert other_process_limiter.take_lease('foo')
+    request = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0.05)
+    assert not request.done()
+    other_process_limiter.return_lease('foo')
+    await asyncio.wait_for(request, 1)
+    assert not other_process_limiter.take_lease('bar')
+    await limiter.release()
+    assert other_process_limiter.take_lease('bar')
+
+def test_token_bucket_limiter_breaks_abandoned_leases(state_dir): # pylint: disable=unused-argument
+    """Tests that leases held past LEASE_TIMEOUT are broken."""
+    limiter = TokenBucketLimiter('foo-us1', 'us1', 1, 1, max_connections=1)
+    assert limiter.take_lease('foo', now=100)
+    assert not limiter.take_lease('bar', now=100)
+    assert limiter.take_lease('bar', now=100 + limiter.LEASE_TIMEOUT + 1)
+
+def test_retry_policy_decorrelated_jitter():
+    """Tests that backoffs stay within bounds and grow from the last one."""
+    policy = RetryPolicy(base_delay=5, max_delay=125)
+    delay = None
+    for _ in range(20):
+        previous_delay = delay
+        delay = policy.get_delay(delay)
+        assert 5 <= delay <= min(125, (previous_delay or 5) * 3)
+
+def test_retry_policy_honors_retry_after():
+    """Tests that a Retry-After header sets the minimum backoff, up to
+    a cap."""
+    policy = RetryPolicy(base_delay=1, max_delay=2, max_retry_after=60)
+    assert policy.get_delay(None, '30') == 30
+    assert policy.get_delay(None, '3600') == 60
+    assert 1 <= policy.get_delay(None, 'foo') <= 3
+
+def test_retry_policy_parse_retry_after():
+    """Tests parsing Retry-After headers sent as seconds or http dates."""
+    now = datetime(2019, 1, 1, tzinfo=timezone.utc)
+    assert RetryPolicy.parse_retry_after('5') == 5
+    assert RetryPolicy.parse_retry_after(
+        'Tue, 01 Jan 2019 00:00:30 GMT', now) == 30
+    assert RetryPolicy.parse_retry_after(
+        'Mon, 31 Dec 2018 00:00:00 GMT', now) == 0
+    assert RetryPolicy.parse_retry_after(None) is None
+    assert RetryPolicy.parse_retry_after('foo') is None
+
+def test_retry_policy_should_retry():
+    """Tests that requests are retried up to max_retries times."""
+    policy = RetryPolicy(max_retries=2)
+    assert policy.should_retry(1, 5)
+    assert not policy.should_retry(2, 5)
+
+def test_retry_policy_deadline(mocker):
+    """Tests that nothing is retried past the deadline."""
+    mocked_time = mocker.patch('app.throttle.time')
+    mocked_time.monotonic.return_value = 100
+    policy = RetryPolicy(deadline=60)
+    assert policy.remaining() == 60
+    assert policy.get_timeout().total == 60
+    assert not policy.should_retry(0, 61)
+    mocked_time.monotonic.return_value = 200
+    assert policy.expired()
+    assert not policy.should_retry(0, 1)
+
+def test_retry_policy_timeouts():
+    """Tests that attempts use separate connect and read timeouts."""
+    timeout = RetryPolicy(connect_timeout=10, read_timeout=30).get_timeout()
+    assert timeout.total is None
+    assert timeout.connect == 10
+    assert timeout.sock_read == 30